@@ -83,10 +83,11 @@ class ProjectContextService:
 
         # Recent Activity (AuditLog по проекту и задачам)
         task_ids = list(WorkItem.objects.filter(project_id=project_id).values_list('id', flat=True))
+        # recent(): один запрос в пределах срока хранения — читаются только его партиции audit_logs
         activity_qs = AuditLog.objects.filter(
             Q(model_name='project', object_id=project_id)
             | Q(model_name='workitem', object_id__in=task_ids)
-        ).select_related('user').order_by('-timestamp')[:cls.RECENT_ACTIVITY_LIMIT]
+        ).select_related('user').recent(cls.RECENT_ACTIVITY_LIMIT)
         recent_activity = [
             {
                 'action': a.action,
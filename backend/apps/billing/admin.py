@@ -11,6 +11,9 @@ from .models import (
     SubscriptionItem,
     UsageMeter,
     UsageRecord,
+    UsageDailyRollup,
+    WorkspaceStorageUsage,
+    InvoiceNumberSequence,
     EntitlementOverride,
     PaymentTransaction,
     PaymentWebhookEvent,
@@ -82,6 +85,28 @@ class UsageRecordAdmin(admin.ModelAdmin):
     raw_id_fields = ['account', 'meter']
 
 
+@admin.register(UsageDailyRollup)
+class UsageDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['id', 'account', 'meter', 'day', 'quantity', 'records_count', 'updated_at']
+    list_filter = ['meter', 'day']
+    search_fields = ['account__workspace__name', 'meter__code']
+    raw_id_fields = ['account', 'meter']
+
+
+@admin.register(WorkspaceStorageUsage)
+class WorkspaceStorageUsageAdmin(admin.ModelAdmin):
+    list_display = ['workspace', 'used_bytes', 'reconciled_at', 'updated_at']
+    search_fields = ['workspace__name']
+    raw_id_fields = ['workspace']
+
+
+@admin.register(InvoiceNumberSequence)
+class InvoiceNumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ['year', 'workspace', 'last_value']
+    list_filter = ['year']
+    raw_id_fields = ['workspace']
+
+
 @admin.register(EntitlementOverride)
 class EntitlementOverrideAdmin(admin.ModelAdmin):
     list_display = ['id', 'account', 'key', 'is_enabled', 'expires_at', 'created_at']
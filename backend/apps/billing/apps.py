@@ -10,3 +10,7 @@ class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.billing'
     verbose_name = 'Биллинг (счета и подписки)'
+
+    def ready(self):
+        """Сброс кэша entitlements при изменении подписок и тарифов."""
+        import apps.billing.signals  # noqa: F401
@@ -0,0 +1,31 @@
+"""
+Management command: пересборка дневных срезов потребления (UsageDailyRollup) из UsageRecord.
+
+Использование:
+    python manage.py backfill_usage_rollups
+    python manage.py backfill_usage_rollups --account 3 --account 7
+
+Срезы ведутся при записи UsageRecord; команда нужна после загрузки или удаления
+записей в обход UsageService и для первичного заполнения.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.billing.rollups import rebuild_usage_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать дневные срезы потребления (account, meter, day) из UsageRecord'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account',
+            type=int,
+            action='append',
+            dest='accounts',
+            default=None,
+            help='ID billing-аккаунта (можно несколько раз); по умолчанию — все',
+        )
+
+    def handle(self, *args, **options):
+        created = rebuild_usage_rollups(account_ids=options['accounts'])
+        self.stdout.write(self.style.SUCCESS(f'Строк среза: {created}'))
@@ -0,0 +1,49 @@
+"""
+Management command: сверка счётчиков объёма workspace (WorkspaceStorageUsage) с Attachment.size.
+
+Использование:
+    python manage.py reconcile_storage_usage
+    python manage.py reconcile_storage_usage --workspace 3 --fix
+
+Без --fix только печатает расхождения; код выхода 1, если они есть (для cron/CI).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.billing.storage import DEFAULT_CHUNK_SIZE, reconcile_storage_usage
+
+
+class Command(BaseCommand):
+    help = 'Сверить счётчики занятого объёма workspace с размерами вложений и показать расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workspace',
+            type=int,
+            action='append',
+            dest='workspaces',
+            default=None,
+            help='ID workspace (можно несколько раз); по умолчанию — все счётчики',
+        )
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Счётчиков в пачке')
+        parser.add_argument('--fix', action='store_true', help='Перезаписать расходящиеся счётчики по вложениям')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным')
+        report = reconcile_storage_usage(
+            workspace_ids=options['workspaces'],
+            chunk_size=options['chunk_size'],
+            fix=options['fix'],
+        )
+        for item in report['mismatches']:
+            self.stdout.write(
+                f"workspace#{item['workspace_id']}: хранится {item['stored']} Б, по вложениям {item['actual']} Б"
+            )
+        self.stdout.write(f"Проверено счётчиков: {report['checked']} за {report['seconds']:.2f} с")
+        if not report['mismatches']:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Исправлено счётчиков: {report['fixed']}"))
+            return
+        raise CommandError(f"Расхождения в {len(report['mismatches'])} счётчиках (запустите с --fix)")
@@ -0,0 +1,57 @@
+"""
+Management command: пакетный рендер PDF счетов в пуле процессов.
+
+Использование:
+    python manage.py render_invoice_pdfs
+    python manage.py render_invoice_pdfs --invoice 12 --invoice 15 --force
+    python manage.py render_invoice_pdfs --status sent --processes 4
+
+Счета, PDF которых собран из текущего содержимого (хэш HTML не изменился),
+пропускаются; --force перерисовывает все выбранные.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.billing.models import Invoice
+from apps.billing.pdf import render_invoice_pdfs
+
+
+class Command(BaseCommand):
+    help = 'Отрендерить PDF счетов (актуальные по хэшу содержимого пропускаются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invoice',
+            type=int,
+            action='append',
+            dest='invoices',
+            default=None,
+            help='ID счёта (можно несколько раз); по умолчанию — все',
+        )
+        parser.add_argument(
+            '--status',
+            choices=[value for value, _ in Invoice.STATUS_CHOICES],
+            default=None,
+            help='Только счета в этом статусе',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Процессов WeasyPrint (по умолчанию BILLING_PDF_RENDER_PROCESSES)',
+        )
+        parser.add_argument('--force', action='store_true', help='Перерисовать и актуальные PDF')
+
+    def handle(self, *args, **options):
+        qs = Invoice.objects.all()
+        if options['invoices']:
+            qs = qs.filter(pk__in=options['invoices'])
+        if options['status']:
+            qs = qs.filter(status=options['status'])
+        processes = options['processes'] or int(getattr(settings, 'BILLING_PDF_RENDER_PROCESSES', 1))
+
+        report = render_invoice_pdfs(qs.values_list('pk', flat=True), force=options['force'], processes=processes)
+        self.stdout.write(self.style.SUCCESS(
+            f"Отрендерено: {report['rendered']}, пропущено: {report['skipped']}, "
+            f"ошибок: {report['failed']} ({report['seconds']:.1f} с)"
+        ))
@@ -0,0 +1,324 @@
+"""
+Буферизованный приём usage-событий (per-API-call, per-AI-message metering).
+
+UsageService.record_usage_event пишет строку UsageRecord на событие и сбрасывает кэш
+сводки — на потоке событий это упирается в БД. Буферизованный путь
+(UsageService.buffer_usage_event) только увеличивает счётчик в Redis:
+  usage:buffer:qty           HASH  "{account_id}:{meter_id}:{minute}" -> количество в тысячных (HINCRBY)
+  usage:buffer:cnt           HASH  то же поле -> число событий
+  usage:buffer:idem:{a}:{m}:{key}  STR  NX-метка idempotency_key (TTL BILLING_USAGE_IDEMPOTENCY_TTL_SECONDS)
+  usage:dirty                SET   аккаунты, чья сводка изменилась с прошлого refresh_usage_summaries
+Метка и инкремент ставятся одним Lua-скриптом: повтор события с тем же ключом
+не увеличивает счётчик.
+
+Периодический flush_usage_buffer переименовывает текущие хэши в
+usage:buffer:flush:{flush_id}:* (новые события копятся в пустых хэшах), пишет
+агрегированные строки одним bulk_create (вместе с дневными срезами apps.billing.rollups)
+и удаляет снимок только после коммита. Строка снимка получает детерминированный
+idempotency_key buffer:{flush_id}:{minute}: уже записанные строки снимка пропускаются,
+а параллельная запись того же снимка упирается в unique_usage_record_idempotency и
+откатывается целиком, поэтому снимок, не удалённый из-за падения воркера, повторно
+записывается без дублей — гарантия at-least-once без двойного учёта.
+InMemoryUsageBuffer — замена Redis для тестов и SQLite-окружения; истёкшие метки
+idempotency_key он удаляет при каждом begin_flush.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import BillingAccount, UsageMeter, UsageRecord
+from .rollups import apply_usage_records
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDEMPOTENCY_TTL = 86400
+METER_CACHE_SECONDS = 60
+FLUSH_BATCH_SIZE = 1000
+FLUSH_SOURCE = 'buffer'
+# Количество хранится в тысячных: UsageRecord.quantity — decimal_places=3
+QUANTITY_SCALE = 1000
+
+_meter_lock = threading.Lock()
+_meter_cache = {'loaded_at': None, 'ids': {}}
+
+
+def idempotency_ttl():
+    return getattr(settings, 'BILLING_USAGE_IDEMPOTENCY_TTL_SECONDS', DEFAULT_IDEMPOTENCY_TTL)
+
+
+def bucket_field(account_id, meter_id, occurred_at):
+    """Поле бакета (account, meter, minute): minute — номер минуты от эпохи."""
+    return f'{account_id}:{meter_id}:{int(occurred_at.timestamp()) // 60}'
+
+
+def parse_bucket_field(field):
+    account_id, meter_id, minute = (int(part) for part in field.split(':'))
+    return account_id, meter_id, minute
+
+
+def meter_id(code):
+    """id активного счётчика по коду (таблица счётчиков кэшируется в процессе) или None."""
+    loaded_at = _meter_cache['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at >= METER_CACHE_SECONDS:
+        with _meter_lock:
+            _meter_cache['ids'] = dict(UsageMeter.objects.filter(is_active=True).values_list('code', 'id'))
+            _meter_cache['loaded_at'] = time.monotonic()
+    return _meter_cache['ids'].get(code)
+
+
+def clear_meter_cache():
+    _meter_cache['loaded_at'] = None
+
+
+class InMemoryUsageBuffer:
+    """Буфер в памяти процесса (тесты, SQLite-окружение, один воркер)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quantities = defaultdict(int)
+        self._counts = defaultdict(int)
+        self._idempotency = {}
+        self._flushes = {}
+        self._dirty = set()
+
+    def add(self, field, quantity, idempotency_key, ttl):
+        with self._lock:
+            if idempotency_key:
+                now = time.monotonic()
+                if self._idempotency.get(idempotency_key, 0) > now:
+                    return False
+                self._idempotency[idempotency_key] = now + ttl
+            self._quantities[field] += quantity
+            self._counts[field] += 1
+        return True
+
+    def _drop_expired_idempotency_keys(self):
+        # Redis удаляет метки по TTL сам; здесь истёкшие чистятся на каждом flush
+        now = time.monotonic()
+        expired = [key for key, expires_at in self._idempotency.items() if expires_at <= now]
+        for key in expired:
+            del self._idempotency[key]
+
+    def begin_flush(self, flush_id):
+        with self._lock:
+            self._drop_expired_idempotency_keys()
+            if not self._quantities:
+                return False
+            self._flushes[flush_id] = (dict(self._quantities), dict(self._counts))
+            self._quantities.clear()
+            self._counts.clear()
+        return True
+
+    def pending_flushes(self):
+        return sorted(self._flushes)
+
+    def read_flush(self, flush_id):
+        quantities, counts = self._flushes.get(flush_id, ({}, {}))
+        return {field: (quantity, counts.get(field, 0)) for field, quantity in quantities.items()}
+
+    def finish_flush(self, flush_id):
+        self._flushes.pop(flush_id, None)
+
+    def mark_dirty(self, account_ids):
+        with self._lock:
+            self._dirty.update(account_ids)
+
+    def pop_dirty(self, count):
+        with self._lock:
+            return [self._dirty.pop() for _ in range(min(count, len(self._dirty)))]
+
+
+class RedisUsageBuffer:
+    """Буфер в Redis: общие для всех процессов счётчики, снимки переживают падение воркера."""
+
+    QUANTITIES_KEY = 'usage:buffer:qty'
+    COUNTS_KEY = 'usage:buffer:cnt'
+    FLUSHING_KEY = 'usage:buffer:flushing'
+    DIRTY_KEY = 'usage:dirty'
+
+    ADD_SCRIPT = """
+    if ARGV[3] == '1' and not redis.call('SET', KEYS[3], '1', 'NX', 'EX', ARGV[4]) then
+        return 0
+    end
+    redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+    return 1
+    """
+    BEGIN_FLUSH_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return 0
+    end
+    redis.call('RENAME', KEYS[1], KEYS[3])
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('RENAME', KEYS[2], KEYS[4])
+    end
+    redis.call('SADD', KEYS[5], ARGV[1])
+    return 1
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._add = self._redis.register_script(self.ADD_SCRIPT)
+        self._begin_flush = self._redis.register_script(self.BEGIN_FLUSH_SCRIPT)
+
+    @staticmethod
+    def _flush_keys(flush_id):
+        return f'usage:buffer:flush:{flush_id}:qty', f'usage:buffer:flush:{flush_id}:cnt'
+
+    def add(self, field, quantity, idempotency_key, ttl):
+        idempotency_redis_key = f'usage:buffer:idem:{idempotency_key}' if idempotency_key else 'usage:buffer:idem:'
+        return bool(self._add(
+            keys=[self.QUANTITIES_KEY, self.COUNTS_KEY, idempotency_redis_key],
+            args=[field, quantity, '1' if idempotency_key else '0', int(ttl)],
+        ))
+
+    def begin_flush(self, flush_id):
+        return bool(self._begin_flush(
+            keys=[self.QUANTITIES_KEY, self.COUNTS_KEY, *self._flush_keys(flush_id), self.FLUSHING_KEY],
+            args=[flush_id],
+        ))
+
+    def pending_flushes(self):
+        return sorted(self._redis.smembers(self.FLUSHING_KEY))
+
+    def read_flush(self, flush_id):
+        quantities_key, counts_key = self._flush_keys(flush_id)
+        with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(quantities_key)
+            pipe.hgetall(counts_key)
+            quantities, counts = pipe.execute()
+        return {field: (int(quantity), int(counts.get(field, 0))) for field, quantity in quantities.items()}
+
+    def finish_flush(self, flush_id):
+        with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*self._flush_keys(flush_id))
+            pipe.srem(self.FLUSHING_KEY, flush_id)
+            pipe.execute()
+
+    def mark_dirty(self, account_ids):
+        self._redis.sadd(self.DIRTY_KEY, *account_ids)
+
+    def pop_dirty(self, count):
+        return [int(account_id) for account_id in self._redis.spop(self.DIRTY_KEY, count) or []]
+
+
+_buffers = {}
+
+
+def get_usage_buffer():
+    """Буфер по settings.BILLING_USAGE_BUFFER_BACKEND ('redis' | 'memory')."""
+    backend = getattr(settings, 'BILLING_USAGE_BUFFER_BACKEND', 'redis')
+    if backend not in _buffers:
+        if backend == 'memory':
+            _buffers[backend] = InMemoryUsageBuffer()
+        else:
+            _buffers[backend] = RedisUsageBuffer(settings.REDIS_URL)
+    return _buffers[backend]
+
+
+def reset_usage_buffer():
+    """Сбросить буферы и кэш счётчиков (тесты)."""
+    _buffers.clear()
+    clear_meter_cache()
+
+
+def mark_accounts_dirty(account_ids):
+    """Отметить аккаунты для следующего refresh_usage_summaries (сбой Redis не ломает запись usage)."""
+    account_ids = [account_id for account_id in account_ids if account_id]
+    if not account_ids:
+        return
+    try:
+        get_usage_buffer().mark_dirty(account_ids)
+    except Exception as e:
+        logger.warning('mark_accounts_dirty failed accounts=%s: %s', account_ids, e)
+
+
+def pop_dirty_accounts(count):
+    """Забрать до count отмеченных аккаунтов (каждый — один раз, пока его не отметят снова)."""
+    return get_usage_buffer().pop_dirty(count)
+
+
+def buffer_event(account_id, meter_id_value, quantity, occurred_at, idempotency_key=''):
+    """
+    Добавить событие в бакет (account, meter, minute).
+    Возвращает False, если событие с этим idempotency_key уже принято.
+    """
+    scaled = int((Decimal(quantity) * QUANTITY_SCALE).to_integral_value())
+    key = f'{account_id}:{meter_id_value}:{idempotency_key}' if idempotency_key else ''
+    return get_usage_buffer().add(
+        bucket_field(account_id, meter_id_value, occurred_at), scaled, key, idempotency_ttl()
+    )
+
+
+def _flush_rows(flush_id, buckets):
+    """UsageRecord снимка; бакеты удалённых аккаунтов и счётчиков отбрасываются."""
+    parsed = [(parse_bucket_field(field), value) for field, value in buckets.items()]
+    account_ids = set(BillingAccount.objects.filter(
+        pk__in={account_id for (account_id, _, _), _ in parsed}
+    ).values_list('pk', flat=True))
+    meter_ids = set(UsageMeter.objects.filter(
+        pk__in={meter for (_, meter, _), _ in parsed}
+    ).values_list('pk', flat=True))
+    rows = []
+    dropped = 0
+    for (account_id, meter, minute), (quantity, count) in parsed:
+        if account_id not in account_ids or meter not in meter_ids:
+            dropped += 1
+            continue
+        rows.append(UsageRecord(
+            account_id=account_id,
+            meter_id=meter,
+            quantity=Decimal(quantity) / QUANTITY_SCALE,
+            occurred_at=datetime.fromtimestamp(minute * 60, tz=dt_timezone.utc),
+            source=FLUSH_SOURCE,
+            idempotency_key=f'{FLUSH_SOURCE}:{flush_id}:{minute}',
+            meta={'events': count, 'flush_id': flush_id},
+        ))
+    if dropped:
+        logger.warning('flush_usage_buffer: dropped %s buckets of missing accounts/meters', dropped)
+    return rows
+
+
+def flush_usage_buffer():
+    """
+    Записать накопленные бакеты в UsageRecord.
+
+    Сначала дописываются снимки, оставшиеся от прерванных flush, затем — новый снимок.
+    Возвращает {flushes, rows, events}.
+    """
+    from .services import UsageService
+
+    buffer = get_usage_buffer()
+    buffer.begin_flush(uuid.uuid4().hex)
+    report = {'flushes': 0, 'rows': 0, 'events': 0}
+    for flush_id in buffer.pending_flushes():
+        buckets = buffer.read_flush(flush_id)
+        rows = _flush_rows(flush_id, buckets)
+        written = set(UsageRecord.objects.filter(
+            source=FLUSH_SOURCE, idempotency_key__in=[row.idempotency_key for row in rows],
+        ).values_list('account_id', 'meter_id', 'idempotency_key'))
+        rows = [row for row in rows if (row.account_id, row.meter_id, row.idempotency_key) not in written]
+        try:
+            with transaction.atomic():
+                UsageRecord.objects.bulk_create(rows, batch_size=FLUSH_BATCH_SIZE)
+                apply_usage_records(rows)
+        except IntegrityError:
+            # Тот же снимок параллельно записал другой flush: строки и срезы уже учтены им
+            logger.info('flush_usage_buffer: flush %s already written concurrently', flush_id)
+            rows = []
+        transaction.on_commit(lambda flush_id=flush_id: buffer.finish_flush(flush_id))
+        for account in BillingAccount.objects.filter(pk__in={row.account_id for row in rows}):
+            UsageService.invalidate_current_period_cache(account)
+        report['flushes'] += 1
+        report['rows'] += len(rows)
+        report['events'] += sum(count for _, count in buckets.values())
+    return report
@@ -0,0 +1,18 @@
+"""
+Middleware: область мемоизации entitlements на время HTTP-запроса.
+
+Все проверки QuotaService в запросе (assert_feature, assert_quota, assert_new_resources_allowed,
+reserve_storage_bytes) используют один вычисленный контекст подписки пользователя.
+"""
+from .services import entitlement_scope
+
+
+class EntitlementScopeMiddleware:
+    """Открывает entitlement_scope() на время обработки запроса."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with entitlement_scope():
+            return self.get_response(request)
@@ -0,0 +1,60 @@
+# Generated by Django 5.0.1 on 2026-10-19 06:20
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_usage_rollups(apps, schema_editor):
+    """Начальные дневные срезы из UsageRecord: TruncDate (TIME_ZONE) + GROUP BY."""
+    UsageRecord = apps.get_model('billing', 'UsageRecord')
+    Rollup = apps.get_model('billing', 'UsageDailyRollup')
+    rows = (
+        UsageRecord.objects.annotate(day=TruncDate('occurred_at'))
+        .values('account_id', 'meter_id', 'day')
+        .annotate(quantity=Sum('quantity'), records_count=Count('id'))
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator():
+        batch.append(Rollup(**row))
+        if len(batch) >= 1000:
+            Rollup.objects.bulk_create(batch)
+            batch = []
+    Rollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0012_limits_unlimited_marker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='День occurred_at в TIME_ZONE проекта', verbose_name='Day')),
+                ('quantity', models.DecimalField(decimal_places=3, default=Decimal('0'), max_digits=18, verbose_name='Quantity')),
+                ('records_count', models.PositiveIntegerField(default=0, verbose_name='Records count')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='billing.billingaccount', verbose_name='Billing account')),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='billing.usagemeter', verbose_name='Meter')),
+            ],
+            options={
+                'verbose_name': 'Usage daily rollup',
+                'verbose_name_plural': 'Usage daily rollups',
+                'db_table': 'billing_usage_daily_rollups',
+                'ordering': ['-day', 'meter'],
+                'indexes': [models.Index(fields=['account', 'day'], name='billing_usa_account_407e30_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usagedailyrollup',
+            constraint=models.UniqueConstraint(fields=('account', 'meter', 'day'), name='unique_usage_daily_rollup'),
+        ),
+        migrations.RunPython(backfill_usage_rollups, migrations.RunPython.noop),
+    ]
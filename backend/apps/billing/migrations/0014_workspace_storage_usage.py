@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-19 06:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0013_usage_daily_rollups'),
+        ('core', '0016_alter_projectmember_options_alter_user_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkspaceStorageUsage',
+            fields=[
+                ('workspace', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to='core.workspace', verbose_name='Workspace')),
+                ('used_bytes', models.BigIntegerField(default=0, verbose_name='Used bytes')),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True, verbose_name='Reconciled at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+            ],
+            options={
+                'verbose_name': 'Workspace storage usage',
+                'verbose_name_plural': 'Workspace storage usage',
+                'db_table': 'billing_workspace_storage_usage',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='workspacestorageusage',
+            constraint=models.CheckConstraint(check=models.Q(('used_bytes__gte', 0)), name='billing_storage_used_bytes_non_negative'),
+        ),
+    ]
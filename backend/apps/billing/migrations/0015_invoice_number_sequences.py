@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-19 06:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0014_workspace_storage_usage'),
+        ('core', '0016_alter_projectmember_options_alter_user_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(verbose_name='Year')),
+                ('last_value', models.PositiveIntegerField(default=0, verbose_name='Last value')),
+                ('workspace', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='invoice_sequences', to='core.workspace', verbose_name='Workspace')),
+            ],
+            options={
+                'verbose_name': 'Invoice number sequence',
+                'verbose_name_plural': 'Invoice number sequences',
+                'db_table': 'billing_invoice_number_sequences',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='invoicenumbersequence',
+            constraint=models.UniqueConstraint(fields=('year', 'workspace'), name='billing_invoice_sequence_unique_key', nulls_distinct=False),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.1 on 2026-10-19 06:38
+
+from django.db import migrations, models
+
+
+def mark_rendered_invoices(apps, schema_editor):
+    """Уже сохранённые PDF считаем готовыми; хэш пустой — первый рендер после миграции обновит файл."""
+    Invoice = apps.get_model('billing', 'Invoice')
+    Invoice.objects.exclude(pdf_file__isnull=True).exclude(pdf_file='').update(pdf_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0015_invoice_number_sequences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_content_hash',
+            field=models.CharField(blank=True, default='', help_text='sha256 HTML, из которого собран pdf_file', max_length=64, verbose_name='PDF Content Hash'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_error',
+            field=models.TextField(blank=True, default='', verbose_name='PDF Error'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_rendered_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='PDF Rendered at'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_status',
+            field=models.CharField(choices=[('none', 'Not rendered'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='none', max_length=20, verbose_name='PDF Status'),
+        ),
+        migrations.RunPython(mark_rendered_invoices, migrations.RunPython.noop),
+    ]
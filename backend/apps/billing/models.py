@@ -4,7 +4,7 @@ Billing models — Invoice, Subscription (HR Phase 0).
 from decimal import Decimal
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 
@@ -571,6 +571,118 @@ class UsageRecord(models.Model):
     def __str__(self):
         return f"{self.account_id}:{self.meter.code}={self.quantity}"
 
+    def save(self, *args, **kwargs):
+        """Новая запись учитывается в дневном срезе (UsageDailyRollup) в той же транзакции БД."""
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        from .rollups import apply_usage_records
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            apply_usage_records([self])
+
+
+class UsageDailyRollup(models.Model):
+    """
+    Дневной срез потребления: сумма quantity и число строк UsageRecord по (account, meter, day).
+
+    Ведётся при записи UsageRecord (apps.billing.rollups); сводка за период читает
+    срезы полных дней и сырые записи только неполных крайних дней.
+    Пересборка из UsageRecord — команда backfill_usage_rollups.
+    """
+    account = models.ForeignKey(
+        BillingAccount,
+        on_delete=models.CASCADE,
+        related_name='usage_rollups',
+        verbose_name=_('Billing account'),
+    )
+    meter = models.ForeignKey(
+        UsageMeter,
+        on_delete=models.CASCADE,
+        related_name='daily_rollups',
+        verbose_name=_('Meter'),
+    )
+    day = models.DateField(
+        verbose_name=_('Day'),
+        help_text=_('День occurred_at в TIME_ZONE проекта'),
+    )
+    quantity = models.DecimalField(
+        max_digits=18,
+        decimal_places=3,
+        default=Decimal('0'),
+        verbose_name=_('Quantity'),
+    )
+    records_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Records count'),
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('Updated at'),
+    )
+
+    class Meta:
+        verbose_name = _('Usage daily rollup')
+        verbose_name_plural = _('Usage daily rollups')
+        db_table = 'billing_usage_daily_rollups'
+        ordering = ['-day', 'meter']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'meter', 'day'],
+                name='unique_usage_daily_rollup',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}:{self.meter_id}@{self.day}={self.quantity}"
+
+
+class WorkspaceStorageUsage(models.Model):
+    """
+    Занятый вложениями объём workspace (байты) для лимита storage_gb.
+
+    Отдельная узкая строка вместо BillingAccount.meta: резервирование — один
+    UPDATE used_bytes = used_bytes + N с условием лимита (QuotaService.reserve_storage_bytes),
+    без блокировки аккаунта. Сверка с Attachment.size — apps.billing.storage.
+    """
+    workspace = models.OneToOneField(
+        'core.Workspace',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='storage_usage',
+        verbose_name=_('Workspace'),
+    )
+    used_bytes = models.BigIntegerField(
+        default=0,
+        verbose_name=_('Used bytes'),
+    )
+    reconciled_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('Reconciled at'),
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('Updated at'),
+    )
+
+    class Meta:
+        verbose_name = _('Workspace storage usage')
+        verbose_name_plural = _('Workspace storage usage')
+        db_table = 'billing_workspace_storage_usage'
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(used_bytes__gte=0),
+                name='billing_storage_used_bytes_non_negative',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.workspace_id}: {self.used_bytes} B"
+
 
 class EntitlementOverride(models.Model):
     """
@@ -881,6 +993,7 @@ class Invoice(models.Model):
     Генерируется на основе TimeLog (выполненные работы).
     line_items — снимок строк (JSON) для неизменности при удалении логов.
     related_timelogs — M2M для пометки логов как «выставленных».
+    pdf_status / pdf_content_hash — состояние фонового рендера PDF (apps.billing.pdf).
     """
 
     STATUS_DRAFT = 'draft'
@@ -895,6 +1008,18 @@ class Invoice(models.Model):
         (STATUS_CANCELLED, _('Cancelled')),
     ]
 
+    PDF_STATUS_NONE = 'none'
+    PDF_STATUS_PENDING = 'pending'
+    PDF_STATUS_READY = 'ready'
+    PDF_STATUS_FAILED = 'failed'
+
+    PDF_STATUS_CHOICES = [
+        (PDF_STATUS_NONE, _('Not rendered')),
+        (PDF_STATUS_PENDING, _('Pending')),
+        (PDF_STATUS_READY, _('Ready')),
+        (PDF_STATUS_FAILED, _('Failed')),
+    ]
+
     project = models.ForeignKey(
         Project,
         on_delete=models.CASCADE,
@@ -941,6 +1066,29 @@ class Invoice(models.Model):
         blank=True,
         verbose_name=_('PDF File'),
     )
+    pdf_status = models.CharField(
+        max_length=20,
+        choices=PDF_STATUS_CHOICES,
+        default=PDF_STATUS_NONE,
+        verbose_name=_('PDF Status'),
+    )
+    pdf_content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name=_('PDF Content Hash'),
+        help_text=_('sha256 HTML, из которого собран pdf_file'),
+    )
+    pdf_rendered_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('PDF Rendered at'),
+    )
+    pdf_error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name=_('PDF Error'),
+    )
     line_items = models.JSONField(
         default=list,
         verbose_name=_('Line Items Snapshot'),
@@ -982,3 +1130,43 @@ class Invoice(models.Model):
 
     def __str__(self):
         return f"{self.number} — {self.project.name}"
+
+
+class InvoiceNumberSequence(models.Model):
+    """
+    Счётчик номеров счетов за год (workspace=None — общая нумерация INV-YYYY-XXXX).
+
+    Номера выдаёт apps.billing.numbering одним UPDATE last_value = last_value + N
+    RETURNING last_value: блок номеров резервируется одним запросом, а блокировка строки
+    до коммита исключает дубли при параллельной генерации.
+    """
+    year = models.PositiveIntegerField(
+        verbose_name=_('Year'),
+    )
+    workspace = models.ForeignKey(
+        'core.Workspace',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='invoice_sequences',
+        verbose_name=_('Workspace'),
+    )
+    last_value = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Last value'),
+    )
+
+    class Meta:
+        verbose_name = _('Invoice number sequence')
+        verbose_name_plural = _('Invoice number sequences')
+        db_table = 'billing_invoice_number_sequences'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['year', 'workspace'],
+                name='billing_invoice_sequence_unique_key',
+                nulls_distinct=False,
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.year}/{self.workspace_id or '*'}: {self.last_value}"
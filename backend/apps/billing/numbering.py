@@ -0,0 +1,89 @@
+"""
+Номера счетов из счётчика InvoiceNumberSequence.
+
+BILLING_INVOICE_NUMBER_SCOPE:
+  'global'    — общая нумерация INV-YYYY-XXXX (по умолчанию);
+  'workspace' — своя нумерация у каждого workspace: INV-{workspace_id}-YYYY-XXXX.
+
+reserve_invoice_numbers(count) резервирует блок одним
+    UPDATE ... SET last_value = last_value + count ... RETURNING last_value
+UPDATE держит блокировку строки счётчика до конца транзакции вызывающего кода, поэтому
+параллельные генерации получают непересекающиеся блоки, а откат транзакции возвращает
+номера (нумерация без пропусков). Строка счётчика создаётся при первом номере года
+и продолжает номера, уже выданные прежним способом (по последнему номеру с тем же префиксом).
+"""
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import Invoice, InvoiceNumberSequence
+
+SCOPE_GLOBAL = 'global'
+SCOPE_WORKSPACE = 'workspace'
+
+
+def number_scope():
+    return getattr(settings, 'BILLING_INVOICE_NUMBER_SCOPE', SCOPE_GLOBAL)
+
+
+def number_prefix(year, workspace_id=None):
+    return f'INV-{workspace_id}-{year}-' if workspace_id else f'INV-{year}-'
+
+
+def _issued_last_value(year, workspace_id):
+    """Наибольший порядковый номер среди уже выданных номеров с префиксом счётчика."""
+    prefix = number_prefix(year, workspace_id)
+    last = 0
+    for number in Invoice.objects.filter(number__startswith=prefix).values_list('number', flat=True).iterator():
+        tail = number[len(prefix):]
+        if tail.isdigit():
+            last = max(last, int(tail))
+    return last
+
+
+def _increment(year, workspace_id, count):
+    """Увеличить счётчик на count; новое last_value или None, если строки счётчика нет."""
+    quote = connection.ops.quote_name
+    table = quote(InvoiceNumberSequence._meta.db_table)
+    workspace_column = quote(InvoiceNumberSequence._meta.get_field('workspace').column)
+    if workspace_id is None:
+        workspace_clause, params = f'{workspace_column} IS NULL', [count, year]
+    else:
+        workspace_clause, params = f'{workspace_column} = %s', [count, year, workspace_id]
+    sql = (
+        f'UPDATE {table} SET {quote("last_value")} = {quote("last_value")} + %s '
+        f'WHERE {quote("year")} = %s AND {workspace_clause} '
+        f'RETURNING {quote("last_value")}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def reserve_invoice_numbers(count=1, workspace_id=None, year=None):
+    """
+    Зарезервировать count последовательных номеров счетов.
+    workspace_id учитывается только при BILLING_INVOICE_NUMBER_SCOPE='workspace'.
+    """
+    if count < 1:
+        return []
+    year = year or timezone.now().year
+    if number_scope() != SCOPE_WORKSPACE:
+        workspace_id = None
+    with transaction.atomic():
+        last_value = _increment(year, workspace_id, count)
+        if last_value is None:
+            try:
+                with transaction.atomic():
+                    InvoiceNumberSequence.objects.create(
+                        year=year,
+                        workspace_id=workspace_id,
+                        last_value=_issued_last_value(year, workspace_id),
+                    )
+            except IntegrityError:
+                # Строку счётчика только что создала параллельная транзакция
+                pass
+            last_value = _increment(year, workspace_id, count)
+    prefix = number_prefix(year, workspace_id)
+    return [f'{prefix}{value:04d}' for value in range(last_value - count + 1, last_value + 1)]
@@ -0,0 +1,189 @@
+"""
+Рендеринг счетов в PDF (WeasyPrint) вне HTTP-запроса.
+
+FontConfiguration и скомпилированный шаблон billing/invoice.html создаются один раз
+на процесс (воркер Celery или процесс пула) и переиспользуются между счетами.
+
+pdf_content_hash — sha256 HTML, из которого собран pdf_file. HTML дёшев по сравнению
+с WeasyPrint, поэтому перед рендером он собирается заново и сравнивается с хэшем:
+если счёт, клиент и шаблон не менялись, готовый файл не перерисовывается.
+
+render_invoice_pdfs рендерит пачку счетов: HTML и хэши — в текущем процессе, а
+WeasyPrint для изменившихся счетов — в пуле процессов (processes > 1). Процессы пула
+получают только HTML и не ходят в БД.
+"""
+import hashlib
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.core.files.base import ContentFile
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import Invoice
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_NAME = 'billing/invoice.html'
+
+_font_config = None
+_template = None
+
+
+def font_configuration():
+    """FontConfiguration WeasyPrint (одна на процесс: загрузка шрифтов — самая дорогая часть)."""
+    global _font_config
+    if _font_config is None:
+        from weasyprint.text.fonts import FontConfiguration
+
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def invoice_template():
+    """Скомпилированный шаблон счёта (одна компиляция на процесс)."""
+    global _template
+    if _template is None:
+        _template = get_template(TEMPLATE_NAME)
+    return _template
+
+
+def reset_render_cache():
+    """Сбросить шрифты и шаблон процесса (тесты, смена шаблона без перезапуска)."""
+    global _font_config, _template
+    _font_config = None
+    _template = None
+
+
+def render_html(invoice: Invoice) -> str:
+    return invoice_template().render({
+        'invoice': invoice,
+        'project': invoice.project,
+        'customer': invoice.customer or invoice.project.customer,
+        'line_items': invoice.line_items,
+    })
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def html_to_pdf(html: str) -> bytes:
+    from weasyprint import HTML
+
+    return HTML(string=html).write_pdf(font_config=font_configuration())
+
+
+def is_pdf_current(invoice: Invoice, digest: str | None = None) -> bool:
+    """PDF счёта сохранён и собран из того же HTML, что даёт счёт сейчас."""
+    if not invoice.pdf_file or not invoice.pdf_content_hash:
+        return False
+    if digest is None:
+        digest = content_hash(render_html(invoice))
+    return invoice.pdf_content_hash == digest
+
+
+def _save_pdf(invoice: Invoice, pdf_bytes: bytes, digest: str):
+    filename = f"{invoice.number.replace('/', '-')}.pdf"
+    invoice.pdf_file.save(filename, ContentFile(pdf_bytes), save=False)
+    invoice.pdf_status = Invoice.PDF_STATUS_READY
+    invoice.pdf_content_hash = digest
+    invoice.pdf_rendered_at = timezone.now()
+    invoice.pdf_error = ''
+    invoice.save(update_fields=[
+        'pdf_file', 'pdf_status', 'pdf_content_hash', 'pdf_rendered_at', 'pdf_error', 'updated_at',
+    ])
+
+
+def _mark_ready(invoice: Invoice):
+    if invoice.pdf_status != Invoice.PDF_STATUS_READY or invoice.pdf_error:
+        invoice.pdf_status = Invoice.PDF_STATUS_READY
+        invoice.pdf_error = ''
+        invoice.save(update_fields=['pdf_status', 'pdf_error', 'updated_at'])
+
+
+def mark_pdf_failed(invoice: Invoice, error):
+    invoice.pdf_status = Invoice.PDF_STATUS_FAILED
+    invoice.pdf_error = str(error)[:2000]
+    invoice.save(update_fields=['pdf_status', 'pdf_error', 'updated_at'])
+
+
+def render_invoice_pdf(invoice: Invoice, force: bool = False) -> bytes | None:
+    """
+    Отрендерить PDF счёта и сохранить в pdf_file.
+    Возвращает байты PDF или None, если файл актуален (хэш HTML не изменился) и force=False.
+    """
+    html = render_html(invoice)
+    digest = content_hash(html)
+    if not force and is_pdf_current(invoice, digest):
+        _mark_ready(invoice)
+        return None
+    pdf_bytes = html_to_pdf(html)
+    _save_pdf(invoice, pdf_bytes, digest)
+    return pdf_bytes
+
+
+def _pool_executor(processes: int):
+    # Процессы пула не используют соединения БД родителя; django.setup нужен только при spawn
+    return ProcessPoolExecutor(max_workers=processes, initializer=django.setup)
+
+
+def _outcome(call):
+    try:
+        return call(), None
+    except Exception as exc:
+        return None, exc
+
+
+def render_invoice_pdfs(invoice_ids, force: bool = False, processes: int = 1) -> dict:
+    """
+    Отрендерить PDF пачки счетов; WeasyPrint — в пуле из processes процессов.
+    Возвращает {rendered, skipped, failed, seconds}.
+    """
+    started = time.monotonic()
+    invoices = (
+        Invoice.objects.select_related('project__customer', 'customer')
+        .filter(pk__in=list(invoice_ids))
+        .order_by('pk')
+    )
+    pending = []
+    skipped = 0
+    for invoice in invoices:
+        html = render_html(invoice)
+        digest = content_hash(html)
+        if not force and is_pdf_current(invoice, digest):
+            _mark_ready(invoice)
+            skipped += 1
+            continue
+        pending.append((invoice, html, digest))
+
+    rendered = 0
+    failed = 0
+    # В демон-процессе (например, worker multiprocessing) дочерние процессы создавать нельзя
+    use_pool = processes > 1 and len(pending) > 1 and not multiprocessing.current_process().daemon
+    if use_pool:
+        with _pool_executor(min(processes, len(pending))) as executor:
+            futures = [executor.submit(html_to_pdf, html) for _, html, _ in pending]
+            results = [_outcome(future.result) for future in futures]
+    else:
+        results = [_outcome(partial(html_to_pdf, html)) for _, html, _ in pending]
+
+    for (invoice, _, digest), (pdf_bytes, error) in zip(pending, results):
+        if error is not None:
+            logger.warning('render_invoice_pdfs: invoice %s failed: %s', invoice.pk, error)
+            mark_pdf_failed(invoice, error)
+            failed += 1
+            continue
+        _save_pdf(invoice, pdf_bytes, digest)
+        rendered += 1
+
+    return {
+        'rendered': rendered,
+        'skipped': skipped,
+        'failed': failed,
+        'seconds': time.monotonic() - started,
+    }
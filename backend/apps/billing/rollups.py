@@ -0,0 +1,160 @@
+"""
+Дневные срезы потребления (UsageDailyRollup) для сводки usage за billing period.
+
+Ключ среза — (account, meter, day); day — дата occurred_at в текущем часовом поясе
+(как TruncDate). Создание UsageRecord (UsageRecord.save; bulk_create во flush буфера
+apps.billing.metering — явным apply_usage_records) увеличивает quantity и records_count
+своей строки в той же транзакции БД. Удаление, правка и вставка записей в обход ORM срезы
+не трогают — их исправляет rebuild_usage_rollups (команда backfill_usage_rollups).
+
+Период подписки начинается и заканчивается не в полночь, поэтому usage_totals берёт
+срезы только полных дней периода, а неполные крайние дни досчитывает по UsageRecord:
+результат совпадает с GROUP BY по всем записям периода, а сырых строк читается не больше
+чем за два дня.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import UsageDailyRollup, UsageRecord
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 1000
+
+
+def usage_day(value):
+    """Дата occurred_at в текущем часовом поясе."""
+    return timezone.localtime(value).date()
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _increment(key, quantity, count):
+    return UsageDailyRollup.objects.filter(**key).update(
+        quantity=F('quantity') + quantity,
+        records_count=F('records_count') + count,
+        updated_at=timezone.now(),
+    )
+
+
+def apply_usage_delta(key, quantity, count=1):
+    """Добавить quantity и count записей к строке среза key (создаёт строку при отсутствии)."""
+    if _increment(key, quantity, count):
+        return
+    try:
+        with transaction.atomic():
+            UsageDailyRollup.objects.create(**key, quantity=quantity, records_count=count)
+    except IntegrityError:
+        # Строку среза только что создала параллельная транзакция
+        _increment(key, quantity, count)
+
+
+def apply_usage_records(records):
+    """Учесть созданные UsageRecord в дневных срезах (вызывать в транзакции записи)."""
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for record in records:
+        key = (record.account_id, record.meter_id, usage_day(record.occurred_at))
+        deltas[key][0] += Decimal(str(record.quantity))
+        deltas[key][1] += 1
+    for (account_id, meter_id, day), (quantity, count) in sorted(deltas.items()):
+        apply_usage_delta({'account_id': account_id, 'meter_id': meter_id, 'day': day}, quantity, count)
+
+
+def usage_totals(account_id, period_start, period_end):
+    """
+    {meter_code: quantity} за [period_start, period_end] — срезы полных дней
+    плюс UsageRecord неполных крайних дней.
+    """
+    first_full_day = usage_day(period_start)
+    if _day_start(first_full_day) < period_start:
+        first_full_day += timedelta(days=1)
+    end_day = usage_day(period_end)
+
+    totals = defaultdict(Decimal)
+    if first_full_day < end_day:
+        rollups = (
+            UsageDailyRollup.objects.filter(account_id=account_id, day__gte=first_full_day, day__lt=end_day)
+            .values('meter__code')
+            .annotate(used=Sum('quantity'))
+            .order_by()
+        )
+        for row in rollups:
+            totals[row['meter__code']] += row['used'] or Decimal('0')
+        edges = (
+            Q(occurred_at__gte=period_start, occurred_at__lt=_day_start(first_full_day))
+            | Q(occurred_at__gte=_day_start(end_day), occurred_at__lte=period_end)
+        )
+    else:
+        edges = Q(occurred_at__gte=period_start, occurred_at__lte=period_end)
+    records = (
+        UsageRecord.objects.filter(edges, account_id=account_id)
+        .values('meter__code')
+        .annotate(used=Sum('quantity'))
+        .order_by()
+    )
+    for row in records:
+        totals[row['meter__code']] += row['used'] or Decimal('0')
+    return dict(totals)
+
+
+def daily_usage(account_id, date_from, date_to, meter_codes=None):
+    """Ряд для графика: [{day, meter_code, quantity, records_count}] по срезам за [date_from, date_to]."""
+    qs = UsageDailyRollup.objects.filter(account_id=account_id, day__gte=date_from, day__lte=date_to)
+    if meter_codes:
+        qs = qs.filter(meter__code__in=list(meter_codes))
+    return [
+        {
+            'day': row['day'],
+            'meter_code': row['meter__code'],
+            'quantity': row['quantity'],
+            'records_count': row['records_count'],
+        }
+        for row in qs.values('day', 'meter__code', 'quantity', 'records_count').order_by('day', 'meter__code')
+    ]
+
+
+def record_rollup_rows(account_ids=None):
+    """Срезы, посчитанные по UsageRecord (TruncDate + GROUP BY) — для пересборки и сверки."""
+    qs = UsageRecord.objects.all()
+    if account_ids is not None:
+        qs = qs.filter(account_id__in=list(account_ids))
+    return (
+        qs.annotate(day=TruncDate('occurred_at'))
+        .values('account_id', 'meter_id', 'day')
+        .annotate(quantity=Sum('quantity'), records_count=Count('id'))
+        .order_by()
+    )
+
+
+@transaction.atomic
+def rebuild_usage_rollups(account_ids=None):
+    """
+    Пересобрать срезы из UsageRecord (всё или по аккаунтам). Возвращает число строк среза.
+    DELETE держит блокировку затронутых строк до конца пересборки.
+    """
+    existing = UsageDailyRollup.objects.all()
+    if account_ids is not None:
+        existing = existing.filter(account_id__in=list(account_ids))
+    existing.delete()
+    created = 0
+    batch = []
+    for row in record_rollup_rows(account_ids):
+        batch.append(UsageDailyRollup(**row))
+        if len(batch) >= BULK_BATCH_SIZE:
+            UsageDailyRollup.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    if batch:
+        UsageDailyRollup.objects.bulk_create(batch)
+        created += len(batch)
+    logger.info('rebuild_usage_rollups: %s rows (accounts=%s)', created, account_ids or 'all')
+    return created
@@ -30,16 +30,26 @@ class InvoiceSerializer(serializers.ModelSerializer):
             'date_due',
             'amount_total',
             'pdf_file',
+            'pdf_status',
             'line_items',
             'created_at',
             'updated_at',
         ]
         read_only_fields = [
-            'number', 'status', 'amount_total', 'pdf_file',
+            'number', 'status', 'amount_total', 'pdf_file', 'pdf_status',
             'line_items', 'created_at', 'updated_at',
         ]
 
 
+class InvoicePdfStatusSerializer(serializers.ModelSerializer):
+    """Состояние фонового рендера PDF (опрос после generate_pdf)."""
+
+    class Meta:
+        model = Invoice
+        fields = ['id', 'pdf_status', 'pdf_file', 'pdf_rendered_at', 'pdf_error']
+        read_only_fields = fields
+
+
 class InvoiceCreateSerializer(serializers.Serializer):
     """Создание черновика счёта."""
 
@@ -55,6 +65,21 @@ class InvoiceCreateSerializer(serializers.Serializer):
         return data
 
 
+class InvoiceBatchCreateSerializer(serializers.Serializer):
+    """Черновики по всем проектам workspace за период."""
+
+    workspace_id = serializers.IntegerField()
+    date_start = serializers.DateField()
+    date_end = serializers.DateField()
+
+    def validate(self, data):
+        if data['date_end'] < data['date_start']:
+            raise serializers.ValidationError(
+                {'date_end': 'Дата окончания не может быть раньше даты начала.'}
+            )
+        return data
+
+
 class BillingMeResponseSerializer(serializers.Serializer):
     account_id = serializers.IntegerField(allow_null=True)
     workspace_id = serializers.IntegerField(allow_null=True)
@@ -91,6 +116,12 @@ class BillingUsageResponseSerializer(serializers.Serializer):
     entitlements = serializers.JSONField()
 
 
+class BillingUsageDailySerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    points = serializers.JSONField()
+
+
 class UsageRecordCreateSerializer(serializers.Serializer):
     meter_code = serializers.CharField(max_length=64)
     quantity = serializers.DecimalField(max_digits=14, decimal_places=3)
@@ -98,6 +129,8 @@ class UsageRecordCreateSerializer(serializers.Serializer):
     idempotency_key = serializers.CharField(max_length=128, required=False, allow_blank=True, default='')
     occurred_at = serializers.DateTimeField(required=False)
     meta = serializers.JSONField(required=False, default=dict)
+    # Принять в буфер (apps.billing.metering) без немедленной записи UsageRecord
+    buffered = serializers.BooleanField(required=False, default=False)
 
     def validate_quantity(self, value):
         if value <= 0:
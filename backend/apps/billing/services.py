@@ -2,22 +2,29 @@
 Billing services — Invoice generation, PDF rendering, Subscription limits (SaaS Sprint 2).
 """
 from decimal import Decimal, InvalidOperation
-from datetime import date
+from datetime import date, timedelta
 from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import threading
+import time
 import uuid
 import jwt
 
 from django.core.cache import cache
-from django.core.files.base import ContentFile
 from django.conf import settings
-from django.template.loader import render_to_string
 from django.utils import timezone
-from django.db.models import Q, Sum
+from django.db.models import Min, Q
 from django.db import IntegrityError
 from django.db import transaction
 import requests
 
 from .exceptions import QuotaExceeded, FeatureLocked
+from .metering import buffer_event, mark_accounts_dirty, meter_id
+from .numbering import reserve_invoice_numbers
+from .pdf import html_to_pdf, render_html, render_invoice_pdf
+from .rollups import daily_usage, usage_totals
+from .storage import release_bytes, reserve_bytes
 from .models import (
     Invoice,
     Subscription,
@@ -35,6 +42,8 @@ from apps.core.models import UserEvent
 from apps.notifications.audit import log_audit
 from apps.notifications.models import AuditLog
 
+logger = logging.getLogger(__name__)
+
 
 # Дефолтные лимиты Free (если у пользователя нет подписки или плана)
 DEFAULT_FREE_LIMITS = {
@@ -139,10 +148,54 @@ class SubscriptionService:
         return bool(features.get(feature_key))
 
 
+_entitlement_locals = threading.local()
+
+
+def open_entitlement_scope():
+    """Открыть область мемоизации entitlements для текущего потока (вложенные вызовы допускаются)."""
+    depth = getattr(_entitlement_locals, 'depth', 0)
+    if depth == 0:
+        _entitlement_locals.contexts = {}
+    _entitlement_locals.depth = depth + 1
+
+
+def close_entitlement_scope():
+    """Закрыть область; на внешнем уровне забыть вычисленные контексты."""
+    depth = getattr(_entitlement_locals, 'depth', 0)
+    if depth <= 0:
+        return
+    _entitlement_locals.depth = depth - 1
+    if depth == 1:
+        _entitlement_locals.contexts = None
+
+
+def forget_entitlement_context(user_id=None):
+    """Сбросить мемоизированный контекст (пользователя или всех) — после смены подписки в том же запросе."""
+    contexts = getattr(_entitlement_locals, 'contexts', None)
+    if not contexts:
+        return
+    if user_id is None:
+        contexts.clear()
+    else:
+        contexts.pop(user_id, None)
+
+
+@contextmanager
+def entitlement_scope():
+    """
+    Все проверки QuotaService внутри блока (HTTP-запрос, Celery-задача) разделяют один
+    контекст entitlements на пользователя: аккаунт, подписка, расчёт и bypass считаются один раз.
+    """
+    open_entitlement_scope()
+    try:
+        yield
+    finally:
+        close_entitlement_scope()
+
+
 class QuotaService:
     """Единый сервис quota/feature enforcement для SaaS-ограничений."""
 
-    STORAGE_META_KEY = 'used_storage_bytes'
     BYPASS_ITEM_META_KEY = 'bypass_quotas'
 
     @staticmethod
@@ -174,20 +227,42 @@ class QuotaService:
 
     @classmethod
     def _resolve_context(cls, user, workspace_id=None):
+        """
+        (account, entitlements, bypass) пользователя. Внутри entitlement_scope
+        (middleware запроса) вычисляется один раз на пользователя: аккаунт и подписка
+        определяются по пользователю, а не по workspace_id. Расчёт v2 между запросами
+        берётся из EntitlementCache.
+        """
+        contexts = getattr(_entitlement_locals, 'contexts', None)
+        user_id = getattr(user, 'pk', None)
+        if contexts is not None and user_id in contexts:
+            return contexts[user_id]
         account = BillingAccountService.get_user_account(user)
-        subscription = BillingAccountService.get_current_subscription(account) if account else None
-        entitlements = EntitlementService.calculate(user=user, account=account, subscription=subscription)
-        return account, subscription, entitlements
+        cache_key, cached = EntitlementCache.get(account.pk) if account else (None, None)
+        if cached is not None:
+            entitlements, items_bypass = cached['entitlements'], cached['bypass']
+        else:
+            subscription = BillingAccountService.get_current_subscription(account) if account else None
+            entitlements = EntitlementService.calculate(user=user, account=account, subscription=subscription)
+            items_bypass = cls._items_bypass(subscription)
+            # legacy-расчёт зависит от пользователя, а не от аккаунта — не кэшируется
+            if cache_key and entitlements.get('source') == 'v2':
+                EntitlementCache.set(account.pk, cache_key, {'entitlements': entitlements, 'bypass': items_bypass})
+        bypass = bool(getattr(user, 'is_superuser', False) or getattr(user, 'is_staff', False) or items_bypass)
+        context = (account, entitlements, bypass)
+        if contexts is not None and user_id is not None:
+            contexts[user_id] = context
+        return context
 
     @classmethod
-    def _has_quota_bypass(cls, user, subscription=None):
-        if getattr(user, 'is_superuser', False) or getattr(user, 'is_staff', False):
-            return True
+    def _items_bypass(cls, subscription):
+        """Активная позиция подписки с meta.bypass_quotas отключает квоты аккаунта."""
         if not subscription:
             return False
-        for item in subscription.items.filter(is_active=True):
+        # items уже загружены prefetch_related в get_current_subscription
+        for item in subscription.items.all():
             meta = item.meta if isinstance(item.meta, dict) else {}
-            if bool(meta.get(cls.BYPASS_ITEM_META_KEY)):
+            if item.is_active and bool(meta.get(cls.BYPASS_ITEM_META_KEY)):
                 return True
         return False
 
@@ -230,8 +305,8 @@ class QuotaService:
 
     @classmethod
     def assert_new_resources_allowed(cls, user, *, workspace_id=None, source=''):
-        account, subscription, entitlements = cls._resolve_context(user, workspace_id=workspace_id)
-        if cls._has_quota_bypass(user, subscription=subscription):
+        account, entitlements, bypass = cls._resolve_context(user, workspace_id=workspace_id)
+        if bypass:
             return
         restrictions = entitlements.get('restrictions', {}) if isinstance(entitlements, dict) else {}
         allow_new = bool(restrictions.get('allow_new_resources', True))
@@ -251,8 +326,8 @@ class QuotaService:
         keys = cls._as_list(feature_keys)
         if not keys:
             return
-        account, subscription, entitlements = cls._resolve_context(user, workspace_id=workspace_id)
-        if cls._has_quota_bypass(user, subscription=subscription):
+        account, entitlements, bypass = cls._resolve_context(user, workspace_id=workspace_id)
+        if bypass:
             return
         feature_key, enabled = cls._get_feature(entitlements, keys)
         # Если фича не описана в тарифе, не блокируем.
@@ -282,8 +357,8 @@ class QuotaService:
         keys = cls._as_list(metric_keys)
         if not keys:
             return
-        account, subscription, entitlements = cls._resolve_context(user, workspace_id=workspace_id)
-        if cls._has_quota_bypass(user, subscription=subscription):
+        account, entitlements, bypass = cls._resolve_context(user, workspace_id=workspace_id)
+        if bypass:
             return
         metric_key, raw_limit = cls._get_limit(entitlements, keys)
         if metric_key is None:
@@ -310,12 +385,6 @@ class QuotaService:
             metric=metric_key,
         )
 
-    @classmethod
-    def _count_workspace_attachments_size(cls, workspace_id):
-        from apps.documents.models import Attachment
-        agg = Attachment.objects.filter(project__workspace_id=workspace_id).aggregate(total=Sum('size'))
-        return int(agg.get('total') or 0)
-
     @classmethod
     def reserve_storage_bytes(
         cls,
@@ -325,11 +394,12 @@ class QuotaService:
         workspace_id=None,
         source='',
     ):
+        """Занять size_bytes в счётчике workspace (apps.billing.storage) с проверкой лимита storage_gb."""
         size_bytes = int(size_bytes or 0)
         if size_bytes <= 0:
             return
-        account, subscription, entitlements = cls._resolve_context(user, workspace_id=workspace_id)
-        if cls._has_quota_bypass(user, subscription=subscription):
+        account, entitlements, bypass = cls._resolve_context(user, workspace_id=workspace_id)
+        if bypass:
             return
         metric_key, raw_limit = cls._get_limit(entitlements, ('storage_gb', 'max_storage_gb'))
         if metric_key is None:
@@ -338,51 +408,41 @@ class QuotaService:
         limit_bytes = None if limit_gb < 0 else int(limit_gb * 1024 * 1024 * 1024)
         if not account:
             return
+        ws_id = workspace_id or account.workspace_id
+        if not ws_id:
+            return
 
-        with transaction.atomic():
-            locked_account = BillingAccount.objects.select_for_update().select_related('workspace').get(pk=account.pk)
-            meta = dict(locked_account.meta or {})
-            used_bytes = int(meta.get(cls.STORAGE_META_KEY) or 0)
-            # Инициализация счетчика из фактического объема (один раз или при рассинхроне вниз).
-            if used_bytes <= 0 and (workspace_id or locked_account.workspace_id):
-                ws_id = workspace_id or locked_account.workspace_id
-                used_bytes = cls._count_workspace_attachments_size(ws_id)
-            projected = used_bytes + size_bytes
-            if limit_bytes is not None and projected > limit_bytes:
-                workspace_name = cls._workspace_name(locked_account, workspace_id=workspace_id)
-                detail = (
-                    f"Ваше пространство '{workspace_name}' заполнено. "
-                    "Чтобы расширить границы до тарифа БАЗА, нажмите здесь."
-                )
-                cls._audit_block(
-                    user=user,
-                    account=locked_account,
-                    kind='limit',
-                    key=metric_key,
-                    limit=limit_bytes,
-                    usage=projected,
-                    source=source or 'storage',
-                )
-                raise QuotaExceeded(detail, limit=limit_bytes, usage=projected, metric=metric_key)
-            meta[cls.STORAGE_META_KEY] = projected
-            locked_account.meta = meta
-            locked_account.save(update_fields=['meta', 'updated_at'])
+        reserved, used_bytes = reserve_bytes(ws_id, size_bytes, limit_bytes)
+        if reserved:
+            return
+        projected = (used_bytes or 0) + size_bytes
+        workspace_name = cls._workspace_name(account, workspace_id=workspace_id)
+        detail = (
+            f"Ваше пространство '{workspace_name}' заполнено. "
+            "Чтобы расширить границы до тарифа БАЗА, нажмите здесь."
+        )
+        cls._audit_block(
+            user=user,
+            account=account,
+            kind='limit',
+            key=metric_key,
+            limit=limit_bytes,
+            usage=projected,
+            source=source or 'storage',
+        )
+        raise QuotaExceeded(detail, limit=limit_bytes, usage=projected, metric=metric_key)
 
     @classmethod
     def release_storage_bytes(cls, user, size_bytes, *, workspace_id=None):
+        """Вернуть size_bytes в счётчик workspace (удаление вложения или неудачная загрузка)."""
         size_bytes = int(size_bytes or 0)
         if size_bytes <= 0:
             return
-        account = BillingAccountService.get_user_account(user)
-        if not account:
-            return
-        with transaction.atomic():
-            locked_account = BillingAccount.objects.select_for_update().get(pk=account.pk)
-            meta = dict(locked_account.meta or {})
-            used_bytes = int(meta.get(cls.STORAGE_META_KEY) or 0)
-            meta[cls.STORAGE_META_KEY] = max(0, used_bytes - size_bytes)
-            locked_account.meta = meta
-            locked_account.save(update_fields=['meta', 'updated_at'])
+        if not workspace_id:
+            account = BillingAccountService.get_user_account(user)
+            workspace_id = account.workspace_id if account else None
+        if workspace_id:
+            release_bytes(workspace_id, size_bytes)
 
 
 class BillingAccountService:
@@ -432,6 +492,80 @@ class BillingAccountService:
         )
 
 
+class EntitlementCache:
+    """
+    Кэш рассчитанных v2-entitlements аккаунта (Redis) с версионными ключами.
+
+    Ключ = аккаунт + версия аккаунта + версия тарифов. Изменение подписки, позиции или
+    override аккаунта увеличивает версию аккаунта, изменение PlanVersion — версию тарифов
+    (apps.billing.signals, после коммита). Читатель берёт версии до чтения БД, поэтому
+    результат, посчитанный до изменения, записывается под старой версией и больше не читается.
+    TTL не дольше ближайшего истечения override (дополнительно к задаче на expires_at).
+    """
+
+    DEFAULT_TIMEOUT = 600
+    PLANS_SCOPE = 'plans'
+
+    @staticmethod
+    def _version_key(scope):
+        return f'billing:entitlements:version:{scope}'
+
+    @classmethod
+    def timeout(cls):
+        return getattr(settings, 'BILLING_ENTITLEMENTS_CACHE_SECONDS', cls.DEFAULT_TIMEOUT)
+
+    @classmethod
+    def _versions(cls, scopes):
+        keys = [cls._version_key(scope) for scope in scopes]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, int(time.time() * 1000), None)
+                versions[key] = cache.get(key)
+        return [versions[key] for key in keys]
+
+    @classmethod
+    def get(cls, account_id):
+        """(cache_key, значение или None); cache_key — под которым сохранять пересчитанное (None — кэш выключен)."""
+        if cls.timeout() <= 0:
+            return None, None
+        try:
+            account_version, plans_version = cls._versions([account_id, cls.PLANS_SCOPE])
+            cache_key = f'billing:entitlements:account:{account_id}:{account_version}:{plans_version}'
+            return cache_key, cache.get(cache_key)
+        except Exception as e:
+            logger.warning('Entitlement cache read failed account_id=%s: %s', account_id, e)
+            return None, None
+
+    @classmethod
+    def set(cls, account_id, cache_key, value):
+        timeout = cls.timeout()
+        now = timezone.now()
+        next_expiry = EntitlementOverride.objects.filter(
+            account_id=account_id, is_enabled=True, expires_at__gt=now
+        ).aggregate(next_expiry=Min('expires_at'))['next_expiry']
+        if next_expiry is not None:
+            timeout = max(1, min(timeout, int((next_expiry - now).total_seconds()) + 1))
+        try:
+            cache.set(cache_key, value, timeout)
+        except Exception as e:
+            logger.warning('Entitlement cache write failed account_id=%s: %s', account_id, e)
+
+    @classmethod
+    def invalidate(cls, account_id=None):
+        """Сбросить entitlements аккаунта (account_id=None — всех аккаунтов: изменился тариф)."""
+        key = cls._version_key(cls.PLANS_SCOPE if account_id is None else account_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), None)
+        except Exception as e:
+            logger.warning('Entitlement cache invalidation failed scope=%s: %s', account_id or cls.PLANS_SCOPE, e)
+        forget_entitlement_context()
+        # Лимиты в сводке usage тоже изменились
+        mark_accounts_dirty([account_id])
+
+
 class EntitlementService:
     """Расчет effective entitlements для v2-контура подписок."""
 
@@ -461,8 +595,8 @@ class EntitlementService:
 
     @classmethod
     def _apply_addon_items(cls, limits, features, subscription):
-        for item in subscription.items.filter(is_active=True):
-            if item.item_type != item.ITEM_ADDON:
+        for item in subscription.items.all():
+            if not item.is_active or item.item_type != item.ITEM_ADDON:
                 continue
             meta = item.meta or {}
             limits_delta = meta.get('limits_delta', {})
@@ -578,6 +712,7 @@ class UsageService:
         subscription = subscription or BillingAccountService.get_current_subscription(account)
         period_start, period_end = cls._resolve_period(subscription)
         cache.delete(cls._cache_key(account.id, period_start, period_end))
+        mark_accounts_dirty([account.id])
 
     @classmethod
     def record_usage_event(
@@ -628,6 +763,35 @@ class UsageService:
         cls.invalidate_current_period_cache(account, subscription=subscription)
         return record, created
 
+    @classmethod
+    def buffer_usage_event(cls, user, meter_code, quantity, idempotency_key='', occurred_at=None, account=None):
+        """
+        Принять событие в буфер (apps.billing.metering) без записи в БД.
+        Строки UsageRecord появятся после flush_usage_buffer. Возвращает False для дубля idempotency_key.
+        """
+        account = account or BillingAccountService.get_user_account(user)
+        if not account:
+            raise ValueError('Billing account not found')
+        meter = meter_id(meter_code)
+        if meter is None:
+            raise ValueError('Usage meter not found')
+        quantity_decimal = cls._safe_decimal(quantity)
+        if quantity_decimal <= 0:
+            raise ValueError('Quantity must be positive')
+        return buffer_event(account.id, meter, quantity_decimal, occurred_at or timezone.now(), idempotency_key or '')
+
+    @classmethod
+    def get_daily_usage(cls, user, days=30, meter_codes=None):
+        """Дневной ряд потребления для графика (по срезам UsageDailyRollup) за последние days дней."""
+        date_to = timezone.localdate()
+        date_from = date_to - timedelta(days=max(int(days), 1) - 1)
+        account = BillingAccountService.get_user_account(user)
+        points = daily_usage(account.id, date_from, date_to, meter_codes) if account else []
+        for point in points:
+            point['day'] = point['day'].isoformat()
+            point['quantity'] = str(point['quantity'])
+        return {'date_from': date_from, 'date_to': date_to, 'points': points}
+
     @classmethod
     def refresh_usage_cache_for_user(cls, user):
         return cls.get_usage_summary(user, use_cache=True, force_refresh=True)
@@ -654,19 +818,13 @@ class UsageService:
             if cached:
                 return cached
 
-        rows = (
-            UsageRecord.objects.filter(account=account, occurred_at__gte=period_start, occurred_at__lte=period_end)
-            .values('meter__code')
-            .annotate(used=Sum('quantity'))
-            .order_by('meter__code')
-        )
+        used_by_meter = usage_totals(account.id, period_start, period_end)
         limits = entitlements.get('limits', {}) if isinstance(entitlements.get('limits'), dict) else {}
         meters = []
         total_used = Decimal('0')
         total_overage = Decimal('0')
-        for row in rows:
-            code = row['meter__code']
-            used = cls._safe_decimal(row.get('used'))
+        for code in sorted(used_by_meter):
+            used = cls._safe_decimal(used_by_meter[code])
             total_used += used
             raw_limit = limits.get(code, limits.get(f'max_{code}'))
             included = cls._safe_decimal(raw_limit) if raw_limit is not None else None
@@ -1039,9 +1197,11 @@ class PaymentProviderService:
         return event, True
 
     @staticmethod
-    def _mark_subscription_past_due(subscription, reason='payment_failed'):
-        if not subscription:
-            return
+    def _set_subscription_past_due(subscription, reason='payment_failed'):
+        """
+        past_due в памяти (без сохранения): meta и статус подписки, статус аккаунта.
+        Возвращает True, если аккаунт нужно сохранить.
+        """
         now = timezone.now()
         meta = dict(subscription.meta or {})
         if 'past_due_since' not in meta:
@@ -1054,27 +1214,21 @@ class PaymentProviderService:
             subscription.STATUS_TRIALING,
         ):
             subscription.status = subscription.STATUS_PAST_DUE
-            subscription.save(update_fields=['status', 'meta', 'updated_at'])
-        else:
-            subscription.save(update_fields=['meta', 'updated_at'])
         account = subscription.account
         if account and account.status != account.STATUS_SUSPENDED:
             account.status = account.STATUS_ACTIVE
-            account.save(update_fields=['status', 'updated_at'])
+            return True
+        return False
 
     @staticmethod
-    def _mark_subscription_active(subscription):
-        if not subscription:
-            return
+    def _set_subscription_active(subscription):
+        """
+        Активация подписки в памяти (без сохранения): сброс dunning-meta, статусы подписки и аккаунта.
+        Возвращает True, если изменился статус аккаунта.
+        """
         meta = dict(subscription.meta or {})
-        if 'past_due_since' in meta:
-            meta.pop('past_due_since', None)
-        if 'past_due_reason' in meta:
-            meta.pop('past_due_reason', None)
-        if 'dunning_attempts' in meta:
-            meta.pop('dunning_attempts', None)
-        if 'last_dunning_notified_at' in meta:
-            meta.pop('last_dunning_notified_at', None)
+        for key in ('past_due_since', 'past_due_reason', 'dunning_attempts', 'last_dunning_notified_at'):
+            meta.pop(key, None)
         subscription.meta = meta
         if subscription.status in (
             subscription.STATUS_PAST_DUE,
@@ -1083,23 +1237,37 @@ class PaymentProviderService:
             subscription.STATUS_EXPIRED,
         ):
             subscription.status = subscription.STATUS_ACTIVE
-            subscription.save(update_fields=['status', 'meta', 'updated_at'])
-        else:
-            subscription.save(update_fields=['meta', 'updated_at'])
         account = subscription.account
         if account and account.status != account.STATUS_ACTIVE:
             account.status = account.STATUS_ACTIVE
-            account.save(update_fields=['status', 'updated_at'])
+            return True
+        return False
 
     @staticmethod
-    def process_webhook_event(event):
+    def _mark_subscription_past_due(subscription, reason='payment_failed'):
+        if not subscription:
+            return
+        save_account = PaymentProviderService._set_subscription_past_due(subscription, reason=reason)
+        subscription.save(update_fields=['status', 'meta', 'updated_at'])
+        if save_account:
+            subscription.account.save(update_fields=['status', 'updated_at'])
+
+    @staticmethod
+    def _mark_subscription_active(subscription):
+        if not subscription:
+            return
+        save_account = PaymentProviderService._set_subscription_active(subscription)
+        subscription.save(update_fields=['status', 'meta', 'updated_at'])
+        if save_account:
+            subscription.account.save(update_fields=['status', 'updated_at'])
+
+    @staticmethod
+    def parse_webhook_event(event):
+        """(provider_payment_id, статус PaymentTransaction, raw_response) из payload события."""
         payload = event.payload if isinstance(event.payload, dict) else {}
-        raw_status = ''
         if event.provider == 'yookassa':
             obj = payload.get('object') if isinstance(payload.get('object'), dict) else {}
-            provider_payment_id = str(obj.get('id') or '')
             raw_status = str(obj.get('status') or '')
-            raw_response = obj
             status_map = {
                 'pending': PaymentTransaction.STATUS_PENDING,
                 'waiting_for_capture': PaymentTransaction.STATUS_WAITING_CAPTURE,
@@ -1107,12 +1275,10 @@ class PaymentProviderService:
                 'canceled': PaymentTransaction.STATUS_CANCELED,
                 'failed': PaymentTransaction.STATUS_FAILED,
             }
-            status = status_map.get(raw_status, raw_status)
-        elif event.provider == 'yandex_pay':
+            return str(obj.get('id') or ''), status_map.get(raw_status, raw_status), obj
+        if event.provider == 'yandex_pay':
             order = payload.get('order') if isinstance(payload.get('order'), dict) else {}
-            provider_payment_id = str(order.get('orderId') or '')
             raw_status = str(order.get('paymentStatus') or '')
-            raw_response = payload
             status_map = {
                 'PENDING': PaymentTransaction.STATUS_PENDING,
                 'AUTHORIZED': PaymentTransaction.STATUS_WAITING_CAPTURE,
@@ -1120,22 +1286,15 @@ class PaymentProviderService:
                 'FAILED': PaymentTransaction.STATUS_FAILED,
                 'CANCELLED': PaymentTransaction.STATUS_CANCELED,
             }
-            status = status_map.get(raw_status, PaymentTransaction.STATUS_PENDING)
-        else:
-            provider_payment_id = ''
-            raw_response = payload
-            status = ''
-        tx = PaymentTransaction.objects.filter(
-            provider=event.provider,
-            provider_payment_id=provider_payment_id,
-        ).first()
-        if not tx:
-            event.status = PaymentWebhookEvent.STATUS_FAILED
-            event.error_message = 'payment_transaction_not_found'
-            event.processed_at = timezone.now()
-            event.save(update_fields=['status', 'error_message', 'processed_at', 'updated_at'])
-            return {'ok': False, 'reason': 'payment_transaction_not_found'}
+            return str(order.get('orderId') or ''), status_map.get(raw_status, PaymentTransaction.STATUS_PENDING), payload
+        return '', '', payload
 
+    @staticmethod
+    def apply_webhook_status(tx, status, raw_response):
+        """
+        Применить статус webhook к транзакции в памяти (правила _should_apply_transaction_status).
+        Возвращает (effective_status, became_succeeded, became_failed_or_canceled, update_fields).
+        """
         update_fields = ['updated_at']
         previous_status = tx.status
         apply_status = PaymentProviderService._should_apply_transaction_status(previous_status, status)
@@ -1156,38 +1315,70 @@ class PaymentProviderService:
             and status in (PaymentTransaction.STATUS_CANCELED, PaymentTransaction.STATUS_FAILED)
             and previous_status not in (PaymentTransaction.STATUS_CANCELED, PaymentTransaction.STATUS_FAILED)
         )
-
         if became_succeeded:
             tx.paid_at = timezone.now()
             update_fields.append('paid_at')
-            PaymentProviderService._mark_subscription_active(tx.subscription)
-            if tx.account and tx.account.owner_id:
-                UserEvent.objects.create(
-                    user=tx.account.owner,
-                    event_type=UserEvent.EVENT_PAYMENT,
-                    amount=tx.amount,
-                    details={
-                        'source': tx.provider,
-                        'status': 'paid',
-                        'currency': tx.currency,
-                        'transaction_id': tx.id,
-                        'provider_payment_id': tx.provider_payment_id,
-                    },
-                )
-            try:
-                from apps.bot.services import send_admin_notification
-                admin_msg = (
-                    f"💰 <b>Новый платеж!</b>\n"
-                    f"Сумма: {tx.amount} {tx.currency}\n"
-                    f"Провайдер: {tx.provider}\n"
-                    f"Аккаунт: {tx.account.owner.email if tx.account and tx.account.owner else 'N/A'}"
-                )
-                send_admin_notification(admin_msg)
-            except Exception as e:
-                logger.warning('Failed to send admin notification for payment tx=%s: %s', tx.id, e)
         if became_failed_or_canceled:
             tx.canceled_at = timezone.now()
             update_fields.append('canceled_at')
+        return effective_status, became_succeeded, became_failed_or_canceled, update_fields
+
+    @staticmethod
+    def payment_user_event(tx):
+        """UserEvent об оплате (без сохранения) или None, если у аккаунта нет владельца."""
+        if not tx.account or not tx.account.owner_id:
+            return None
+        return UserEvent(
+            user=tx.account.owner,
+            event_type=UserEvent.EVENT_PAYMENT,
+            amount=tx.amount,
+            details={
+                'source': tx.provider,
+                'status': 'paid',
+                'currency': tx.currency,
+                'transaction_id': tx.id,
+                'provider_payment_id': tx.provider_payment_id,
+            },
+        )
+
+    @staticmethod
+    def notify_admin_payment(tx):
+        try:
+            from apps.bot.services import send_admin_notification
+            admin_msg = (
+                f"💰 <b>Новый платеж!</b>\n"
+                f"Сумма: {tx.amount} {tx.currency}\n"
+                f"Провайдер: {tx.provider}\n"
+                f"Аккаунт: {tx.account.owner.email if tx.account and tx.account.owner else 'N/A'}"
+            )
+            send_admin_notification(admin_msg)
+        except Exception as e:
+            logger.warning('Failed to send admin notification for payment tx=%s: %s', tx.id, e)
+
+    @staticmethod
+    def process_webhook_event(event):
+        provider_payment_id, status, raw_response = PaymentProviderService.parse_webhook_event(event)
+        tx = PaymentTransaction.objects.filter(
+            provider=event.provider,
+            provider_payment_id=provider_payment_id,
+        ).first()
+        if not tx:
+            event.status = PaymentWebhookEvent.STATUS_FAILED
+            event.error_message = 'payment_transaction_not_found'
+            event.processed_at = timezone.now()
+            event.save(update_fields=['status', 'error_message', 'processed_at', 'updated_at'])
+            return {'ok': False, 'reason': 'payment_transaction_not_found'}
+
+        effective_status, became_succeeded, became_failed_or_canceled, update_fields = (
+            PaymentProviderService.apply_webhook_status(tx, status, raw_response)
+        )
+        if became_succeeded:
+            PaymentProviderService._mark_subscription_active(tx.subscription)
+            user_event = PaymentProviderService.payment_user_event(tx)
+            if user_event:
+                user_event.save()
+            PaymentProviderService.notify_admin_payment(tx)
+        if became_failed_or_canceled:
             PaymentProviderService._mark_subscription_past_due(tx.subscription, reason=status)
         tx.save(update_fields=update_fields)
 
@@ -1201,57 +1392,28 @@ class PaymentProviderService:
 class InvoiceGenerator:
     """
     Генератор черновиков счетов на основе TimeLog.
+
+    Выставленный лог помечается ссылкой TimeLog.invoice: выборка невыставленных логов —
+    поиск по частичному индексу time_logs_unbilled_idx, а не вычитание всех логов всех
+    счетов. Логи блокируются (select_for_update) и помечаются условным UPDATE
+    invoice IS NULL, поэтому параллельная генерация не включит лог в два счёта.
+    M2M related_timelogs заполняется как раньше. Номера — из счётчика
+    (apps.billing.numbering): пакетная генерация резервирует блок номеров одним запросом.
     """
 
     @staticmethod
-    def _next_invoice_number() -> str:
-        """Генерация номера счёта: INV-YYYY-XXXX."""
-        year = timezone.now().year
-        last = Invoice.objects.filter(
-            number__startswith=f'INV-{year}-'
-        ).order_by('-number').values_list('number', flat=True).first()
-        if last:
-            try:
-                seq = int(last.split('-')[-1]) + 1
-            except (ValueError, IndexError):
-                seq = 1
-        else:
-            seq = 1
-        return f'INV-{year}-{seq:04d}'
-
-    @classmethod
-    def generate_draft(
-        cls,
-        project_id: int,
-        date_start: date,
-        date_end: date,
-        created_by,
-    ) -> Invoice | None:
-        """
-        Создать черновик счёта за период.
-        
-        Находит billable TimeLog проекта, ещё не включённые ни в один счёт.
-        Группирует по WorkItem, формирует line_items.
-        """
-        project = Project.objects.select_related('customer').get(pk=project_id)
-
-        invoiced_timelog_ids = Invoice.objects.values_list(
-            'related_timelogs', flat=True
-        ).distinct()
-
-        timelogs = TimeLog.objects.filter(
-            workitem__project_id=project_id,
+    def _unbilled_timelogs(date_start: date, date_end: date):
+        return TimeLog.objects.filter(
             billable=True,
+            invoice__isnull=True,
             started_at__date__gte=date_start,
             started_at__date__lte=date_end,
             amount__isnull=False,
-        ).exclude(
-            id__in=invoiced_timelog_ids
-        ).select_related('workitem', 'user')
-
-        if not timelogs.exists():
-            return None
+        )
 
+    @classmethod
+    def _create_invoice(cls, project, timelogs, number: str, date_start: date, date_end: date, created_by) -> Invoice:
+        """Черновик по логам проекта: строки — по WorkItem; логи помечаются счётом."""
         grouped: dict[int, list[TimeLog]] = defaultdict(list)
         for tl in timelogs:
             grouped[tl.workitem_id].append(tl)
@@ -1274,13 +1436,12 @@ class InvoiceGenerator:
 
         date_due = date_end
         if date_due <= date_start:
-            from datetime import timedelta
             date_due = date_start + timedelta(days=14)
 
         invoice = Invoice.objects.create(
             project=project,
             customer=project.customer,
-            number=cls._next_invoice_number(),
+            number=number,
             status=Invoice.STATUS_DRAFT,
             date_issue=date_start,
             date_due=date_due,
@@ -1288,13 +1449,77 @@ class InvoiceGenerator:
             line_items=line_items,
             created_by=created_by,
         )
-        invoice.related_timelogs.set(timelogs)
+        timelog_ids = [tl.pk for tl in timelogs]
+        claimed = TimeLog.objects.filter(pk__in=timelog_ids, invoice__isnull=True).update(invoice=invoice)
+        if claimed != len(timelog_ids):
+            raise ValueError('Часть таймлогов уже включена в другой счёт')
+        invoice.related_timelogs.set(timelog_ids)
         return invoice
 
+    @classmethod
+    def generate_draft(
+        cls,
+        project_id: int,
+        date_start: date,
+        date_end: date,
+        created_by,
+    ) -> Invoice | None:
+        """
+        Создать черновик счёта за период.
+        
+        Находит billable TimeLog проекта, ещё не включённые ни в один счёт.
+        Группирует по WorkItem, формирует line_items.
+        """
+        project = Project.objects.select_related('customer').get(pk=project_id)
+
+        with transaction.atomic():
+            timelogs = list(
+                cls._unbilled_timelogs(date_start, date_end)
+                .filter(workitem__project_id=project_id)
+                .select_related('workitem', 'user')
+                .select_for_update(of=('self',))
+            )
+            if not timelogs:
+                return None
+            number = reserve_invoice_numbers(1, workspace_id=project.workspace_id)[0]
+            return cls._create_invoice(project, timelogs, number, date_start, date_end, created_by)
+
+    @classmethod
+    def generate_workspace_drafts(
+        cls,
+        workspace_id: int,
+        date_start: date,
+        date_end: date,
+        created_by,
+    ) -> list[Invoice]:
+        """
+        Черновики за период по всем проектам workspace за один проход: невыставленные
+        логи всех проектов читаются одним запросом и делятся по проектам.
+        Проекты без невыставленных логов пропускаются.
+        """
+        with transaction.atomic():
+            timelogs = (
+                cls._unbilled_timelogs(date_start, date_end)
+                .filter(workitem__project__workspace_id=workspace_id)
+                .select_related('workitem__project__customer', 'user')
+                .select_for_update(of=('self',))
+            )
+            by_project: dict[int, list[TimeLog]] = defaultdict(list)
+            for tl in timelogs:
+                by_project[tl.workitem.project_id].append(tl)
+            numbers = reserve_invoice_numbers(len(by_project), workspace_id=workspace_id)
+            return [
+                cls._create_invoice(logs[0].workitem.project, logs, number, date_start, date_end, created_by)
+                for number, (_, logs) in zip(numbers, sorted(by_project.items()))
+            ]
+
 
 class PDFRenderer:
     """
-    Рендеринг HTML-шаблона в PDF через WeasyPrint.
+    Рендеринг HTML-шаблона в PDF через WeasyPrint (apps.billing.pdf).
+
+    Шрифты и шаблон переиспользуются в процессе; из API рендер запускается
+    задачей apps.billing.tasks.render_invoice_pdf.
     """
 
     @staticmethod
@@ -1304,33 +1529,13 @@ class PDFRenderer:
         
         Возвращает байты PDF.
         """
-        from weasyprint import HTML
-        from weasyprint.text.fonts import FontConfiguration
-
-        font_config = FontConfiguration()
-        context = {
-            'invoice': invoice,
-            'project': invoice.project,
-            'customer': invoice.customer or invoice.project.customer,
-            'line_items': invoice.line_items,
-        }
-        html_str = render_to_string('billing/invoice.html', context)
-        html = HTML(string=html_str)
-        pdf_bytes = html.write_pdf(font_config=font_config)
-        return pdf_bytes
+        return html_to_pdf(render_html(invoice))
 
     @classmethod
     def render_and_save(cls, invoice: Invoice) -> bytes:
         """
-        Рендер PDF и сохранение в модель.
+        Рендер PDF и сохранение в модель (вместе с хэшем содержимого).
         
         Возвращает байты PDF.
         """
-        pdf_bytes = cls.render(invoice)
-        filename = f"{invoice.number.replace('/', '-')}.pdf"
-        invoice.pdf_file.save(
-            filename,
-            ContentFile(pdf_bytes),
-            save=True,
-        )
-        return pdf_bytes
+        return render_invoice_pdf(invoice, force=True)
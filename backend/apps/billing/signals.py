@@ -0,0 +1,56 @@
+"""
+Сигналы billing: сброс кэша entitlements (EntitlementCache) при изменении подписки,
+позиций, override и тарифов; плановый сброс в момент истечения override.
+
+Версия увеличивается после коммита: до него читатели ещё видят старые строки в БД.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import BillingSubscription, EntitlementOverride, PlanVersion, SubscriptionItem
+from .services import EntitlementCache
+
+
+def _invalidate_on_commit(account_id=None):
+    transaction.on_commit(partial(EntitlementCache.invalidate, account_id))
+
+
+@receiver(post_save, sender=BillingSubscription)
+@receiver(post_delete, sender=BillingSubscription)
+def subscription_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(instance.account_id)
+
+
+@receiver(post_save, sender=SubscriptionItem)
+@receiver(post_delete, sender=SubscriptionItem)
+def subscription_item_changed(sender, instance, **kwargs):
+    account_id = (
+        BillingSubscription.objects.filter(pk=instance.subscription_id).values_list('account_id', flat=True).first()
+    )
+    if account_id:
+        _invalidate_on_commit(account_id)
+
+
+@receiver(post_save, sender=EntitlementOverride)
+@receiver(post_delete, sender=EntitlementOverride)
+def entitlement_override_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(instance.account_id)
+    if kwargs.get('signal') is post_save and instance.is_enabled and instance.expires_at:
+        if instance.expires_at > timezone.now():
+            transaction.on_commit(partial(_schedule_expiry_invalidation, instance.account_id, instance.expires_at))
+
+
+@receiver(post_save, sender=PlanVersion)
+@receiver(post_delete, sender=PlanVersion)
+def plan_version_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(None)
+
+
+def _schedule_expiry_invalidation(account_id, expires_at):
+    from .tasks import invalidate_entitlements_cache
+
+    invalidate_entitlements_cache.apply_async(args=[account_id], eta=expires_at)
@@ -0,0 +1,148 @@
+"""
+Счётчик занятого объёма workspace (WorkspaceStorageUsage) и его сверка с Attachment.size.
+
+Резервирование — один условный UPDATE:
+    UPDATE ... SET used_bytes = used_bytes + N WHERE workspace_id = W AND used_bytes <= limit - N
+Загрузки в одном workspace не сериализуются на блокировке BillingAccount, а лимит
+не может быть превышен конкурентными загрузками: условие проверяется атомарно с
+увеличением. Строка счётчика создаётся при первом резервировании из суммы размеров
+вложений workspace.
+
+Счётчик может разойтись с фактом (удаление вложений в обход API, падение между
+резервированием и сохранением файла) — reconcile_storage_usage сравнивает его с
+GROUP BY по Attachment.size и при fix=True перезаписывает под блокировкой строки.
+Вложение относится к workspace своего проекта; вложения без проекта не учитываются.
+"""
+import logging
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import WorkspaceStorageUsage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def attachments_size(workspace_ids):
+    """Фактический объём вложений по workspace одним GROUP BY: {workspace_id: bytes}."""
+    from apps.documents.models import Attachment
+
+    workspace_ids = list(workspace_ids)
+    sizes = dict.fromkeys(workspace_ids, 0)
+    rows = (
+        Attachment.objects.filter(project__workspace_id__in=workspace_ids)
+        .values('project__workspace_id')
+        .annotate(total=Sum('size'))
+        .order_by()
+    )
+    for row in rows:
+        sizes[row['project__workspace_id']] = int(row['total'] or 0)
+    return sizes
+
+
+def _ensure_counter(workspace_id):
+    """Создать строку счётчика из фактического объёма вложений (если её ещё нет)."""
+    try:
+        with transaction.atomic():
+            WorkspaceStorageUsage.objects.create(
+                workspace_id=workspace_id,
+                used_bytes=attachments_size([workspace_id])[workspace_id],
+                reconciled_at=timezone.now(),
+            )
+    except IntegrityError:
+        # Строку только что создал параллельный запрос
+        pass
+
+
+def reserve_bytes(workspace_id, size_bytes, limit_bytes=None):
+    """
+    Увеличить счётчик на size_bytes, если результат не превысит limit_bytes (None — без лимита).
+    Возвращает (True, None) или (False, занятый объём) при превышении лимита.
+    """
+    for _ in range(2):
+        qs = WorkspaceStorageUsage.objects.filter(workspace_id=workspace_id)
+        if limit_bytes is not None:
+            qs = qs.filter(used_bytes__lte=limit_bytes - size_bytes)
+        if qs.update(used_bytes=F('used_bytes') + size_bytes, updated_at=timezone.now()):
+            return True, None
+        used_bytes = (
+            WorkspaceStorageUsage.objects.filter(workspace_id=workspace_id)
+            .values_list('used_bytes', flat=True)
+            .first()
+        )
+        if used_bytes is not None:
+            return False, used_bytes
+        _ensure_counter(workspace_id)
+    return False, None
+
+
+def release_bytes(workspace_id, size_bytes):
+    """Уменьшить счётчик на size_bytes (не ниже нуля); отсутствующий счётчик не создаётся."""
+    return WorkspaceStorageUsage.objects.filter(workspace_id=workspace_id).update(
+        used_bytes=Greatest(F('used_bytes') - size_bytes, 0),
+        updated_at=timezone.now(),
+    )
+
+
+@transaction.atomic
+def _fix_counters(workspace_ids):
+    """Перезаписать счётчики под блокировкой, пересчитав вложения внутри той же транзакции."""
+    counters = list(
+        WorkspaceStorageUsage.objects.select_for_update().filter(workspace_id__in=workspace_ids).order_by('pk')
+    )
+    actual = attachments_size(workspace_ids)
+    now = timezone.now()
+    for counter in counters:
+        counter.used_bytes = actual[counter.workspace_id]
+        counter.reconciled_at = now
+        counter.updated_at = now
+    WorkspaceStorageUsage.objects.bulk_update(counters, ['used_bytes', 'reconciled_at', 'updated_at'])
+    return len(counters)
+
+
+def reconcile_storage_usage(workspace_ids=None, chunk_size=DEFAULT_CHUNK_SIZE, fix=False):
+    """
+    Сверить счётчики (все или указанных workspace) с Attachment.size пачками по chunk_size.
+    Возвращает {checked, mismatches: [{workspace_id, stored, actual}], fixed, seconds}.
+    """
+    started = time.monotonic()
+    qs = WorkspaceStorageUsage.objects.all()
+    if workspace_ids is not None:
+        qs = qs.filter(workspace_id__in=list(workspace_ids))
+    ids = list(qs.order_by('pk').values_list('pk', flat=True))
+    checked = 0
+    mismatches = []
+    fixed = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        stored = dict(WorkspaceStorageUsage.objects.filter(pk__in=chunk).values_list('pk', 'used_bytes'))
+        actual = attachments_size(stored)
+        chunk_mismatches = [
+            {'workspace_id': workspace_id, 'stored': used_bytes, 'actual': actual[workspace_id]}
+            for workspace_id, used_bytes in sorted(stored.items())
+            if used_bytes != actual[workspace_id]
+        ]
+        checked += len(stored)
+        mismatches.extend(chunk_mismatches)
+        if fix:
+            if chunk_mismatches:
+                fixed += _fix_counters([item['workspace_id'] for item in chunk_mismatches])
+            WorkspaceStorageUsage.objects.filter(pk__in=list(stored)).update(reconciled_at=timezone.now())
+
+    report = {
+        'checked': checked,
+        'mismatches': mismatches,
+        'fixed': fixed,
+        'seconds': time.monotonic() - started,
+    }
+    if mismatches:
+        logger.warning(
+            'reconcile_storage_usage: %s mismatches of %s counters (fixed %s)',
+            len(mismatches), checked, fixed,
+        )
+    return report
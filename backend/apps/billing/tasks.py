@@ -2,47 +2,157 @@
 Celery tasks for billing app.
 """
 import logging
+import time
 from datetime import datetime
 
-from celery import shared_task
+from celery import group, shared_task
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 
-from .models import BillingAccount, PaymentWebhookEvent, BillingSubscription
-from .services import UsageService, PaymentProviderService
+from .metering import flush_usage_buffer as flush_usage_buffer_rows, mark_accounts_dirty, pop_dirty_accounts
+from .models import BillingAccount, Invoice, PaymentWebhookEvent, BillingSubscription
+from .pdf import (
+    mark_pdf_failed,
+    render_invoice_pdf as render_invoice_pdf_file,
+    render_invoice_pdfs as render_invoice_pdf_files,
+)
+from .storage import reconcile_storage_usage as reconcile_storage_counters
+from .services import EntitlementCache, UsageService, PaymentProviderService
+from .webhooks import process_pending_webhook_events as process_pending_webhook_event_batches
+from apps.notifications.inbox import create_notifications
 from apps.notifications.models import Notification
 from apps.notifications.tasks import send_email_message, send_telegram_message
 from apps.core.models import UserEvent
 
 logger = logging.getLogger(__name__)
 
+WEBHOOK_BATCH_SCHEDULED_KEY = 'billing:webhooks:batch_scheduled'
+
+
+@shared_task(name='apps.billing.tasks.refresh_usage_summaries')
+def refresh_usage_summaries():
+    """
+    Периодический refresh usage summary cache только по аккаунтам, отмеченным «грязными»
+    с прошлого запуска (apps.billing.metering.mark_accounts_dirty: новые usage-записи,
+    изменения подписки и entitlements). Аккаунты раздаются пачками группе задач
+    refresh_usage_summaries_chunk; за запуск забирается не больше BILLING_USAGE_REFRESH_MAX_ACCOUNTS,
+    остальные остаются отмеченными до следующего запуска.
+    """
+    started = time.monotonic()
+    chunk_size = max(int(getattr(settings, 'BILLING_USAGE_REFRESH_CHUNK_SIZE', 200)), 1)
+    limit = int(getattr(settings, 'BILLING_USAGE_REFRESH_MAX_ACCOUNTS', 10000))
+    chunks = []
+    dirty = 0
+    while dirty < limit:
+        account_ids = pop_dirty_accounts(min(chunk_size, limit - dirty))
+        if not account_ids:
+            break
+        chunks.append(sorted(account_ids))
+        dirty += len(account_ids)
+    if chunks:
+        try:
+            group(refresh_usage_summaries_chunk.s(account_ids) for account_ids in chunks).apply_async()
+        except Exception:
+            # Не потерять забранные аккаунты: следующий запуск обработает их снова
+            mark_accounts_dirty([account_id for account_ids in chunks for account_id in account_ids])
+            raise
+    metrics = {'dirty': dirty, 'chunks': len(chunks), 'seconds': round(time.monotonic() - started, 3)}
+    logger.info(
+        'refresh_usage_summaries: dirty=%s chunks=%s dispatch_seconds=%s',
+        metrics['dirty'], metrics['chunks'], metrics['seconds'],
+    )
+    return metrics
+
 
 @shared_task(
-    name='apps.billing.tasks.refresh_usage_summaries',
+    name='apps.billing.tasks.refresh_usage_summaries_chunk',
     autoretry_for=(Exception,),
     retry_backoff=True,
     max_retries=3,
 )
-def refresh_usage_summaries():
-    """
-    Периодический refresh usage summary cache по активным billing-аккаунтам.
-    """
+def refresh_usage_summaries_chunk(account_ids):
+    """Пересчитать usage summary cache пачки аккаунтов (одна задача группы refresh_usage_summaries)."""
+    started = time.monotonic()
     processed = 0
-    skipped = 0
-    for account in BillingAccount.objects.select_related('owner').filter(status=BillingAccount.STATUS_ACTIVE):
+    accounts = BillingAccount.objects.select_related('owner').filter(
+        pk__in=account_ids, status=BillingAccount.STATUS_ACTIVE,
+    )
+    for account in accounts:
         owner = account.owner
         if not owner or not getattr(owner, 'is_active', False):
-            skipped += 1
             continue
         UsageService.refresh_usage_cache_for_user(owner)
         processed += 1
+    metrics = {
+        'accounts': len(account_ids),
+        'processed': processed,
+        'skipped': len(account_ids) - processed,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    logger.info(
+        'refresh_usage_summaries_chunk: accounts=%s processed=%s skipped=%s seconds=%s',
+        metrics['accounts'], metrics['processed'], metrics['skipped'], metrics['seconds'],
+    )
+    return metrics
 
+
+@shared_task(name='apps.billing.tasks.flush_usage_buffer')
+def flush_usage_buffer():
+    """Периодическая запись буфера usage-событий в UsageRecord (apps.billing.metering)."""
+    report = flush_usage_buffer_rows()
+    if report['rows']:
+        logger.info(
+            'flush_usage_buffer: flushes=%s rows=%s events=%s',
+            report['flushes'], report['rows'], report['events'],
+        )
+    return report
+
+
+@shared_task(name='apps.billing.tasks.reconcile_storage_usage')
+def reconcile_storage_usage(fix=True):
+    """Периодическая сверка счётчиков объёма workspace с Attachment.size (apps.billing.storage)."""
+    report = reconcile_storage_counters(fix=fix)
     logger.info(
-        'refresh_usage_summaries: processed=%s skipped=%s',
-        processed,
-        skipped,
+        'reconcile_storage_usage: checked=%s mismatches=%s fixed=%s seconds=%.2f',
+        report['checked'], len(report['mismatches']), report['fixed'], report['seconds'],
+    )
+    return {'checked': report['checked'], 'mismatches': len(report['mismatches']), 'fixed': report['fixed']}
+
+
+@shared_task(name='apps.billing.tasks.render_invoice_pdf')
+def render_invoice_pdf(invoice_id: int, force: bool = False):
+    """Фоновый рендер PDF счёта (POST generate_pdf); актуальный по хэшу файл не перерисовывается."""
+    invoice = Invoice.objects.select_related('project__customer', 'customer').filter(pk=invoice_id).first()
+    if not invoice:
+        return {'ok': False, 'reason': 'invoice_not_found'}
+    try:
+        pdf_bytes = render_invoice_pdf_file(invoice, force=force)
+    except Exception as exc:
+        logger.exception('render_invoice_pdf: invoice %s failed', invoice_id)
+        mark_pdf_failed(invoice, exc)
+        return {'ok': False, 'reason': 'render_failed'}
+    return {'ok': True, 'rendered': pdf_bytes is not None}
+
+
+@shared_task(name='apps.billing.tasks.render_invoice_pdfs')
+def render_invoice_pdfs(invoice_ids, force: bool = False):
+    """Рендер PDF пачки счетов в пуле из BILLING_PDF_RENDER_PROCESSES процессов."""
+    processes = int(getattr(settings, 'BILLING_PDF_RENDER_PROCESSES', 1))
+    report = render_invoice_pdf_files(invoice_ids, force=force, processes=processes)
+    logger.info(
+        'render_invoice_pdfs: rendered=%s skipped=%s failed=%s seconds=%.2f',
+        report['rendered'], report['skipped'], report['failed'], report['seconds'],
     )
-    return {'processed': processed, 'skipped': skipped}
+    return report
+
+
+@shared_task(name='apps.billing.tasks.invalidate_entitlements_cache')
+def invalidate_entitlements_cache(account_id=None):
+    """Сбросить кэш entitlements аккаунта (планируется на EntitlementOverride.expires_at)."""
+    EntitlementCache.invalidate(account_id)
+    return {'account_id': account_id}
 
 
 @shared_task(
@@ -52,10 +162,56 @@ def refresh_usage_summaries():
     max_retries=5,
 )
 def process_payment_webhook_event(webhook_event_id: int):
-    event = PaymentWebhookEvent.objects.filter(pk=webhook_event_id).first()
-    if not event:
-        return {'ok': False, 'reason': 'webhook_event_not_found'}
-    return PaymentProviderService.process_webhook_event(event)
+    # Блокировка строки события исключает параллельную обработку пакетной задачей
+    with transaction.atomic():
+        event = PaymentWebhookEvent.objects.select_for_update().filter(pk=webhook_event_id).first()
+        if not event:
+            return {'ok': False, 'reason': 'webhook_event_not_found'}
+        if event.status == PaymentWebhookEvent.STATUS_PROCESSED:
+            return {'ok': True, 'reason': 'already_processed'}
+        return PaymentProviderService.process_webhook_event(event)
+
+
+@shared_task(
+    name='apps.billing.tasks.process_pending_webhook_events',
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def process_pending_webhook_events(provider=None):
+    """
+    Пакетная обработка pending webhook-событий (apps.billing.webhooks): периодически
+    и по dispatch_webhook_event при BILLING_WEBHOOK_BATCH_MODE.
+    """
+    # Снимаем отметку до выборки: события, пришедшие во время обработки, запланируют новый запуск
+    cache.delete(WEBHOOK_BATCH_SCHEDULED_KEY)
+    report = process_pending_webhook_event_batches(
+        provider=provider,
+        batch_size=max(int(getattr(settings, 'BILLING_WEBHOOK_BATCH_SIZE', 500)), 1),
+    )
+    if report['events']:
+        logger.info(
+            'process_pending_webhook_events: events=%s processed=%s failed=%s transactions=%s batches=%s seconds=%.2f',
+            report['events'], report['processed'], report['failed'], report['transactions'],
+            report['batches'], report['seconds'],
+        )
+    return report
+
+
+def dispatch_webhook_event(webhook_event_id: int):
+    """
+    Поставить обработку принятого webhook-события в очередь. По умолчанию — отдельной
+    задачей; при BILLING_WEBHOOK_BATCH_MODE события за BILLING_WEBHOOK_BATCH_COUNTDOWN_SECONDS
+    собираются в один запуск process_pending_webhook_events (повторы провайдера не
+    размножают задачи в очереди).
+    """
+    if not getattr(settings, 'BILLING_WEBHOOK_BATCH_MODE', False):
+        process_payment_webhook_event.delay(webhook_event_id)
+        return
+    countdown = int(getattr(settings, 'BILLING_WEBHOOK_BATCH_COUNTDOWN_SECONDS', 2))
+    # Отметка живёт дольше countdown: если запуск потерян, события подберёт периодический запуск
+    if cache.add(WEBHOOK_BATCH_SCHEDULED_KEY, webhook_event_id, timeout=countdown + 60):
+        process_pending_webhook_events.apply_async(countdown=countdown)
 
 
 @shared_task(
@@ -121,6 +277,8 @@ def process_dunning_notifications():
     notified = 0
     skipped = 0
 
+    notifications = []
+
     qs = BillingSubscription.objects.select_related('account', 'account__owner').filter(
         status=BillingSubscription.STATUS_PAST_DUE
     )
@@ -163,11 +321,12 @@ def process_dunning_notifications():
             f"Не удалось списать оплату за подписку{f' {plan_name}' if plan_name else ''}. "
             f"Попытка #{attempts + 1}. Обновите способ оплаты, чтобы избежать ограничения доступа."
         )
-        Notification.objects.create(
-            user=owner,
-            type=Notification.TYPE_BUDGET_ALERT,
-            message=message,
-        )
+        notifications.append({
+            'user_id': owner.id,
+            'type': Notification.TYPE_BUDGET_ALERT,
+            'message': message,
+            'dedupe_key': f'dunning:{sub.id}:{attempts + 1}',
+        })
         if owner.email:
             send_email_message.delay(
                 owner.email,
@@ -197,6 +356,9 @@ def process_dunning_notifications():
         sub.save(update_fields=['meta', 'updated_at'])
         notified += 1
 
+    # Все уведомления прогона — одним bulk_create
+    create_notifications(notifications)
+
     logger.info(
         'process_dunning_notifications: checked=%s notified=%s skipped=%s schedule=%s',
         checked,
@@ -1,9 +1,15 @@
+import tempfile
 from datetime import timedelta
 from decimal import Decimal
 from unittest.mock import Mock, patch
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -14,16 +20,45 @@ from apps.billing.models import (
     BillingSubscription,
     SubscriptionItem,
     EntitlementOverride,
+    UsageDailyRollup,
     UsageMeter,
     UsageRecord,
+    WorkspaceStorageUsage,
     Invoice,
+    InvoiceNumberSequence,
     PaymentTransaction,
     PaymentWebhookEvent,
 )
 from apps.core.models import Workspace, WorkspaceMember, UserEvent
-from apps.todo.models import Project
-from apps.billing.services import PaymentProviderService
-from apps.billing.tasks import enforce_subscription_access_states, process_dunning_notifications
+from apps.documents.models import Attachment
+from apps.timetracking.models import TimeLog
+from apps.todo.models import Project, WorkItem
+from apps.billing.exceptions import FeatureLocked, QuotaExceeded
+from apps.billing.metering import (
+    InMemoryUsageBuffer, flush_usage_buffer, get_usage_buffer, pop_dirty_accounts, reset_usage_buffer,
+)
+from apps.billing.middleware import EntitlementScopeMiddleware
+from apps.billing.numbering import reserve_invoice_numbers
+from apps.billing.pdf import render_invoice_pdf, render_invoice_pdfs
+from apps.billing.rollups import rebuild_usage_rollups, usage_totals
+from apps.billing.storage import reconcile_storage_usage
+from apps.billing.webhooks import process_pending_webhook_events
+from apps.billing.services import (
+    EntitlementCache,
+    EntitlementService,
+    InvoiceGenerator,
+    PaymentProviderService,
+    QuotaService,
+    UsageService,
+    entitlement_scope,
+)
+from apps.billing.tasks import (
+    enforce_subscription_access_states,
+    process_dunning_notifications,
+    process_payment_webhook_event,
+    refresh_usage_summaries,
+    refresh_usage_summaries_chunk,
+)
 from apps.notifications.models import Notification
 
 User = get_user_model()
@@ -206,7 +241,7 @@ class BillingCabinetApiTestCase(TestCase):
         self.assertTrue(body['checks']['has_subscription_v2'])
 
     @patch('apps.billing.services.requests.post')
-    @patch('apps.billing.views.process_payment_webhook_event.delay')
+    @patch('apps.billing.tasks.process_payment_webhook_event.delay')
     def test_yookassa_create_payment_intent_and_webhook(self, mock_delay, mock_post):
         with self.settings(
             YOOKASSA_SHOP_ID='test-shop',
@@ -245,7 +280,7 @@ class BillingCabinetApiTestCase(TestCase):
             mock_delay.assert_called_once()
 
     @patch('apps.billing.services.requests.post')
-    @patch('apps.billing.views.process_payment_webhook_event.delay')
+    @patch('apps.billing.tasks.process_payment_webhook_event.delay')
     @patch('apps.billing.services.PaymentProviderService.decode_yandex_pay_webhook_token')
     def test_yandex_pay_create_payment_and_webhook(self, mock_decode, mock_delay, mock_post):
         with self.settings(
@@ -512,3 +547,796 @@ class BillingCabinetApiTestCase(TestCase):
             me_body = me_resp.json()
             self.assertEqual(me_body['status'], BillingSubscription.STATUS_PAST_DUE)
             self.assertEqual(me_body['entitlements']['access_mode'], 'grace')
+
+
+class QuotaPlanMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(username='quota_user', email='quota@example.com', password='pass12345')
+        self.workspace = Workspace.objects.create(name='Quota WS', slug='quota-ws', owner=self.user)
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        self.account = BillingAccount.objects.create(
+            workspace=self.workspace, owner=self.user, status=BillingAccount.STATUS_ACTIVE
+        )
+        plan = PlanVersion.objects.create(
+            code='quota_monthly',
+            name='Quota Monthly',
+            version=1,
+            interval=PlanVersion.INTERVAL_MONTH,
+            price=Decimal('1200'),
+            currency='RUB',
+            limits_schema={'max_ai_agents': 2, 'storage_gb': 1},
+            features_schema={'ai_analyst': True},
+        )
+        self.plan = plan
+        self.subscription = subscription = BillingSubscription.objects.create(
+            account=self.account,
+            plan_version=plan,
+            status=BillingSubscription.STATUS_ACTIVE,
+            current_period_start=timezone.now() - timedelta(days=3),
+            current_period_end=timezone.now() + timedelta(days=27),
+        )
+        SubscriptionItem.objects.create(
+            subscription=subscription,
+            item_type=SubscriptionItem.ITEM_ADDON,
+            code='addon_agents',
+            quantity=1,
+            unit_price=Decimal('500'),
+            meta={'limits_delta': {'max_ai_agents': 1}},
+        )
+
+    def run_checks(self):
+        QuotaService.assert_new_resources_allowed(self.user, workspace_id=self.workspace.id)
+        QuotaService.assert_feature(self.user, 'ai_analyst', workspace_id=self.workspace.id)
+        QuotaService.assert_quota(self.user, 'max_ai_agents', current_usage=2, workspace_id=self.workspace.id)
+
+
+@override_settings(BILLING_ENTITLEMENTS_CACHE_SECONDS=0)
+class QuotaEntitlementScopeTestCase(QuotaPlanMixin, TestCase):
+    """Проверки квот в одном запросе разделяют один расчёт entitlements (кэш между запросами выключен)."""
+
+    def test_checks_in_scope_resolve_once(self):
+        with entitlement_scope():
+            with patch.object(EntitlementService, 'calculate', wraps=EntitlementService.calculate) as calculate:
+                self.run_checks()
+                # Повторные проверки в той же области не обращаются к БД
+                with self.assertNumQueries(0):
+                    self.run_checks()
+            self.assertEqual(calculate.call_count, 1)
+            # reserve_storage_bytes берёт лимит из того же контекста; первое резервирование
+            # создаёт счётчик workspace, дальше — один условный UPDATE
+            QuotaService.reserve_storage_bytes(self.user, 1024, workspace_id=self.workspace.id)
+            with self.assertNumQueries(1):
+                QuotaService.reserve_storage_bytes(self.user, 1024, workspace_id=self.workspace.id)
+
+    def test_middleware_scopes_context_to_request(self):
+        def view(request):
+            self.run_checks()
+            QuotaService.reserve_storage_bytes(self.user, 1024, workspace_id=self.workspace.id)
+            return HttpResponse('ok')
+
+        middleware = EntitlementScopeMiddleware(view)
+        factory = RequestFactory()
+        with patch.object(EntitlementService, 'calculate', wraps=EntitlementService.calculate) as calculate:
+            middleware(factory.post('/upload/'))
+            middleware(factory.post('/upload/'))
+            self.assertEqual(calculate.call_count, 2)
+            # Вне области запроса каждая проверка считает контекст заново
+            self.run_checks()
+            self.assertEqual(calculate.call_count, 5)
+
+
+class EntitlementCacheTestCase(QuotaPlanMixin, TestCase):
+    """Кэш entitlements между запросами: версии аккаунта и тарифов, сброс при изменениях."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def limits(self):
+        return QuotaService._resolve_context(self.user)[1]['limits']
+
+    def test_entitlements_are_reused_across_requests(self):
+        with patch.object(EntitlementService, 'calculate', wraps=EntitlementService.calculate) as calculate:
+            self.assertEqual(self.limits()['max_ai_agents'], 3)
+            # Вне запроса каждая из трёх проверок ищет только аккаунт: без подписки, items и override
+            with self.assertNumQueries(3):
+                self.run_checks()
+        self.assertEqual(calculate.call_count, 1)
+
+    def test_saves_invalidate_cached_entitlements(self):
+        self.assertEqual(self.limits()['max_ai_agents'], 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.limits_schema = {'max_ai_agents': 5, 'storage_gb': 1}
+            self.plan.save()
+        self.assertEqual(self.limits()['max_ai_agents'], 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SubscriptionItem.objects.filter(subscription=self.subscription).get().delete()
+        self.assertEqual(self.limits()['max_ai_agents'], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            EntitlementOverride.objects.create(account=self.account, key='limits.max_ai_agents', value={'value': 9})
+        self.assertEqual(self.limits()['max_ai_agents'], 9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subscription.status = BillingSubscription.STATUS_SUSPENDED
+            self.subscription.save(update_fields=['status'])
+        with self.assertRaises(FeatureLocked):
+            QuotaService.assert_new_resources_allowed(self.user)
+
+    def test_value_computed_before_invalidation_is_never_read(self):
+        cache_key, cached = EntitlementCache.get(self.account.pk)
+        self.assertIsNone(cached)
+        EntitlementCache.invalidate(self.account.pk)
+        # Читатель, начавший до смены тарифа, пишет под старой версией
+        EntitlementCache.set(self.account.pk, cache_key, {'entitlements': {'limits': {}}, 'bypass': False})
+        self.assertIsNone(EntitlementCache.get(self.account.pk)[1])
+
+    def test_override_expiry_schedules_invalidation_and_caps_ttl(self):
+        expires_at = timezone.now() + timedelta(minutes=5)
+        with patch('apps.billing.tasks.invalidate_entitlements_cache.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                EntitlementOverride.objects.create(
+                    account=self.account, key='features.payroll', value=True, expires_at=expires_at
+                )
+        apply_async.assert_called_once_with(args=[self.account.pk], eta=expires_at)
+
+        with patch('apps.billing.services.cache.set') as cache_set:
+            self.limits()
+        self.assertLessEqual(cache_set.call_args.args[2], 301)
+
+
+@override_settings(BILLING_USAGE_BUFFER_BACKEND='memory')
+class UsageBufferTestCase(TestCase):
+    def setUp(self):
+        reset_usage_buffer()
+        self.addCleanup(reset_usage_buffer)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='meter_user', email='meter@example.com', password='pass12345')
+        self.workspace = Workspace.objects.create(name='Meter WS', slug='meter-ws', owner=self.user)
+        self.account = BillingAccount.objects.create(
+            workspace=self.workspace, owner=self.user, status=BillingAccount.STATUS_ACTIVE,
+        )
+        self.meter = UsageMeter.objects.create(code='api_calls', name='API Calls', unit='count')
+        self.minute = timezone.now().replace(second=0, microsecond=0)
+        self.client.force_authenticate(self.user)
+
+    def _flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return flush_usage_buffer()
+
+    def test_events_aggregate_per_account_meter_minute(self):
+        for second in (1, 20, 59):
+            UsageService.buffer_usage_event(self.user, 'api_calls', '1.5', occurred_at=self.minute + timedelta(seconds=second))
+        UsageService.buffer_usage_event(self.user, 'api_calls', 2, occurred_at=self.minute + timedelta(minutes=1))
+        self.assertFalse(UsageRecord.objects.exists())
+
+        report = self._flush()
+
+        self.assertEqual(report, {'flushes': 1, 'rows': 2, 'events': 4})
+        rows = list(UsageRecord.objects.order_by('occurred_at'))
+        self.assertEqual([row.quantity for row in rows], [Decimal('4.500'), Decimal('2.000')])
+        self.assertEqual(rows[0].occurred_at, self.minute)
+        self.assertEqual(rows[0].meta['events'], 3)
+        self.assertEqual(rows[0].source, 'buffer')
+        self.assertEqual(self._flush(), {'flushes': 0, 'rows': 0, 'events': 0})
+
+    def test_idempotency_key_is_counted_once(self):
+        self.assertTrue(UsageService.buffer_usage_event(self.user, 'api_calls', 1, idempotency_key='evt-1'))
+        self.assertFalse(UsageService.buffer_usage_event(self.user, 'api_calls', 1, idempotency_key='evt-1'))
+        self.assertTrue(UsageService.buffer_usage_event(self.user, 'api_calls', 1, idempotency_key='evt-2'))
+        self._flush()
+        self.assertEqual(UsageRecord.objects.get().quantity, Decimal('2.000'))
+
+    def test_memory_buffer_drops_expired_idempotency_keys_on_flush(self):
+        buffer = InMemoryUsageBuffer()
+        with patch('apps.billing.metering.time.monotonic', return_value=100.0):
+            self.assertTrue(buffer.add('1:1:1', 1000, 'evt-old', ttl=10))
+            self.assertTrue(buffer.add('1:1:1', 1000, 'evt-new', ttl=60))
+        with patch('apps.billing.metering.time.monotonic', return_value=120.0):
+            buffer.begin_flush('flush-1')
+            self.assertEqual(set(buffer._idempotency), {'evt-new'})
+            self.assertTrue(buffer.add('1:1:1', 1000, 'evt-old', ttl=10))
+            self.assertFalse(buffer.add('1:1:1', 1000, 'evt-new', ttl=60))
+
+    def test_interrupted_flush_is_replayed_without_duplicates(self):
+        UsageService.buffer_usage_event(self.user, 'api_calls', 3, occurred_at=self.minute)
+        # Строки записаны, но снимок не удалён (воркер упал до on_commit)
+        flush_usage_buffer()
+        self.assertEqual(UsageRecord.objects.count(), 1)
+        UsageService.buffer_usage_event(self.user, 'api_calls', 1, occurred_at=self.minute)
+
+        report = self._flush()
+
+        self.assertEqual(report['flushes'], 2)
+        self.assertEqual(
+            sorted(UsageRecord.objects.values_list('quantity', flat=True)), [Decimal('1.000'), Decimal('3.000')],
+        )
+        self.assertEqual(get_usage_buffer().pending_flushes(), [])
+
+    def test_flush_invalidates_usage_summary_cache(self):
+        self.assertEqual(UsageService.get_usage_summary(self.user)['meters'], [])
+        UsageService.buffer_usage_event(self.user, 'api_calls', 5)
+        self._flush()
+        meters = UsageService.get_usage_summary(self.user)['meters']
+        self.assertEqual([(item['code'], Decimal(item['used'])) for item in meters], [('api_calls', Decimal('5'))])
+
+    def test_buffered_api_event_returns_accepted(self):
+        payload = {'meter_code': 'api_calls', 'quantity': '1', 'idempotency_key': 'req-1', 'buffered': True}
+        first = self.client.post('/api/v1/billing/usage/events/', payload, format='json')
+        second = self.client.post('/api/v1/billing/usage/events/', payload, format='json')
+        unknown = self.client.post(
+            '/api/v1/billing/usage/events/', {**payload, 'meter_code': 'missing'}, format='json',
+        )
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(first.json()['status'], 'accepted')
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.json()['status'], 'duplicate')
+        self.assertEqual(unknown.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UsageDailyRollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rollup_user', email='rollup@example.com', password='pass12345')
+        self.workspace = Workspace.objects.create(name='Rollup WS', slug='rollup-ws', owner=self.user)
+        self.account = BillingAccount.objects.create(
+            workspace=self.workspace, owner=self.user, status=BillingAccount.STATUS_ACTIVE,
+        )
+        self.meters = [
+            UsageMeter.objects.create(code='api_calls', name='API Calls', unit='count'),
+            UsageMeter.objects.create(code='ai_messages', name='AI Messages', unit='count'),
+        ]
+        self.now = timezone.now()
+        # События за 40 дней с шагом 7 ч 13 мин: попадают и в полные, и в крайние дни периода
+        for index in range(135):
+            UsageService.record_usage_event(
+                self.user,
+                self.meters[index % 2].code,
+                Decimal('0.125') * (index % 7 + 1),
+                occurred_at=self.now - timedelta(days=40) + timedelta(minutes=433 * index),
+            )
+
+    def raw_totals(self, period_start, period_end):
+        rows = (
+            UsageRecord.objects.filter(account=self.account, occurred_at__gte=period_start, occurred_at__lte=period_end)
+            .values('meter__code')
+            .annotate(used=Sum('quantity'))
+        )
+        return {row['meter__code']: row['used'] for row in rows}
+
+    def test_rollup_totals_match_raw_aggregation(self):
+        periods = [
+            (self.now - timedelta(days=30, hours=5, minutes=17), self.now - timedelta(hours=3)),
+            (self.now - timedelta(days=2, hours=1), self.now),
+            (self.now - timedelta(hours=10), self.now - timedelta(hours=2)),
+            (self.now - timedelta(days=50), self.now + timedelta(days=1)),
+        ]
+        for period_start, period_end in periods:
+            with self.subTest(period_start=period_start):
+                self.assertEqual(usage_totals(self.account.id, period_start, period_end), self.raw_totals(period_start, period_end))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        incremental = sorted(
+            UsageDailyRollup.objects.values_list('meter_id', 'day', 'quantity', 'records_count'),
+        )
+        self.assertEqual(sum(row[3] for row in incremental), 135)
+        self.assertEqual(rebuild_usage_rollups(), len(incremental))
+        rebuilt = sorted(UsageDailyRollup.objects.values_list('meter_id', 'day', 'quantity', 'records_count'))
+        self.assertEqual(rebuilt, incremental)
+
+    def test_duplicate_event_is_not_rolled_up_twice(self):
+        before = UsageDailyRollup.objects.aggregate(total=Sum('quantity'))['total']
+        UsageService.record_usage_event(self.user, 'api_calls', 2, idempotency_key='dup')
+        UsageService.record_usage_event(self.user, 'api_calls', 2, idempotency_key='dup')
+        after = UsageDailyRollup.objects.aggregate(total=Sum('quantity'))['total']
+        self.assertEqual(after - before, Decimal('2'))
+
+    @override_settings(BILLING_USAGE_BUFFER_BACKEND='memory')
+    def test_buffer_flush_updates_rollups(self):
+        reset_usage_buffer()
+        self.addCleanup(reset_usage_buffer)
+        UsageService.buffer_usage_event(self.user, 'api_calls', 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            flush_usage_buffer()
+        period = (self.now - timedelta(days=45), timezone.now() + timedelta(minutes=1))
+        self.assertEqual(usage_totals(self.account.id, *period), self.raw_totals(*period))
+
+    def test_daily_usage_endpoint_reads_rollups(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/v1/billing/usage/daily/', {'days': 7, 'meter': 'api_calls'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        points = response.json()['points']
+        expected = UsageDailyRollup.objects.filter(
+            account=self.account, meter=self.meters[0], day__gte=timezone.localdate() - timedelta(days=6),
+        )
+        self.assertEqual(len(points), expected.count())
+        self.assertEqual({point['meter_code'] for point in points}, {'api_calls'})
+
+
+@override_settings(BILLING_USAGE_BUFFER_BACKEND='memory')
+class RefreshUsageSummariesTestCase(TestCase):
+    def setUp(self):
+        reset_usage_buffer()
+        self.addCleanup(reset_usage_buffer)
+        UsageMeter.objects.create(code='api_calls', name='API Calls', unit='count')
+        self.users = []
+        self.accounts = []
+        for index in range(3):
+            user = User.objects.create_user(
+                username=f'refresh_{index}', email=f'refresh_{index}@example.com', password='pass12345',
+            )
+            workspace = Workspace.objects.create(name=f'Refresh WS {index}', slug=f'refresh-ws-{index}', owner=user)
+            self.users.append(user)
+            self.accounts.append(BillingAccount.objects.create(
+                workspace=workspace, owner=user, status=BillingAccount.STATUS_ACTIVE,
+            ))
+        # Аккаунты, отмеченные при создании данных, к тесту не относятся
+        pop_dirty_accounts(1000)
+
+    def dispatched_chunks(self, **settings_overrides):
+        """Запуск refresh_usage_summaries без брокера: пачки аккаунтов из подписей группы задач."""
+        with override_settings(**settings_overrides), patch('apps.billing.tasks.group') as group_mock:
+            metrics = refresh_usage_summaries()
+        if not group_mock.called:
+            return metrics, []
+        group_mock.return_value.apply_async.assert_called_once_with()
+        signatures = list(group_mock.call_args.args[0])
+        for signature in signatures:
+            self.assertEqual(signature.task, 'apps.billing.tasks.refresh_usage_summaries_chunk')
+        return metrics, [list(signature.args[0]) for signature in signatures]
+
+    def account_ids(self, *indexes):
+        return sorted(self.accounts[index].pk for index in indexes)
+
+    def test_only_accounts_with_new_usage_are_dispatched(self):
+        UsageService.record_usage_event(self.users[1], 'api_calls', 1)
+
+        metrics, chunks = self.dispatched_chunks()
+
+        self.assertEqual(chunks, [self.account_ids(1)])
+        self.assertEqual((metrics['dirty'], metrics['chunks']), (1, 1))
+        self.assertIn('seconds', metrics)
+        metrics, chunks = self.dispatched_chunks()
+        self.assertEqual((metrics['dirty'], chunks), (0, []))
+
+    def test_accounts_are_split_into_chunks_and_capped_per_run(self):
+        for user in self.users:
+            UsageService.record_usage_event(user, 'api_calls', 1)
+
+        metrics, chunks = self.dispatched_chunks(
+            BILLING_USAGE_REFRESH_CHUNK_SIZE=1, BILLING_USAGE_REFRESH_MAX_ACCOUNTS=2,
+        )
+        self.assertEqual((metrics['dirty'], metrics['chunks']), (2, 2))
+        self.assertEqual([len(chunk) for chunk in chunks], [1, 1])
+
+        metrics, rest = self.dispatched_chunks()
+        self.assertEqual((metrics['dirty'], [len(chunk) for chunk in rest]), (1, [1]))
+        self.assertEqual(sorted(sum(chunks + rest, [])), self.account_ids(0, 1, 2))
+
+    def test_chunk_refreshes_active_accounts_with_active_owners(self):
+        self.users[1].is_active = False
+        self.users[1].save(update_fields=['is_active'])
+        self.accounts[2].status = BillingAccount.STATUS_SUSPENDED
+        self.accounts[2].save(update_fields=['status'])
+
+        with patch.object(UsageService, 'refresh_usage_cache_for_user', autospec=True) as refresh:
+            metrics = refresh_usage_summaries_chunk(self.account_ids(0, 1, 2))
+
+        self.assertEqual([call.args[0].pk for call in refresh.call_args_list], [self.users[0].pk])
+        self.assertEqual((metrics['accounts'], metrics['processed'], metrics['skipped']), (3, 1, 2))
+
+    def test_entitlement_change_marks_account_dirty(self):
+        EntitlementCache.invalidate(self.accounts[2].pk)
+        self.assertEqual(pop_dirty_accounts(10), [self.accounts[2].pk])
+
+    def test_failed_dispatch_keeps_accounts_dirty(self):
+        UsageService.record_usage_event(self.users[0], 'api_calls', 1)
+        with patch('apps.billing.tasks.group', side_effect=RuntimeError('broker down')):
+            with self.assertRaises(RuntimeError):
+                refresh_usage_summaries()
+        self.assertEqual(pop_dirty_accounts(10), [self.accounts[0].pk])
+
+
+class WorkspaceStorageUsageTestCase(QuotaPlanMixin, TestCase):
+    GB = 1024 * 1024 * 1024
+
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(name='Storage Project', workspace=self.workspace, owner=self.user)
+
+    def attach(self, size):
+        return Attachment.objects.create(
+            file='attachments/test.bin', filename='test.bin', size=size,
+            mime_type='application/octet-stream', project=self.project, uploaded_by=self.user,
+        )
+
+    def used_bytes(self):
+        return WorkspaceStorageUsage.objects.get(workspace=self.workspace).used_bytes
+
+    def test_first_reservation_starts_from_attachment_sizes(self):
+        self.attach(1000)
+        self.attach(500)
+        QuotaService.reserve_storage_bytes(self.user, 100, workspace_id=self.workspace.id)
+        self.assertEqual(self.used_bytes(), 1600)
+
+    def test_limit_is_checked_atomically_with_increment(self):
+        QuotaService.reserve_storage_bytes(self.user, self.GB - 100, workspace_id=self.workspace.id)
+        with self.assertRaises(QuotaExceeded) as ctx:
+            QuotaService.reserve_storage_bytes(self.user, 200, workspace_id=self.workspace.id)
+        self.assertEqual(ctx.exception.usage, self.GB + 100)
+        self.assertEqual(self.used_bytes(), self.GB - 100)
+        QuotaService.reserve_storage_bytes(self.user, 100, workspace_id=self.workspace.id)
+        self.assertEqual(self.used_bytes(), self.GB)
+
+    def test_release_does_not_go_below_zero_and_leaves_account_meta(self):
+        QuotaService.reserve_storage_bytes(self.user, 300, workspace_id=self.workspace.id)
+        QuotaService.release_storage_bytes(self.user, 100, workspace_id=self.workspace.id)
+        self.assertEqual(self.used_bytes(), 200)
+        QuotaService.release_storage_bytes(self.user, 1000)
+        self.assertEqual(self.used_bytes(), 0)
+        self.account.refresh_from_db()
+        self.assertNotIn('used_storage_bytes', self.account.meta or {})
+
+    def test_reconciliation_reports_and_fixes_drift(self):
+        QuotaService.reserve_storage_bytes(self.user, 700, workspace_id=self.workspace.id)
+        self.attach(250)
+
+        report = reconcile_storage_usage()
+        self.assertEqual(report['checked'], 1)
+        self.assertEqual(report['mismatches'], [{'workspace_id': self.workspace.id, 'stored': 700, 'actual': 250}])
+        self.assertEqual(self.used_bytes(), 700)
+
+        report = reconcile_storage_usage(fix=True)
+        self.assertEqual(report['fixed'], 1)
+        self.assertEqual(self.used_bytes(), 250)
+        self.assertIsNotNone(WorkspaceStorageUsage.objects.get(workspace=self.workspace).reconciled_at)
+        self.assertEqual(reconcile_storage_usage()['mismatches'], [])
+
+
+class InvoiceGeneratorTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='invoicer', email='invoicer@example.com', password='pass12345')
+        self.user.groups.add(Group.objects.get_or_create(name='Director')[0])
+        self.workspace = Workspace.objects.create(name='Invoice WS', slug='invoice-ws', owner=self.user)
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        self.projects = [
+            Project.objects.create(name=f'Client {index}', workspace=self.workspace, owner=self.user)
+            for index in range(3)
+        ]
+        self.day = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.period = (self.day.date() - timedelta(days=7), self.day.date())
+
+    def log(self, project, amount='100', billable=True, days_ago=1, title='Задача'):
+        workitem = WorkItem.objects.create(title=title, project=project, created_by=self.user)
+        return TimeLog.objects.create(
+            workitem=workitem,
+            user=self.user,
+            started_at=self.day - timedelta(days=days_ago),
+            duration_minutes=90,
+            billable=billable,
+            hourly_rate=Decimal('1000'),
+            amount=Decimal(amount),
+        )
+
+    def test_generate_draft_marks_logs_and_skips_them_next_time(self):
+        billed = [self.log(self.projects[0]), self.log(self.projects[0], amount='50')]
+        self.log(self.projects[0], billable=False)
+        self.log(self.projects[0], days_ago=30)
+
+        invoice = InvoiceGenerator.generate_draft(self.projects[0].id, *self.period, created_by=self.user)
+
+        self.assertEqual(invoice.amount_total, Decimal('150'))
+        self.assertEqual(
+            sorted(TimeLog.objects.filter(invoice=invoice).values_list('pk', flat=True)), sorted(tl.pk for tl in billed),
+        )
+        self.assertEqual(invoice.related_timelogs.count(), 2)
+        self.assertIsNone(InvoiceGenerator.generate_draft(self.projects[0].id, *self.period, created_by=self.user))
+
+    def test_already_claimed_logs_abort_the_draft(self):
+        timelog = self.log(self.projects[0])
+        # Параллельный генератор уже пометил лог, а выборка прочитала его как невыставленный
+        other = Invoice.objects.create(project=self.projects[0], number='INV-OTHER', date_due=self.day.date())
+        TimeLog.objects.filter(pk=timelog.pk).update(invoice=other)
+        stale = TimeLog.objects.filter(pk=timelog.pk)
+        with patch.object(InvoiceGenerator, '_unbilled_timelogs', return_value=stale):
+            with self.assertRaises(ValueError):
+                InvoiceGenerator.generate_draft(self.projects[0].id, *self.period, created_by=self.user)
+        self.assertEqual(list(Invoice.objects.values_list('number', flat=True)), ['INV-OTHER'])
+
+    def test_workspace_batch_creates_one_draft_per_project(self):
+        self.log(self.projects[0], amount='100')
+        self.log(self.projects[0], amount='20', title='Другая задача')
+        self.log(self.projects[2], amount='70')
+        other_user = User.objects.create_user(username='other_ws', email='other_ws@example.com', password='pass12345')
+        other_ws = Workspace.objects.create(name='Other WS', slug='other-ws', owner=other_user)
+        foreign = self.log(Project.objects.create(name='Foreign', workspace=other_ws, owner=other_user))
+
+        invoices = InvoiceGenerator.generate_workspace_drafts(self.workspace.id, *self.period, created_by=self.user)
+
+        self.assertEqual([invoice.project_id for invoice in invoices], [self.projects[0].id, self.projects[2].id])
+        self.assertEqual([invoice.amount_total for invoice in invoices], [Decimal('120'), Decimal('70')])
+        self.assertEqual(len(invoices[0].line_items), 2)
+        self.assertEqual(len({invoice.number for invoice in invoices}), 2)
+        foreign.refresh_from_db()
+        self.assertIsNone(foreign.invoice_id)
+        self.assertEqual(InvoiceGenerator.generate_workspace_drafts(self.workspace.id, *self.period, self.user), [])
+
+    def test_generate_batch_endpoint(self):
+        self.log(self.projects[1])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        payload = {'date_start': self.period[0].isoformat(), 'date_end': self.period[1].isoformat()}
+
+        response = client.post(
+            '/api/v1/billing/invoices/generate_batch/', {**payload, 'workspace_id': self.workspace.id}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.json()), 1)
+
+        stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='pass12345')
+        forbidden = client.post(
+            '/api/v1/billing/invoices/generate_batch/',
+            {**payload, 'workspace_id': Workspace.objects.create(name='S', slug='s-ws', owner=stranger).id},
+            format='json',
+        )
+        self.assertEqual(forbidden.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class InvoiceNumberingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='numbers', email='numbers@example.com', password='pass12345')
+        self.workspace = Workspace.objects.create(name='Numbers WS', slug='numbers-ws', owner=self.user)
+        self.project = Project.objects.create(name='Numbers', workspace=self.workspace, owner=self.user)
+
+    def test_sequence_continues_legacy_numbers(self):
+        Invoice.objects.create(project=self.project, number='INV-2025-0041', date_due=timezone.now().date())
+        Invoice.objects.create(project=self.project, number='INV-2024-0090', date_due=timezone.now().date())
+
+        self.assertEqual(reserve_invoice_numbers(year=2025), ['INV-2025-0042'])
+        self.assertEqual(reserve_invoice_numbers(year=2025), ['INV-2025-0043'])
+        self.assertEqual(InvoiceNumberSequence.objects.get(year=2025, workspace=None).last_value, 43)
+
+    def test_block_reservation_is_consecutive(self):
+        self.assertEqual(reserve_invoice_numbers(3, year=2026), ['INV-2026-0001', 'INV-2026-0002', 'INV-2026-0003'])
+        self.assertEqual(reserve_invoice_numbers(2, year=2026), ['INV-2026-0004', 'INV-2026-0005'])
+
+    def test_rolled_back_numbers_are_reused(self):
+        reserve_invoice_numbers(year=2026)
+        try:
+            with transaction.atomic():
+                self.assertEqual(reserve_invoice_numbers(2, year=2026), ['INV-2026-0002', 'INV-2026-0003'])
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(reserve_invoice_numbers(year=2026), ['INV-2026-0002'])
+
+    @override_settings(BILLING_INVOICE_NUMBER_SCOPE='workspace')
+    def test_workspace_scope_numbers_per_workspace(self):
+        other = Workspace.objects.create(name='Other numbers', slug='other-numbers', owner=self.user)
+
+        self.assertEqual(
+            reserve_invoice_numbers(workspace_id=self.workspace.id, year=2026), [f'INV-{self.workspace.id}-2026-0001'],
+        )
+        self.assertEqual(reserve_invoice_numbers(workspace_id=other.id, year=2026), [f'INV-{other.id}-2026-0001'])
+        self.assertEqual(
+            reserve_invoice_numbers(workspace_id=self.workspace.id, year=2026), [f'INV-{self.workspace.id}-2026-0002'],
+        )
+
+    def test_generators_use_the_sequence(self):
+        year = timezone.now().year
+        workitem = WorkItem.objects.create(title='Задача', project=self.project, created_by=self.user)
+        TimeLog.objects.create(
+            workitem=workitem, user=self.user, started_at=timezone.now() - timedelta(hours=2),
+            duration_minutes=60, billable=True, hourly_rate=Decimal('1000'), amount=Decimal('1000'),
+        )
+        period = (timezone.now().date() - timedelta(days=1), timezone.now().date())
+
+        invoice = InvoiceGenerator.generate_draft(self.project.id, *period, created_by=self.user)
+
+        self.assertEqual(invoice.number, f'INV-{year}-0001')
+        self.assertEqual(InvoiceNumberSequence.objects.get(year=year, workspace=None).last_value, 1)
+
+
+class InvoicePdfRenderingTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        html_to_pdf = patch('apps.billing.pdf.html_to_pdf', return_value=b'%PDF-1.4 test')
+        self.html_to_pdf = html_to_pdf.start()
+        self.addCleanup(html_to_pdf.stop)
+
+        self.user = User.objects.create_user(username='pdf', email='pdf@example.com', password='pass12345')
+        self.user.groups.add(Group.objects.get_or_create(name='Director')[0])
+        workspace = Workspace.objects.create(name='PDF WS', slug='pdf-ws', owner=self.user)
+        WorkspaceMember.objects.create(workspace=workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        self.project = Project.objects.create(name='PDF', workspace=workspace, owner=self.user)
+        self.invoices = [
+            Invoice.objects.create(
+                project=self.project,
+                number=f'INV-2026-01{index}',
+                date_due=timezone.now().date(),
+                amount_total=Decimal('100'),
+                line_items=[{'title': 'Работа', 'hours': 1, 'rate': '100', 'amount': '100'}],
+            )
+            for index in range(3)
+        ]
+        # Рендерим строки из БД, как задача render_invoice_pdf (Decimal отображается с копейками)
+        self.invoices = list(Invoice.objects.filter(project=self.project).order_by('pk'))
+
+    def test_unchanged_invoice_is_not_rendered_again(self):
+        invoice = self.invoices[0]
+
+        self.assertEqual(render_invoice_pdf(invoice), b'%PDF-1.4 test')
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.pdf_status, Invoice.PDF_STATUS_READY)
+        self.assertEqual(len(invoice.pdf_content_hash), 64)
+        self.assertIsNone(render_invoice_pdf(invoice))
+        self.assertEqual(self.html_to_pdf.call_count, 1)
+
+        invoice.amount_total = Decimal('150')
+        invoice.save()
+        self.assertIsNotNone(render_invoice_pdf(invoice))
+        self.assertEqual(self.html_to_pdf.call_count, 2)
+
+    def test_batch_skips_current_and_records_failures(self):
+        render_invoice_pdf(self.invoices[0])
+        self.html_to_pdf.side_effect = [b'%PDF-1.4 ok', RuntimeError('no fonts')]
+
+        report = render_invoice_pdfs([invoice.pk for invoice in self.invoices])
+
+        self.assertEqual((report['rendered'], report['skipped'], report['failed']), (1, 1, 1))
+        failed = Invoice.objects.get(pk=self.invoices[2].pk)
+        self.assertEqual((failed.pdf_status, failed.pdf_error), (Invoice.PDF_STATUS_FAILED, 'no fonts'))
+
+    def test_generate_pdf_endpoint_queues_rendering(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        invoice = self.invoices[0]
+        url = f'/api/v1/billing/invoices/{invoice.id}/generate_pdf/'
+
+        with patch('apps.billing.views.render_invoice_pdf.delay') as delay:
+            response = client.post(url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        delay.assert_called_once_with(invoice.id, force=False)
+        self.assertEqual(response.json()['pdf_status'], Invoice.PDF_STATUS_PENDING)
+        self.assertTrue(response.json()['status_url'].endswith(f'/invoices/{invoice.id}/pdf_status/'))
+
+        render_invoice_pdf(Invoice.objects.get(pk=invoice.pk))
+        polled = client.get(f'/api/v1/billing/invoices/{invoice.id}/pdf_status/')
+        self.assertEqual(polled.json()['pdf_status'], Invoice.PDF_STATUS_READY)
+
+        with patch('apps.billing.views.render_invoice_pdf.delay') as delay:
+            current = client.post(url, {}, format='json')
+        self.assertEqual(current.status_code, status.HTTP_200_OK)
+        delay.assert_not_called()
+
+    def test_generate_pdf_marks_failed_when_queue_is_unavailable(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        invoice = self.invoices[0]
+
+        with patch('apps.billing.views.render_invoice_pdf.delay', side_effect=ConnectionError('broker down')):
+            response = client.post(f'/api/v1/billing/invoices/{invoice.id}/generate_pdf/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['pdf_status'], Invoice.PDF_STATUS_FAILED)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.pdf_status, invoice.pdf_error), (Invoice.PDF_STATUS_FAILED, 'broker down'))
+
+
+class WebhookBatchProcessingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='hooks', email='hooks@example.com', password='pass12345')
+        workspace = Workspace.objects.create(name='Hooks WS', slug='hooks-ws', owner=self.user)
+        self.account = BillingAccount.objects.create(
+            workspace=workspace, owner=self.user, status=BillingAccount.STATUS_ACTIVE,
+        )
+        plan = PlanVersion.objects.create(
+            code='hooks_monthly', name='Hooks', version=1, interval=PlanVersion.INTERVAL_MONTH,
+            price=Decimal('990'), currency='RUB',
+        )
+        self.subscription = BillingSubscription.objects.create(
+            account=self.account,
+            plan_version=plan,
+            status=BillingSubscription.STATUS_ACTIVE,
+            current_period_start=timezone.now() - timedelta(days=3),
+            current_period_end=timezone.now() + timedelta(days=27),
+            provider='yookassa',
+        )
+
+    def transaction(self, payment_id, status=PaymentTransaction.STATUS_PENDING):
+        return PaymentTransaction.objects.create(
+            account=self.account,
+            subscription=self.subscription,
+            provider=PaymentTransaction.PROVIDER_YOOKASSA,
+            provider_payment_id=payment_id,
+            idempotency_key=f'key-{payment_id}',
+            amount=Decimal('990.00'),
+            currency='RUB',
+            status=status,
+        )
+
+    def webhook(self, payment_id, status):
+        event, _ = PaymentProviderService.ingest_webhook(
+            'yookassa', {'event': f'payment.{status}', 'object': {'id': payment_id, 'status': status}},
+        )
+        return event
+
+    def test_batch_applies_events_in_order_per_transaction(self):
+        paid = self.transaction('pay_batch_1')
+        failed = self.transaction('pay_batch_2')
+        self.webhook('pay_batch_1', 'waiting_for_capture')
+        self.webhook('pay_batch_1', 'succeeded')
+        self.webhook('pay_batch_2', 'canceled')
+        # Запоздавший canceled по уже оплаченной транзакции не откатывает её
+        self.webhook('pay_batch_1', 'canceled')
+        unknown = self.webhook('pay_unknown', 'succeeded')
+
+        report = process_pending_webhook_events()
+
+        self.assertEqual((report['events'], report['processed'], report['failed']), (5, 4, 1))
+        self.assertEqual(report['transactions'], 2)
+        paid.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual(paid.status, PaymentTransaction.STATUS_SUCCEEDED)
+        self.assertIsNotNone(paid.paid_at)
+        self.assertEqual(failed.status, PaymentTransaction.STATUS_CANCELED)
+        self.assertIsNotNone(failed.canceled_at)
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, BillingSubscription.STATUS_PAST_DUE)
+        self.assertEqual(self.subscription.meta['past_due_reason'], PaymentTransaction.STATUS_CANCELED)
+        self.assertEqual(UserEvent.objects.filter(user=self.user, event_type=UserEvent.EVENT_PAYMENT).count(), 1)
+        unknown.refresh_from_db()
+        self.assertEqual(
+            (unknown.status, unknown.error_message), (PaymentWebhookEvent.STATUS_FAILED, 'payment_transaction_not_found'),
+        )
+        self.assertFalse(PaymentWebhookEvent.objects.filter(status=PaymentWebhookEvent.STATUS_PENDING).exists())
+
+    def test_processed_events_are_not_applied_twice(self):
+        self.transaction('pay_once')
+        event = self.webhook('pay_once', 'succeeded')
+        process_pending_webhook_events()
+
+        self.assertEqual(process_pending_webhook_events()['events'], 0)
+        self.assertEqual(process_payment_webhook_event(event.id), {'ok': True, 'reason': 'already_processed'})
+        _, requeue = PaymentProviderService.ingest_webhook(
+            'yookassa', {'event': 'payment.succeeded', 'object': {'id': 'pay_once', 'status': 'succeeded'}},
+        )
+        self.assertFalse(requeue)
+        self.assertEqual(UserEvent.objects.filter(user=self.user, event_type=UserEvent.EVENT_PAYMENT).count(), 1)
+
+    def test_failed_batch_falls_back_to_single_events(self):
+        tx = self.transaction('pay_fallback')
+        self.webhook('pay_fallback', 'succeeded')
+
+        with patch('apps.billing.webhooks._process_batch', side_effect=RuntimeError('boom')):
+            report = process_pending_webhook_events()
+
+        self.assertEqual((report['events'], report['processed']), (1, 1))
+        tx.refresh_from_db()
+        self.assertEqual(tx.status, PaymentTransaction.STATUS_SUCCEEDED)
+
+    @override_settings(BILLING_WEBHOOK_BATCH_MODE=True, BILLING_WEBHOOK_BATCH_COUNTDOWN_SECONDS=5)
+    def test_batch_mode_coalesces_webhooks_into_one_task(self):
+        self.transaction('pay_storm')
+        client = APIClient()
+        with patch('apps.billing.tasks.process_pending_webhook_events.apply_async') as apply_async, \
+                patch('apps.billing.tasks.process_payment_webhook_event.delay') as delay:
+            for status_value in ('pending', 'waiting_for_capture', 'succeeded'):
+                response = client.post(
+                    '/api/v1/billing/provider/yookassa/webhook/',
+                    {'event': f'payment.{status_value}', 'object': {'id': 'pay_storm', 'status': status_value}},
+                    format='json',
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        apply_async.assert_called_once_with(countdown=5)
+        delay.assert_not_called()
+        self.assertEqual(PaymentWebhookEvent.objects.filter(status=PaymentWebhookEvent.STATUS_PENDING).count(), 3)
@@ -12,9 +12,12 @@ from apps.auth.permissions import IsDirectorOrManager
 from .models import Invoice, PlanVersion
 from .serializers import (
     InvoiceSerializer,
+    InvoiceBatchCreateSerializer,
     InvoiceCreateSerializer,
+    InvoicePdfStatusSerializer,
     BillingMeResponseSerializer,
     BillingReadinessSerializer,
+    BillingUsageDailySerializer,
     BillingUsageResponseSerializer,
     YookassaPaymentIntentCreateSerializer,
     YookassaPaymentIntentResponseSerializer,
@@ -35,7 +38,8 @@ from .services import (
     EntitlementService,
     UsageService,
 )
-from .tasks import process_payment_webhook_event
+from .pdf import is_pdf_current, mark_pdf_failed
+from .tasks import dispatch_webhook_event, render_invoice_pdf
 from apps.todo.models import Project
 from apps.core.models import WorkspaceMember, UserEvent
 
@@ -46,7 +50,9 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     
     - list/retrieve: стандартно
     - create: генерирует черновик по project_id, date_start, date_end
-    - generate_pdf (action): рендерит PDF и сохраняет в модель
+    - generate_batch (action): черновики по всем проектам workspace за период
+    - generate_pdf (action): ставит рендер PDF в очередь (202), актуальный PDF — сразу
+    - pdf_status (action): состояние рендера PDF
     - download (action): отдаёт PDF файл
     - mark_as_sent (action): меняет статус на SENT
     """
@@ -98,12 +104,15 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        invoice = InvoiceGenerator.generate_draft(
-            project_id=data['project_id'],
-            date_start=data['date_start'],
-            date_end=data['date_end'],
-            created_by=request.user,
-        )
+        try:
+            invoice = InvoiceGenerator.generate_draft(
+                project_id=data['project_id'],
+                date_start=data['date_start'],
+                date_end=data['date_end'],
+                created_by=request.user,
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
 
         if invoice is None:
             return Response(
@@ -114,23 +123,86 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(invoice)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'])
+    def generate_batch(self, request):
+        """
+        POST /api/v1/billing/invoices/generate_batch/
+
+        Body: { workspace_id, date_start, date_end }
+        Создаёт черновики по всем проектам workspace с невыставленными таймлогами.
+        """
+        ser = InvoiceBatchCreateSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        data = ser.validated_data
+
+        if not WorkspaceMember.objects.filter(user=request.user, workspace_id=data['workspace_id']).exists():
+            return Response(
+                {'error': 'Нет доступа к workspace'},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        try:
+            invoices = InvoiceGenerator.generate_workspace_drafts(
+                workspace_id=data['workspace_id'],
+                date_start=data['date_start'],
+                date_end=data['date_end'],
+                created_by=request.user,
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+
+        serializer = self.get_serializer(invoices, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     def generate_pdf(self, request, pk=None):
         """
         POST /api/v1/billing/invoices/{id}/generate_pdf/
+        Body: {force?: bool}
         
-        Рендерит PDF и сохраняет в invoice.pdf_file.
+        Если PDF уже собран из текущего содержимого счёта — 200 с данными счёта.
+        Иначе ставит рендер в очередь (задача render_invoice_pdf) и отвечает 202;
+        готовность — GET pdf_status/. Очередь недоступна — 503, pdf_status = failed.
         """
         invoice = self.get_object()
+        force = str(request.data.get('force', '')).lower() in ('1', 'true', 'yes')
+        if not force and is_pdf_current(invoice):
+            return Response(self.get_serializer(invoice).data)
+
+        invoice.pdf_status = Invoice.PDF_STATUS_PENDING
+        invoice.pdf_error = ''
+        invoice.save(update_fields=['pdf_status', 'pdf_error', 'updated_at'])
         try:
-            PDFRenderer.render_and_save(invoice)
-            serializer = self.get_serializer(invoice)
-            return Response(serializer.data)
-        except Exception as e:
+            render_invoice_pdf.delay(invoice.id, force=force)
+        except Exception as exc:
+            # Задача не поставлена (брокер недоступен): pending не должен остаться навсегда
+            mark_pdf_failed(invoice, exc)
             return Response(
-                {'error': f'Ошибка генерации PDF: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                {
+                    'id': invoice.id,
+                    'pdf_status': invoice.pdf_status,
+                    'error': f'Очередь рендера недоступна: {exc}',
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
             )
+        return Response(
+            {
+                'id': invoice.id,
+                'pdf_status': invoice.pdf_status,
+                'status_url': request.build_absolute_uri(f'/api/v1/billing/invoices/{invoice.id}/pdf_status/'),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=True, methods=['get'])
+    def pdf_status(self, request, pk=None):
+        """
+        GET /api/v1/billing/invoices/{id}/pdf_status/
+        
+        Состояние рендера PDF: none | pending | ready | failed.
+        """
+        invoice = self.get_object()
+        return Response(InvoicePdfStatusSerializer(invoice, context={'request': request}).data)
 
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
@@ -337,15 +409,53 @@ class BillingUsageViewSet(viewsets.ViewSet):
         serializer.is_valid(raise_exception=True)
         return Response(serializer.validated_data)
 
+    @action(detail=False, methods=['get'], url_path='daily')
+    def daily(self, request):
+        """
+        GET /api/v1/billing/usage/daily/?days=30&meter=api_calls
+        Дневной ряд потребления для графика.
+        """
+        try:
+            days = min(int(request.query_params.get('days', 30)), 366)
+        except (TypeError, ValueError):
+            return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        payload = UsageService.get_daily_usage(
+            request.user, days=days, meter_codes=request.query_params.getlist('meter') or None,
+        )
+        serializer = BillingUsageDailySerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.validated_data)
+
     @action(detail=False, methods=['post'], url_path='events')
     def events(self, request):
         """
         POST /api/v1/billing/usage/events/
         Запись usage-события с поддержкой idempotency_key.
+        buffered=true — событие копится в буфере и пишется периодическим flush (202 Accepted).
         """
         serializer = UsageRecordCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
+        if data.get('buffered'):
+            try:
+                accepted = UsageService.buffer_usage_event(
+                    user=request.user,
+                    meter_code=data['meter_code'],
+                    quantity=data['quantity'],
+                    idempotency_key=data.get('idempotency_key', ''),
+                    occurred_at=data.get('occurred_at'),
+                )
+            except ValueError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {
+                    'status': 'accepted' if accepted else 'duplicate',
+                    'meter_code': data['meter_code'],
+                    'quantity': str(data['quantity']),
+                    'idempotency_key': data.get('idempotency_key', ''),
+                },
+                status=status.HTTP_202_ACCEPTED if accepted else status.HTTP_200_OK,
+            )
         try:
             record, created = UsageService.record_usage_event(
                 user=request.user,
@@ -563,7 +673,7 @@ class BillingProviderViewSet(viewsets.ViewSet):
             payload=request.data if isinstance(request.data, dict) else {},
         )
         if should_process:
-            process_payment_webhook_event.delay(event.id)
+            dispatch_webhook_event(event.id)
         return Response({'ok': True, 'event_id': event.id, 'queued': bool(should_process)})
 
     @action(detail=False, methods=['post'], url_path='yandex-pay/create-payment')
@@ -623,5 +733,5 @@ class BillingProviderViewSet(viewsets.ViewSet):
             payload=payload,
         )
         if should_process:
-            process_payment_webhook_event.delay(event.id)
+            dispatch_webhook_event(event.id)
         return Response({'ok': True, 'event_id': event.id, 'queued': bool(should_process)}, status=status.HTTP_200_OK)
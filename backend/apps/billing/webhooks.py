@@ -0,0 +1,201 @@
+"""
+Пакетная обработка webhook-событий платёжных провайдеров (PaymentWebhookEvent).
+
+process_pending_webhook_events забирает pending-события провайдера в порядке поступления
+(created_at, id) под SELECT ... FOR UPDATE SKIP LOCKED и обрабатывает пачку в одной
+транзакции:
+  - транзакции, подписки и аккаунты пачки читаются по одному запросу на модель;
+  - события одной транзакции применяются по порядку теми же правилами, что и
+    PaymentProviderService.process_webhook_event (_should_apply_transaction_status),
+    поэтому итог совпадает с последовательной обработкой по одному событию;
+  - изменения пишутся bulk_update/UPDATE ... WHERE id IN (...), UserEvent — bulk_create.
+
+Повторные доставки одного события дедуплицирует ingest_webhook (provider, event_id), а
+обработанные события не выбираются повторно. Если пачка падает целиком, события
+обрабатываются по одному; упавшее событие помечается failed с текстом ошибки
+(повторная доставка провайдером вернёт его в pending).
+"""
+import logging
+import time
+from functools import partial
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.core.models import UserEvent
+
+from .models import BillingAccount, BillingSubscription, PaymentTransaction, PaymentWebhookEvent
+from .services import EntitlementCache, PaymentProviderService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+TRANSACTION_NOT_FOUND = 'payment_transaction_not_found'
+
+
+def pending_providers():
+    return sorted(
+        PaymentWebhookEvent.objects.filter(status=PaymentWebhookEvent.STATUS_PENDING)
+        .values_list('provider', flat=True)
+        .distinct()
+        .order_by()
+    )
+
+
+def _lock_pending_events(provider, limit):
+    return list(
+        PaymentWebhookEvent.objects.select_for_update(skip_locked=True)
+        .filter(provider=provider, status=PaymentWebhookEvent.STATUS_PENDING)
+        .order_by('created_at', 'id')[:limit]
+    )
+
+
+def _load_transactions(provider, payment_ids):
+    """{provider_payment_id: tx} с общими экземплярами подписок и аккаунтов (одна подписка — один объект)."""
+    transactions = {}
+    rows = (
+        PaymentTransaction.objects.select_for_update()
+        .filter(provider=provider, provider_payment_id__in=payment_ids)
+        .order_by('pk')
+    )
+    for tx in rows:
+        transactions.setdefault(tx.provider_payment_id, tx)
+    subscriptions = BillingSubscription.objects.in_bulk(
+        {tx.subscription_id for tx in transactions.values() if tx.subscription_id}
+    )
+    account_ids = {tx.account_id for tx in transactions.values()}
+    account_ids |= {subscription.account_id for subscription in subscriptions.values()}
+    accounts = BillingAccount.objects.select_related('owner').in_bulk(account_ids)
+    for subscription in subscriptions.values():
+        subscription.account = accounts[subscription.account_id]
+    for tx in transactions.values():
+        tx.account = accounts[tx.account_id]
+        if tx.subscription_id:
+            tx.subscription = subscriptions[tx.subscription_id]
+    return transactions
+
+
+def _mark_events(event_ids, status, error_message='', now=None):
+    if not event_ids:
+        return 0
+    now = now or timezone.now()
+    return PaymentWebhookEvent.objects.filter(pk__in=event_ids).update(
+        status=status, error_message=error_message, processed_at=now, updated_at=now,
+    )
+
+
+@transaction.atomic
+def _process_batch(provider, limit):
+    events = _lock_pending_events(provider, limit)
+    if not events:
+        return {'events': 0, 'processed': 0, 'failed': 0, 'transactions': 0}
+    parsed = [(event, *PaymentProviderService.parse_webhook_event(event)) for event in events]
+    transactions = _load_transactions(provider, {payment_id for _, payment_id, _, _ in parsed if payment_id})
+
+    changed_transactions = {}
+    changed_subscriptions = {}
+    changed_accounts = {}
+    user_events = []
+    paid = []
+    processed_ids = []
+    missing_ids = []
+    for event, payment_id, status, raw_response in parsed:
+        tx = transactions.get(payment_id)
+        if not tx:
+            missing_ids.append(event.pk)
+            continue
+        _, became_succeeded, became_failed_or_canceled, _ = PaymentProviderService.apply_webhook_status(
+            tx, status, raw_response,
+        )
+        changed_transactions[tx.pk] = tx
+        subscription = tx.subscription
+        if became_succeeded:
+            if subscription:
+                if PaymentProviderService._set_subscription_active(subscription):
+                    changed_accounts[subscription.account_id] = subscription.account
+                changed_subscriptions[subscription.pk] = subscription
+            user_event = PaymentProviderService.payment_user_event(tx)
+            if user_event:
+                user_events.append(user_event)
+            paid.append(tx)
+        if became_failed_or_canceled and subscription:
+            if PaymentProviderService._set_subscription_past_due(subscription, reason=status):
+                changed_accounts[subscription.account_id] = subscription.account
+            changed_subscriptions[subscription.pk] = subscription
+        processed_ids.append(event.pk)
+
+    now = timezone.now()
+    for obj in (*changed_transactions.values(), *changed_subscriptions.values(), *changed_accounts.values()):
+        obj.updated_at = now
+    PaymentTransaction.objects.bulk_update(
+        changed_transactions.values(), ['status', 'raw_response', 'paid_at', 'canceled_at', 'updated_at'],
+    )
+    BillingSubscription.objects.bulk_update(changed_subscriptions.values(), ['status', 'meta', 'updated_at'])
+    BillingAccount.objects.bulk_update(changed_accounts.values(), ['status', 'updated_at'])
+    UserEvent.objects.bulk_create(user_events)
+    _mark_events(processed_ids, PaymentWebhookEvent.STATUS_PROCESSED, now=now)
+    _mark_events(missing_ids, PaymentWebhookEvent.STATUS_FAILED, TRANSACTION_NOT_FOUND, now=now)
+
+    # bulk_update не шлёт post_save: кэш entitlements сбрасываем сами, как apps.billing.signals
+    for account_id in sorted({subscription.account_id for subscription in changed_subscriptions.values()}):
+        transaction.on_commit(partial(EntitlementCache.invalidate, account_id))
+    for tx in paid:
+        transaction.on_commit(partial(PaymentProviderService.notify_admin_payment, tx))
+    return {
+        'events': len(events),
+        'processed': len(processed_ids),
+        'failed': len(missing_ids),
+        'transactions': len(changed_transactions),
+    }
+
+
+def _process_one_by_one(provider, limit):
+    """Запасной путь для пачки с ошибкой: по одному событию, упавшее помечается failed."""
+    report = {'events': 0, 'processed': 0, 'failed': 0, 'transactions': 0}
+    while report['events'] < limit:
+        with transaction.atomic():
+            events = _lock_pending_events(provider, 1)
+            if not events:
+                break
+            event = events[0]
+            report['events'] += 1
+            try:
+                with transaction.atomic():
+                    result = PaymentProviderService.process_webhook_event(event)
+            except Exception as exc:
+                logger.exception('process_pending_webhook_events: event %s failed', event.pk)
+                _mark_events([event.pk], PaymentWebhookEvent.STATUS_FAILED, str(exc)[:2000])
+                result = {'ok': False}
+        if result['ok']:
+            report['processed'] += 1
+            report['transactions'] += 1
+        else:
+            report['failed'] += 1
+    return report
+
+
+def process_pending_webhook_events(provider=None, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """
+    Обработать pending-события (всех провайдеров или одного) пачками по batch_size.
+    Возвращает {events, processed, failed, transactions, batches, seconds}.
+    """
+    started = time.monotonic()
+    report = {'events': 0, 'processed': 0, 'failed': 0, 'transactions': 0, 'batches': 0}
+    for current in ([provider] if provider else pending_providers()):
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            try:
+                batch = _process_batch(current, batch_size)
+            except Exception:
+                logger.exception('process_pending_webhook_events: %s batch failed, processing one by one', current)
+                batch = _process_one_by_one(current, batch_size)
+            if not batch['events']:
+                break
+            batches += 1
+            for key in ('events', 'processed', 'failed', 'transactions'):
+                report[key] += batch[key]
+            if batch['events'] < batch_size:
+                break
+        report['batches'] += batches
+    report['seconds'] = time.monotonic() - started
+    return report
@@ -1,12 +1,18 @@
 """
 Tests for core API: ProjectMemberViewSet, DashboardStatsView.
 """
+from calendar import month_abbr
+from decimal import Decimal
+
 from django.test import TestCase
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from apps.core.models import User, Workspace, WorkspaceMember, ProjectMember
+from apps.finance.models import Wallet
+from apps.finance.services import TransactionService
 from apps.todo.models import Project
 
 
@@ -118,3 +124,17 @@ class DashboardStatsViewTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.json()
         self.assertIn('finance_flow', data)
+
+    def test_finance_flow_is_read_from_monthly_rollups(self):
+        """finance_flow собирается из месячных срезов Ledger."""
+        project = Project.objects.create(name='Flow', workspace=self.workspace)
+        wallet = Wallet.objects.create(name='Flow wallet', workspace=self.workspace)
+        TransactionService.create_deposit(wallet=wallet, amount=Decimal('700'), created_by=self.user, project=project)
+        TransactionService.create_spend(amount=Decimal('120.50'), created_by=self.user, wallet=wallet, project=project)
+        response = self.client.get('/api/v1/core/dashboard-stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['finance_flow'], [{
+            'month': month_abbr[timezone.localtime().month],
+            'income': 700.0,
+            'expense': 120.5,
+        }])
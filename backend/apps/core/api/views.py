@@ -6,13 +6,15 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Sum, Q, Value, DecimalField
-from django.db.models.functions import TruncMonth, Coalesce
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import timedelta
 from calendar import month_abbr
 
 from apps.auth.permissions import IsWorkspaceMember, IsManagerOrReadOnly
-from apps.finance.models import Transaction
+from apps.finance.fx import ExchangeRateMissing, converted_amount, currency_from_settings, validate_currency
+from apps.finance.models import Transaction, TransactionMonthlyRollup
+from apps.finance.services import FinanceStatsService
 from apps.timetracking.models import TimeLog
 from apps.core.models import WorkspaceMember, ProjectMember, Workspace
 from apps.core.serializers import ProjectMemberSerializer
@@ -79,14 +81,26 @@ class DashboardStatsView(APIView):
     GET /api/v1/core/dashboard-stats/
     Агрегация для графиков дашборда: finance_flow, project_hours, team_load.
     Если данных нет — возвращаются пустые массивы.
+    Суммы finance_flow — в finance_currency (?currency=, по умолчанию базовая валюта воркспейсов);
+    валюта без курсов в ?currency= — 400.
     """
     permission_classes = [IsAuthenticated, IsWorkspaceMember]
 
     def get(self, request):
         user = request.user
-        workspace_ids = list(
-            WorkspaceMember.objects.filter(user=user).values_list('workspace_id', flat=True)
+        memberships = list(
+            WorkspaceMember.objects.filter(user=user).values_list('workspace_id', 'workspace__settings')
         )
+        workspace_ids = [workspace_id for workspace_id, _settings in memberships]
+        if request.query_params.get('currency'):
+            try:
+                currency = validate_currency(request.query_params['currency'])
+            except ExchangeRateMissing as e:
+                return Response({'currency': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            currency = FinanceStatsService.report_currency(
+                currency_from_settings(ws_settings) for _id, ws_settings in memberships
+            )
         if not workspace_ids and getattr(user, 'is_staff', False):
             workspace_ids = list(Workspace.objects.values_list('id', flat=True))
         user_projects = Project.objects.filter(workspace_id__in=workspace_ids)
@@ -96,13 +110,14 @@ class DashboardStatsView(APIView):
         finance_flow = []
         if project_ids:
             zero = Value(0, output_field=DecimalField(max_digits=12, decimal_places=2))
+            # Месячные срезы Ledger вместо TruncMonth по всем транзакциям; валюты пересчитываются в SQL
+            amount = converted_amount(currency)
             qs = (
-                Transaction.objects.filter(project_id__in=project_ids)
-                .annotate(month=TruncMonth('created_at'))
+                TransactionMonthlyRollup.objects.filter(project_id__in=project_ids)
                 .values('month')
                 .annotate(
-                    income=Coalesce(Sum('amount', filter=Q(type=Transaction.TYPE_DEPOSIT)), zero),
-                    expense=Coalesce(Sum('amount', filter=Q(type=Transaction.TYPE_SPEND)), zero),
+                    income=Coalesce(Sum(amount, filter=Q(type=Transaction.TYPE_DEPOSIT)), zero),
+                    expense=Coalesce(Sum(amount, filter=Q(type=Transaction.TYPE_SPEND)), zero),
                 )
                 .order_by('month')[:12]
             )
@@ -149,6 +164,7 @@ class DashboardStatsView(APIView):
 
         return Response({
             'finance_flow': finance_flow,
+            'finance_currency': currency,
             'project_hours': project_hours,
             'team_load': team_load,
         })
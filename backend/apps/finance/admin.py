@@ -3,7 +3,9 @@ Admin configuration for finance app — Immutable Ledger (Task 2.2).
 """
 from django.contrib import admin
 
-from .models import BankConnection, Category, Transaction, Wallet
+from .models import (
+    BankConnection, Category, ExchangeRate, ProjectBalance, Transaction, TransactionMonthlyRollup, Wallet,
+)
 
 
 @admin.register(Transaction)
@@ -73,3 +75,49 @@ class BankConnectionAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'bank_type', 'workspace', 'linked_wallet', 'last_synced_at']
     list_filter = ['bank_type', 'workspace']
     search_fields = ['name']
+
+
+@admin.register(ProjectBalance)
+class ProjectBalanceAdmin(admin.ModelAdmin):
+    """Баланс проекта ведётся из Ledger — только просмотр (сверка: verify_project_balances)."""
+
+    list_display = ['project', 'deposited', 'spent', 'held', 'released', 'updated_at']
+    readonly_fields = list_display
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TransactionMonthlyRollup)
+class TransactionMonthlyRollupAdmin(admin.ModelAdmin):
+    """Месячные срезы Ledger — только просмотр (пересборка: backfill_finance_rollups)."""
+
+    list_display = [
+        'month', 'workspace', 'project', 'category', 'type', 'status', 'currency', 'amount', 'transactions_count',
+    ]
+    list_filter = ['type', 'status', 'currency', 'month']
+    readonly_fields = list_display + ['updated_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    """Курсы валют к FINANCE_BASE_CURRENCY: ручной ввод; массовая загрузка — import_exchange_rates."""
+
+    list_display = ['currency', 'date', 'rate', 'source', 'updated_at']
+    list_filter = ['currency', 'source']
+    search_fields = ['currency']
+    date_hierarchy = 'date'
+    readonly_fields = ['source', 'created_at', 'updated_at']
+
+    def save_model(self, request, obj, form, change):
+        obj.source = ExchangeRate.SOURCE_MANUAL
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,187 @@
+"""
+Баланс проекта (ProjectBalance) поверх Ledger.
+
+Каждая завершённая транзакция проекта с типом deposit/spend/hold/release увеличивает
+соответствующее поле строки finance_project_balances одним UPDATE ... SET x = x + amount
+в той же транзакции БД, что и INSERT в transactions (Transaction.save). Чтение баланса —
+одна строка по PK вместо SUM по всем транзакциям проекта.
+
+Строка проекта создаётся из Ledger при первой транзакции или первом чтении. Она же —
+финансовая блокировка проекта: lock_balance() берёт SELECT ... FOR UPDATE только на неё,
+не трогая строку Project, которую меняют обычные правки проекта.
+verify_balances() пересчитывает суммы по Ledger и сообщает (и при fix=True исправляет) расхождения.
+"""
+import logging
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ProjectBalance, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Тип транзакции -> поле ProjectBalance
+BALANCE_FIELDS = {
+    Transaction.TYPE_DEPOSIT: 'deposited',
+    Transaction.TYPE_SPEND: 'spent',
+    Transaction.TYPE_HOLD: 'held',
+    Transaction.TYPE_RELEASE: 'released',
+}
+
+
+def _zero_totals():
+    return {field: Decimal('0') for field in BALANCE_FIELDS.values()}
+
+
+def ledger_totals(project_ids=None):
+    """Суммы completed-транзакций по Ledger одним GROUP BY (project, type): {project_id: {поле: сумма}}."""
+    qs = Transaction.objects.filter(
+        project__isnull=False,
+        status=Transaction.STATUS_COMPLETED,
+        type__in=list(BALANCE_FIELDS),
+    )
+    if project_ids is not None:
+        qs = qs.filter(project_id__in=list(project_ids))
+    totals = {}
+    rows = qs.values('project_id', 'type').annotate(total=Sum('amount')).order_by()
+    for row in rows:
+        totals.setdefault(row['project_id'], _zero_totals())[BALANCE_FIELDS[row['type']]] = row['total'] or Decimal('0')
+    return totals
+
+
+def balance_dict(balance):
+    """Формат FinanceService.get_project_balance: total_budget, spent, on_hold, available."""
+    return {
+        'total_budget': balance.deposited,
+        'spent': balance.spent,
+        'on_hold': balance.on_hold,
+        'available': balance.available,
+    }
+
+
+def _create_from_ledger(project_id):
+    """Создать строку баланса из Ledger; None — строку уже создала параллельная транзакция."""
+    totals = ledger_totals([project_id]).get(project_id, _zero_totals())
+    try:
+        with transaction.atomic():
+            return ProjectBalance.objects.create(project_id=project_id, **totals)
+    except IntegrityError:
+        return None
+
+
+def _increment(project_id, deltas):
+    return ProjectBalance.objects.filter(project_id=project_id).update(
+        **{field: F(field) + amount for field, amount in deltas.items()},
+        updated_at=timezone.now(),
+    )
+
+
+def apply_transaction(tx):
+    """
+    Учесть созданную транзакцию в балансе проекта (вызывается из Transaction.save в atomic).
+    UPDATE блокирует строку баланса до конца транзакции — параллельные записи по проекту
+    сериализуются на одной строке, а не на пересчёте всего Ledger.
+    """
+    field = BALANCE_FIELDS.get(tx.type)
+    if not tx.project_id or field is None or tx.status != Transaction.STATUS_COMPLETED:
+        return
+    apply_deltas(tx.project_id, {field: Decimal(str(tx.amount))})
+
+
+def apply_deltas(project_id, deltas):
+    """
+    Добавить суммы {поле: amount} к балансу проекта одним UPDATE. Строки Ledger, давшие
+    эти суммы, уже записаны в текущей транзакции БД (Transaction.save или пакетный импорт).
+    """
+    if not deltas or _increment(project_id, deltas):
+        return
+    # Строки ещё нет: Ledger уже содержит эти транзакции (та же транзакция БД)
+    if _create_from_ledger(project_id) is None:
+        # Строку создала другая транзакция — её снимок Ledger их не видел
+        _increment(project_id, deltas)
+
+
+def lock_balance(project_id):
+    """
+    Заблокировать строку баланса проекта до конца транзакции (вызывать внутри atomic).
+    Сериализует holds/commits проекта между собой; при отсутствии строка создаётся из Ledger.
+    """
+    balance = ProjectBalance.objects.select_for_update().filter(project_id=project_id).first()
+    if balance is None:
+        _create_from_ledger(project_id)
+        balance = ProjectBalance.objects.select_for_update().get(project_id=project_id)
+    return balance
+
+
+def get_balance(project_id):
+    """Баланс проекта (строка ProjectBalance; при отсутствии — создаётся из Ledger)."""
+    balance = ProjectBalance.objects.filter(project_id=project_id).first()
+    if balance is None:
+        balance = _create_from_ledger(project_id) or ProjectBalance.objects.get(project_id=project_id)
+    return balance_dict(balance)
+
+
+def get_balances(project_ids):
+    """Балансы нескольких проектов одним запросом: {project_id: dict}."""
+    project_ids = list(project_ids)
+    balances = {
+        balance.project_id: balance
+        for balance in ProjectBalance.objects.filter(project_id__in=project_ids)
+    }
+    missing = [project_id for project_id in project_ids if project_id not in balances]
+    if missing:
+        totals = ledger_totals(missing)
+        created = [
+            ProjectBalance(project_id=project_id, **totals.get(project_id, _zero_totals()))
+            for project_id in missing
+        ]
+        ProjectBalance.objects.bulk_create(created, ignore_conflicts=True)
+        balances.update({balance.project_id: balance for balance in created})
+    return {project_id: balance_dict(balances[project_id]) for project_id in project_ids}
+
+
+def verify_balances(project_ids=None, fix=False):
+    """
+    Пересчитать балансы по Ledger и сравнить со строками ProjectBalance.
+
+    Возвращает список расхождений {project_id, field, stored, actual}
+    (stored=None — строки баланса нет). fix=True перезаписывает строку под блокировкой,
+    пересчитав Ledger проекта заново внутри той же транзакции.
+    """
+    actual = ledger_totals(project_ids)
+    stored_qs = ProjectBalance.objects.all()
+    if project_ids is not None:
+        stored_qs = stored_qs.filter(project_id__in=list(project_ids))
+    stored = {balance.project_id: balance for balance in stored_qs}
+
+    drift = []
+    for project_id in sorted(set(actual) | set(stored)):
+        totals = actual.get(project_id, _zero_totals())
+        balance = stored.get(project_id)
+        for field, value in totals.items():
+            current = getattr(balance, field) if balance is not None else None
+            if balance is None and not value:
+                continue
+            if current != value:
+                drift.append({'project_id': project_id, 'field': field, 'stored': current, 'actual': value})
+
+    if fix:
+        for project_id in sorted({item['project_id'] for item in drift}):
+            _rewrite_from_ledger(project_id)
+    if drift:
+        logger.warning('ProjectBalance drift: %s fields in %s projects', len(drift), len({d['project_id'] for d in drift}))
+    return drift
+
+
+@transaction.atomic
+def _rewrite_from_ledger(project_id):
+    balance = ProjectBalance.objects.select_for_update().filter(project_id=project_id).first()
+    totals = ledger_totals([project_id]).get(project_id, _zero_totals())
+    if balance is None:
+        ProjectBalance.objects.create(project_id=project_id, **totals)
+        return
+    for field, value in totals.items():
+        setattr(balance, field, value)
+    balance.save(update_fields=[*totals, 'updated_at'])
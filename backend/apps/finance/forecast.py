@@ -0,0 +1,266 @@
+"""
+Прогноз cash-flow workspace на HORIZON месяцев вперёд (текущий месяц — первый).
+
+Источники (всё в базовой валюте workspace, apps.finance.fx):
+- поступления — отправленные неоплаченные счета (Invoice.status=sent) по месяцу date_due,
+  просроченные — в текущем месяце;
+- зарплаты — EmployeeProfile (не уволенные): FIXED — salary_amount в месяц,
+  HOURLY — salary_amount × fte × STANDARD_MONTH_HOURS; с месяца найма до месяца увольнения;
+- открытые холды (held − released) — списание в текущем месяце;
+- расходы (SPEND) проектов — линейный тренд по HISTORY_MONTHS полным месяцам
+  месячных срезов (TransactionMonthlyRollup), не ниже нуля.
+
+Ряды считаются матрицами NumPy (проекты × месяцы): тренд — МНК сразу по всем проектам,
+балансы — cumsum по оси месяцев. Результат кэшируется на workspace; версии кэша
+общие со сводкой (FinanceStatsService.invalidate_cache) — новая транзакция, счёт,
+профиль сотрудника или курс сбрасывают прогноз.
+"""
+import hashlib
+from decimal import Decimal
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .fx import ExchangeRateMissing, convert, converted_amount, par_currencies, workspace_currency
+from .models import Transaction, TransactionMonthlyRollup, Wallet
+from .services import FinanceStatsService
+
+HORIZON_MIN = 3
+HORIZON_MAX = 6
+DEFAULT_HORIZON = 6
+HISTORY_MONTHS = 6
+STANDARD_MONTH_HOURS = 168
+CACHE_TTL_SEC = 900
+CENTS = Decimal('0.01')
+
+_SIGNS = {
+    Transaction.TYPE_DEPOSIT: 1,
+    Transaction.TYPE_SPEND: -1,
+    Transaction.TYPE_HOLD: -1,
+    Transaction.TYPE_RELEASE: 1,
+}
+
+
+def _add_months(month, count):
+    """Первое число месяца, отстоящего от month на count (count может быть отрицательным)."""
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def _month_index(value, first_month):
+    """Номер месяца value относительно first_month (0 — тот же месяц)."""
+    return (value.year - first_month.year) * 12 + value.month - first_month.month
+
+
+def spend_trend(history, horizon):
+    """
+    Линейный тренд расходов: history — матрица (проекты × месяцы истории),
+    результат — (проекты × horizon) для месяцев сразу после истории, не ниже нуля.
+    """
+    months = history.shape[1]
+    if months < 2:
+        return np.repeat(history.mean(axis=1, keepdims=True), horizon, axis=1).clip(min=0)
+    x = np.arange(months, dtype=float)
+    x_centered = x - x.mean()
+    mean = history.mean(axis=1, keepdims=True)
+    slope = (history - mean) @ x_centered / (x_centered @ x_centered)
+    future = np.arange(months, months + horizon, dtype=float) - x.mean()
+    return (mean + slope[:, None] * future[None, :]).clip(min=0)
+
+
+def _convert(amount, from_currency, to_currency, on_date):
+    """Как fx.convert, но валюта без курсов считается по номиналу (как converted_amount в SQL)."""
+    try:
+        return convert(amount, from_currency, to_currency, on_date)
+    except ExchangeRateMissing:
+        return Decimal(str(amount))
+
+
+def _to_money(values):
+    # + 0.0 убирает «-0.00» у округлённых до нуля отрицательных значений
+    return [f'{round(float(value), 2) + 0.0:.2f}' for value in values]
+
+
+def _cache_key(workspace_id, horizon, currency, today):
+    versions = FinanceStatsService._versions([workspace_id, FinanceStatsService.RATES_SCOPE])
+    digest = hashlib.md5('.'.join(str(version) for version in versions).encode()).hexdigest()
+    return f'finance:forecast:ws:{workspace_id}:{horizon}:{currency}:{today:%Y%m%d}:{digest}'
+
+
+def forecast_workspace(workspace, horizon=DEFAULT_HORIZON, currency=None, use_cache=True):
+    """
+    Прогноз балансов кошельков (cash) и проектов workspace на horizon месяцев.
+
+    Returns:
+        dict: currency, months, cash {opening, inflows, payroll, holds, spend, net, balance},
+              projects [{project_id, project_name, available, inflows, spend, balance,
+              has_cash_gap, first_gap_month}], cash_gap_months, has_cash_gap,
+              par_currencies (валюты без курсов, учтённые по номиналу)
+    """
+    from apps.billing.models import Invoice
+    from apps.hr.models import EmployeeProfile
+
+    horizon = min(max(int(horizon), HORIZON_MIN), HORIZON_MAX)
+    currency = (currency or workspace_currency(workspace)).upper()
+    today = timezone.localdate()
+    cache_key = _cache_key(workspace.id, horizon, currency, today) if use_cache else None
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    first_month = today.replace(day=1)
+    months = [_add_months(first_month, index) for index in range(horizon)]
+    history_start = _add_months(first_month, -HISTORY_MONTHS)
+
+    # --- Проекты: доступный остаток и помесячные расходы истории одним GROUP BY по срезам ---
+    amount = converted_amount(currency)
+    history_sums = {
+        f'month_{index}': Sum(amount, filter=Q(month=_add_months(history_start, index)))
+        for index in range(HISTORY_MONTHS)
+    }
+    rows = (
+        TransactionMonthlyRollup.objects.filter(
+            Q(workspace=workspace) | Q(project__workspace=workspace),
+            status=Transaction.STATUS_COMPLETED,
+            type__in=list(_SIGNS),
+        )
+        .values('project_id', 'project__name', 'type', 'currency')
+        .annotate(total=Sum(amount), **history_sums)
+        .order_by()
+    )
+    project_index = {}
+    names = []
+    available = []
+    history = []
+    on_hold = 0.0
+    # Валюты сумм прогноза: те, у которых нет курсов, пересчитаны по номиналу
+    currencies = {currency}
+
+    def row_index(project_id, name):
+        if project_id not in project_index:
+            project_index[project_id] = len(names)
+            names.append(name)
+            available.append(0.0)
+            history.append([0.0] * HISTORY_MONTHS)
+        return project_index[project_id]
+
+    for row in rows:
+        currencies.add(row['currency'])
+        index = row_index(row['project_id'], row['project__name'])
+        total = float(row['total'] or 0)
+        available[index] += _SIGNS[row['type']] * total
+        if row['type'] == Transaction.TYPE_SPEND:
+            for month in range(HISTORY_MONTHS):
+                history[index][month] += float(row[f'month_{month}'] or 0)
+        elif row['type'] == Transaction.TYPE_HOLD:
+            on_hold += total
+        elif row['type'] == Transaction.TYPE_RELEASE:
+            on_hold -= total
+
+    # --- Поступления: отправленные счета по месяцу оплаты ---
+    invoices = (
+        Invoice.objects.filter(
+            project__workspace=workspace,
+            status=Invoice.STATUS_SENT,
+            date_due__lt=_add_months(first_month, horizon),
+        )
+        .values_list('project_id', 'project__name', 'date_due', 'amount_total')
+    )
+    invoice_rows = []
+    for project_id, project_name, date_due, amount_total in invoices:
+        invoice_rows.append((
+            row_index(project_id, project_name),
+            max(_month_index(date_due, first_month), 0),
+            float(amount_total),
+        ))
+
+    projects_count = len(names)
+    inflows = np.zeros((projects_count, horizon))
+    if invoice_rows:
+        rows_idx, months_idx, amounts = (np.array(column) for column in zip(*invoice_rows))
+        np.add.at(inflows, (rows_idx.astype(int), months_idx.astype(int)), amounts)
+    spend = spend_trend(np.array(history, dtype=float).reshape(projects_count, HISTORY_MONTHS), horizon)
+
+    # --- Зарплаты: месячная сумма сотрудника × маска активных месяцев ---
+    profiles = (
+        EmployeeProfile.objects.filter(member__workspace=workspace, salary_amount__isnull=False)
+        .exclude(status=EmployeeProfile.STATUS_TERMINATED)
+        .values_list('salary_mode', 'salary_amount', 'fte', 'currency', 'date_hired', 'date_terminated')
+    )
+    monthly_salary = []
+    starts = []
+    ends = []
+    for mode, salary, fte, salary_currency, hired, terminated in profiles:
+        if mode == EmployeeProfile.SALARY_HOURLY:
+            salary = salary * (fte or Decimal('1')) * STANDARD_MONTH_HOURS
+        currencies.add(salary_currency)
+        monthly_salary.append(float(_convert(salary, salary_currency, currency, today)))
+        starts.append(_month_index(hired, first_month) if hired else 0)
+        ends.append(_month_index(terminated, first_month) if terminated else horizon)
+    month_numbers = np.arange(horizon)
+    active = (
+        (month_numbers[None, :] >= np.array(starts, dtype=int)[:, None])
+        & (month_numbers[None, :] <= np.array(ends, dtype=int)[:, None])
+    )
+    payroll = (np.array(monthly_salary, dtype=float)[:, None] * active).sum(axis=0)
+
+    # --- Кошельки workspace: остаток сейчас ---
+    wallets = list(Wallet.objects.filter(workspace=workspace, is_active=True).values_list('balance', 'currency'))
+    currencies.update(wallet_currency for _balance, wallet_currency in wallets)
+    opening = sum(
+        (_convert(balance, wallet_currency, currency, today) for balance, wallet_currency in wallets),
+        Decimal('0'),
+    )
+    holds = np.zeros(horizon)
+    holds[0] = max(on_hold, 0.0)
+
+    inflows_total = inflows.sum(axis=0)
+    spend_total = spend.sum(axis=0)
+    net = inflows_total - spend_total - payroll - holds
+    cash_balance = float(opening) + np.cumsum(net)
+    project_balance = np.array(available, dtype=float)[:, None] + np.cumsum(inflows - spend, axis=1)
+
+    labels = [month.strftime('%Y-%m') for month in months]
+    gap_mask = project_balance < 0
+    projects = []
+    for project_id, index in project_index.items():
+        if project_id is None:
+            continue
+        gaps = np.flatnonzero(gap_mask[index])
+        projects.append({
+            'project_id': project_id,
+            'project_name': names[index] or '—',
+            'available': _to_money([available[index]])[0],
+            'inflows': _to_money(inflows[index]),
+            'spend': _to_money(spend[index]),
+            'balance': _to_money(project_balance[index]),
+            'has_cash_gap': bool(gaps.size),
+            'first_gap_month': labels[gaps[0]] if gaps.size else None,
+        })
+    projects.sort(key=lambda item: (not item['has_cash_gap'], item['project_name']))
+
+    cash_gap_months = [labels[index] for index in np.flatnonzero(cash_balance < 0)]
+    result = {
+        'currency': currency,
+        'months': labels,
+        'cash': {
+            'opening': str(opening.quantize(CENTS)),
+            'inflows': _to_money(inflows_total),
+            'payroll': _to_money(payroll),
+            'holds': _to_money(holds),
+            'spend': _to_money(spend_total),
+            'net': _to_money(net),
+            'balance': _to_money(cash_balance),
+        },
+        'projects': projects,
+        'cash_gap_months': cash_gap_months,
+        'has_cash_gap': bool(cash_gap_months),
+        'par_currencies': par_currencies(currencies),
+    }
+    if cache_key:
+        cache.set(cache_key, result, CACHE_TTL_SEC)
+    return result
+
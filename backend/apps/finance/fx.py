@@ -0,0 +1,242 @@
+"""
+Курсы валют (ExchangeRate) и пересчёт сумм в валюту отчёта.
+
+Курс — цена 1 единицы валюты в FINANCE_BASE_CURRENCY (у базовой валюты курс 1);
+кросс-курс A→B = rate(A) / rate(B). На дату берётся последний курс не позже неё,
+для дат раньше первой записи — самый ранний известный курс.
+
+Таблица целиком держится в памяти процесса FINANCE_FX_CACHE_SECONDS: курсы меняются
+раз в день, а конвертация (create_transfer, отчёты) не должна ходить в БД на каждую сумму.
+Изменение курсов сбрасывает кэш процесса сразу (signals) и кэш аналитики (rates_changed);
+другие процессы подхватывают курсы по истечении TTL.
+
+Отчёты пересчитывают суммы в SQL (converted_amount): курс строки — коррелированный
+подзапрос, поэтому мультивалютная сводка остаётся одним агрегирующим запросом.
+Валюта отчёта из запроса проверяется validate_currency (нет курсов — ExchangeRateMissing);
+валюты строк без курсов считаются по номиналу, и отчёт перечисляет их (par_currencies).
+"""
+import bisect
+import csv
+import io
+import threading
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, Exists, ExpressionWrapper, F, Func, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ExchangeRate
+from .statements import StatementParseError, parse_amount, parse_date
+
+DEFAULT_BASE_CURRENCY = 'RUB'
+DEFAULT_CACHE_SECONDS = 60
+RATE_FIELD = DecimalField(max_digits=18, decimal_places=8)
+AMOUNT_FIELD = DecimalField(max_digits=28, decimal_places=8)
+CENTS = Decimal('0.01')
+IMPORT_BATCH_SIZE = 1000
+
+_lock = threading.Lock()
+_cache = {'loaded_at': None, 'rates': {}}
+
+
+class ExchangeRateMissing(ValueError):
+    """Для валюты нет ни одного курса."""
+
+
+def base_currency():
+    return (getattr(settings, 'FINANCE_BASE_CURRENCY', None) or DEFAULT_BASE_CURRENCY).upper()
+
+
+def currency_from_settings(workspace_settings):
+    """Базовая валюта workspace по его settings (JSON): settings['base_currency'] или FINANCE_BASE_CURRENCY."""
+    value = (workspace_settings or {}).get('base_currency') if isinstance(workspace_settings, dict) else None
+    return (value or base_currency()).upper()
+
+
+def workspace_currency(workspace):
+    return currency_from_settings(getattr(workspace, 'settings', None))
+
+
+def _cache_seconds():
+    return getattr(settings, 'FINANCE_FX_CACHE_SECONDS', DEFAULT_CACHE_SECONDS)
+
+
+def _rates_table():
+    """{currency: ([date, ...], [rate, ...])} по возрастанию дат; перечитывается раз в TTL."""
+    loaded_at = _cache['loaded_at']
+    if loaded_at is not None and time.monotonic() - loaded_at < _cache_seconds():
+        return _cache['rates']
+    with _lock:
+        loaded_at = _cache['loaded_at']
+        if loaded_at is None or time.monotonic() - loaded_at >= _cache_seconds():
+            table = {}
+            rows = ExchangeRate.objects.order_by('currency', 'date').values_list('currency', 'date', 'rate')
+            for currency, day, rate in rows:
+                dates, rates = table.setdefault(currency, ([], []))
+                dates.append(day)
+                rates.append(rate)
+            _cache['rates'] = table
+            _cache['loaded_at'] = time.monotonic()
+        return _cache['rates']
+
+
+def clear_rates_cache():
+    """Сбросить таблицу курсов процесса (следующее чтение перечитает её из БД)."""
+    _cache['loaded_at'] = None
+
+
+def has_rates(currency):
+    """Для валюты есть курс (базовая валюта — всегда)."""
+    currency = (currency or '').upper()
+    return currency == base_currency() or currency in _rates_table()
+
+
+def validate_currency(currency):
+    """Валюта отчёта, запрошенная пользователем (?currency=): код в верхнем регистре или ExchangeRateMissing."""
+    currency = (currency or '').strip().upper()
+    if not has_rates(currency):
+        raise ExchangeRateMissing(f'Нет курсов валюты {currency or "(пусто)"}')
+    return currency
+
+
+def par_currencies(currencies):
+    """Валюты из currencies без курсов — их суммы пересчитаны по номиналу (отсортированный список)."""
+    return sorted({currency.upper() for currency in currencies if currency and not has_rates(currency)})
+
+
+def rate_exists(currency_field='currency'):
+    """SQL-выражение «для валюты строки есть курс»: par_currencies без отдельного запроса."""
+    return Exists(ExchangeRate.objects.filter(currency=OuterRef(currency_field)))
+
+
+def get_rate(currency, on_date=None):
+    """Курс currency к базовой валюте на дату (Decimal)."""
+    currency = (currency or '').upper()
+    if currency == base_currency():
+        return Decimal('1')
+    series = _rates_table().get(currency)
+    if not series:
+        raise ExchangeRateMissing(f'Нет курса валюты {currency}')
+    dates, rates = series
+    index = bisect.bisect_right(dates, on_date or timezone.localdate()) - 1
+    return rates[max(index, 0)]
+
+
+def convert(amount, from_currency, to_currency, on_date=None):
+    """Пересчитать сумму из from_currency в to_currency по курсам на дату (округление до копеек)."""
+    amount = Decimal(str(amount))
+    if (from_currency or '').upper() == (to_currency or '').upper():
+        return amount
+    value = amount * get_rate(from_currency, on_date) / get_rate(to_currency, on_date)
+    return value.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+class _ExactDivisor(Func):
+    """Делитель без целочисленного деления: SQLite хранит целые курсы в NUMERIC как INTEGER."""
+
+    template = '%(expressions)s'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template='CAST(%(expressions)s AS REAL)', **extra_context)
+
+
+def _rate_lookup(currency, date_field):
+    """Курс на дату строки внешнего запроса: последний не позже date_field, иначе самый ранний."""
+    latest = ExchangeRate.objects.filter(currency=currency, date__lte=OuterRef(date_field)).order_by('-date')
+    earliest = ExchangeRate.objects.filter(currency=currency, date__gt=OuterRef(date_field)).order_by('date')
+    return Coalesce(
+        Subquery(latest.values('rate')[:1], output_field=RATE_FIELD),
+        Subquery(earliest.values('rate')[:1], output_field=RATE_FIELD),
+        # Валюта без курсов считается по номиналу, как до появления таблицы курсов;
+        # отчёты перечисляют такие валюты (par_currencies)
+        Value(Decimal('1')),
+        output_field=RATE_FIELD,
+    )
+
+
+def converted_amount(target_currency, amount_field='amount', currency_field='currency', date_field='month'):
+    """
+    SQL-выражение «amount строки в target_currency» для агрегатов (Sum(converted_amount(...))).
+    Курс берётся на date_field строки; строки в базовой валюте подзапросов не вычисляют.
+    """
+    pivot = base_currency()
+    target_currency = (target_currency or pivot).upper()
+    source_rate = Case(
+        When(**{currency_field: pivot}, then=Value(Decimal('1'))),
+        When(**{currency_field: target_currency}, then=Value(Decimal('1'))),
+        default=_rate_lookup(OuterRef(currency_field), date_field),
+        output_field=RATE_FIELD,
+    )
+    value = F(amount_field) * source_rate
+    if target_currency != pivot:
+        # A→target = A→pivot / (target→pivot); строки уже в target_currency не пересчитываются
+        value = Case(
+            When(**{currency_field: target_currency}, then=F(amount_field)),
+            default=value / _ExactDivisor(_rate_lookup(Value(target_currency), date_field), output_field=RATE_FIELD),
+            output_field=AMOUNT_FIELD,
+        )
+    return ExpressionWrapper(value, output_field=AMOUNT_FIELD)
+
+
+def rates_changed():
+    """Курсы изменились: сбросить кэш процесса и сводки аналитики всех пользователей."""
+    from .services import FinanceStatsService
+
+    clear_rates_cache()
+    FinanceStatsService.invalidate_cache(rates=True)
+
+
+def iter_rates_csv(fileobj):
+    """Строки CSV курсов: заголовок currency,date,rate (разделитель , или ;)."""
+    stream = fileobj if isinstance(fileobj, io.TextIOBase) else io.TextIOWrapper(fileobj, encoding='utf-8-sig')
+    header_line = stream.readline()
+    if not header_line.strip():
+        return
+    delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+    header = [name.strip().lower() for name in next(csv.reader([header_line], delimiter=delimiter))]
+    missing = {'currency', 'date', 'rate'} - set(header)
+    if missing:
+        raise StatementParseError(f"Нет колонок: {', '.join(sorted(missing))}")
+    for line, row in enumerate(csv.reader(stream, delimiter=delimiter), start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        values = dict(zip(header, row))
+        currency = (values.get('currency') or '').strip().upper()
+        if len(currency) != 3:
+            raise StatementParseError(f'Строка {line}: некорректный код валюты «{currency}»')
+        rate = parse_amount(values.get('rate'), line)
+        if rate <= 0:
+            raise StatementParseError(f'Строка {line}: курс должен быть больше нуля')
+        yield currency, parse_date(values.get('date'), line), rate
+
+
+def import_rates(rows, source=ExchangeRate.SOURCE_IMPORT):
+    """
+    Загрузить курсы [(currency, date, rate)]: существующие (currency, date) перезаписываются.
+    Возвращает число загруженных строк.
+    """
+    total = 0
+    batch = []
+
+    def flush():
+        ExchangeRate.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['currency', 'date'],
+            update_fields=['rate', 'source', 'updated_at'],
+        )
+
+    for currency, day, rate in rows:
+        batch.append(ExchangeRate(currency=currency.upper(), date=day, rate=rate, source=source))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+            total += len(batch)
+            batch = []
+    if batch:
+        flush()
+        total += len(batch)
+    if total:
+        rates_changed()
+    return total
@@ -0,0 +1,31 @@
+"""
+Management command: пересборка месячных срезов Ledger (TransactionMonthlyRollup) из transactions.
+
+Использование:
+    python manage.py backfill_finance_rollups
+    python manage.py backfill_finance_rollups --workspace 3 --workspace 7
+
+Срезы ведутся при создании транзакции; команда нужна после загрузки данных в обход ORM,
+ручных правок Ledger или для первичного заполнения.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.finance.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать месячные срезы транзакций (workspace, project, category, month, type) из Ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workspace',
+            type=int,
+            action='append',
+            dest='workspaces',
+            default=None,
+            help='ID workspace (можно несколько раз); по умолчанию — все',
+        )
+
+    def handle(self, *args, **options):
+        created = rebuild_rollups(workspace_ids=options['workspaces'])
+        self.stdout.write(self.style.SUCCESS(f'Строк среза: {created}'))
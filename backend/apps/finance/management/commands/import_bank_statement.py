@@ -0,0 +1,59 @@
+"""
+Management command: импорт банковской выписки (CSV, OFX 2.x, CAMT.053) в кошелёк подключения.
+
+Использование:
+    python manage.py import_bank_statement 5 statement.csv --user admin
+    python manage.py import_bank_statement 5 camt053.xml --format camt --user admin --project 12
+
+Повторный запуск с тем же файлом не создаёт дублей (дедупликация по external_id).
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.finance.models import BankConnection, Category
+from apps.finance.statements import DEFAULT_CHUNK_SIZE, FORMATS, StatementParseError, detect_format, import_statement
+from apps.todo.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Импортировать банковскую выписку в Ledger пачками (одна вставка на пачку)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('connection_id', type=int, help='ID BankConnection')
+        parser.add_argument('path', help='Путь к файлу выписки')
+        parser.add_argument('--format', choices=FORMATS, default=None, help='Формат (по умолчанию — по расширению)')
+        parser.add_argument('--user', required=True, help='username автора транзакций')
+        parser.add_argument('--project', type=int, default=None, help='ID проекта для всех операций')
+        parser.add_argument('--category', type=int, default=None, help='ID категории для всех операций')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Строк в пачке')
+
+    def handle(self, *args, **options):
+        try:
+            connection = BankConnection.objects.select_related('workspace').get(pk=options['connection_id'])
+        except BankConnection.DoesNotExist:
+            raise CommandError(f"BankConnection {options['connection_id']} не найден")
+        user = get_user_model().objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user']} не найден")
+        fmt = options['format'] or detect_format(options['path'])
+        if fmt is None:
+            raise CommandError('Не удалось определить формат, укажите --format')
+        project = None
+        if options['project']:
+            project = Project.objects.filter(pk=options['project'], workspace_id=connection.workspace_id).first()
+            if project is None:
+                raise CommandError('Проект не найден в workspace подключения')
+        category = Category.objects.filter(pk=options['category']).first() if options['category'] else None
+
+        with open(options['path'], 'rb') as fileobj:
+            try:
+                result = import_statement(
+                    connection, fileobj, fmt, user,
+                    project=project, category=category, chunk_size=options['chunk_size'],
+                )
+            except StatementParseError as e:
+                raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: {result['created']}, дублей: {result['duplicates']}, "
+            f"пропущено: {result['skipped']}, изменение баланса: {result['net_delta']}"
+        ))
@@ -0,0 +1,29 @@
+"""
+Management command: загрузка курсов валют (ExchangeRate) из CSV.
+
+Использование:
+    python manage.py import_exchange_rates rates.csv
+
+Формат: заголовок currency,date,rate; rate — цена 1 единицы currency в FINANCE_BASE_CURRENCY.
+Курсы на уже загруженные даты перезаписываются.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.finance.fx import import_rates, iter_rates_csv
+from apps.finance.statements import StatementParseError
+
+
+class Command(BaseCommand):
+    help = 'Загрузить курсы валют к базовой валюте учёта из CSV (currency,date,rate)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к CSV-файлу курсов')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as fileobj, transaction.atomic():
+                loaded = import_rates(iter_rates_csv(fileobj))
+        except (OSError, StatementParseError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Загружено курсов: {loaded}'))
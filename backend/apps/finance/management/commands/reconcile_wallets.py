@@ -0,0 +1,48 @@
+"""
+Management command: сверка балансов кошельков (Wallet.balance) с Ledger пачками.
+
+Использование:
+    python manage.py reconcile_wallets
+    python manage.py reconcile_wallets --workspace 3 --fix
+    python manage.py reconcile_wallets --chunk-size 1000 --workers 4
+
+Без --fix только печатает расхождения; код выхода 1, если они есть (для cron/CI).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.finance.reconciliation import DEFAULT_CHUNK_SIZE, reconcile_wallets
+
+
+class Command(BaseCommand):
+    help = 'Сверить балансы кошельков с Ledger (пачками, опционально в пуле процессов) и показать расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workspace', type=int, default=None, help='ID workspace; по умолчанию — все кошельки')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Кошельков в пачке')
+        parser.add_argument('--workers', type=int, default=1, help='Число процессов (1 — без пула)')
+        parser.add_argument('--fix', action='store_true', help='Перезаписать расходящиеся балансы из Ledger')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size и --workers должны быть положительными')
+        report = reconcile_wallets(
+            workspace_id=options['workspace'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            fix=options['fix'],
+        )
+        for item in report['mismatches']:
+            self.stdout.write(
+                f"wallet#{item['wallet_id']}: хранится {item['stored']}, по Ledger {item['actual']}"
+            )
+        self.stdout.write(
+            f"Проверено кошельков: {report['checked']} в {report['chunks']} пачках за {report['seconds']:.2f} с "
+            f"(самая долгая пачка {report['chunk_seconds_max']:.2f} с)"
+        )
+        if not report['mismatches']:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Исправлено кошельков: {report['fixed']}"))
+            return
+        raise CommandError(f"Расхождения в {len(report['mismatches'])} кошельках (запустите с --fix)")
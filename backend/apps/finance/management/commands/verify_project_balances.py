@@ -0,0 +1,44 @@
+"""
+Management command: сверка балансов проектов (ProjectBalance) с Ledger (transactions).
+
+Использование:
+    python manage.py verify_project_balances
+    python manage.py verify_project_balances --project 12 --project 15
+    python manage.py verify_project_balances --fix
+
+Без --fix только печатает расхождения; код выхода 1, если они есть (для cron/CI).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.finance.balances import verify_balances
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать балансы проектов по Ledger и показать (или исправить) расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            action='append',
+            dest='projects',
+            default=None,
+            help='ID проекта (можно несколько раз); по умолчанию — все проекты',
+        )
+        parser.add_argument('--fix', action='store_true', help='Перезаписать расходящиеся балансы из Ledger')
+
+    def handle(self, *args, **options):
+        drift = verify_balances(project_ids=options['projects'], fix=options['fix'])
+        for item in drift:
+            self.stdout.write(
+                f"project#{item['project_id']} {item['field']}: "
+                f"хранится {item['stored'] if item['stored'] is not None else '—'}, по Ledger {item['actual']}"
+            )
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        projects = len({item['project_id'] for item in drift})
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено проектов: {projects}'))
+            return
+        raise CommandError(f'Расхождения в {projects} проектах (запустите с --fix)')
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.1 on 2026-10-19 05:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+BALANCE_FIELDS = {
+    'deposit': 'deposited',
+    'spend': 'spent',
+    'hold': 'held',
+    'release': 'released',
+}
+
+
+def backfill_project_balances(apps, schema_editor):
+    """Начальные балансы из Ledger: одна агрегация GROUP BY (project, type)."""
+    Transaction = apps.get_model('finance', 'Transaction')
+    ProjectBalance = apps.get_model('finance', 'ProjectBalance')
+    rows = (
+        Transaction.objects.filter(project__isnull=False, status='completed', type__in=list(BALANCE_FIELDS))
+        .values('project_id', 'type')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    balances = {}
+    for row in rows:
+        balance = balances.setdefault(row['project_id'], ProjectBalance(project_id=row['project_id']))
+        setattr(balance, BALANCE_FIELDS[row['type']], row['total'] or 0)
+    ProjectBalance.objects.bulk_create(balances.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0009_alter_bankconnection_options_alter_category_options_and_more'),
+        ('todo', '0021_alter_checklistitem_options_alter_project_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectBalance',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='finance_balance', serialize=False, to='todo.project')),
+                ('deposited', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('held', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('released', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Баланс проекта',
+                'verbose_name_plural': 'Балансы проектов',
+                'db_table': 'finance_project_balances',
+            },
+        ),
+        migrations.RunPython(backfill_project_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.1 on 2026-10-19 05:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def backfill_monthly_rollups(apps, schema_editor):
+    """Начальные срезы из Ledger: TruncMonth + GROUP BY по ключу среза."""
+    Transaction = apps.get_model('finance', 'Transaction')
+    Rollup = apps.get_model('finance', 'TransactionMonthlyRollup')
+    rows = (
+        Transaction.objects.annotate(month=TruncMonth('created_at'))
+        .values('workspace_id', 'project_id', 'category_id', 'month', 'type', 'status')
+        .annotate(amount=Sum('amount'), transactions_count=Count('id'))
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator():
+        row['month'] = timezone.localtime(row['month']).date()
+        batch.append(Rollup(**row))
+        if len(batch) >= 1000:
+            Rollup.objects.bulk_create(batch)
+            batch = []
+    Rollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_alter_projectmember_options_alter_user_options_and_more'),
+        ('finance', '0010_project_balance'),
+        ('todo', '0021_alter_checklistitem_options_alter_project_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Первое число месяца (в TIME_ZONE проекта)')),
+                ('type', models.CharField(choices=[('deposit', 'Deposit'), ('spend', 'Spend'), ('transfer', 'Transfer'), ('hold', 'Hold'), ('release', 'Release'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('transactions_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='finance.category')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='finance_rollups', to='todo.project')),
+                ('workspace', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='finance_rollups', to='core.workspace')),
+            ],
+            options={
+                'verbose_name': 'Месячный срез транзакций',
+                'verbose_name_plural': 'Месячные срезы транзакций',
+                'db_table': 'finance_monthly_rollups',
+                'indexes': [models.Index(fields=['workspace', 'month'], name='finance_mon_workspa_65701e_idx'), models.Index(fields=['project', 'month'], name='finance_mon_project_d1e81e_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='transactionmonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('workspace', 'project', 'category', 'month', 'type', 'status'), name='finance_rollup_unique_key', nulls_distinct=False),
+        ),
+        migrations.RunPython(backfill_monthly_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-19 05:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0016_alter_projectmember_options_alter_user_options_and_more'),
+        ('crm', '0005_alter_company_options_alter_customer_options'),
+        ('finance', '0011_transaction_monthly_rollup'),
+        ('hr', '0006_alter_contact_options_alter_department_options_and_more'),
+        ('timetracking', '0004_alter_timelog_options'),
+        ('todo', '0021_alter_checklistitem_options_alter_project_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='bank_connection',
+            field=models.ForeignKey(blank=True, help_text='Подключение, из выписки которого импортирована транзакция.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='finance.bankconnection'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='booked_at',
+            field=models.DateField(blank=True, help_text='Дата проводки по выписке банка.', null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Идентификатор операции в выписке банка (дедупликация импорта).', max_length=128, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(fields=('bank_connection', 'external_id'), name='transactions_bank_external_id_unique'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.0.1 on 2026-10-19 06:04
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def rebuild_rollups_by_currency(apps, schema_editor):
+    """Срезы получили валюту в ключе: пересобрать их из Ledger с разбивкой по currency."""
+    Transaction = apps.get_model('finance', 'Transaction')
+    Rollup = apps.get_model('finance', 'TransactionMonthlyRollup')
+    Rollup.objects.all().delete()
+    rows = (
+        Transaction.objects.annotate(month=TruncMonth('created_at'))
+        .values('workspace_id', 'project_id', 'category_id', 'month', 'type', 'status', 'currency')
+        .annotate(amount=Sum('amount'), transactions_count=Count('id'))
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator():
+        row['month'] = timezone.localtime(row['month']).date()
+        batch.append(Rollup(**row))
+        if len(batch) >= 1000:
+            Rollup.objects.bulk_create(batch)
+            batch = []
+    Rollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_alter_projectmember_options_alter_user_options_and_more'),
+        ('finance', '0012_transaction_bank_statement_import'),
+        ('todo', '0021_alter_checklistitem_options_alter_project_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('source', models.CharField(choices=[('manual', 'Вручную'), ('import', 'Импорт')], default='manual', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Курс валюты',
+                'verbose_name_plural': 'Курсы валют',
+                'db_table': 'finance_exchange_rates',
+                'ordering': ['currency', '-date'],
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='transactionmonthlyrollup',
+            name='finance_rollup_unique_key',
+        ),
+        migrations.AddField(
+            model_name='transactionmonthlyrollup',
+            name='currency',
+            field=models.CharField(default='RUB', max_length=3),
+        ),
+        migrations.AddConstraint(
+            model_name='transactionmonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('workspace', 'project', 'category', 'month', 'type', 'status', 'currency'), name='finance_rollup_unique_key', nulls_distinct=False),
+        ),
+        migrations.RunPython(rebuild_rollups_by_currency, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('currency', 'date'), name='finance_exchange_rate_unique_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.CheckConstraint(check=models.Q(('rate__gt', 0)), name='finance_exchange_rate_positive'),
+        ),
+    ]
@@ -2,12 +2,13 @@
 Finance models for Office Suite 360.
 """
 import uuid
+from functools import partial
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 
 
@@ -281,6 +282,22 @@ class Transaction(models.Model):
         help_text=_('Устаревшее поле для payroll, оставлено для совместимости.')
     )
 
+    bank_connection = models.ForeignKey(
+        'BankConnection',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='transactions',
+        help_text=_('Подключение, из выписки которого импортирована транзакция.')
+    )
+    external_id = models.CharField(
+        max_length=128,
+        null=True,
+        blank=True,
+        help_text=_('Идентификатор операции в выписке банка (дедупликация импорта).')
+    )
+    booked_at = models.DateField(null=True, blank=True, help_text=_('Дата проводки по выписке банка.'))
+
     receipt = models.FileField(upload_to='protected/receipts/%Y/%m/', null=True, blank=True)
     transfer_group_id = models.UUIDField(null=True, blank=True, editable=False)
 
@@ -314,6 +331,12 @@ class Transaction(models.Model):
             models.Index(fields=['destination_wallet']),
             models.Index(fields=['transfer_group_id']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['bank_connection', 'external_id'],
+                name='transactions_bank_external_id_unique',
+            ),
+        ]
 
     def __str__(self):
         project_name = self.project.name if self.project else '—'
@@ -322,10 +345,160 @@ class Transaction(models.Model):
     def save(self, *args, **kwargs):
         """
         Immutability: запрет на изменение существующих транзакций.
+        Баланс проекта (ProjectBalance) и месячный срез (TransactionMonthlyRollup) обновляются
+        в той же транзакции БД, что и INSERT; после коммита сбрасывается кэш аналитики воркспейса.
         """
         if self.pk is not None:
             raise ValueError(
                 "Транзакции immutable — изменение запрещено. "
                 "Создайте новую транзакцию для корректировки."
             )
+        from .balances import apply_transaction
+        from .rollups import apply_rollup
+        from .services import FinanceStatsService
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            apply_transaction(self)
+            apply_rollup(self)
+        if self.project_id:
+            workspace_id = self.workspace_id or getattr(self.project, 'workspace_id', None)
+            transaction.on_commit(partial(FinanceStatsService.invalidate_cache, workspace_id))
+
+
+class ProjectBalance(models.Model):
+    """
+    Текущий баланс проекта по Ledger: суммы завершённых (completed) транзакций по типам.
+
+    Обновляется инкрементально при создании Transaction (apps.finance.balances),
+    чтобы чтение баланса было одной строкой, а не SUM по всем транзакциям проекта.
+    Сверка с Ledger — команда verify_project_balances.
+    """
+
+    project = models.OneToOneField(
+        'todo.Project',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='finance_balance'
+    )
+    deposited = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+    spent = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+    held = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+    released = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Баланс проекта'
+        verbose_name_plural = 'Балансы проектов'
+        db_table = 'finance_project_balances'
+
+    def __str__(self):
+        return f"Balance project#{self.project_id}"
+
+    @property
+    def on_hold(self):
+        return self.held - self.released
+
+    @property
+    def available(self):
+        return self.deposited - self.spent - self.on_hold
+
+
+class TransactionMonthlyRollup(models.Model):
+    """
+    Месячный срез Ledger: сумма и число транзакций по
+    (workspace, project, category, month, type, status, currency).
+
+    Ведётся инкрементально при создании Transaction (apps.finance.rollups); графики
+    cash-flow и P&L читают десятки строк среза вместо TruncMonth по всем транзакциям.
+    Пересборка из Ledger — команда backfill_finance_rollups.
+    """
+
+    workspace = models.ForeignKey(
+        'core.Workspace',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='finance_rollups'
+    )
+    project = models.ForeignKey(
+        'todo.Project',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='finance_rollups'
+    )
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='rollups'
+    )
+    month = models.DateField(help_text=_('Первое число месяца (в TIME_ZONE проекта)'))
+    type = models.CharField(max_length=20, choices=Transaction.TYPE_CHOICES)
+    status = models.CharField(max_length=20, choices=Transaction.STATUS_CHOICES)
+    currency = models.CharField(max_length=3, default='RUB')
+    amount = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+    transactions_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Месячный срез транзакций'
+        verbose_name_plural = 'Месячные срезы транзакций'
+        db_table = 'finance_monthly_rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['workspace', 'project', 'category', 'month', 'type', 'status', 'currency'],
+                name='finance_rollup_unique_key',
+                nulls_distinct=False,
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['workspace', 'month']),
+            models.Index(fields=['project', 'month']),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.type}/{self.status} {self.amount} {self.currency}"
+
+
+class ExchangeRate(models.Model):
+    """
+    Курс валюты на дату: сколько единиц FINANCE_BASE_CURRENCY стоит 1 единица currency.
+
+    Кросс-курсы считаются через базовую валюту (у неё курс 1, строка не нужна).
+    Таблица заполняется импортом (import_exchange_rates) или вручную в админке;
+    чтение — через apps.finance.fx (кэш в процессе и SQL-выражения для отчётов).
+    """
+
+    SOURCE_MANUAL = 'manual'
+    SOURCE_IMPORT = 'import'
+    SOURCE_CHOICES = [
+        (SOURCE_MANUAL, 'Вручную'),
+        (SOURCE_IMPORT, 'Импорт'),
+    ]
+
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default=SOURCE_MANUAL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Курс валюты'
+        verbose_name_plural = 'Курсы валют'
+        db_table = 'finance_exchange_rates'
+        ordering = ['currency', '-date']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='finance_exchange_rate_unique_day'),
+            models.CheckConstraint(check=models.Q(rate__gt=0), name='finance_exchange_rate_positive'),
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+    def save(self, *args, **kwargs):
+        self.currency = (self.currency or '').upper()
         super().save(*args, **kwargs)
@@ -0,0 +1,136 @@
+"""
+Сверка балансов кошельков (Wallet.balance) с Ledger.
+
+Баланс кошелька = сумма completed-транзакций, где он destination, минус сумма, где он source.
+Кошельки обрабатываются пачками: на пачку — один GROUP BY (source_wallet, destination_wallet)
+вместо двух агрегатов на кошелёк (TransactionService.recalculate_wallet_balance).
+Пачки можно раздать пулу процессов (reconcile_wallets(workers=N)): воркеры только читают.
+
+При fix=True расходящиеся кошельки исправляет родительский процесс: блокирует их
+(select_for_update), пересчитывает Ledger под блокировкой и перезаписывает баланс;
+last_reconciled_at обновляется у всех проверенных.
+"""
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Transaction, Wallet
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def ledger_wallet_balances(wallet_ids):
+    """Балансы кошельков по Ledger одним GROUP BY: {wallet_id: Decimal}."""
+    wallet_ids = list(wallet_ids)
+    balances = dict.fromkeys(wallet_ids, Decimal('0'))
+    rows = (
+        Transaction.objects.filter(status=Transaction.STATUS_COMPLETED)
+        .filter(Q(source_wallet_id__in=wallet_ids) | Q(destination_wallet_id__in=wallet_ids))
+        .values('source_wallet_id', 'destination_wallet_id')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for row in rows:
+        total = row['total'] or Decimal('0')
+        if row['destination_wallet_id'] in balances:
+            balances[row['destination_wallet_id']] += total
+        if row['source_wallet_id'] in balances:
+            balances[row['source_wallet_id']] -= total
+    return balances
+
+
+@transaction.atomic
+def _fix_wallets(wallet_ids):
+    """Перезаписать балансы под блокировкой, пересчитав Ledger внутри той же транзакции."""
+    wallets = list(Wallet.objects.select_for_update().filter(pk__in=wallet_ids).order_by('pk'))
+    actual = ledger_wallet_balances(wallet_ids)
+    now = timezone.now()
+    for wallet in wallets:
+        wallet.balance = actual[wallet.pk]
+        wallet.last_reconciled_at = now
+        wallet.updated_at = now
+    Wallet.objects.bulk_update(wallets, ['balance', 'last_reconciled_at', 'updated_at'])
+    return len(wallets)
+
+
+def reconcile_chunk(wallet_ids):
+    """
+    Сверить пачку кошельков (только чтение). Возвращает
+    {wallet_ids, mismatches: [{wallet_id, stored, actual}], seconds}.
+    """
+    started = time.monotonic()
+    stored = dict(Wallet.objects.filter(pk__in=wallet_ids).values_list('pk', 'balance'))
+    actual = ledger_wallet_balances(stored)
+    mismatches = [
+        {'wallet_id': wallet_id, 'stored': balance, 'actual': actual[wallet_id]}
+        for wallet_id, balance in sorted(stored.items())
+        if balance != actual[wallet_id]
+    ]
+    return {
+        'wallet_ids': list(stored),
+        'mismatches': mismatches,
+        'seconds': time.monotonic() - started,
+    }
+
+
+def _reconcile_chunk_in_worker(wallet_ids):
+    try:
+        return reconcile_chunk(wallet_ids)
+    finally:
+        connections.close_all()
+
+
+def reconcile_wallets(workspace_id=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, fix=False):
+    """
+    Сверить все кошельки (или кошельки workspace) пачками по chunk_size.
+
+    workers > 1 — пачки обрабатываются в пуле процессов (fork: настроенный Django наследуется),
+    у каждого процесса своё подключение к БД.
+    Возвращает {checked, mismatches, fixed, chunks, seconds, chunk_seconds_max}.
+    """
+    started = time.monotonic()
+    qs = Wallet.objects.all()
+    if workspace_id is not None:
+        qs = qs.filter(workspace_id=workspace_id)
+    wallet_ids = list(qs.order_by('pk').values_list('pk', flat=True))
+    chunks = [wallet_ids[i:i + chunk_size] for i in range(0, len(wallet_ids), chunk_size)]
+
+    if workers > 1 and len(chunks) > 1:
+        # Дочерние процессы не должны наследовать открытые соединения родителя
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            results = list(pool.map(_reconcile_chunk_in_worker, chunks))
+    else:
+        results = [reconcile_chunk(chunk) for chunk in chunks]
+
+    mismatches = [item for result in results for item in result['mismatches']]
+    fixed = 0
+    if fix:
+        for start in range(0, len(mismatches), chunk_size):
+            fixed += _fix_wallets([item['wallet_id'] for item in mismatches[start:start + chunk_size]])
+        now = timezone.now()
+        for result in results:
+            Wallet.objects.filter(pk__in=result['wallet_ids']).update(last_reconciled_at=now)
+
+    report = {
+        'checked': sum(len(result['wallet_ids']) for result in results),
+        'mismatches': mismatches,
+        'fixed': fixed,
+        'chunks': len(chunks),
+        'seconds': time.monotonic() - started,
+        'chunk_seconds_max': max((result['seconds'] for result in results), default=0),
+    }
+    if report['mismatches']:
+        logger.warning(
+            'reconcile_wallets: %s mismatches of %s wallets (fixed %s)',
+            len(report['mismatches']), report['checked'], report['fixed'],
+        )
+    return report
@@ -0,0 +1,122 @@
+"""
+Месячные срезы Ledger (TransactionMonthlyRollup) для графиков cash-flow и P&L.
+
+Ключ среза — (workspace, project, category, month, type, status, currency); month — первое число
+месяца created_at в текущем часовом поясе (как TruncMonth). Создание Transaction
+увеличивает amount и transactions_count своей строки в той же транзакции БД
+(Transaction.save). Транзакции immutable, поэтому статус строки Ledger после INSERT
+не меняется. Единственная допустимая правка ключа — категория (PATCH metadata):
+move_rollup_category переносит сумму между строками среза в той же транзакции БД.
+Прочие правки в обход ORM исправляет rebuild_rollups (команда backfill_finance_rollups).
+"""
+import logging
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Transaction, TransactionMonthlyRollup
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 1000
+
+
+def rollup_month(value):
+    """Первое число месяца (date) в текущем часовом поясе."""
+    return timezone.localtime(value).date().replace(day=1)
+
+
+def _increment(key, amount, count=1):
+    return TransactionMonthlyRollup.objects.filter(**key).update(
+        amount=F('amount') + amount,
+        transactions_count=F('transactions_count') + count,
+        updated_at=timezone.now(),
+    )
+
+
+def rollup_key(tx):
+    """Ключ среза транзакции: workspace_id, project_id, category_id, month, type, status, currency."""
+    return {
+        'workspace_id': tx.workspace_id,
+        'project_id': tx.project_id,
+        'category_id': tx.category_id,
+        'month': rollup_month(tx.created_at or timezone.now()),
+        'type': tx.type,
+        'status': tx.status,
+        'currency': tx.currency,
+    }
+
+
+def apply_rollup(tx):
+    """Учесть созданную транзакцию в месячном срезе (вызывается из Transaction.save в atomic)."""
+    apply_rollup_delta(rollup_key(tx), Decimal(str(tx.amount)))
+
+
+def apply_rollup_delta(key, amount, count=1):
+    """Добавить amount и count транзакций к строке среза key (создаёт строку при отсутствии)."""
+    if _increment(key, amount, count):
+        return
+    try:
+        with transaction.atomic():
+            TransactionMonthlyRollup.objects.create(**key, amount=amount, transactions_count=count)
+    except IntegrityError:
+        # Строку среза только что создала параллельная транзакция
+        _increment(key, amount, count)
+
+
+def move_rollup_category(tx, category_id):
+    """
+    Перенести транзакцию tx (с прежней категорией) в срез категории category_id.
+    Вызывать в транзакции БД правки; опустевшая строка прежнего среза удаляется.
+    """
+    if tx.category_id == category_id:
+        return
+    amount = Decimal(str(tx.amount))
+    old_key = rollup_key(tx)
+    apply_rollup_delta(old_key, -amount, -1)
+    TransactionMonthlyRollup.objects.filter(**old_key, transactions_count__lte=0).delete()
+    apply_rollup_delta({**old_key, 'category_id': category_id}, amount)
+
+
+def ledger_rollup_rows(workspace_ids=None):
+    """Срезы, посчитанные по Ledger (TruncMonth + GROUP BY) — для пересборки и сверки."""
+    qs = Transaction.objects.all()
+    if workspace_ids is not None:
+        qs = qs.filter(workspace_id__in=list(workspace_ids))
+    rows = (
+        qs.annotate(month=TruncMonth('created_at'))
+        .values('workspace_id', 'project_id', 'category_id', 'month', 'type', 'status', 'currency')
+        .annotate(amount=Sum('amount'), transactions_count=Count('id'))
+        .order_by()
+    )
+    for row in rows:
+        row['month'] = timezone.localtime(row['month']).date()
+        yield row
+
+
+@transaction.atomic
+def rebuild_rollups(workspace_ids=None):
+    """
+    Пересобрать срезы из Ledger (всё или по воркспейсам). Возвращает число строк среза.
+    DELETE держит блокировку затронутых строк до конца пересборки.
+    """
+    existing = TransactionMonthlyRollup.objects.all()
+    if workspace_ids is not None:
+        existing = existing.filter(workspace_id__in=list(workspace_ids))
+    existing.delete()
+    created = 0
+    batch = []
+    for row in ledger_rollup_rows(workspace_ids):
+        batch.append(TransactionMonthlyRollup(**row))
+        if len(batch) >= BULK_BATCH_SIZE:
+            TransactionMonthlyRollup.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    if batch:
+        TransactionMonthlyRollup.objects.bulk_create(batch)
+        created += len(batch)
+    logger.info('rebuild_rollups: %s rows (workspaces=%s)', created, workspace_ids or 'all')
+    return created
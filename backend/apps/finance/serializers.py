@@ -3,12 +3,14 @@ Serializers for finance app.
 """
 from decimal import Decimal
 
-from django.db.models import Sum
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
 from rest_framework import serializers
 
 from apps.core.models import User, Workspace
 from apps.todo.models import Project, WorkItem
 
+from .fx import converted_amount, par_currencies, rate_exists, workspace_currency
 from .models import BankConnection, Category, Transaction, Wallet
 
 
@@ -144,57 +146,113 @@ class ProjectBudgetSummarySerializer(serializers.Serializer):
     budget_spent = serializers.DecimalField(max_digits=12, decimal_places=2)
     remaining = serializers.DecimalField(max_digits=12, decimal_places=2)
     spent_percent = serializers.FloatField()
+    alert_level = serializers.ChoiceField(choices=Project.BUDGET_ALERT_LEVEL_CHOICES)
     transactions_count = serializers.IntegerField()
     income_total = serializers.DecimalField(max_digits=12, decimal_places=2)
     expense_total = serializers.DecimalField(max_digits=12, decimal_places=2)
     hold_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    currency = serializers.CharField()
+    par_currencies = serializers.ListField(child=serializers.CharField())
     
     @classmethod
     def from_project(cls, project):
         """Создание сводки из проекта."""
-        budget_total = project.budget_total or project.budget or Decimal('0')
-        budget_spent = project.budget_spent or Decimal('0')
-        remaining = budget_total - budget_spent
-        
-        # Процент израсходования
-        if budget_total > 0:
-            spent_percent = float(budget_spent / budget_total * 100)
-        else:
-            spent_percent = 0.0
-        
-        # Агрегация транзакций (модель Transaction: type = deposit/spend/hold/release, без status)
-        from .models import Transaction
-        
-        transactions = Transaction.objects.filter(
-            project=project,
-            status=Transaction.STATUS_COMPLETED,
+        return cls.from_projects([project])[0]
+    
+    @classmethod
+    def _transaction_totals(cls, project_ids, currency):
+        """
+        {project_id: агрегаты} завершённых транзакций одним GROUP BY (project, currency);
+        суммы — в currency по курсу на дату транзакции (booked_at, иначе created_at).
+        """
+        amount = converted_amount(currency, date_field='tx_date')
+        rows = (
+            Transaction.objects.filter(project_id__in=project_ids, status=Transaction.STATUS_COMPLETED)
+            .annotate(tx_date=Coalesce('booked_at', TruncDate('created_at')))
+            .values('project_id', 'currency')
+            .annotate(
+                has_rate=rate_exists(),
+                transactions_count=Count('id'),
+                income_total=Sum(amount, filter=Q(type=Transaction.TYPE_DEPOSIT)),
+                expense_total=Sum(amount, filter=Q(type=Transaction.TYPE_SPEND)),
+                hold_total=Sum(amount, filter=Q(type=Transaction.TYPE_HOLD)),
+            )
+            .order_by()
         )
-        transactions_count = transactions.count()
-        
-        income_total = transactions.filter(
-            type=Transaction.TYPE_DEPOSIT
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
-        
-        expense_total = transactions.filter(
-            type=Transaction.TYPE_SPEND
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
-        
-        hold_total = transactions.filter(
-            type=Transaction.TYPE_HOLD
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+        zero = Decimal('0')
+        totals = {}
+        for row in rows:
+            total = totals.setdefault(row['project_id'], {
+                'transactions_count': 0,
+                'income_total': zero,
+                'expense_total': zero,
+                'hold_total': zero,
+                'unrated': {currency},
+            })
+            total['transactions_count'] += row['transactions_count']
+            for field in ('income_total', 'expense_total', 'hold_total'):
+                total[field] += Decimal(row[field] or zero)
+            if not row['has_rate']:
+                total['unrated'].add(row['currency'])
+        return totals
+    
+    @classmethod
+    def from_projects(cls, projects):
+        """
+        Сводки для списка проектов: агрегаты транзакций одним GROUP BY на базовую валюту
+        workspace (обычно одна на страницу). Суммы — в базовой валюте workspace проекта,
+        par_currencies — валюты без курсов, учтённые по номиналу.
+        Порядок результата совпадает с порядком projects.
+        """
+        projects = list(projects)
+        zero = Decimal('0')
+        cents = Decimal('0.01')
+        currencies = {project.id: workspace_currency(project.workspace) for project in projects}
+        totals = {}
+        for currency in sorted(set(currencies.values())):
+            totals.update(cls._transaction_totals(
+                [project_id for project_id, value in currencies.items() if value == currency], currency,
+            ))
         
-        return {
-            'project_id': project.id,
-            'project_name': project.name,
-            'budget_total': budget_total,
-            'budget_spent': budget_spent,
-            'remaining': remaining,
-            'spent_percent': round(spent_percent, 1),
-            'transactions_count': transactions_count,
-            'income_total': income_total,
-            'expense_total': expense_total,
-            'hold_total': hold_total,
-        }
+        summaries = []
+        for project in projects:
+            budget_total = project.budget_total or project.budget or zero
+            budget_spent = project.budget_spent or zero
+            
+            # Процент израсходования
+            if budget_total > 0:
+                spent_percent = float(budget_spent / budget_total * 100)
+            else:
+                spent_percent = 0.0
+            
+            currency = currencies[project.id]
+            row = totals.get(project.id, {})
+            summaries.append({
+                'project_id': project.id,
+                'project_name': project.name,
+                'budget_total': budget_total,
+                'budget_spent': budget_spent,
+                'remaining': budget_total - budget_spent,
+                'spent_percent': round(spent_percent, 1),
+                'alert_level': cls.budget_alert_level(project, spent_percent),
+                'transactions_count': row.get('transactions_count', 0),
+                'income_total': row.get('income_total', zero).quantize(cents),
+                'expense_total': row.get('expense_total', zero).quantize(cents),
+                'hold_total': row.get('hold_total', zero).quantize(cents),
+                'currency': currency,
+                'par_currencies': par_currencies(row.get('unrated', {currency})),
+            })
+        return summaries
+    
+    @staticmethod
+    def budget_alert_level(project, spent_percent):
+        """Уровень алерта бюджета: 100% — critical, порог проекта (по умолчанию 80%) — warning."""
+        if spent_percent >= Project.BUDGET_ALERT_CRITICAL:
+            return Project.BUDGET_ALERT_CRITICAL
+        threshold = project.budget_alert_threshold or Project.BUDGET_ALERT_WARNING
+        if spent_percent >= threshold:
+            return Project.BUDGET_ALERT_WARNING
+        return Project.BUDGET_ALERT_NONE
 
 
 class DepositRequestSerializer(serializers.Serializer):
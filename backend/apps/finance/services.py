@@ -3,17 +3,26 @@ Services for finance app — Ledger & Holds с защитой от Race Conditio
 
 Double-Entry Logic + Immutability + select_for_update для атомарности.
 """
+import hashlib
 import logging
+import time
 import uuid
 from datetime import timedelta
 from decimal import Decimal
+from functools import partial
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
 from django.db.models import Q, Sum
-from django.db.models.functions import Coalesce, TruncMonth
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from .balances import get_balance, get_balances, lock_balance
+from .fx import ExchangeRateMissing, converted_amount, currency_from_settings, par_currencies, rate_exists
+from .fx import convert as fx_convert
 from .models import Category, Transaction, Wallet
+from .reconciliation import ledger_wallet_balances
 
 logger = logging.getLogger(__name__)
 
@@ -128,7 +137,11 @@ class TransactionService:
             inbound_amount = amount
         else:
             if target_amount is None:
-                raise ValueError('Для мультивалютного перевода требуется target_amount.')
+                # Сумма зачисления — по курсу на сегодня из таблицы ExchangeRate
+                try:
+                    target_amount = fx_convert(amount, source.currency, destination.currency)
+                except ExchangeRateMissing as e:
+                    raise ValueError(f'{e}: укажите target_amount для мультивалютного перевода.')
             inbound_amount = TransactionService._normalize_amount(target_amount)
 
         group_id = uuid.uuid4()
@@ -194,18 +207,7 @@ class TransactionService:
     @transaction.atomic
     def recalculate_wallet_balance(wallet_id):
         wallet = Wallet.objects.select_for_update().get(pk=wallet_id)
-        completed = Transaction.objects.filter(
-            status=Transaction.STATUS_COMPLETED,
-        ).filter(
-            Q(source_wallet=wallet) | Q(destination_wallet=wallet)
-        )
-        outgoing = completed.filter(source_wallet=wallet).aggregate(
-            total=Coalesce(Sum('amount'), Decimal('0'))
-        )['total']
-        incoming = completed.filter(destination_wallet=wallet).aggregate(
-            total=Coalesce(Sum('amount'), Decimal('0'))
-        )['total']
-        wallet.balance = incoming - outgoing
+        wallet.balance = ledger_wallet_balances([wallet.pk])[wallet.pk]
         wallet.save(update_fields=['balance', 'updated_at'])
         return wallet.balance
 
@@ -216,7 +218,7 @@ class FinanceService:
     @staticmethod
     def get_project_balance(project_id):
         """
-        Получение баланса проекта с агрегацией по типам транзакций.
+        Получение баланса проекта (строка ProjectBalance, ведётся при создании транзакций).
         
         Формула:
         available = deposited - spent - (held - released)
@@ -232,44 +234,12 @@ class FinanceService:
                 'available': Decimal      # доступно для использования
             }
         """
-        transactions = Transaction.objects.filter(
-            project_id=project_id,
-            status=Transaction.STATUS_COMPLETED,
-        )
-        
-        aggregated = transactions.aggregate(
-            deposited=Coalesce(
-                Sum('amount', filter=Q(type=Transaction.TYPE_DEPOSIT)),
-                Decimal('0')
-            ),
-            spent=Coalesce(
-                Sum('amount', filter=Q(type=Transaction.TYPE_SPEND)),
-                Decimal('0')
-            ),
-            held=Coalesce(
-                Sum('amount', filter=Q(type=Transaction.TYPE_HOLD)),
-                Decimal('0')
-            ),
-            released=Coalesce(
-                Sum('amount', filter=Q(type=Transaction.TYPE_RELEASE)),
-                Decimal('0')
-            )
-        )
-        
-        deposited = aggregated['deposited']
-        spent = aggregated['spent']
-        held = aggregated['held']
-        released = aggregated['released']
-        
-        on_hold = held - released
-        available = deposited - spent - on_hold
-        
-        return {
-            'total_budget': deposited,
-            'spent': spent,
-            'on_hold': on_hold,
-            'available': available,
-        }
+        return get_balance(project_id)
+    
+    @staticmethod
+    def get_project_balances(project_ids):
+        """Балансы нескольких проектов одним запросом: {project_id: dict как у get_project_balance}."""
+        return get_balances(project_ids)
     
     @staticmethod
     @transaction.atomic
@@ -277,7 +247,8 @@ class FinanceService:
         """
         Создание HOLD (заморозка средств под задачу).
         
-        CRITICAL: Использует select_for_update для защиты от race conditions.
+        CRITICAL: блокирует строку баланса проекта (lock_balance) — holds/commits проекта
+        сериализуются между собой, но не с правками самого Project.
         
         Args:
             project: экземпляр Project
@@ -292,24 +263,20 @@ class FinanceService:
         Raises:
             InsufficientFundsError: если недостаточно средств
         """
-        from apps.todo.models import Project
-        
-        # CRITICAL: Блокировка проекта для предотвращения гонки
-        locked_project = Project.objects.select_for_update().get(pk=project.id)
+        # CRITICAL: Блокировка строки баланса для предотвращения гонки
+        balance = lock_balance(project.id)
         
         # Проверка баланса внутри транзакции
-        balance = FinanceService.get_project_balance(locked_project.id)
-        
-        if balance['available'] < amount:
+        if balance.available < amount:
             raise InsufficientFundsError(
-                f"Недостаточно средств. Доступно: {balance['available']}, "
+                f"Недостаточно средств. Доступно: {balance.available}, "
                 f"запрошено: {amount}"
             )
         
         # Создание транзакции HOLD
         hold_transaction = Transaction.objects.create(
-            project=locked_project,
-            workspace=locked_project.workspace,
+            project=project,
+            workspace_id=project.workspace_id,
             type=Transaction.TYPE_HOLD,
             amount=amount,
             related_workitem=workitem,
@@ -319,7 +286,7 @@ class FinanceService:
         
         logger.info(
             f"Created HOLD #{hold_transaction.id}: {amount} "
-            f"for workitem #{workitem.id} in project #{locked_project.id}"
+            f"for workitem #{workitem.id} in project #{project.id}"
         )
         
         return hold_transaction
@@ -347,7 +314,7 @@ class FinanceService:
         
         related_timelog: для идемпотентности биллинга (Task 3.1).
         
-        CRITICAL: Использует select_for_update для защиты от race conditions.
+        CRITICAL: блокирует строку баланса проекта (lock_balance), а не строку Project.
         
         Args:
             workitem: экземпляр WorkItem
@@ -360,12 +327,10 @@ class FinanceService:
         Returns:
             tuple: (release_transaction, spend_transaction) или (spend_transaction,)
         """
-        from apps.todo.models import Project
-        
-        # CRITICAL: Блокировка проекта
-        locked_project = Project.objects.select_for_update().get(
-            pk=workitem.project_id
-        )
+        project = workitem.project
+
+        # CRITICAL: Блокировка строки баланса проекта
+        balance = lock_balance(project.id)
         
         # Находим все HOLD по этой задаче
         holds = Transaction.objects.filter(
@@ -389,8 +354,8 @@ class FinanceService:
         # 1. RELEASE: возвращаем замороженные средства
         if hold_amount > 0:
             release_transaction = Transaction.objects.create(
-                project=locked_project,
-                workspace=locked_project.workspace,
+                project=project,
+                workspace_id=project.workspace_id,
                 type=Transaction.TYPE_RELEASE,
                 amount=hold_amount,
                 related_workitem=workitem,
@@ -406,17 +371,17 @@ class FinanceService:
         # 2. SPEND: списываем фактическую сумму
         # Проверка баланса (если не разрешён овердрафт)
         if not allow_overdraft:
-            balance = FinanceService.get_project_balance(locked_project.id)
-            # После RELEASE баланс обновился, проверяем available
-            if balance['available'] < actual_amount:
+            # Строка заблокирована нами: после RELEASE available больше на hold_amount
+            available = balance.available + hold_amount
+            if available < actual_amount:
                 raise InsufficientFundsError(
                     f"Недостаточно средств для SPEND. "
-                    f"Доступно: {balance['available']}, запрошено: {actual_amount}"
+                    f"Доступно: {available}, запрошено: {actual_amount}"
                 )
         
         spend_transaction = Transaction.objects.create(
-            project=locked_project,
-            workspace=locked_project.workspace,
+            project=project,
+            workspace_id=project.workspace_id,
             type=Transaction.TYPE_SPEND,
             amount=actual_amount,
             related_workitem=workitem,
@@ -437,23 +402,60 @@ class FinanceStatsService:
     """
     Сервис агрегированной финансовой аналитики для дашборда.
     Scope: только проекты, доступные пользователю (через WorkspaceMember).
+
+    Сводка считается одним GROUP BY (project, type) по месячным срезам Ledger
+    (TransactionMonthlyRollup) с условными суммами по месяцам и кэшируется на пользователя.
+    Суммы пересчитываются в валюту отчёта в том же запросе (apps.finance.fx.converted_amount).
+    Ключ кэша включает версии воркспейсов пользователя и курсов; новая транзакция проекта
+    увеличивает версию своего воркспейса, изменение курсов — версию курсов (invalidate_cache).
     """
 
+    CACHE_TTL_SEC = 300
+    HISTORY_MONTHS = 6
+    CASH_GAP_MONTHS = 3
+    GLOBAL_SCOPE = 'all'
+    RATES_SCOPE = 'fx'
+
     @staticmethod
-    def _get_user_project_ids(user):
-        """ID проектов воркспейсов, в которых состоит пользователь."""
-        from apps.todo.models import Project
+    def _get_user_workspace_ids(user):
         from apps.core.models import WorkspaceMember
 
-        workspace_ids = list(
+        return sorted(
             WorkspaceMember.objects.filter(user=user).values_list(
                 'workspace_id', flat=True
             )
         )
+
+    @staticmethod
+    def _get_user_workspace_currencies(user):
+        """{workspace_id: базовая валюта} воркспейсов пользователя одним запросом."""
+        from apps.core.models import WorkspaceMember
+
+        rows = WorkspaceMember.objects.filter(user=user).values_list('workspace_id', 'workspace__settings')
+        return {workspace_id: currency_from_settings(ws_settings) for workspace_id, ws_settings in rows}
+
+    @staticmethod
+    def report_currency(currencies):
+        """Валюта сводки: общая базовая валюта воркспейсов, при разных — FINANCE_BASE_CURRENCY."""
+        currencies = set(currencies)
+        if len(currencies) == 1:
+            return currencies.pop()
+        return currency_from_settings(None)
+
+    @staticmethod
+    def _sees_all_projects(user):
+        # Суперпользователь и staff видят все проекты
+        return bool(getattr(user, 'is_superuser', False) or getattr(user, 'is_staff', False))
+
+    @classmethod
+    def _get_user_project_ids(cls, user):
+        """ID проектов воркспейсов, в которых состоит пользователь."""
+        from apps.todo.models import Project
+
+        workspace_ids = cls._get_user_workspace_ids(user)
         if not workspace_ids:
             return []
-        # Суперпользователь и staff видят все проекты
-        if getattr(user, 'is_superuser', False) or getattr(user, 'is_staff', False):
+        if cls._sees_all_projects(user):
             return list(Project.objects.values_list('id', flat=True))
         return list(
             Project.objects.filter(
@@ -461,151 +463,189 @@ class FinanceStatsService:
             ).values_list('id', flat=True)
         )
 
+    @staticmethod
+    def _version_key(scope):
+        return f'finance:analytics:version:{scope}'
+
     @classmethod
-    def get_analytics_summary(cls, user):
+    def _versions(cls, scopes):
+        """Версии кэша по воркспейсам; отсутствующая версия заводится текущим временем (мс)."""
+        keys = [cls._version_key(scope) for scope in scopes]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, int(time.time() * 1000), None)
+                versions[key] = cache.get(key)
+        return [versions[key] for key in keys]
+
+    @classmethod
+    def _cache_key(cls, user, workspace_ids, currency):
+        scopes = list(workspace_ids) + [cls.RATES_SCOPE]
+        if cls._sees_all_projects(user):
+            scopes.append(cls.GLOBAL_SCOPE)
+        versions = '.'.join(str(version) for version in cls._versions(scopes))
+        digest = hashlib.md5(versions.encode()).hexdigest()
+        return f'finance:analytics:summary:user:{user.id}:{currency}:{digest}'
+
+    @classmethod
+    def invalidate_cache(cls, workspace_id=None, rates=False):
+        """
+        Сбросить сводки всех пользователей воркспейса (и staff-сводки по всем проектам);
+        rates=True — сводки всех пользователей (изменились курсы валют).
+        """
+        scopes = [cls.GLOBAL_SCOPE] + ([workspace_id] if workspace_id else []) + ([cls.RATES_SCOPE] if rates else [])
+        for scope in scopes:
+            key = cls._version_key(scope)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, int(time.time() * 1000), None)
+            except Exception as e:
+                logger.warning('Finance analytics cache invalidation failed scope=%s: %s', scope, e)
+
+    @classmethod
+    def _month_windows(cls, now):
+        """Последние HISTORY_MONTHS календарных месяцев (старые сначала): [(YYYY-MM, первое число)]."""
+        current = timezone.localtime(now).date().replace(day=1)
+        months = [current]
+        for _ in range(cls.HISTORY_MONTHS - 1):
+            months.append((months[-1] - timedelta(days=1)).replace(day=1))
+        months.reverse()
+        return [(month.strftime('%Y-%m'), month) for month in months]
+
+    @classmethod
+    def get_analytics_summary(cls, user, use_cache=True, currency=None):
         """
         Сводка для Finance Dashboard: cash_flow_history, expenses_by_project,
         total_balance, has_cash_gap, current_month_expense.
 
+        Суммы — в currency (по умолчанию базовая валюта воркспейсов пользователя)
+        по курсу на первое число месяца среза.
+
         Returns:
             dict: cash_flow_history, expenses_by_project, total_balance,
-                  has_cash_gap, current_month_expense (опционально)
+                  has_cash_gap, current_month_expense (опционально), currency,
+                  par_currencies (валюты без курсов, учтённые по номиналу)
         """
-        from .models import Transaction
+        from .models import Transaction, TransactionMonthlyRollup
 
-        project_ids = cls._get_user_project_ids(user)
-        if not project_ids:
+        workspace_currencies = cls._get_user_workspace_currencies(user)
+        currency = (currency or cls.report_currency(workspace_currencies.values())).upper()
+        workspace_ids = sorted(workspace_currencies)
+        if not workspace_ids:
             return {
                 'cash_flow_history': [],
                 'expenses_by_project': [],
                 'total_balance': '0.00',
                 'has_cash_gap': False,
                 'current_month_expense': '0.00',
+                'currency': currency,
+                'par_currencies': par_currencies([currency]),
             }
 
-        now = timezone.now()
-        six_months_ago = now - timedelta(days=180)
+        cache_key = cls._cache_key(user, workspace_ids, currency) if use_cache else None
+        if cache_key:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        windows = cls._month_windows(timezone.now())
 
-        qs = Transaction.objects.filter(
-            project_id__in=project_ids,
-            created_at__gte=six_months_ago,
-            created_at__lte=now,
+        qs = TransactionMonthlyRollup.objects.filter(
             status=Transaction.STATUS_COMPLETED,
+            type__in=[
+                Transaction.TYPE_DEPOSIT,
+                Transaction.TYPE_SPEND,
+                Transaction.TYPE_HOLD,
+                Transaction.TYPE_RELEASE,
+            ],
         )
+        if cls._sees_all_projects(user):
+            qs = qs.filter(project__isnull=False)
+        else:
+            qs = qs.filter(project__workspace_id__in=workspace_ids)
 
-        # cash_flow_history: последние 6 календарных месяцев, income=deposit, expense=spend
-        by_month = (
-            qs.annotate(month=TruncMonth('created_at'))
-            .values('month')
-            .annotate(
-                income=Coalesce(
-                    Sum('amount', filter=Q(type=Transaction.TYPE_DEPOSIT)),
-                    Decimal('0'),
-                ),
-                expense=Coalesce(
-                    Sum('amount', filter=Q(type=Transaction.TYPE_SPEND)),
-                    Decimal('0'),
-                ),
-            )
-            .order_by('month')
+        # Один проход по срезам: итог за всё время и суммы по календарным месяцам в валюте отчёта
+        amount = converted_amount(currency)
+        month_sums = {
+            f'month_{index}': Sum(amount, filter=Q(month=month))
+            for index, (_key, month) in enumerate(windows)
+        }
+        # currency и has_rate в группировке — валюты, пересчитанные по номиналу, тем же запросом
+        rows = (
+            qs.values('project_id', 'project__name', 'type', 'currency')
+            .annotate(has_rate=rate_exists(), total=Sum(amount), **month_sums)
+            .order_by()
         )
-        by_month_map = {}
-        for row in by_month:
-            m = row['month']
-            if m:
-                key = m.strftime('%Y-%m')
-                by_month_map[key] = {
-                    'month': key,
-                    'income': str(row['income']),
-                    'expense': str(row['expense']),
-                }
-
-        # Последние 6 календарных месяцев (старые сначала)
-        y, m = now.year, now.month
-        month_keys = []
-        for _ in range(6):
-            month_keys.append(f'{y}-{m:02d}')
-            m -= 1
-            if m == 0:
-                m, y = 12, y - 1
-        month_keys.reverse()
-        cash_flow_history = [
-            by_month_map.get(
-                mk,
-                {'month': mk, 'income': '0.00', 'expense': '0.00'},
-            )
-            for mk in month_keys
-        ]
 
-        # expenses_by_project: сумма SPEND по project__name
-        expenses_by_project = (
-            Transaction.objects.filter(
-                project_id__in=project_ids,
-                type=Transaction.TYPE_SPEND,
-                status=Transaction.STATUS_COMPLETED,
-            )
-            .values('project__name', 'project_id')
-            .annotate(amount=Coalesce(Sum('amount'), Decimal('0')))
-            .order_by('-amount')
-        )
-        expenses_by_project = [
+        zero = Decimal('0')
+        signs = {
+            Transaction.TYPE_DEPOSIT: 1,
+            Transaction.TYPE_SPEND: -1,
+            Transaction.TYPE_HOLD: -1,
+            Transaction.TYPE_RELEASE: 1,
+        }
+        total_available = zero
+        monthly = {
+            Transaction.TYPE_DEPOSIT: [zero] * len(windows),
+            Transaction.TYPE_SPEND: [zero] * len(windows),
+        }
+        expenses = {}
+        unrated = {currency}
+        for row in rows:
+            if not row['has_rate']:
+                unrated.add(row['currency'])
+            tx_type = row['type']
+            total = Decimal(row['total'] or zero)
+            # available = deposited - spent - (held - released)
+            total_available += signs[tx_type] * total
+            if tx_type not in monthly:
+                continue
+            for index in range(len(windows)):
+                monthly[tx_type][index] += Decimal(row[f'month_{index}'] or zero)
+            if tx_type == Transaction.TYPE_SPEND:
+                expense = expenses.setdefault(row['project_id'], {
+                    'project_id': row['project_id'],
+                    'project_name': row['project__name'] or '—',
+                    'amount': zero,
+                })
+                expense['amount'] += total
+
+        cents = Decimal('0.01')
+        # cash_flow_history: последние 6 календарных месяцев, income=deposit, expense=spend
+        cash_flow_history = [
             {
-                'project_id': r['project_id'],
-                'project_name': r['project__name'] or '—',
-                'amount': str(r['amount']),
+                'month': key,
+                'income': str(monthly[Transaction.TYPE_DEPOSIT][index].quantize(cents)),
+                'expense': str(monthly[Transaction.TYPE_SPEND][index].quantize(cents)),
             }
-            for r in expenses_by_project
+            for index, (key, _month) in enumerate(windows)
         ]
+        # expenses_by_project: сумма SPEND по проекту
+        expenses = sorted(expenses.values(), key=lambda item: item['amount'], reverse=True)
+        expenses_by_project = [{**item, 'amount': str(item['amount'].quantize(cents))} for item in expenses]
 
-        # total_balance: сумма available по всем проектам пользователя
-        total_available = Decimal('0')
-        for pid in project_ids:
-            bal = FinanceService.get_project_balance(pid)
-            total_available += bal['available']
-
-        # has_cash_gap: расходы за последние 3 месяца > доходов И баланс < 0
-        three_months_ago = now - timedelta(days=90)
-        three_qs = Transaction.objects.filter(
-            project_id__in=project_ids,
-            created_at__gte=three_months_ago,
-            created_at__lte=now,
-            status=Transaction.STATUS_COMPLETED,
-        )
-        three_agg = three_qs.aggregate(
-            income=Coalesce(
-                Sum('amount', filter=Q(type=Transaction.TYPE_DEPOSIT)),
-                Decimal('0'),
-            ),
-            expense=Coalesce(
-                Sum('amount', filter=Q(type=Transaction.TYPE_SPEND)),
-                Decimal('0'),
-            ),
-        )
+        # has_cash_gap: расходы за последние 3 календарных месяца > доходов И баланс < 0
+        recent = slice(-cls.CASH_GAP_MONTHS, None)
         has_cash_gap = (
-            three_agg['expense'] > three_agg['income']
+            sum(monthly[Transaction.TYPE_SPEND][recent], zero) > sum(monthly[Transaction.TYPE_DEPOSIT][recent], zero)
             and total_available < 0
         )
 
-        # Расход за текущий месяц
-        current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        current_month_expense = (
-            Transaction.objects.filter(
-                project_id__in=project_ids,
-                type=Transaction.TYPE_SPEND,
-                status=Transaction.STATUS_COMPLETED,
-                created_at__gte=current_month_start,
-                created_at__lte=now,
-            ).aggregate(total=Coalesce(Sum('amount'), Decimal('0')))['total']
-            or Decimal('0')
-        )
-
-        return {
+        summary = {
             'cash_flow_history': cash_flow_history,
             'expenses_by_project': expenses_by_project,
-            'total_balance': str(total_available),
+            'total_balance': str(total_available.quantize(cents)),
             'has_cash_gap': has_cash_gap,
-            'current_month_expense': str(current_month_expense),
+            # Расход за текущий месяц — последнее месячное окно
+            'current_month_expense': str(monthly[Transaction.TYPE_SPEND][-1].quantize(cents)),
+            'currency': currency,
+            # Валюты без курсов: их суммы учтены по номиналу
+            'par_currencies': par_currencies(unrated),
         }
+        if cache_key:
+            cache.set(cache_key, summary, cls.CACHE_TTL_SEC)
+        return summary
 
 
 # === Старая логика для совместимости (можно удалить после миграции) ===
@@ -613,7 +653,7 @@ class FinanceStatsService:
 
 def recalc_project_budget(project):
     """
-    Пересчёт budget_spent для проекта.
+    Пересчёт budget_spent для проекта (синхронно; из сигналов — через mark_project_budget_dirty).
 
     Формула:
     budget_spent = SUM(WorkItem.cost) + SUM(Transaction.amount WHERE type IN (expense, hold) AND status=completed)
@@ -646,11 +686,63 @@ def recalc_project_budget(project):
     _check_budget_alert(project)
 
 
+DEFAULT_BUDGET_RECALC_DEBOUNCE_SECONDS = 10
+
+
+def budget_recalc_debounce():
+    return getattr(settings, 'FINANCE_BUDGET_RECALC_DEBOUNCE_SECONDS', DEFAULT_BUDGET_RECALC_DEBOUNCE_SECONDS)
+
+
+def budget_recalc_pending_key(project_id):
+    return f'finance:budget_recalc_pending:{project_id}'
+
+
+def mark_project_budget_dirty(project_id):
+    """
+    Отметить проект «грязным»: budget_spent пересчитается один раз после коммита
+    и окна FINANCE_BUDGET_RECALC_DEBOUNCE_SECONDS, сколько бы задач ни изменилось.
+    """
+    if project_id:
+        transaction.on_commit(partial(_schedule_budget_recalc, project_id))
+
+
+def _schedule_budget_recalc(project_id):
+    """После коммита: поставить пересчёт, если для проекта он ещё не запланирован (cache.add)."""
+    from .tasks import recalc_project_budget_task
+
+    window = budget_recalc_debounce()
+    key = budget_recalc_pending_key(project_id)
+    try:
+        if not cache.add(key, 1, timeout=window + 60):
+            return
+    except Exception as e:
+        logger.warning('Budget recalc debounce cache failed project_id=%s: %s', project_id, e)
+    try:
+        recalc_project_budget_task.apply_async(args=[project_id], countdown=window)
+    except Exception as e:
+        logger.warning('Budget recalc schedule failed project_id=%s: %s', project_id, e)
+        cache.delete(key)
+
+
+def _budget_alert_level(project, spent_percent):
+    from apps.todo.models import Project
+
+    threshold = getattr(project, 'budget_alert_threshold', 80) or 80
+    if spent_percent >= Project.BUDGET_ALERT_CRITICAL:
+        return Project.BUDGET_ALERT_CRITICAL
+    if spent_percent >= threshold:
+        return Project.BUDGET_ALERT_WARNING
+    return Project.BUDGET_ALERT_NONE
+
+
 def _check_budget_alert(project):
     """
     Проверка превышения порога бюджета.
-    При превышении: создаём Notification для админов или выводим WARNING в консоль.
+    Уведомление админам — один раз на переход уровня (порог, затем 100%):
+    уровень фиксируется в Project.last_budget_alert_level условным UPDATE.
     """
+    from apps.todo.models import Project
+
     budget_total = project.budget_total or project.budget
     if not budget_total or budget_total == 0:
         return
@@ -660,34 +752,39 @@ def _check_budget_alert(project):
     except (TypeError, ZeroDivisionError):
         return
 
-    threshold = getattr(project, 'budget_alert_threshold', 80) or 80
-
-    if spent_percent < threshold:
+    level = _budget_alert_level(project, spent_percent)
+    if level == Project.BUDGET_ALERT_NONE:
+        return
+    # При параллельных пересчётах переход уровня «выигрывает» только один
+    crossed = Project.objects.filter(
+        pk=project.pk, last_budget_alert_level__lt=level
+    ).update(last_budget_alert_level=level)
+    if not crossed:
         return
+    project.last_budget_alert_level = level
 
     try:
         from apps.core.models import WorkspaceMember
+        from apps.notifications.inbox import notify_users
         from apps.notifications.models import Notification
 
-        notif_type = Notification.TYPE_BUDGET_ALERT
-
-        admins = WorkspaceMember.objects.filter(
+        admin_ids = WorkspaceMember.objects.filter(
             workspace=project.workspace,
             role__in=[WorkspaceMember.ROLE_OWNER, WorkspaceMember.ROLE_ADMIN]
-        ).select_related('user')
+        ).values_list('user_id', flat=True)
 
         message = f"⚠️ Бюджет проекта '{project.name}' израсходован на {spent_percent:.0f}%"
 
-        for membership in admins:
-            Notification.objects.create(
-                type=notif_type,
-                message=message,
-                user=membership.user,
-            )
+        notify_users(
+            admin_ids,
+            Notification.TYPE_BUDGET_ALERT,
+            message,
+            dedupe_key=f'budget_alert:project:{project.id}:{level}',
+        )
     except Exception as e:
         logger.warning('Budget alert notification failed: %s', e)
 
     logger.warning(
-        "WARNING: Budget Exceeded - Project '%s' (id=%s): spent %.1f%% (threshold %s%%)",
-        project.name, project.id, spent_percent, threshold
+        "WARNING: Budget Exceeded - Project '%s' (id=%s): spent %.1f%% (level %s)",
+        project.name, project.id, spent_percent, level
     )
@@ -8,7 +8,7 @@ import logging
 from decimal import Decimal
 
 from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 logger = logging.getLogger(__name__)
@@ -115,3 +115,32 @@ def _get_hourly_rate(timelog_instance):
             f"Error getting hourly_rate for TimeLog #{timelog_instance.id}: {e}"
         )
         return Decimal('0')
+
+
+@receiver(post_save, sender='finance.ExchangeRate')
+@receiver(post_delete, sender='finance.ExchangeRate')
+def exchange_rate_changed(sender, instance, **kwargs):
+    """Ручная правка курса: сбросить кэш курсов процесса и сводки аналитики."""
+    from apps.finance.fx import rates_changed
+
+    rates_changed()
+
+
+@receiver(post_save, sender='billing.Invoice')
+@receiver(post_delete, sender='billing.Invoice')
+def invoice_changed(sender, instance, **kwargs):
+    """Счета — поступления прогноза cash-flow: сбросить кэш аналитики workspace."""
+    from apps.finance.services import FinanceStatsService
+
+    workspace_id = getattr(instance.project, 'workspace_id', None) if instance.project_id else None
+    FinanceStatsService.invalidate_cache(workspace_id)
+
+
+@receiver(post_save, sender='hr.EmployeeProfile')
+@receiver(post_delete, sender='hr.EmployeeProfile')
+def employee_profile_changed(sender, instance, **kwargs):
+    """Зарплаты — расходы прогноза cash-flow: сбросить кэш аналитики workspace."""
+    from apps.finance.services import FinanceStatsService
+
+    workspace_id = getattr(instance.member, 'workspace_id', None) if instance.member_id else None
+    FinanceStatsService.invalidate_cache(workspace_id)
@@ -0,0 +1,378 @@
+"""
+Импорт банковских выписок в Ledger (BankConnection -> Transaction).
+
+Парсеры читают файл потоково и отдают строки выписки по одной:
+- CSV (UTF-8 или cp1251; разделитель , ; или табуляция; колонки id, date, amount, description
+  и русские аналоги; amount со знаком: плюс — поступление, минус — списание);
+- OFX 2.x (XML, элементы STMTTRN);
+- CAMT.053 (ISO 20022, элементы Ntry).
+
+import_statement() обрабатывает строки пачками: один SELECT уже импортированных external_id
+и один INSERT (executemany подготовленного запроса, без сборки модели на строку) на пачку. Кошелёк блокируется один раз на весь импорт; его баланс, баланс
+проекта (ProjectBalance) и месячные срезы меняются одним суммарным изменением в конце —
+пакетная вставка не вызывает Transaction.save. Импорт атомарен: ошибка в любой строке откатывает файл.
+"""
+import codecs
+import csv
+import hashlib
+import io
+import logging
+import os
+from collections import Counter, defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .balances import BALANCE_FIELDS, apply_deltas
+from .models import Transaction, Wallet
+from .rollups import apply_rollup_delta, rollup_month
+
+logger = logging.getLogger(__name__)
+
+FORMAT_CSV = 'csv'
+FORMAT_OFX = 'ofx'
+FORMAT_CAMT = 'camt'
+FORMATS = (FORMAT_CSV, FORMAT_OFX, FORMAT_CAMT)
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# Колонки пакетной вставки; остальные поля Transaction nullable и остаются NULL
+INSERT_FIELDS = (
+    'type', 'status', 'amount', 'currency', 'description', 'source_wallet', 'destination_wallet',
+    'project', 'workspace', 'category', 'created_by', 'created_at', 'bank_connection',
+    'external_id', 'booked_at',
+)
+
+CSV_COLUMNS = {
+    'external_id': ('external_id', 'id', 'transaction_id', 'fitid', 'номер операции', 'номер', 'id операции'),
+    'date': ('date', 'booked_at', 'booking_date', 'дата', 'дата операции', 'дата проводки'),
+    'amount': ('amount', 'сумма', 'сумма операции'),
+    'description': ('description', 'memo', 'purpose', 'назначение платежа', 'назначение', 'описание'),
+    'currency': ('currency', 'валюта'),
+}
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%Y%m%d')
+# Кодировка CSV определяется по началу файла: UTF-8 (с BOM или без), иначе cp1251
+CSV_FALLBACK_ENCODING = 'cp1251'
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+class StatementParseError(ValueError):
+    """Файл выписки не разобран (номер строки — в сообщении)."""
+
+
+def detect_format(filename):
+    """Формат по расширению файла: .csv/.txt -> csv, .ofx/.qfx -> ofx, .xml -> camt."""
+    ext = os.path.splitext(filename or '')[1].lower()
+    return {
+        '.csv': FORMAT_CSV,
+        '.txt': FORMAT_CSV,
+        '.ofx': FORMAT_OFX,
+        '.qfx': FORMAT_OFX,
+        '.xml': FORMAT_CAMT,
+    }.get(ext)
+
+
+def parse_amount(value, line):
+    raw = (value or '').strip().replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        return Decimal(raw)
+    except InvalidOperation:
+        raise StatementParseError(f'Строка {line}: некорректная сумма «{value}»')
+
+
+def parse_date(value, line):
+    raw = (value or '').strip()
+    if len(raw) > 10 and raw[4] == '-':
+        # ISO datetime: 2024-01-31T10:00:00+03:00
+        raw = raw[:10]
+    elif raw[:8].isdigit():
+        # OFX: YYYYMMDDHHMMSS[.XXX][TZ]
+        raw = raw[:8]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt).date()
+        except ValueError:
+            continue
+    raise StatementParseError(f'Строка {line}: некорректная дата «{value}»')
+
+
+def _statement_line(line, external_id, booked_at, amount, description, currency=None):
+    return {
+        'line': line,
+        'external_id': (external_id or '').strip()[:128] or None,
+        'booked_at': booked_at,
+        'amount': amount,
+        'description': (description or '').strip(),
+        'currency': (currency or '').strip().upper() or None,
+    }
+
+
+def detect_csv_encoding(fileobj):
+    """utf-8-sig, если начало файла — корректный UTF-8, иначе cp1251 (выгрузки банков РФ)."""
+    if not fileobj.seekable():
+        return 'utf-8-sig'
+    start = fileobj.tell()
+    sample = fileobj.read(ENCODING_SAMPLE_SIZE)
+    fileobj.seek(start)
+    try:
+        # final=False: обрезанный на границе выборки многобайтовый символ — не ошибка
+        codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return CSV_FALLBACK_ENCODING
+    return 'utf-8-sig'
+
+
+def iter_csv(fileobj):
+    """Строки CSV-выписки; первая строка — заголовок (имена колонок — CSV_COLUMNS)."""
+    if isinstance(fileobj, io.TextIOBase):
+        stream = fileobj
+    else:
+        stream = io.TextIOWrapper(fileobj, encoding=detect_csv_encoding(fileobj), newline='')
+    line = 0
+    try:
+        header_line = stream.readline()
+        if not header_line.strip():
+            return
+        line = 1
+        try:
+            dialect = csv.Sniffer().sniff(header_line, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        names = [name.strip().lstrip('\ufeff').lower() for name in next(csv.reader([header_line], dialect))]
+        columns = {
+            field: next((names.index(alias) for alias in aliases if alias in names), None)
+            for field, aliases in CSV_COLUMNS.items()
+        }
+        for field in ('date', 'amount'):
+            if columns[field] is None:
+                raise StatementParseError(f'В заголовке CSV нет колонки {field}')
+
+        def cell(row, field):
+            index = columns[field]
+            return row[index] if index is not None and index < len(row) else ''
+
+        for line, row in enumerate(csv.reader(stream, dialect), start=2):
+            if not any(value.strip() for value in row):
+                continue
+            yield _statement_line(
+                line,
+                cell(row, 'external_id'),
+                parse_date(cell(row, 'date'), line),
+                parse_amount(cell(row, 'amount'), line),
+                cell(row, 'description'),
+                cell(row, 'currency'),
+            )
+    except UnicodeDecodeError:
+        raise StatementParseError(f'Строка {line + 1}: неподдерживаемая кодировка CSV (ожидается UTF-8 или cp1251)')
+    except csv.Error as e:
+        raise StatementParseError(f'Строка {line + 1}: некорректный CSV ({e})')
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(elem, *path):
+    """Текст первого потомка по пути из локальных имён тегов (без учёта namespace)."""
+    nodes = [elem]
+    for name in path:
+        nodes = [child for node in nodes for child in node if _local(child.tag) == name]
+        if not nodes:
+            return None
+    return nodes[0].text
+
+
+def _iter_xml(fileobj, entry_tag):
+    """Потоковый разбор: элементы entry_tag по мере чтения, обработанные очищаются."""
+    try:
+        for _event, elem in iterparse(fileobj, events=('end',)):
+            if _local(elem.tag) == entry_tag:
+                yield elem
+                elem.clear()
+    except ParseError as e:
+        raise StatementParseError(f'Некорректный XML: {e}')
+
+
+def iter_ofx(fileobj):
+    """Строки OFX 2.x (XML): STMTTRN с FITID, DTPOSTED, TRNAMT, NAME/MEMO."""
+    for index, elem in enumerate(_iter_xml(fileobj, 'STMTTRN'), start=1):
+        yield _statement_line(
+            index,
+            _child_text(elem, 'FITID'),
+            parse_date(_child_text(elem, 'DTPOSTED'), index),
+            parse_amount(_child_text(elem, 'TRNAMT'), index),
+            ' '.join(filter(None, (_child_text(elem, 'NAME'), _child_text(elem, 'MEMO')))),
+        )
+
+
+def iter_camt(fileobj):
+    """Строки CAMT.053: Ntry с Amt (Ccy), CdtDbtInd, BookgDt, AcctSvcrRef/NtryRef."""
+    for index, elem in enumerate(_iter_xml(fileobj, 'Ntry'), start=1):
+        amount_elem = next((child for child in elem if _local(child.tag) == 'Amt'), None)
+        if amount_elem is None:
+            raise StatementParseError(f'Запись {index}: нет суммы (Amt)')
+        amount = parse_amount(amount_elem.text, index)
+        if _child_text(elem, 'CdtDbtInd') == 'DBIT':
+            amount = -amount
+        booked = _child_text(elem, 'BookgDt', 'Dt') or _child_text(elem, 'BookgDt', 'DtTm')
+        yield _statement_line(
+            index,
+            _child_text(elem, 'AcctSvcrRef') or _child_text(elem, 'NtryRef')
+            or _child_text(elem, 'NtryDtls', 'TxDtls', 'Refs', 'EndToEndId'),
+            parse_date(booked, index),
+            amount,
+            _child_text(elem, 'AddtlNtryInf')
+            or _child_text(elem, 'NtryDtls', 'TxDtls', 'RmtInf', 'Ustrd'),
+            amount_elem.get('Ccy'),
+        )
+
+
+PARSERS = {FORMAT_CSV: iter_csv, FORMAT_OFX: iter_ofx, FORMAT_CAMT: iter_camt}
+
+
+def _with_external_ids(lines):
+    """
+    Строкам без идентификатора банка — детерминированный id из даты, суммы, описания
+    и номера повтора в файле: повторный импорт того же файла их не задваивает.
+    """
+    repeats = Counter()
+    for item in lines:
+        if not item['external_id']:
+            raw = f"{item['booked_at']:%Y-%m-%d}|{item['amount']}|{item['description']}"
+            repeats[raw] += 1
+            digest = hashlib.sha1(f'{raw}|{repeats[raw]}'.encode('utf-8')).hexdigest()
+            item['external_id'] = f'sha1:{digest}'
+        yield item
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_sql(db):
+    quote = db.ops.quote_name
+    columns = ', '.join(quote(Transaction._meta.get_field(name).column) for name in INSERT_FIELDS)
+    placeholders = ', '.join(['%s'] * len(INSERT_FIELDS))
+    return f'INSERT INTO {quote(Transaction._meta.db_table)} ({columns}) VALUES ({placeholders})'
+
+
+@transaction.atomic
+def import_statement(connection, fileobj, fmt, created_by, project=None, category=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Импортировать выписку в кошелёк подключения (connection.linked_wallet).
+
+    Положительная сумма — deposit на кошелёк, отрицательная — spend с него; нулевые строки
+    пропускаются. Уже импортированные (bank_connection, external_id) не создаются повторно.
+    Возвращает {'created', 'duplicates', 'skipped', 'net_delta'}.
+    """
+    if fmt not in PARSERS:
+        raise StatementParseError(f'Неизвестный формат выписки: {fmt}')
+    wallet = Wallet.objects.select_for_update().get(pk=connection.linked_wallet_id)
+    workspace_id = getattr(project, 'workspace_id', None) or wallet.workspace_id or connection.workspace_id
+    now = timezone.now()
+    db = connections[Transaction.objects.db]
+    sql = _insert_sql(db)
+    amount_field = Transaction._meta.get_field('amount')
+    booked_field = Transaction._meta.get_field('booked_at')
+    created_at = Transaction._meta.get_field('created_at').get_db_prep_save(now, db)
+    project_id = getattr(project, 'pk', None)
+    category_id = getattr(category, 'pk', None)
+    result = {'created': 0, 'duplicates': 0, 'skipped': 0, 'net_delta': Decimal('0')}
+    project_deltas = defaultdict(Decimal)
+    rollup_deltas = defaultdict(lambda: [Decimal('0'), 0])
+    seen = set()
+
+    for chunk in _chunks(_with_external_ids(PARSERS[fmt](fileobj)), chunk_size):
+        ids = [item['external_id'] for item in chunk]
+        existing = set(
+            Transaction.objects.filter(bank_connection=connection, external_id__in=ids)
+            .values_list('external_id', flat=True)
+        )
+        rows = []
+        for item in chunk:
+            if item['external_id'] in existing or item['external_id'] in seen:
+                result['duplicates'] += 1
+                continue
+            seen.add(item['external_id'])
+            if not item['amount']:
+                result['skipped'] += 1
+                continue
+            if item['currency'] and item['currency'] != wallet.currency:
+                raise StatementParseError(
+                    f"Строка {item['line']}: валюта {item['currency']} не совпадает с валютой кошелька {wallet.currency}"
+                )
+            is_deposit = item['amount'] > 0
+            tx_type = Transaction.TYPE_DEPOSIT if is_deposit else Transaction.TYPE_SPEND
+            amount = abs(item['amount'])
+            rows.append((
+                tx_type,
+                Transaction.STATUS_COMPLETED,
+                amount_field.get_db_prep_save(amount, db),
+                wallet.currency,
+                item['description'],
+                None if is_deposit else wallet.pk,
+                wallet.pk if is_deposit else None,
+                project_id,
+                workspace_id,
+                category_id,
+                created_by.pk,
+                created_at,
+                connection.pk,
+                item['external_id'],
+                booked_field.get_db_prep_save(item['booked_at'], db),
+            ))
+            result['net_delta'] += item['amount']
+            if project is not None:
+                project_deltas[BALANCE_FIELDS[tx_type]] += amount
+            totals = rollup_deltas[tx_type]
+            totals[0] += amount
+            totals[1] += 1
+        if rows:
+            with db.cursor() as cursor:
+                cursor.executemany(sql, rows)
+            result['created'] += len(rows)
+
+    # Одно суммарное изменение вместо UPDATE на каждую строку выписки
+    if result['net_delta']:
+        wallet.balance += result['net_delta']
+        wallet.save(update_fields=['balance', 'updated_at'])
+    if project is not None:
+        apply_deltas(project_id, dict(project_deltas))
+    month = rollup_month(now)
+    for tx_type, (amount, count) in rollup_deltas.items():
+        apply_rollup_delta(
+            {
+                'workspace_id': workspace_id,
+                'project_id': project_id,
+                'category_id': category_id,
+                'month': month,
+                'type': tx_type,
+                'status': Transaction.STATUS_COMPLETED,
+                'currency': wallet.currency,
+            },
+            amount,
+            count,
+        )
+    connection.last_synced_at = now
+    connection.save(update_fields=['last_synced_at'])
+    if result['created'] and project is not None:
+        from .services import FinanceStatsService
+
+        transaction.on_commit(partial(FinanceStatsService.invalidate_cache, workspace_id))
+    logger.info(
+        'import_statement: connection=%s created=%s duplicates=%s skipped=%s',
+        connection.pk, result['created'], result['duplicates'], result['skipped'],
+    )
+    return result
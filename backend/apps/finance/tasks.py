@@ -88,3 +88,26 @@ def process_timelog_billing(timelog_id: int):
         amount,
     )
     return {'ok': True, 'timelog_id': timelog_id, 'amount': str(amount)}
+
+
+@shared_task(name='apps.finance.tasks.recalc_project_budget')
+def recalc_project_budget_task(project_id: int):
+    """
+    Отложенный пересчёт budget_spent (mark_project_budget_dirty): один раз на окно debounce.
+    Ключ «пересчёт запланирован» снимается до чтения данных — изменения, закоммиченные
+    после этого, планируют следующий пересчёт.
+    """
+    from django.core.cache import cache
+
+    from apps.finance.services import budget_recalc_pending_key, recalc_project_budget
+    from apps.todo.models import Project
+
+    try:
+        cache.delete(budget_recalc_pending_key(project_id))
+    except Exception as e:
+        logger.warning('recalc_project_budget: cache delete failed project_id=%s: %s', project_id, e)
+    project = Project.objects.filter(pk=project_id).first()
+    if project is None:
+        return {'ok': False, 'reason': 'project_not_found'}
+    recalc_project_budget(project)
+    return {'ok': True, 'project_id': project_id, 'budget_spent': str(project.budget_spent)}
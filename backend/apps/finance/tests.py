@@ -0,0 +1,825 @@
+"""
+Tests for finance app: баланс проекта (ProjectBalance) и месячные срезы поверх Ledger,
+сверка кошельков, импорт банковских выписок, отложенный пересчёт budget_spent, курсы валют,
+сводка Finance Dashboard, прогноз cash-flow, список бюджетов проектов.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import close_old_connections, connection, transaction
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import numpy as np
+from rest_framework.test import APIClient
+
+from apps.auth.permissions import GROUP_MANAGER
+from apps.billing.models import Invoice
+from apps.core.models import User, Workspace, WorkspaceMember
+from apps.finance.balances import lock_balance, verify_balances
+from apps.finance.forecast import _add_months, forecast_workspace, spend_trend
+from apps.finance.fx import ExchangeRateMissing, convert, get_rate, validate_currency
+from apps.finance.models import (
+    BankConnection, Category, ExchangeRate, ProjectBalance, Transaction, TransactionMonthlyRollup, Wallet,
+)
+from apps.finance.reconciliation import reconcile_chunk, reconcile_wallets
+from apps.finance.rollups import ledger_rollup_rows, rollup_month
+from apps.finance.statements import StatementParseError, import_statement, iter_ofx
+from apps.finance.services import (
+    FinanceService,
+    FinanceStatsService,
+    InsufficientFundsError,
+    TransactionService,
+    budget_recalc_debounce,
+    budget_recalc_pending_key,
+)
+from apps.finance.tasks import recalc_project_budget_task
+from apps.hr.models import EmployeeProfile
+from apps.notifications.models import Notification
+from apps.todo.models import Project, WorkItem
+
+logger = logging.getLogger(__name__)
+
+
+class FinanceTestMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(username='finance', email='finance@example.com', password='x')
+        self.workspace = Workspace.objects.create(name='Finance WS', slug='finance-ws')
+        self.project = Project.objects.create(name='Ledger', workspace=self.workspace)
+        self.wallet = Wallet.objects.create(name='Счёт', workspace=self.workspace)
+        self.workitem = WorkItem.objects.create(title='Задача', project=self.project, created_by=self.user)
+
+    def deposit(self, amount, **kwargs):
+        return TransactionService.create_deposit(
+            wallet=self.wallet, amount=amount, created_by=self.user, project=self.project, **kwargs
+        )
+
+
+class ProjectBalanceTestCase(FinanceTestMixin, TestCase):
+    """Баланс обновляется вместе с INSERT транзакции и читается одной строкой."""
+
+    def test_balance_follows_ledger_and_reads_one_row(self):
+        self.deposit(Decimal('1000'))
+        FinanceService.create_hold(self.project, Decimal('300'), self.workitem, self.user)
+        FinanceService.commit_hold(self.workitem, Decimal('250'), self.user)
+        # pending не учитывается
+        self.deposit(Decimal('500'), status=Transaction.STATUS_PENDING)
+
+        with self.assertNumQueries(1):
+            balance = FinanceService.get_project_balance(self.project.id)
+        self.assertEqual(balance, {
+            'total_budget': Decimal('1000'),
+            'spent': Decimal('250'),
+            'on_hold': Decimal('0'),
+            'available': Decimal('750'),
+        })
+        self.assertEqual(verify_balances(), [])
+
+    def test_rejected_hold_leaves_balance_untouched(self):
+        self.deposit(Decimal('100'))
+        with self.assertRaises(InsufficientFundsError):
+            FinanceService.create_hold(self.project, Decimal('150'), self.workitem, self.user)
+        FinanceService.create_hold(self.project, Decimal('60'), self.workitem, self.user)
+        with self.assertRaises(InsufficientFundsError):
+            FinanceService.commit_hold(self.workitem, Decimal('200'), self.user)
+        balance = FinanceService.get_project_balance(self.project.id)
+        self.assertEqual(balance['on_hold'], Decimal('60'))
+        self.assertEqual(balance['available'], Decimal('40'))
+
+    def test_missing_row_is_built_from_ledger(self):
+        self.deposit(Decimal('80'))
+        ProjectBalance.objects.all().delete()
+        balances = FinanceService.get_project_balances([self.project.id])
+        self.assertEqual(balances[self.project.id]['available'], Decimal('80'))
+        self.assertTrue(ProjectBalance.objects.filter(project=self.project).exists())
+
+    def test_verify_command_reports_and_fixes_drift(self):
+        self.deposit(Decimal('500'))
+        ProjectBalance.objects.filter(project=self.project).update(deposited=Decimal('10'))
+
+        with self.assertRaises(CommandError):
+            call_command('verify_project_balances', stdout=StringIO())
+        out = StringIO()
+        call_command('verify_project_balances', '--fix', stdout=out)
+        self.assertIn(f'project#{self.project.id} deposited', out.getvalue())
+        self.assertEqual(ProjectBalance.objects.get(project=self.project).deposited, Decimal('500'))
+        self.assertEqual(verify_balances(), [])
+
+
+class MonthlyRollupTestCase(FinanceTestMixin, TestCase):
+    """Срезы ведутся при создании транзакций и совпадают с GROUP BY по Ledger."""
+
+    def stored_rows(self):
+        fields = (
+            'workspace_id', 'project_id', 'category_id', 'month', 'type', 'status', 'currency',
+            'amount', 'transactions_count',
+        )
+        return sorted(TransactionMonthlyRollup.objects.values_list(*fields), key=repr)
+
+    def ledger_rows(self):
+        return sorted(
+            (
+                (
+                    row['workspace_id'], row['project_id'], row['category_id'], row['month'],
+                    row['type'], row['status'], row['currency'], row['amount'], row['transactions_count'],
+                )
+                for row in ledger_rollup_rows()
+            ),
+            key=repr,
+        )
+
+    def test_rollups_follow_inserts(self):
+        self.deposit(Decimal('100'))
+        self.deposit(Decimal('50.25'))
+        self.deposit(Decimal('10'), status=Transaction.STATUS_PENDING)
+        TransactionService.create_spend(
+            amount=Decimal('30'), created_by=self.user, wallet=self.wallet, project=self.project
+        )
+
+        row = TransactionMonthlyRollup.objects.get(
+            project=self.project, type=Transaction.TYPE_DEPOSIT, status=Transaction.STATUS_COMPLETED
+        )
+        self.assertEqual(row.month, rollup_month(timezone.now()))
+        self.assertEqual(row.amount, Decimal('150.25'))
+        self.assertEqual(row.transactions_count, 2)
+        self.assertEqual(self.stored_rows(), sorted(self.ledger_rows(), key=repr))
+
+    def test_backfill_command_rebuilds_drifted_rollups(self):
+        self.deposit(Decimal('400'))
+        TransactionMonthlyRollup.objects.update(amount=Decimal('1'))
+        out = StringIO()
+        call_command('backfill_finance_rollups', '--workspace', str(self.workspace.id), stdout=out)
+        self.assertIn('Строк среза', out.getvalue())
+        self.assertEqual(
+            TransactionMonthlyRollup.objects.get(project=self.project, type=Transaction.TYPE_DEPOSIT).amount,
+            Decimal('400'),
+        )
+        self.assertEqual(self.stored_rows(), sorted(self.ledger_rows(), key=repr))
+
+    def test_category_edit_moves_amount_between_rollups(self):
+        rent = Category.objects.create(workspace=self.workspace, name='Аренда', type=Category.TYPE_EXPENSE)
+        sales = Category.objects.create(workspace=self.workspace, name='Продажи', type=Category.TYPE_INCOME)
+        edited = self.deposit(Decimal('100'))
+        self.deposit(Decimal('40'), category=rent)
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        for category in (rent, sales, None):
+            response = client.patch(
+                f'/api/v1/finance/transactions/{edited.id}/metadata/',
+                {'category': category.id if category else None},
+                format='json',
+            )
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(self.stored_rows(), sorted(self.ledger_rows(), key=repr))
+        self.assertFalse(TransactionMonthlyRollup.objects.filter(category=sales).exists())
+
+
+class BudgetRecalcDebounceTestCase(FinanceTestMixin, TestCase):
+    """Массовая правка задач — один пересчёт бюджета; алерт — один раз на переход порога."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        Project.objects.filter(pk=self.project.pk).update(budget_total=Decimal('1000'))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_bulk_edit_schedules_one_recalc(self):
+        with mock.patch('apps.finance.tasks.recalc_project_budget_task.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                for index in range(50):
+                    WorkItem.objects.create(
+                        title=f'Задача {index}', project=self.project, created_by=self.user, cost=Decimal('10')
+                    )
+            with self.captureOnCommitCallbacks(execute=True):
+                self.workitem.cost = Decimal('5')
+                self.workitem.save()
+        apply_async.assert_called_once_with(args=[self.project.id], countdown=budget_recalc_debounce())
+
+        # Задача снимает отметку: следующая правка планирует новый пересчёт
+        recalc_project_budget_task(self.project.id)
+        self.assertIsNone(cache.get(budget_recalc_pending_key(self.project.id)))
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.budget_spent, Decimal('505'))
+
+    def test_alert_fires_once_per_threshold_crossing(self):
+        def set_cost(value):
+            WorkItem.objects.filter(pk=self.workitem.pk).update(cost=Decimal(value))
+            recalc_project_budget_task(self.project.id)
+
+        set_cost('850')
+        set_cost('900')
+        set_cost('950')
+        self.assertEqual(Notification.objects.filter(type=Notification.TYPE_BUDGET_ALERT).count(), 1)
+        set_cost('1100')
+        set_cost('1200')
+        messages = list(
+            Notification.objects.filter(type=Notification.TYPE_BUDGET_ALERT)
+            .order_by('id').values_list('message', flat=True)
+        )
+        self.assertEqual(len(messages), 2)
+        self.assertIn('110%', messages[1])
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.last_budget_alert_level, Project.BUDGET_ALERT_CRITICAL)
+
+
+class WalletReconciliationTestCase(FinanceTestMixin, TestCase):
+    """Сверка кошельков: один GROUP BY на пачку, отчёт о расхождениях, исправление."""
+
+    def setUp(self):
+        super().setUp()
+        self.savings = Wallet.objects.create(name='Резерв', workspace=self.workspace)
+        self.deposit(Decimal('1000'))
+        TransactionService.create_spend(amount=Decimal('150'), created_by=self.user, wallet=self.wallet)
+        TransactionService.create_transfer(
+            from_wallet=self.wallet, to_wallet=self.savings, amount=Decimal('300'), created_by=self.user
+        )
+        other_ws = Workspace.objects.create(name='Другой', slug='other-recon')
+        self.alien = Wallet.objects.create(name='Чужой', workspace=other_ws, balance=Decimal('5'))
+
+    def test_chunk_is_two_queries_and_matches_ledger(self):
+        with self.assertNumQueries(2):
+            result = reconcile_chunk([self.wallet.pk, self.savings.pk])
+        self.assertEqual((len(result['wallet_ids']), result['mismatches']), (2, []))
+        self.assertEqual(
+            TransactionService.recalculate_wallet_balance(self.wallet.pk), Decimal('550')
+        )
+
+    def test_report_and_fix(self):
+        Wallet.objects.filter(pk=self.savings.pk).update(balance=Decimal('1'))
+        report = reconcile_wallets(workspace_id=self.workspace.id, chunk_size=1)
+        self.assertEqual(report['chunks'], 2)
+        self.assertEqual(
+            report['mismatches'],
+            [{'wallet_id': self.savings.pk, 'stored': Decimal('1.00'), 'actual': Decimal('300')}],
+        )
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_wallets', '--workspace', str(self.workspace.id), stdout=StringIO())
+        out = StringIO()
+        call_command('reconcile_wallets', '--workspace', str(self.workspace.id), '--fix', stdout=out)
+        self.assertIn(f'wallet#{self.savings.pk}', out.getvalue())
+        self.savings.refresh_from_db()
+        self.assertEqual(self.savings.balance, Decimal('300'))
+        self.assertIsNotNone(self.savings.last_reconciled_at)
+        self.alien.refresh_from_db()
+        self.assertEqual((self.alien.balance, self.alien.last_reconciled_at), (Decimal('5'), None))
+        # Вне workspace расхождение осталось
+        self.assertEqual(len(reconcile_wallets()['mismatches']), 1)
+
+
+CAMT_STATEMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+  <BkToCstmrStmt><Stmt>
+    <Ntry>
+      <Amt Ccy="RUB">1500.00</Amt><CdtDbtInd>CRDT</CdtDbtInd>
+      <BookgDt><Dt>2024-03-01</Dt></BookgDt><AcctSvcrRef>CAMT-1</AcctSvcrRef>
+      <AddtlNtryInf>Оплата по счёту 7</AddtlNtryInf>
+    </Ntry>
+    <Ntry>
+      <Amt Ccy="RUB">200.50</Amt><CdtDbtInd>DBIT</CdtDbtInd>
+      <BookgDt><DtTm>2024-03-02T10:00:00+03:00</DtTm></BookgDt><AcctSvcrRef>CAMT-2</AcctSvcrRef>
+    </Ntry>
+  </Stmt></BkToCstmrStmt>
+</Document>
+""".encode('utf-8')
+
+OFX_STATEMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+  <STMTTRN><TRNTYPE>CREDIT</TRNTYPE><DTPOSTED>20240305120000[+3:MSK]</DTPOSTED>
+    <TRNAMT>99.90</TRNAMT><FITID>OFX-1</FITID><NAME>Клиент</NAME><MEMO>Аванс</MEMO></STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+""".encode('utf-8')
+
+
+class BankStatementImportTestCase(FinanceTestMixin, TestCase):
+    """Импорт выписки: пачки bulk_create, дедупликация, одно изменение баланса кошелька."""
+
+    def setUp(self):
+        super().setUp()
+        self.connection = BankConnection.objects.create(
+            workspace=self.workspace, name='Банк', linked_wallet=self.wallet
+        )
+
+    def csv_file(self, rows, encoding='utf-8-sig'):
+        lines = ['Номер;Дата операции;Сумма;Назначение платежа'] + rows
+        return BytesIO('\n'.join(lines).encode(encoding))
+
+    def test_csv_import_is_chunked_and_deduped(self):
+        rows = [f'op-{index};01.03.2024;{"-" if index % 3 == 0 else ""}10,50;Строка {index}' for index in range(60)]
+        rows += [';02.03.2024;5;Без номера', ';02.03.2024;5;Без номера', 'op-zero;02.03.2024;0;Нулевая']
+
+        with CaptureQueriesContext(connection) as queries:
+            result = import_statement(
+                self.connection, self.csv_file(rows), 'csv', self.user, project=self.project, chunk_size=25
+            )
+        # Число запросов зависит от числа пачек, а не строк
+        self.assertLess(len(queries), 30)
+        self.assertEqual(result['created'], 62)
+        self.assertEqual(result['skipped'], 1)
+        # 40 поступлений и 20 списаний по 10.50, две строки по 5 без номера
+        self.assertEqual(result['net_delta'], Decimal('220.00'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('220.00'))
+        tx = Transaction.objects.get(bank_connection=self.connection, external_id='op-0')
+        self.assertEqual((tx.type, tx.amount, tx.booked_at), (Transaction.TYPE_SPEND, Decimal('10.50'), date(2024, 3, 1)))
+        self.assertEqual(verify_balances(), [])
+        self.assertEqual(
+            sum(row.transactions_count for row in TransactionMonthlyRollup.objects.filter(project=self.project)),
+            62,
+        )
+
+        again = import_statement(self.connection, self.csv_file(rows), 'csv', self.user, project=self.project)
+        self.assertEqual((again['created'], again['duplicates']), (0, 62))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('220.00'))
+
+    def test_bad_line_rolls_back_whole_file(self):
+        rows = ['op-1;01.03.2024;100;ok', 'op-2;not-a-date;100;bad']
+        with self.assertRaises(StatementParseError):
+            import_statement(self.connection, self.csv_file(rows), 'csv', self.user)
+        self.assertFalse(Transaction.objects.filter(bank_connection=self.connection).exists())
+
+    def test_cp1251_csv_upload_via_api(self):
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        self.user.groups.add(Group.objects.get_or_create(name=GROUP_MANAGER)[0])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/api/v1/finance/bank-connections/{self.connection.id}/import/'
+        statement = self.csv_file(['op-1;01.03.2024;1500,00;Оплата по счёту №7'], encoding='cp1251')
+        response = client.post(
+            url, {'file': SimpleUploadedFile('выписка.csv', statement.getvalue())}, format='multipart',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['created'], 1)
+        tx = Transaction.objects.get(bank_connection=self.connection, external_id='op-1')
+        self.assertEqual(tx.description, 'Оплата по счёту №7')
+
+        # Битый CSV (поле длиннее csv.field_size_limit) — 400 с номером строки, а не 500
+        broken = f'Номер;Дата;Сумма;Назначение\nop-2;01.03.2024;5;{"x" * 200_000}'.encode('utf-8')
+        response = client.post(url, {'file': SimpleUploadedFile('broken.csv', broken)}, format='multipart')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('Строка 2', response.json()['error'])
+
+    def test_camt_upload_via_api(self):
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        self.user.groups.add(Group.objects.get_or_create(name=GROUP_MANAGER)[0])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            f'/api/v1/finance/bank-connections/{self.connection.id}/import/',
+            {'file': SimpleUploadedFile('statement.xml', CAMT_STATEMENT), 'project': self.project.id},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(Decimal(response.json()['net_delta']), Decimal('1299.50'))
+        spend = Transaction.objects.get(bank_connection=self.connection, external_id='CAMT-2')
+        self.assertEqual((spend.type, spend.booked_at), (Transaction.TYPE_SPEND, date(2024, 3, 2)))
+        self.assertEqual(FinanceService.get_project_balance(self.project.id)['available'], Decimal('1299.50'))
+
+    def test_ofx_lines(self):
+        [line] = list(iter_ofx(BytesIO(OFX_STATEMENT)))
+        self.assertEqual(line['external_id'], 'OFX-1')
+        self.assertEqual(line['booked_at'], date(2024, 3, 5))
+        self.assertEqual(line['amount'], Decimal('99.90'))
+        self.assertEqual(line['description'], 'Клиент Аванс')
+
+
+class FinanceLockTestCase(FinanceTestMixin, TestCase):
+    """holds/commits блокируют строку баланса проекта, а не строку Project."""
+
+    def test_hold_locks_balance_row_only(self):
+        self.deposit(Decimal('100'))
+        with CaptureQueriesContext(connection) as queries:
+            FinanceService.create_hold(self.project, Decimal('40'), self.workitem, self.user)
+            FinanceService.commit_hold(self.workitem, Decimal('30'), self.user)
+        locked = [query['sql'] for query in queries if 'FOR UPDATE' in query['sql']]
+        if connection.features.has_select_for_update:
+            self.assertEqual(len(locked), 2)
+            self.assertTrue(all('finance_project_balances' in sql for sql in locked))
+        self.assertFalse(any('FOR UPDATE' in query['sql'] and '"projects"' in query['sql'] for query in queries))
+        self.assertEqual(FinanceService.get_project_balance(self.project.id)['available'], Decimal('70'))
+
+    def test_lock_creates_missing_balance_row(self):
+        self.deposit(Decimal('25'))
+        ProjectBalance.objects.all().delete()
+        with transaction.atomic():
+            self.assertEqual(lock_balance(self.project.id).available, Decimal('25'))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class FinanceConcurrencyStressTestCase(FinanceTestMixin, TransactionTestCase):
+    """
+    Нагрузочный тест (PostgreSQL): потоки параллельно создают holds и commits по одному проекту,
+    пока другой поток держит блокировку строки Project. Овердрафта нет, Ledger и баланс сходятся.
+    """
+
+    THREADS = 8
+    OPS_PER_THREAD = 15
+    AMOUNT = Decimal('10')
+
+    def test_parallel_holds_and_commits_never_overdraft(self):
+        self.deposit(Decimal('500'))
+        workitems = [
+            [
+                WorkItem.objects.create(title=f'Нагрузка {t}-{i}', project=self.project, created_by=self.user)
+                for i in range(self.OPS_PER_THREAD)
+            ]
+            for t in range(self.THREADS)
+        ]
+        done = []
+        rejected = []
+        errors = []
+        stop = threading.Event()
+
+        def worker(items):
+            try:
+                for workitem in items:
+                    try:
+                        FinanceService.create_hold(self.project, self.AMOUNT, workitem, self.user)
+                        FinanceService.commit_hold(workitem, self.AMOUNT, self.user)
+                        done.append(workitem.pk)
+                    except InsufficientFundsError:
+                        rejected.append(workitem.pk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        def project_editor():
+            # Обычные правки проекта держат строку Project — финансовые операции их не ждут
+            try:
+                while not stop.is_set():
+                    with transaction.atomic():
+                        Project.objects.select_for_update().get(pk=self.project.pk)
+                        time.sleep(0.05)
+            finally:
+                connection.close()
+
+        editor = threading.Thread(target=project_editor)
+        threads = [threading.Thread(target=worker, args=(items,)) for items in workitems]
+        started = time.monotonic()
+        editor.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        stop.set()
+        editor.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(done) + len(rejected), self.THREADS * self.OPS_PER_THREAD)
+        balance = FinanceService.get_project_balance(self.project.id)
+        self.assertGreaterEqual(balance['available'], Decimal('0'))
+        self.assertEqual(balance['spent'], self.AMOUNT * len(done))
+        self.assertEqual(balance['available'], Decimal('500') - self.AMOUNT * len(done))
+        self.assertEqual(verify_balances(), [])
+        logger.info(
+            'finance stress: %s hold+commit pairs (%s rejected) in %.2fs — %.1f ops/s',
+            len(done), len(rejected), elapsed, (len(done) + len(rejected)) / elapsed,
+        )
+
+
+class AnalyticsSummaryTestCase(FinanceTestMixin, TestCase):
+    """Сводка дашборда: один GROUP BY, кэш на пользователя, сброс новой транзакцией."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        self.other = Project.objects.create(name='Второй', workspace=self.workspace)
+        other_ws = Workspace.objects.create(name='Чужой', slug='alien-ws')
+        alien = Project.objects.create(name='Чужой проект', workspace=other_ws)
+        alien_wallet = Wallet.objects.create(name='Чужой счёт', workspace=other_ws)
+        TransactionService.create_deposit(
+            wallet=alien_wallet, amount=Decimal('9999'), created_by=self.user, project=alien
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_summary_is_two_queries_then_cached(self):
+        self.deposit(Decimal('1000'))
+        TransactionService.create_spend(
+            amount=Decimal('300'), created_by=self.user, wallet=self.wallet, project=self.project
+        )
+        TransactionService.create_spend(
+            amount=Decimal('500'), created_by=self.user, wallet=self.wallet, project=self.other
+        )
+        FinanceService.create_hold(self.project, Decimal('100'), self.workitem, self.user)
+
+        # членство + GROUP BY
+        with self.assertNumQueries(2):
+            summary = FinanceStatsService.get_analytics_summary(self.user)
+        self.assertEqual(summary['total_balance'], '100.00')
+        self.assertFalse(summary['has_cash_gap'])
+        self.assertEqual(summary['current_month_expense'], '800.00')
+        self.assertEqual(
+            [(item['project_name'], item['amount']) for item in summary['expenses_by_project']],
+            [('Второй', '500.00'), ('Ledger', '300.00')],
+        )
+        history = summary['cash_flow_history']
+        self.assertEqual(len(history), 6)
+        self.assertEqual(history[-1], {
+            'month': timezone.localtime().strftime('%Y-%m'),
+            'income': '1000.00',
+            'expense': '800.00',
+        })
+
+        with self.assertNumQueries(1):
+            self.assertEqual(FinanceStatsService.get_analytics_summary(self.user), summary)
+
+    def test_new_transaction_invalidates_cached_summary(self):
+        self.deposit(Decimal('200'))
+        first = FinanceStatsService.get_analytics_summary(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.deposit(Decimal('50'))
+        second = FinanceStatsService.get_analytics_summary(self.user)
+        self.assertEqual(first['total_balance'], '200.00')
+        self.assertEqual(second['total_balance'], '250.00')
+
+
+class ExchangeRateTestCase(FinanceTestMixin, TestCase):
+    """Курсы из таблицы: кэш в процессе, авто-пересчёт перевода, мультивалютная сводка одним запросом."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER)
+        self.usd_wallet = Wallet.objects.create(name='USD', workspace=self.workspace, currency='USD')
+        self.month_start = rollup_month(timezone.now())
+        ExchangeRate.objects.create(currency='USD', date=self.month_start - timedelta(days=40), rate=Decimal('80'))
+        ExchangeRate.objects.create(currency='USD', date=self.month_start, rate=Decimal('90'))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_rates_are_read_from_process_cache(self):
+        self.assertEqual(get_rate('usd', self.month_start + timedelta(days=3)), Decimal('90'))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_rate('USD', self.month_start - timedelta(days=1)), Decimal('80'))
+            # До первой записи — самый ранний курс
+            self.assertEqual(get_rate('USD', self.month_start - timedelta(days=400)), Decimal('80'))
+            self.assertEqual(get_rate('RUB'), Decimal('1'))
+            self.assertEqual(convert(Decimal('180'), 'RUB', 'USD', self.month_start), Decimal('2.00'))
+
+        ExchangeRate.objects.create(currency='USD', date=self.month_start + timedelta(days=1), rate=Decimal('100'))
+        self.assertEqual(get_rate('USD', self.month_start + timedelta(days=3)), Decimal('100'))
+
+    def test_transfer_target_amount_defaults_to_table_rate(self):
+        self.wallet.balance = Decimal('10000')
+        self.wallet.save()
+        _out_tx, in_tx = TransactionService.create_transfer(
+            from_wallet=self.wallet, to_wallet=self.usd_wallet, amount=Decimal('9000'), created_by=self.user
+        )
+        self.assertEqual(in_tx.amount, Decimal('100.00'))
+        self.assertEqual(in_tx.currency, 'USD')
+        self.usd_wallet.refresh_from_db()
+        self.assertEqual(self.usd_wallet.balance, Decimal('100.00'))
+
+        eur_wallet = Wallet.objects.create(name='EUR', workspace=self.workspace, currency='EUR')
+        with self.assertRaises(ValueError):
+            TransactionService.create_transfer(
+                from_wallet=self.wallet, to_wallet=eur_wallet, amount=Decimal('10'), created_by=self.user
+            )
+
+    def test_mixed_currency_summary_is_converted_in_one_query(self):
+        self.deposit(Decimal('1000'))
+        TransactionService.create_deposit(
+            wallet=self.usd_wallet, amount=Decimal('100'), created_by=self.user, project=self.project
+        )
+        TransactionService.create_spend(
+            amount=Decimal('10'), created_by=self.user, wallet=self.usd_wallet, project=self.project
+        )
+        self.assertEqual(
+            TransactionMonthlyRollup.objects.filter(project=self.project, type=Transaction.TYPE_DEPOSIT).count(), 2
+        )
+
+        # членство + GROUP BY с пересчётом курсов в SQL
+        with self.assertNumQueries(2):
+            summary = FinanceStatsService.get_analytics_summary(self.user)
+        self.assertEqual(summary['currency'], 'RUB')
+        self.assertEqual(summary['total_balance'], '9100.00')
+        self.assertEqual(summary['cash_flow_history'][-1]['income'], '10000.00')
+        self.assertEqual(summary['current_month_expense'], '900.00')
+
+        in_usd = FinanceStatsService.get_analytics_summary(self.user, currency='usd')
+        self.assertEqual(in_usd['currency'], 'USD')
+        self.assertEqual(in_usd['total_balance'], '101.11')
+        self.assertEqual(in_usd['current_month_expense'], '10.00')
+
+        # Общая базовая валюта воркспейсов пользователя — валюта сводки по умолчанию
+        Workspace.objects.filter(memberships__user=self.user).update(settings={'base_currency': 'USD'})
+        self.assertEqual(FinanceStatsService.get_analytics_summary(self.user), in_usd)
+
+    def test_rate_change_invalidates_cached_summary(self):
+        TransactionService.create_deposit(
+            wallet=self.usd_wallet, amount=Decimal('10'), created_by=self.user, project=self.project
+        )
+        self.assertEqual(FinanceStatsService.get_analytics_summary(self.user)['total_balance'], '900.00')
+        ExchangeRate.objects.filter(date=self.month_start).delete()
+        ExchangeRate.objects.create(currency='USD', date=self.month_start, rate=Decimal('95'))
+        self.assertEqual(FinanceStatsService.get_analytics_summary(self.user)['total_balance'], '950.00')
+
+    def test_unknown_currency_is_rejected_and_par_fallback_reported(self):
+        gbp_wallet = Wallet.objects.create(name='GBP', workspace=self.workspace, currency='GBP')
+        TransactionService.create_deposit(
+            wallet=gbp_wallet, amount=Decimal('10'), created_by=self.user, project=self.project
+        )
+        self.assertEqual(validate_currency(' usd '), 'USD')
+        with self.assertRaises(ExchangeRateMissing):
+            validate_currency('GBP')
+
+        summary = FinanceStatsService.get_analytics_summary(self.user)
+        self.assertEqual((summary['total_balance'], summary['par_currencies']), ('10.00', ['GBP']))
+        self.assertEqual(forecast_workspace(self.workspace, use_cache=False)['par_currencies'], ['GBP'])
+
+        self.user.groups.add(Group.objects.get_or_create(name=GROUP_MANAGER)[0])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('apps.finance.views.SubscriptionService.has_feature', return_value=True):
+            response = client.get('/api/v1/finance/analytics/summary/', {'currency': 'xyz'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('currency', response.data)
+            response = client.get('/api/v1/finance/analytics/summary/', {'currency': 'usd'})
+            self.assertEqual((response.status_code, response.data['par_currencies']), (200, ['GBP']))
+            response = client.get(
+                '/api/v1/finance/analytics/forecast/', {'workspace': self.workspace.id, 'currency': 'GBP'}
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.get('/api/v1/core/dashboard-stats/', {'currency': 'xyz'}).status_code, 400)
+
+    def test_import_command_upserts_rates(self):
+        out = StringIO()
+        csv_data = (
+            'currency;date;rate\n'
+            f'usd;{self.month_start:%d.%m.%Y};91,5\n'
+            f'EUR;{self.month_start:%Y-%m-%d};99\n'
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rates.csv')
+            with open(path, 'w', encoding='utf-8') as fileobj:
+                fileobj.write(csv_data)
+            call_command('import_exchange_rates', path, stdout=out)
+        self.assertIn('Загружено курсов: 2', out.getvalue())
+        row = ExchangeRate.objects.get(currency='USD', date=self.month_start)
+        self.assertEqual((row.rate, row.source), (Decimal('91.5'), ExchangeRate.SOURCE_IMPORT))
+        self.assertEqual(get_rate('EUR', self.month_start), Decimal('99'))
+
+
+class CashFlowForecastTestCase(FinanceTestMixin, TestCase):
+    """Прогноз: счета, зарплаты, холды и тренд расходов по срезам; кэш на workspace."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        member = WorkspaceMember.objects.create(
+            workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_OWNER
+        )
+        self.user.groups.add(Group.objects.get_or_create(name=GROUP_MANAGER)[0])
+        self.this_month = rollup_month(timezone.now())
+        self.deposit(Decimal('1000'))
+        # История расходов: по 100 в каждом из шести прошлых месяцев
+        for offset in range(1, 7):
+            TransactionMonthlyRollup.objects.create(
+                workspace=self.workspace, project=self.project, month=_add_months(self.this_month, -offset),
+                type=Transaction.TYPE_SPEND, status=Transaction.STATUS_COMPLETED,
+                amount=Decimal('100'), transactions_count=1,
+            )
+        FinanceService.create_hold(self.project, Decimal('100'), self.workitem, self.user)
+        Invoice.objects.create(
+            project=self.project, number='INV-FC-0001', status=Invoice.STATUS_SENT,
+            date_due=_add_months(self.this_month, 1) + timedelta(days=9), amount_total=Decimal('500'),
+        )
+        EmployeeProfile.objects.create(member=member, salary_amount=Decimal('3000'))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_spend_trend_is_least_squares_per_row(self):
+        history = np.array([
+            [100, 200, 300, 400, 500, 600],
+            [50, 50, 50, 50, 50, 50],
+            [600, 500, 400, 300, 200, 100],
+        ], dtype=float)
+        np.testing.assert_allclose(spend_trend(history, 3), [[700, 800, 900], [50, 50, 50], [0, 0, 0]])
+
+    def test_forecast_combines_sources_and_flags_gap(self):
+        forecast = forecast_workspace(self.workspace, horizon=6)
+        self.assertEqual(len(forecast['months']), 6)
+        self.assertEqual(forecast['months'][0], self.this_month.strftime('%Y-%m'))
+        cash = forecast['cash']
+        self.assertEqual(cash['opening'], '1000.00')
+        self.assertEqual(cash['payroll'], ['3000.00'] * 6)
+        self.assertEqual(cash['holds'], ['100.00'] + ['0.00'] * 5)
+        self.assertEqual(cash['inflows'], ['0.00', '500.00'] + ['0.00'] * 4)
+        self.assertEqual(cash['spend'], ['100.00'] * 6)
+        self.assertEqual(cash['balance'][:2], ['-2200.00', '-4800.00'])
+        self.assertTrue(forecast['has_cash_gap'])
+        self.assertEqual(forecast['cash_gap_months'], forecast['months'])
+
+        [project] = forecast['projects']
+        # available = 1000 − 600 (история) − 100 (холд)
+        self.assertEqual(project['available'], '300.00')
+        self.assertEqual(project['balance'], ['200.00', '600.00', '500.00', '400.00', '300.00', '200.00'])
+        self.assertFalse(project['has_cash_gap'])
+
+    def test_forecast_is_cached_until_invoice_changes(self):
+        first = forecast_workspace(self.workspace, horizon=3)
+        with self.assertNumQueries(0):
+            self.assertEqual(forecast_workspace(self.workspace, horizon=3), first)
+        Invoice.objects.create(
+            project=self.project, number='INV-FC-0002', status=Invoice.STATUS_SENT,
+            date_due=self.this_month, amount_total=Decimal('250'),
+        )
+        self.assertEqual(forecast_workspace(self.workspace, horizon=3)['cash']['inflows'][0], '250.00')
+
+    def test_forecast_api(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/api/v1/finance/analytics/forecast/'
+        alien = Workspace.objects.create(name='Чужой', slug='alien-forecast')
+        with mock.patch('apps.finance.views.SubscriptionService.has_feature', return_value=True):
+            response = client.get(url, {'workspace': self.workspace.id, 'months': 3})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['months']), 3)
+            self.assertEqual(client.get(url, {'workspace': self.workspace.id, 'months': 9}).status_code, 400)
+            self.assertEqual(client.get(url, {'workspace': alien.id}).status_code, 404)
+
+
+class ProjectBudgetListTestCase(FinanceTestMixin, TestCase):
+    """GET /finance/projects/: сводки одним GROUP BY и keyset-пагинация."""
+
+    def setUp(self):
+        super().setUp()
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_MEMBER)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for index in range(4):
+            project = Project.objects.create(name=f'Проект {index}', workspace=self.workspace)
+            Project.objects.filter(pk=project.pk).update(budget_total=Decimal('100'), budget_spent=Decimal(30 * index))
+            TransactionService.create_spend(
+                amount=Decimal('10'), created_by=self.user, wallet=self.wallet,
+                project=project, allow_overdraft=True,
+            )
+
+    def test_page_is_built_with_constant_queries(self):
+        # членство, страница проектов, GROUP BY транзакций
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/finance/projects/', {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(len(body['results']), 3)
+        self.assertIsNotNone(body['next'])
+        first = body['results'][0]
+        self.assertEqual(first['project_name'], 'Проект 3')
+        self.assertEqual(first['alert_level'], Project.BUDGET_ALERT_WARNING)
+        self.assertEqual(first['transactions_count'], 1)
+        self.assertEqual(Decimal(first['expense_total']), Decimal('10'))
+
+        rest = self.client.get(body['next']).json()
+        names = [item['project_name'] for item in body['results'] + rest['results']]
+        # Далее — проекты, созданные вместе с пользователем/workspace
+        self.assertEqual(names[:5], ['Проект 3', 'Проект 2', 'Проект 1', 'Проект 0', 'Ledger'])
+        self.assertEqual(len(names), len(set(names)))
+        self.assertIsNone(rest['next'])
+
+    def test_mixed_currency_totals_are_converted_to_workspace_currency(self):
+        project = Project.objects.create(name='Валютный', workspace=self.workspace)
+        today = timezone.localdate()
+        ExchangeRate.objects.create(currency='USD', date=today - timedelta(days=1), rate=Decimal('90'))
+        usd_wallet = Wallet.objects.create(name='USD', workspace=self.workspace, currency='USD')
+        gbp_wallet = Wallet.objects.create(name='GBP', workspace=self.workspace, currency='GBP')
+        TransactionService.create_deposit(
+            wallet=self.wallet, amount=Decimal('1000'), created_by=self.user, project=project
+        )
+        TransactionService.create_deposit(wallet=usd_wallet, amount=Decimal('10'), created_by=self.user, project=project)
+        TransactionService.create_deposit(wallet=gbp_wallet, amount=Decimal('5'), created_by=self.user, project=project)
+
+        [summary] = self.client.get('/api/v1/finance/projects/', {'page_size': 1}).json()['results']
+        self.assertEqual(summary['project_name'], 'Валютный')
+        self.assertEqual(summary['transactions_count'], 3)
+        # 1000 RUB + 10 USD × 90 + 5 GBP по номиналу (курса нет)
+        self.assertEqual(Decimal(summary['income_total']), Decimal('1905.00'))
+        self.assertEqual((summary['currency'], summary['par_currencies']), ('RUB', ['GBP']))
+        # Дашборд даёт то же число для того же workspace
+        dashboard = FinanceStatsService.get_analytics_summary(self.user, use_cache=False)
+        self.assertEqual(dashboard['cash_flow_history'][-1]['income'], '1905.00')
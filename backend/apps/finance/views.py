@@ -3,6 +3,7 @@ Views for finance app — Ledger & Holds API (Task 2.2).
 """
 from decimal import Decimal
 
+from django.db import transaction as db_transaction
 from django.db.models import Q
 from django.http import FileResponse, Http404
 from django_filters.rest_framework import DjangoFilterBackend
@@ -10,16 +11,20 @@ from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.pagination import CursorPagination
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from apps.auth.permissions import IsDirectorOrManager
 from apps.billing.services import SubscriptionService
-from apps.core.models import WorkspaceMember
+from apps.core.models import Workspace, WorkspaceMember
 from apps.todo.models import Project, WorkItem
 
+from .forecast import DEFAULT_HORIZON, HORIZON_MAX, HORIZON_MIN, forecast_workspace
+from .fx import ExchangeRateMissing, validate_currency
 from .models import BankConnection, Category, Transaction, Wallet
+from .rollups import move_rollup_category
 from .serializers import (
     BankConnectionSerializer,
     CategorySerializer,
@@ -37,6 +42,7 @@ from .services import (
     InsufficientFundsError,
     TransactionService,
 )
+from .statements import FORMATS, StatementParseError, detect_format, import_statement
 
 
 class WorkspaceAccessMixin:
@@ -448,7 +454,15 @@ class TransactionViewSet(WorkspaceAccessMixin, viewsets.ReadOnlyModelViewSet):
         serializer.is_valid(raise_exception=True)
         update_data = {k: v for k, v in serializer.validated_data.items()}
         if update_data:
-            Transaction.objects.filter(pk=transaction.pk).update(**update_data)
+            with db_transaction.atomic():
+                # Категория входит в ключ TransactionMonthlyRollup: сумма переносится между срезами
+                locked = Transaction.objects.select_for_update().get(pk=transaction.pk)
+                if 'category' in update_data:
+                    category = update_data['category']
+                    move_rollup_category(locked, category.pk if category else None)
+                    workspace_id = locked.workspace_id
+                    db_transaction.on_commit(lambda: FinanceStatsService.invalidate_cache(workspace_id))
+                Transaction.objects.filter(pk=transaction.pk).update(**update_data)
             transaction.refresh_from_db()
         return Response(TransactionSerializer(transaction, context=self.get_serializer_context()).data)
 
@@ -555,6 +569,56 @@ class BankConnectionViewSet(WorkspaceAccessMixin, viewsets.ModelViewSet):
             raise PermissionDenied('Недостаточно прав на workspace.')
         serializer.save()
 
+    @action(detail=True, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FormParser])
+    def import_statement(self, request, pk=None):
+        """
+        Импорт выписки (multipart: file; format — csv/ofx/camt, по умолчанию по расширению;
+        project, category — необязательно). Повторно загруженные операции пропускаются.
+        """
+        connection = self.get_object()
+        if not self._is_workspace_manager(connection.workspace):
+            raise PermissionDenied('Недостаточно прав на workspace.')
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'Файл file обязателен'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or detect_format(upload.name)
+        if fmt not in FORMATS:
+            return Response(
+                {'error': f'Формат выписки: {", ".join(FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        project = None
+        if request.data.get('project'):
+            project = Project.objects.filter(
+                pk=request.data['project'], workspace_id=connection.workspace_id
+            ).first()
+            if project is None:
+                return Response({'error': 'Проект не найден в workspace'}, status=status.HTTP_400_BAD_REQUEST)
+        category = None
+        if request.data.get('category'):
+            category = Category.objects.filter(
+                Q(workspace__isnull=True) | Q(workspace_id=connection.workspace_id),
+                pk=request.data['category'],
+            ).first()
+            if category is None:
+                return Response({'error': 'Категория не найдена'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = import_statement(
+                connection, upload, fmt, request.user, project=project, category=category
+            )
+        except StatementParseError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**result, 'net_delta': str(result['net_delta'])}, status=status.HTTP_200_OK)
+
+
+class ProjectBudgetCursorPagination(CursorPagination):
+    """Keyset-пагинация списка бюджетов: стабильна и быстра на больших workspace."""
+
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
 
 class ProjectBudgetViewSet(viewsets.ViewSet):
     """
@@ -616,7 +680,8 @@ class ProjectBudgetViewSet(viewsets.ViewSet):
         """
         GET /finance/projects/
         
-        Список всех проектов с их бюджетными сводками.
+        Список проектов с бюджетными сводками, keyset-пагинация по (-created_at, -id):
+        ?cursor=<next из предыдущего ответа>&page_size=N.
         """
         user = request.user
         
@@ -625,18 +690,17 @@ class ProjectBudgetViewSet(viewsets.ViewSet):
             WorkspaceMember.objects.filter(user=user).values_list('workspace_id', flat=True)
         )
         if not workspace_ids and (getattr(user, 'is_superuser', False) or getattr(user, 'is_staff', False)):
-            workspace_ids = list(Project.objects.values_list('workspace_id', flat=True).distinct())
-        
-        projects = Project.objects.filter(
-            workspace_id__in=workspace_ids
-        ).order_by('-created_at')
-        
-        summaries = [
-            ProjectBudgetSummarySerializer.from_project(project)
-            for project in projects
-        ]
+            projects = Project.objects.filter(workspace__isnull=False)
+        else:
+            projects = Project.objects.filter(workspace_id__in=workspace_ids)
+        # Базовая валюта сводок — из settings workspace, без запроса на проект
+        projects = projects.select_related('workspace')
         
-        return Response(summaries)
+        paginator = ProjectBudgetCursorPagination()
+        page = paginator.paginate_queryset(projects, request, view=self)
+        return paginator.get_paginated_response(
+            ProjectBudgetSummarySerializer.from_projects(page)
+        )
     
     def retrieve(self, request, pk=None):
         """
@@ -653,25 +717,71 @@ class FinanceAnalyticsViewSet(viewsets.ViewSet):
     
     GET /api/v1/finance/analytics/summary/ — сводка: cash_flow_history,
     expenses_by_project, total_balance, has_cash_gap, current_month_expense.
+    GET /api/v1/finance/analytics/forecast/ — прогноз cash-flow workspace на 3–6 месяцев.
     """
 
     permission_classes = [IsAuthenticated, IsDirectorOrManager]
 
+    @staticmethod
+    def _feature_locked(request):
+        if SubscriptionService.has_feature(request.user, 'finance_analytics'):
+            return None
+        return Response(
+            {
+                'code': 'FEATURE_LOCKED',
+                'detail': 'Аналитика по финансам недоступна на вашем тарифе.',
+            },
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    @staticmethod
+    def _requested_currency(request):
+        """?currency= отчёта: None — валюта по умолчанию; валюта без курсов — 400."""
+        currency = request.query_params.get('currency')
+        if not currency:
+            return None
+        try:
+            return validate_currency(currency)
+        except ExchangeRateMissing as e:
+            raise ValidationError({'currency': str(e)})
+
     @action(detail=False, methods=['get'], url_path='summary')
     def summary(self, request):
         """
-        GET /api/v1/finance/analytics/summary/
-        
-        Агрегаты по транзакциям проектов, доступных пользователю.
+        GET /api/v1/finance/analytics/summary/?currency=USD
+
+        Агрегаты по транзакциям проектов, доступных пользователю, в валюте отчёта.
         Требуется фича finance_analytics в тарифе (SaaS Sprint 2).
         """
-        if not SubscriptionService.has_feature(request.user, 'finance_analytics'):
-            return Response(
-                {
-                    'code': 'FEATURE_LOCKED',
-                    'detail': 'Аналитика по финансам недоступна на вашем тарифе.',
-                },
-                status=status.HTTP_403_FORBIDDEN,
-            )
-        data = FinanceStatsService.get_analytics_summary(request.user)
+        locked = self._feature_locked(request)
+        if locked:
+            return locked
+        data = FinanceStatsService.get_analytics_summary(request.user, currency=self._requested_currency(request))
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path='forecast')
+    def forecast(self, request):
+        """
+        GET /api/v1/finance/analytics/forecast/?workspace=<id>&months=6&currency=USD
+
+        Прогноз балансов кошельков и проектов workspace (months — от 3 до 6, по умолчанию 6)
+        с отметкой месяцев кассового разрыва. Требуется фича finance_analytics.
+        """
+        locked = self._feature_locked(request)
+        if locked:
+            return locked
+        try:
+            workspace_id = int(request.query_params.get('workspace', ''))
+            months = int(request.query_params.get('months', DEFAULT_HORIZON))
+        except ValueError:
+            raise ValidationError('Укажите workspace и months (целые числа).')
+        if not HORIZON_MIN <= months <= HORIZON_MAX:
+            raise ValidationError(f'months должен быть от {HORIZON_MIN} до {HORIZON_MAX}.')
+        workspaces = Workspace.objects.all()
+        if not request.user.is_superuser:
+            workspaces = workspaces.filter(memberships__user=request.user)
+        workspace = workspaces.filter(pk=workspace_id).first()
+        if workspace is None:
+            raise Http404
+        data = forecast_workspace(workspace, horizon=months, currency=self._requested_currency(request))
         return Response(data)
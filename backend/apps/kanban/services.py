@@ -1,14 +1,25 @@
 """
-Kanban services: расчёт прогресса и здоровья этапа (Stage).
+Kanban services: расчёт прогресса и здоровья этапа (Stage),
+перемещение задач между колонками (общая логика для HTTP move-task и WebSocket).
 """
 from decimal import Decimal
 
 from django.utils import timezone
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Q
 
 from .models import Stage, Column
 
 
+class MoveTaskError(Exception):
+    """Перемещение задачи невозможно (некорректные параметры, задача или колонка не найдены)."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
 class ProgressService:
     """
     Пересчёт progress и health_status этапа по задачам.
@@ -93,3 +104,162 @@ class ProgressService:
             Stage.HEALTH_BEHIND if any_behind else Stage.HEALTH_ON_TRACK
         )
         project.save(update_fields=['progress', 'health_status'])
+
+
+class MoveService:
+    """
+    Drag-and-Drop: перемещение WorkItem между колонками канбана.
+    Одна транзакция: сдвиг sort_order соседей, kanban_column/stage/sort_order задачи,
+    синхронизация status по column_type. Используется move-task view и KanbanConsumer.
+    """
+
+    @staticmethod
+    def column_type_to_status():
+        """Маппинг column_type -> status WorkItem для синхронизации при перемещении."""
+        from apps.todo.models import WorkItem
+
+        return {
+            Column.COLUMN_TYPE_TODO: WorkItem.STATUS_TODO,
+            Column.COLUMN_TYPE_IN_PROGRESS: WorkItem.STATUS_IN_PROGRESS,
+            Column.COLUMN_TYPE_REVIEW: WorkItem.STATUS_REVIEW,
+            Column.COLUMN_TYPE_COMPLETED: WorkItem.STATUS_COMPLETED,
+        }
+
+    @staticmethod
+    def move_workitem(workitem_id, target_column_id, new_order=0):
+        """
+        Переместить задачу в target_column на позицию new_order.
+        Возвращает (workitem, old_column). Бросает MoveTaskError.
+        """
+        from apps.todo.models import WorkItem
+
+        if not workitem_id or not target_column_id:
+            raise MoveTaskError('workitem_id и target_column_id обязательны')
+        try:
+            new_order = max(0, int(new_order or 0))
+        except (TypeError, ValueError):
+            raise MoveTaskError('new_order должен быть целым числом')
+
+        try:
+            target_column = Column.objects.select_related('stage').get(id=target_column_id)
+        except (Column.DoesNotExist, ValueError):
+            raise MoveTaskError('Колонка не найдена', status_code=404)
+
+        with transaction.atomic():
+            # Блокируем строку задачи: параллельные перемещения одной карточки
+            # (несколько вкладок / сокет + HTTP) применяются по очереди.
+            try:
+                workitem = WorkItem.objects.select_for_update().select_related('kanban_column').get(
+                    id=workitem_id, deleted_at__isnull=True
+                )
+            except (WorkItem.DoesNotExist, ValueError):
+                raise MoveTaskError('Задача не найдена', status_code=404)
+
+            old_column = workitem.kanban_column
+            old_position = workitem.sort_order
+            same_column = old_column and old_column.id == target_column.id
+
+            if same_column:
+                # Перемещение внутри той же колонки
+                if new_order > old_position:
+                    WorkItem.objects.filter(
+                        kanban_column=target_column,
+                        sort_order__gt=old_position,
+                        sort_order__lte=new_order,
+                        deleted_at__isnull=True
+                    ).exclude(id=workitem.id).update(sort_order=F('sort_order') - 1)
+                elif new_order < old_position:
+                    WorkItem.objects.filter(
+                        kanban_column=target_column,
+                        sort_order__gte=new_order,
+                        sort_order__lt=old_position,
+                        deleted_at__isnull=True
+                    ).exclude(id=workitem.id).update(sort_order=F('sort_order') + 1)
+            else:
+                # Перемещение в другую колонку
+                WorkItem.objects.filter(
+                    kanban_column=target_column,
+                    sort_order__gte=new_order,
+                    deleted_at__isnull=True
+                ).exclude(id=workitem.id).update(sort_order=F('sort_order') + 1)
+                if old_column:
+                    WorkItem.objects.filter(
+                        kanban_column=old_column,
+                        sort_order__gt=old_position,
+                        deleted_at__isnull=True
+                    ).update(sort_order=F('sort_order') - 1)
+
+            # Обновляем WorkItem (спринт = доска колонки)
+            workitem.kanban_column = target_column
+            workitem.stage = target_column.stage
+            workitem.sort_order = new_order
+
+            # Синхронизация status по column_type
+            update_fields = ['kanban_column', 'stage', 'sort_order', 'status', 'updated_at']
+            new_status = MoveService.column_type_to_status().get(target_column.column_type)
+            if new_status and workitem.status != new_status:
+                workitem.status = new_status
+                if new_status == WorkItem.STATUS_IN_PROGRESS and not workitem.started_at:
+                    workitem.started_at = timezone.now()
+                    update_fields.append('started_at')
+                if new_status == WorkItem.STATUS_COMPLETED:
+                    if not workitem.completed_at:
+                        from apps.todo.services.checklist_service import complete_checklist_for_workitem
+                        complete_checklist_for_workitem(workitem)
+                        workitem.completed_at = timezone.now()
+                        workitem.progress = 100
+                    update_fields.extend(['completed_at', 'progress'])
+
+            workitem._skip_signal = True
+            workitem.save(update_fields=update_fields)
+
+        return workitem, old_column
+
+    @staticmethod
+    def build_card_moved_payload(workitem, old_column):
+        """
+        Авторитетное состояние карточки после перемещения (без DRF serializer,
+        как в todo.signals._send_websocket_notifications).
+        """
+        return {
+            'id': workitem.id,
+            'title': workitem.title,
+            'status': workitem.status,
+            'priority': workitem.priority,
+            'progress': workitem.progress,
+            'project_id': workitem.project_id,
+            'stage_id': workitem.stage_id,
+            'from_column_id': old_column.id if old_column else None,
+            'column_id': workitem.kanban_column_id,
+            'sort_order': workitem.sort_order,
+            'started_at': workitem.started_at.isoformat() if workitem.started_at else None,
+            'completed_at': workitem.completed_at.isoformat() if workitem.completed_at else None,
+            'updated_at': workitem.updated_at.isoformat() if workitem.updated_at else None,
+        }
+
+    @staticmethod
+    def affected_board_ids(workitem, old_column):
+        """ID этапов (досок), которым нужно разослать card_moved: целевой и исходный."""
+        board_ids = [workitem.stage_id] if workitem.stage_id else []
+        old_stage_id = old_column.stage_id if old_column else None
+        if old_stage_id and old_stage_id not in board_ids:
+            board_ids.append(old_stage_id)
+        return board_ids
+
+    @staticmethod
+    def broadcast_move(workitem, old_column):
+        """
+        Разослать авторитетный card_moved в группы досок и task_updated в группу проекта
+        (move-task сохраняет задачу с _skip_signal, поэтому сигнал todo этого не делает).
+        """
+        try:
+            from apps.notifications.services import NotificationService
+
+            payload = MoveService.build_card_moved_payload(workitem, old_column)
+            for board_id in MoveService.affected_board_ids(workitem, old_column):
+                NotificationService.send_card_moved(board_id, payload)
+            if workitem.project_id:
+                NotificationService.send_task_updated(workitem.project_id, payload)
+        except Exception as e:
+            import logging
+            logging.getLogger(__name__).warning('MoveService.broadcast_move: %s', e)
@@ -1,12 +1,22 @@
 """
-Tests for kanban app: ProgressService (progress и health для Stage и Project).
+Tests for kanban app: ProgressService (progress и health для Stage и Project),
+MoveService и серверное перемещение карточек через KanbanConsumer.
 """
-from django.test import TestCase
+import json
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, override_settings
+from django.urls import path
 
 from apps.core.models import User, Workspace, WorkspaceMember
 from apps.todo.models import Project, WorkItem
 from apps.kanban.models import Stage, Column
-from apps.kanban.services import ProgressService
+from apps.kanban.services import MoveService, MoveTaskError, ProgressService
+from apps.notifications.consumers import KanbanConsumer
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
 
 
 class ProgressServiceTestCase(TestCase):
@@ -109,3 +119,189 @@ class ProgressServiceTestCase(TestCase):
         ProgressService.recalculate_project_progress(self.project)
         self.project.refresh_from_db()
         self.assertEqual(self.project.health_status, 'behind')
+
+
+class MoveServiceTestCase(TestCase):
+    """Перемещение задач: sort_order соседей, колонка/этап и синхронизация status."""
+
+    def setUp(self):
+        self.workspace = Workspace.objects.create(name='Move WS', slug='move-ws')
+        self.project = Project.objects.create(
+            name='Move Project',
+            status=Project.STATUS_ACTIVE,
+            workspace=self.workspace,
+        )
+        self.stage = Stage.objects.create(name='Move Stage', project=self.project, is_default=True)
+        self.col_plan = Column.objects.get(stage=self.stage, system_type=Column.SYSTEM_TYPE_PLAN)
+        self.col_in_progress = Column.objects.get(stage=self.stage, system_type=Column.SYSTEM_TYPE_IN_PROGRESS)
+        self.tasks = [
+            WorkItem.objects.create(
+                title=f'Task {i}',
+                project=self.project,
+                stage=self.stage,
+                kanban_column=self.col_plan,
+                status=WorkItem.STATUS_TODO,
+            )
+            for i in range(3)
+        ]
+        for order, task in enumerate(self.tasks):
+            WorkItem.objects.filter(id=task.id).update(sort_order=order)
+
+    def _orders(self, column):
+        return list(
+            WorkItem.objects.filter(kanban_column=column).order_by('sort_order').values_list('id', 'sort_order')
+        )
+
+    def test_move_to_other_column_shifts_neighbours_and_syncs_status(self):
+        moved = self.tasks[0]
+        workitem, old_column = MoveService.move_workitem(moved.id, self.col_in_progress.id, 0)
+        self.assertEqual(old_column.id, self.col_plan.id)
+        self.assertEqual(workitem.kanban_column_id, self.col_in_progress.id)
+        self.assertEqual(workitem.status, WorkItem.STATUS_IN_PROGRESS)
+        self.assertIsNotNone(workitem.started_at)
+        self.assertEqual(
+            [order for _, order in self._orders(self.col_plan)],
+            list(range(2)),
+        )
+
+    def test_move_within_column_reorders(self):
+        first = self.tasks[0]
+        MoveService.move_workitem(first.id, self.col_plan.id, 2)
+        self.assertEqual(self._orders(self.col_plan)[-1], (first.id, 2))
+
+    def test_missing_workitem_raises(self):
+        with self.assertRaises(MoveTaskError) as ctx:
+            MoveService.move_workitem(999999, self.col_plan.id, 0)
+        self.assertEqual(ctx.exception.status_code, 404)
+
+    def test_payload_and_boards(self):
+        workitem, old_column = MoveService.move_workitem(self.tasks[1].id, self.col_in_progress.id, 0)
+        payload = MoveService.build_card_moved_payload(workitem, old_column)
+        self.assertEqual(payload['from_column_id'], self.col_plan.id)
+        self.assertEqual(payload['column_id'], self.col_in_progress.id)
+        self.assertEqual(MoveService.affected_board_ids(workitem, old_column), [self.stage.id])
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, PRESENCE_BACKEND='memory', PRESENCE_BROADCAST_INTERVAL=60,
+)
+class KanbanConsumerMoveTestCase(TestCase):
+    """move_card по сокету применяется на сервере и рассылается всем зрителям доски."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='mover', email='mover@example.com', password='x')
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='x')
+        self.workspace = Workspace.objects.create(name='WS Socket', slug='ws-socket')
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role=WorkspaceMember.ROLE_MEMBER)
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.viewer, role=WorkspaceMember.ROLE_VIEWER)
+        self.project = Project.objects.create(
+            name='Socket Project',
+            status=Project.STATUS_ACTIVE,
+            workspace=self.workspace,
+        )
+        self.stage = Stage.objects.create(name='Socket Stage', project=self.project, is_default=True)
+        self.col_plan = Column.objects.get(stage=self.stage, system_type=Column.SYSTEM_TYPE_PLAN)
+        self.col_done = Column.objects.get(stage=self.stage, system_type=Column.SYSTEM_TYPE_DONE)
+        self.task = WorkItem.objects.create(
+            title='Socket task',
+            project=self.project,
+            stage=self.stage,
+            kanban_column=self.col_plan,
+            status=WorkItem.STATUS_TODO,
+        )
+        self.application = URLRouter([
+            path('ws/kanban/<int:board_id>/', KanbanConsumer.as_asgi()),
+        ])
+
+    def _communicator(self, user):
+        communicator = WebsocketCommunicator(self.application, f'/ws/kanban/{self.stage.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def _connect(self, user):
+        """Подключиться и пропустить начальный presence_state."""
+        communicator = self._communicator(user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(json.loads(await communicator.receive_from())['type'], 'presence_state')
+        return communicator
+
+    def test_move_card_is_applied_and_broadcast(self):
+        async def scenario():
+            mover = await self._connect(self.user)
+            watcher = await self._connect(self.viewer)
+            await mover.send_to(text_data=json.dumps({
+                'type': 'move_card',
+                'data': {
+                    'workitem_id': self.task.id,
+                    'target_column_id': self.col_done.id,
+                    'new_order': 0,
+                    'client_move_id': 'm-1',
+                },
+            }))
+            broadcast = json.loads(await watcher.receive_from())
+            mover_messages = [json.loads(await mover.receive_from()) for _ in range(2)]
+            await mover.disconnect()
+            await watcher.disconnect()
+            return broadcast, mover_messages
+
+        broadcast, mover_messages = async_to_sync(scenario)()
+        self.assertEqual(broadcast['type'], 'card_moved')
+        self.assertEqual(broadcast['data']['column_id'], self.col_done.id)
+        self.assertEqual(broadcast['data']['status'], WorkItem.STATUS_COMPLETED)
+        self.assertEqual(
+            sorted(m['type'] for m in mover_messages), ['card_moved', 'move_ack']
+        )
+        ack = next(m for m in mover_messages if m['type'] == 'move_ack')
+        self.assertEqual(ack['data']['client_move_id'], 'm-1')
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.kanban_column_id, self.col_done.id)
+
+    def test_viewer_move_is_rejected(self):
+        async def scenario():
+            communicator = await self._connect(self.viewer)
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'move_card',
+                'data': {'workitem_id': self.task.id, 'target_column_id': self.col_done.id},
+            }))
+            message = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return message
+
+        message = async_to_sync(scenario)()
+        self.assertEqual(message['type'], 'move_rejected')
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.kanban_column_id, self.col_plan.id)
+
+    def test_foreign_workitem_cannot_be_pulled_onto_board(self):
+        other_workspace = Workspace.objects.create(name='WS Foreign', slug='ws-foreign')
+        other_project = Project.objects.create(
+            name='Foreign Project',
+            status=Project.STATUS_ACTIVE,
+            workspace=other_workspace,
+        )
+        other_stage = Stage.objects.create(name='Foreign Stage', project=other_project, is_default=True)
+        foreign_column = Column.objects.get(stage=other_stage, system_type=Column.SYSTEM_TYPE_PLAN)
+        foreign_task = WorkItem.objects.create(
+            title='Foreign task',
+            project=other_project,
+            stage=other_stage,
+            kanban_column=foreign_column,
+            status=WorkItem.STATUS_TODO,
+        )
+
+        async def scenario():
+            communicator = await self._connect(self.user)
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'move_card',
+                'data': {'workitem_id': foreign_task.id, 'target_column_id': self.col_done.id},
+            }))
+            message = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return message
+
+        message = async_to_sync(scenario)()
+        self.assertEqual(message['type'], 'move_rejected')
+        foreign_task.refresh_from_db()
+        self.assertEqual(foreign_task.kanban_column_id, foreign_column.id)
+        self.assertEqual(foreign_task.stage_id, other_stage.id)
@@ -3,31 +3,22 @@ Views for kanban app.
 Канбан — представление WorkItem. Модель Card удалена.
 """
 import logging
-from rest_framework import viewsets, status
+from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db import transaction
-from django.db.models import F
 from .models import Stage, Board, Column
 from .serializers import (
     BoardSerializer, BoardFullSerializer,
     KanbanColumnSerializer, KanbanBoardSerializer,
     WorkItemShortSerializer
 )
+from .services import MoveService, MoveTaskError
 from apps.auth.permissions import IsWorkspaceMember
 from apps.core.models import WorkspaceMember
-from apps.todo.models import WorkItem
 
 logger = logging.getLogger(__name__)
 
-# Маппинг column_type -> status для синхронизации при перемещении
-COLUMN_TYPE_TO_STATUS = {
-    Column.COLUMN_TYPE_TODO: WorkItem.STATUS_TODO,
-    Column.COLUMN_TYPE_IN_PROGRESS: WorkItem.STATUS_IN_PROGRESS,
-    Column.COLUMN_TYPE_REVIEW: WorkItem.STATUS_REVIEW,
-    Column.COLUMN_TYPE_COMPLETED: WorkItem.STATUS_COMPLETED,
-}
-
 
 class BoardViewSet(viewsets.ModelViewSet):
     """ViewSet для управления этапами (Stage, ранее Board)."""
@@ -125,93 +116,17 @@ class KanbanColumnViewSet(viewsets.ModelViewSet):
         Параметры: workitem_id, target_column_id, new_order.
         Обновляет: workitem.kanban_column, workitem.sort_order, workitem.status (по column_type).
         """
-        workitem_id = request.data.get('workitem_id')
-        target_column_id = request.data.get('target_column_id')
-        new_order = request.data.get('new_order', 0)
-
-        if not workitem_id or not target_column_id:
-            return Response(
-                {'error': 'workitem_id и target_column_id обязательны'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        try:
-            target_column = Column.objects.select_related('stage').get(id=target_column_id)
-        except Column.DoesNotExist:
-            return Response(
-                {'error': 'Колонка не найдена'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
         try:
-            workitem = WorkItem.objects.select_related('kanban_column').get(
-                id=workitem_id, deleted_at__isnull=True
-            )
-        except WorkItem.DoesNotExist:
-            return Response(
-                {'error': 'Задача не найдена'},
-                status=status.HTTP_404_NOT_FOUND
+            workitem, old_column = MoveService.move_workitem(
+                request.data.get('workitem_id'),
+                request.data.get('target_column_id'),
+                request.data.get('new_order', 0),
             )
+        except MoveTaskError as e:
+            return Response({'error': e.message}, status=e.status_code)
 
-        with transaction.atomic():
-            old_column = workitem.kanban_column
-            old_position = workitem.sort_order
-            same_column = old_column and old_column.id == target_column.id
-
-            if same_column:
-                # Перемещение внутри той же колонки
-                if new_order > old_position:
-                    WorkItem.objects.filter(
-                        kanban_column=target_column,
-                        sort_order__gt=old_position,
-                        sort_order__lte=new_order,
-                        deleted_at__isnull=True
-                    ).exclude(id=workitem_id).update(sort_order=F('sort_order') - 1)
-                elif new_order < old_position:
-                    WorkItem.objects.filter(
-                        kanban_column=target_column,
-                        sort_order__gte=new_order,
-                        sort_order__lt=old_position,
-                        deleted_at__isnull=True
-                    ).exclude(id=workitem_id).update(sort_order=F('sort_order') + 1)
-            else:
-                # Перемещение в другую колонку
-                WorkItem.objects.filter(
-                    kanban_column=target_column,
-                    sort_order__gte=new_order,
-                    deleted_at__isnull=True
-                ).exclude(id=workitem_id).update(sort_order=F('sort_order') + 1)
-                if old_column:
-                    WorkItem.objects.filter(
-                        kanban_column=old_column,
-                        sort_order__gt=old_position,
-                        deleted_at__isnull=True
-                    ).update(sort_order=F('sort_order') - 1)
-
-            # Обновляем WorkItem (спринт = доска колонки)
-            workitem.kanban_column = target_column
-            workitem.stage = target_column.stage
-            workitem.sort_order = new_order
-
-            # Синхронизация status по column_type
-            from django.utils import timezone
-            update_fields = ['kanban_column', 'stage', 'sort_order', 'status', 'updated_at']
-            new_status = COLUMN_TYPE_TO_STATUS.get(target_column.column_type)
-            if new_status and workitem.status != new_status:
-                workitem.status = new_status
-                if new_status == WorkItem.STATUS_IN_PROGRESS and not workitem.started_at:
-                    workitem.started_at = timezone.now()
-                    update_fields.append('started_at')
-                if new_status == WorkItem.STATUS_COMPLETED:
-                    if not workitem.completed_at:
-                        from apps.todo.services.checklist_service import complete_checklist_for_workitem
-                        complete_checklist_for_workitem(workitem)
-                        workitem.completed_at = timezone.now()
-                        workitem.progress = 100
-                    update_fields.extend(['completed_at', 'progress'])
-
-            workitem._skip_signal = True
-            workitem.save(update_fields=update_fields)
+        # Авторитетный результат — всем, кто смотрит доску/проект (после коммита)
+        transaction.on_commit(lambda: MoveService.broadcast_move(workitem, old_column))
 
         serializer = WorkItemShortSerializer(workitem, context={'request': request})
         return Response(serializer.data)
@@ -1,11 +1,30 @@
 """
 Хелпер для записи в AuditLog. Использует thread-local для текущего пользователя (устанавливается middleware).
+
+Запись буферизуется: log_audit не делает INSERT в горячем пути сигнала, а ставит запись
+в transaction.on_commit (откат транзакции/savepoint отбрасывает и запись). Закоммиченные
+записи копятся в буфере запроса (AuditRequestMiddleware) или Celery-задачи и пишутся
+одним bulk_create при выходе из audit_buffer(). Переполнение буфера уходит в Celery
+(write_audit_entries). timestamp фиксируется в момент вызова log_audit, поэтому порядок
+записей по объекту не зависит от того, каким путём и когда они записаны.
 """
+import logging
 import threading
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
 from .models import AuditLog
 
+logger = logging.getLogger(__name__)
+
 _thread_locals = threading.local()
 
+DEFAULT_AUDIT_BUFFER_MAX_ENTRIES = 500
+
 
 def set_current_user(user):
     """Установить текущего пользователя для запроса (вызывается из middleware)."""
@@ -29,14 +48,105 @@ def log_audit(action, model_name, object_id, user=None, changes=None):
     if action not in (AuditLog.ACTION_CREATE, AuditLog.ACTION_UPDATE, AuditLog.ACTION_DELETE):
         return
     user = user or get_current_user()
+    entry = AuditLog(
+        action=action,
+        model_name=model_name,
+        object_id=object_id,
+        user=user if getattr(user, 'pk', None) else None,
+        changes=changes or {},
+        timestamp=timezone.now(),
+    )
+    if not getattr(settings, 'AUDIT_LOG_BUFFERED', True):
+        write_audit_entries([entry])
+        return
+    # Вне atomic-блока on_commit выполняется сразу
+    transaction.on_commit(partial(_enqueue_committed, entry))
+
+
+def _enqueue_committed(entry):
+    """Запись закоммичена: в буфер текущего запроса/задачи или сразу в БД, если буфера нет."""
+    buffer = getattr(_thread_locals, 'audit_buffer', None)
+    if buffer is None:
+        write_audit_entries([entry])
+        return
+    buffer.append(entry)
+    max_entries = getattr(settings, 'AUDIT_BUFFER_MAX_ENTRIES', DEFAULT_AUDIT_BUFFER_MAX_ENTRIES)
+    if len(buffer) >= max_entries:
+        _drain_overflow(buffer[:])
+        del buffer[:]
+
+
+def write_audit_entries(entries):
+    """Записать записи одним bulk_create (ошибки журнала не ломают основной поток)."""
+    if not entries:
+        return
     try:
-        AuditLog.objects.create(
-            action=action,
-            model_name=model_name,
-            object_id=object_id,
-            user=user,
-            changes=changes or {},
-        )
+        AuditLog.objects.bulk_create(entries)
     except Exception as e:
-        import logging
-        logging.getLogger(__name__).warning('AuditLog create failed: %s', e)
+        logger.warning('AuditLog bulk_create failed (%s entries): %s', len(entries), e)
+
+
+def serialize_audit_entry(entry):
+    return {
+        'action': entry.action,
+        'model_name': entry.model_name,
+        'object_id': entry.object_id,
+        'user_id': entry.user_id,
+        'changes': entry.changes,
+        'timestamp': entry.timestamp.isoformat(),
+    }
+
+
+def deserialize_audit_entry(data):
+    from django.utils.dateparse import parse_datetime
+
+    return AuditLog(
+        action=data['action'],
+        model_name=data['model_name'],
+        object_id=data['object_id'],
+        user_id=data.get('user_id'),
+        changes=data.get('changes') or {},
+        timestamp=parse_datetime(data['timestamp']) or timezone.now(),
+    )
+
+
+def _drain_overflow(entries):
+    """Переполнение буфера: отдать пачку в Celery; если брокер недоступен — записать здесь."""
+    try:
+        from .tasks import write_audit_entries_task
+
+        write_audit_entries_task.delay([serialize_audit_entry(entry) for entry in entries])
+    except Exception as e:
+        logger.warning('AuditLog overflow drain to Celery failed, writing inline: %s', e)
+        write_audit_entries(entries)
+
+
+def open_audit_buffer():
+    """Открыть буфер журнала для текущего потока (вложенные вызовы допускаются)."""
+    depth = getattr(_thread_locals, 'audit_buffer_depth', 0)
+    if depth == 0:
+        _thread_locals.audit_buffer = []
+    _thread_locals.audit_buffer_depth = depth + 1
+
+
+def close_audit_buffer():
+    """Закрыть буфер; на внешнем уровне записать накопленное одним bulk_create."""
+    depth = getattr(_thread_locals, 'audit_buffer_depth', 0)
+    if depth <= 0:
+        return
+    _thread_locals.audit_buffer_depth = depth - 1
+    if depth > 1:
+        return
+    entries = getattr(_thread_locals, 'audit_buffer', None) or []
+    _thread_locals.audit_buffer = None
+    write_audit_entries(entries)
+
+
+@contextmanager
+def audit_buffer():
+    """Буферизовать записи журнала до выхода из блока (запрос, Celery-задача, пакетная операция)."""
+    open_audit_buffer()
+    try:
+        yield
+    finally:
+        close_audit_buffer()
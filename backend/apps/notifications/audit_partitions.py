@@ -0,0 +1,193 @@
+"""
+Помесячные партиции audit_logs (PostgreSQL, RANGE по timestamp) и архивирование.
+
+Таблица audit_logs партиционирована миграцией 0005: партиции audit_logs_pYYYYMM
+и audit_logs_default для строк вне созданных диапазонов.
+  ensure_partitions()    — заранее создать партиции на текущий и следующие месяцы;
+  archive_old_months()   — месяцы старше AUDIT_LOG_RETENTION_MONTHS выгрузить в
+                           {AUDIT_LOG_ARCHIVE_DIR}/audit_logs_YYYYMM.ndjson.gz и удалить
+                           (DETACH + DROP партиции; на других СУБД — DELETE по диапазону).
+Вызывается Celery-задачей maintain_audit_partitions и командой archive_audit_logs.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'audit_logs'
+DEFAULT_PARTITION = 'audit_logs_default'
+DEFAULT_RETENTION_MONTHS = 12
+DEFAULT_MONTHS_AHEAD = 2
+EXPORT_CHUNK_SIZE = 2000
+
+
+def month_start(value):
+    """Начало месяца (UTC) для datetime/date."""
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    index = value.year * 12 + (value.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month.year:04d}{month.month:02d}'
+
+
+def retention_months():
+    return getattr(settings, 'AUDIT_LOG_RETENTION_MONTHS', DEFAULT_RETENTION_MONTHS)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'AUDIT_LOG_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive' / 'audit_logs'))
+
+
+def is_partitioned():
+    """audit_logs — партиционированная таблица PostgreSQL (relkind = 'p')."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+        row = cursor.fetchone()
+    return bool(row and row[0] == 'p')
+
+
+def existing_partitions():
+    """Имена партиций audit_logs (кроме default)."""
+    if not is_partitioned():
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [TABLE],
+        )
+        return {name for (name,) in cursor.fetchall() if name != DEFAULT_PARTITION}
+
+
+def create_partition(month):
+    """
+    Создать партицию месяца. Строки этого месяца, попавшие в default-партицию,
+    переносятся в новую (иначе ATTACH не пройдёт проверку default).
+    """
+    name = partition_name(month)
+    start, end = month_start(month), add_months(month, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'''
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}"
+                WHERE "timestamp" >= %s AND "timestamp" < %s
+                RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved
+            ''',
+            [start, end],
+        )
+        # Границы — константы DDL (не параметры запроса)
+        cursor.execute(
+            f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    return name
+
+
+def ensure_partitions(months_ahead=DEFAULT_MONTHS_AHEAD, now=None):
+    """Создать недостающие партиции с текущего месяца на months_ahead вперёд."""
+    if not is_partitioned():
+        return []
+    existing = existing_partitions()
+    current = month_start(now or timezone.now())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if partition_name(month) not in existing:
+            created.append(create_partition(month))
+    return created
+
+
+def export_month(month, path):
+    """Выгрузить записи месяца в gzip NDJSON (по порядку timestamp, id). Возвращает число строк."""
+    start, end = month_start(month), add_months(month, 1)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    rows = 0
+    qs = (
+        AuditLog.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        .order_by('timestamp', 'id')
+        .values('id', 'action', 'model_name', 'object_id', 'user_id', 'changes', 'timestamp')
+    )
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as fh:
+        for row in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            row['timestamp'] = row['timestamp'].isoformat()
+            fh.write(json.dumps(row, ensure_ascii=False, default=str))
+            fh.write('\n')
+            rows += 1
+    os.replace(tmp_path, path)
+    return rows
+
+
+def drop_month(month):
+    """Удалить данные месяца: DETACH + DROP партиции или DELETE по диапазону."""
+    name = partition_name(month)
+    if name in existing_partitions():
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+        return
+    AuditLog.objects.filter(
+        timestamp__gte=month_start(month), timestamp__lt=add_months(month, 1)
+    ).delete()
+
+
+def archive_old_months(retention=None, directory=None, now=None):
+    """
+    Выгрузить и удалить месяцы старше retention (по умолчанию AUDIT_LOG_RETENTION_MONTHS).
+    Возвращает список (YYYY-MM, строк, путь к файлу).
+    """
+    retention = retention_months() if retention is None else retention
+    directory = Path(directory) if directory else archive_dir()
+    cutoff = add_months(month_start(now or timezone.now()), -retention)
+    oldest = AuditLog.objects.filter(timestamp__lt=cutoff).aggregate(oldest=Min('timestamp'))['oldest']
+    months = []
+    if oldest is not None:
+        month = month_start(oldest)
+        while month < cutoff:
+            months.append(month)
+            month = add_months(month, 1)
+    # Пустые, но ещё не удалённые партиции старше cutoff
+    for name in existing_partitions():
+        month = datetime(int(name[-6:-2]), int(name[-2:]), 1, tzinfo=dt_timezone.utc)
+        if month < cutoff and month not in months:
+            months.append(month)
+
+    archived = []
+    for month in sorted(months):
+        path = directory / f'{TABLE}_{month.year:04d}{month.month:02d}.ndjson.gz'
+        rows = export_month(month, path)
+        drop_month(month)
+        if not rows:
+            path.unlink(missing_ok=True)
+            path = None
+        archived.append((f'{month.year:04d}-{month.month:02d}', rows, path))
+        logger.info('audit_logs archived month=%s rows=%s path=%s', archived[-1][0], rows, path)
+    return archived
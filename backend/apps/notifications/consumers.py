@@ -6,9 +6,65 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 
+from . import inbox
+from .presence import (
+    PresenceService,
+    clean_cursor,
+    subscribe_broadcaster,
+    unsubscribe_broadcaster,
+)
+
 User = get_user_model()
 
 
+class PresenceMixin:
+    """
+    Presence для групповых консьюмеров (доска, проект): кто смотрит и курсоры.
+    Клиент шлёт heartbeat/ping (раз в ~30 с) и cursor; изменения приходят
+    батчем presence_diff, новому подключению — presence_state.
+    """
+
+    async def presence_join(self):
+        self.presence = PresenceService()
+        await self.presence.heartbeat(self.group_name, self.user, self.channel_name)
+        subscribe_broadcaster(self.group_name, self.channel_layer)
+        await self.send(text_data=json.dumps({
+            'type': 'presence_state',
+            'data': await self.presence.state(self.group_name)
+        }))
+
+    async def presence_leave(self):
+        if not hasattr(self, 'presence'):
+            return
+        unsubscribe_broadcaster(self.group_name)
+        await self.presence.leave(self.group_name, self.user, self.channel_name)
+
+    async def presence_receive(self, message_type, data):
+        """Обработать presence-сообщение клиента. True — сообщение обработано."""
+        if not hasattr(self, 'presence'):
+            return False
+        if message_type in ('ping', 'heartbeat'):
+            await self.presence.heartbeat(self.group_name, self.user, self.channel_name)
+            if message_type == 'ping':
+                await self.send(text_data=json.dumps({
+                    'type': 'pong'
+                }))
+            return True
+        if message_type == 'cursor':
+            cursor = clean_cursor(data.get('data'))
+            if cursor:
+                await self.presence.move_cursor(self.group_name, self.user, cursor)
+            return True
+        return False
+
+    async def presence_diff(self, event):
+        """Отправка батча изменений presence (joined, left, cursors)."""
+        await self.send(text_data=json.dumps({
+            'type': 'presence_diff',
+            'data': event['data']
+        }))
+
+
 class DashboardConsumer(AsyncWebsocketConsumer):
     """
     Consumer для личных обновлений пользователя (группа: dashboard_{user_id}).
@@ -31,6 +87,12 @@ class DashboardConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        
+        # Бейдж непрочитанных — сразу при подключении, дальше только push
+        await self.send(text_data=json.dumps({
+            'type': 'unread_count',
+            'data': {'count': await database_sync_to_async(inbox.get_unread_count)(self.user.id)}
+        }))
     
     async def disconnect(self, close_code):
         """Отключение от WebSocket."""
@@ -51,9 +113,21 @@ class DashboardConsumer(AsyncWebsocketConsumer):
                 await self.send(text_data=json.dumps({
                     'type': 'pong'
                 }))
+            elif message_type == 'mark_read':
+                await self.handle_mark_read(data)
         except json.JSONDecodeError:
             pass
     
+    async def handle_mark_read(self, data):
+        """Отметить уведомления прочитанными: ids — список id, без ids — все."""
+        ids = data.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list):
+                return
+            ids = [value for value in ids if isinstance(value, int)]
+        # Новый счётчик придёт всем вкладкам пользователя событием unread_count
+        await database_sync_to_async(inbox.mark_read)(self.user.id, ids)
+    
     async def dashboard_update(self, event):
         """Отправка обновления дашборда."""
         await self.send(text_data=json.dumps({
@@ -74,9 +148,16 @@ class DashboardConsumer(AsyncWebsocketConsumer):
             'type': 'notification',
             'data': event['data']
         }))
+    
+    async def unread_count(self, event):
+        """Отправка счётчика непрочитанных уведомлений."""
+        await self.send(text_data=json.dumps({
+            'type': 'unread_count',
+            'data': event['data']
+        }))
 
 
-class KanbanConsumer(AsyncWebsocketConsumer):
+class KanbanConsumer(PresenceMixin, AsyncWebsocketConsumer):
     """
     Consumer для обновлений канбан-доски (группа: kanban_board_{board_id}).
     """
@@ -105,9 +186,11 @@ class KanbanConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        await self.presence_join()
     
     async def disconnect(self, close_code):
         """Отключение от WebSocket."""
+        await self.presence_leave()
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
                 self.group_name,
@@ -115,22 +198,121 @@ class KanbanConsumer(AsyncWebsocketConsumer):
             )
     
     async def receive(self, text_data):
-        """Получение сообщения от клиента."""
+        """
+        Получение сообщения от клиента.
+        heartbeat/ping и cursor — presence (PresenceMixin).
+        move_card (и устаревший card_moved) — команда перемещения: применяется на сервере
+        той же транзакционной логикой, что и POST move-task; всем зрителям доски уходит
+        авторитетный card_moved, отправителю — move_ack или move_rejected.
+        """
         try:
             data = json.loads(text_data)
-            message_type = data.get('type')
-            
-            if message_type == 'card_moved':
-                # Перемещение карточки
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        'type': 'card_moved',
-                        'data': data.get('data', {})
-                    }
-                )
         except json.JSONDecodeError:
-            pass
+            return
+        if not isinstance(data, dict):
+            return
+        message_type = data.get('type')
+
+        if await self.presence_receive(message_type, data):
+            return
+        if message_type in ('move_card', 'card_moved'):
+            await self.handle_move_card(data.get('data') or {})
+
+    async def handle_move_card(self, data):
+        """Серверное перемещение карточки и рассылка результата."""
+        client_move_id = data.get('client_move_id')
+        result = await self.apply_move(
+            data.get('workitem_id') or data.get('id'),
+            data.get('target_column_id') or data.get('column'),
+            data.get('new_order', data.get('position', 0)),
+        )
+        if 'error' in result:
+            await self.send(text_data=json.dumps({
+                'type': 'move_rejected',
+                'data': {
+                    'client_move_id': client_move_id,
+                    'workitem_id': data.get('workitem_id') or data.get('id'),
+                    'error': result['error'],
+                }
+            }))
+            return
+
+        payload = result['payload']
+        for board_id in result['board_ids']:
+            await self.channel_layer.group_send(
+                f"kanban_board_{board_id}",
+                {
+                    'type': 'card_moved',
+                    'data': payload
+                }
+            )
+        if payload.get('project_id'):
+            await self.channel_layer.group_send(
+                f"project_{payload['project_id']}",
+                {
+                    'type': 'task_updated',
+                    'data': payload
+                }
+            )
+        await self.send(text_data=json.dumps({
+            'type': 'move_ack',
+            'data': {**payload, 'client_move_id': client_move_id}
+        }))
+
+    @database_sync_to_async
+    def apply_move(self, workitem_id, target_column_id, new_order):
+        """
+        Проверка прав и перемещение через MoveService (одна транзакция).
+        Двигать можно задачи этой доски (или в колонку этой доски); задача и колонка
+        должны принадлежать workspace доски, роль viewer — только чтение.
+        """
+        from apps.core.models import WorkspaceMember
+        from apps.kanban.models import Column, Stage
+        from apps.kanban.services import MoveService, MoveTaskError
+        from apps.todo.models import WorkItem
+
+        try:
+            workitem_id = int(workitem_id)
+            target_column_id = int(target_column_id)
+        except (TypeError, ValueError):
+            return {'error': 'workitem_id и target_column_id обязательны'}
+
+        board = Stage.objects.select_related('project').filter(id=self.board_id).first()
+        board_workspace_id = board.project.workspace_id if board and board.project_id else None
+        column = Column.objects.select_related('stage__project').filter(id=target_column_id).first()
+        if column is None:
+            return {'error': 'Колонка не найдена'}
+        workitem = WorkItem.objects.select_related('project', 'stage__project').filter(
+            id=workitem_id, deleted_at__isnull=True
+        ).first()
+        if workitem is None:
+            return {'error': 'Задача не найдена'}
+        if board is None or board.id not in (column.stage_id, workitem.stage_id):
+            return {'error': 'Задача или колонка не относится к этой доске'}
+        # Задача другого workspace не должна попасть на доску через колонку этой доски
+        column_project = column.stage.project if column.stage_id else None
+        workitem_project = workitem.project or (workitem.stage.project if workitem.stage_id else None)
+        workspace_ids = {
+            getattr(column_project, 'workspace_id', None),
+            getattr(workitem_project, 'workspace_id', None),
+        }
+        if board_workspace_id is None or workspace_ids != {board_workspace_id}:
+            return {'error': 'Задача или колонка не относится к этой доске'}
+        if not getattr(self.user, 'is_staff', False):
+            role = WorkspaceMember.objects.filter(
+                workspace_id=board_workspace_id, user=self.user
+            ).values_list('role', flat=True).first()
+            if role is None or role == WorkspaceMember.ROLE_VIEWER:
+                return {'error': 'Недостаточно прав для перемещения задачи'}
+
+        try:
+            workitem, old_column = MoveService.move_workitem(workitem_id, target_column_id, new_order)
+        except MoveTaskError as e:
+            return {'error': e.message}
+        return {
+            'payload': MoveService.build_card_moved_payload(workitem, old_column),
+            'board_ids': MoveService.affected_board_ids(workitem, old_column),
+        }
     
     @database_sync_to_async
     def check_board_access(self, board_id):
@@ -165,7 +347,7 @@ class KanbanConsumer(AsyncWebsocketConsumer):
         }))
 
 
-class ProjectConsumer(AsyncWebsocketConsumer):
+class ProjectConsumer(PresenceMixin, AsyncWebsocketConsumer):
     """
     Consumer для обновлений проекта (группа: project_{project_id}).
     """
@@ -194,15 +376,26 @@ class ProjectConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        await self.presence_join()
     
     async def disconnect(self, close_code):
         """Отключение от WebSocket."""
+        await self.presence_leave()
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
     
+    async def receive(self, text_data):
+        """Получение сообщения от клиента (heartbeat/ping, cursor)."""
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        if isinstance(data, dict):
+            await self.presence_receive(data.get('type'), data)
+    
     @database_sync_to_async
     def check_project_access(self, project_id):
         """Проверка доступа к проекту."""
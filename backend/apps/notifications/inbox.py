@@ -0,0 +1,315 @@
+"""
+Персональные уведомления (Notification): пакетное создание и счётчик непрочитанных.
+
+create_notifications / notify_users создают строки одним bulk_create на всех получателей.
+Одинаковое уведомление (тип + dedupe_key или текст + задача) одному пользователю в пределах
+NOTIFICATION_DEDUPE_WINDOW_SECONDS создаётся один раз: маркер notifications:dedupe:{user_id}:{digest}
+ставится в кэш после коммита. До коммита маркеры своей транзакции лежат в реестре потока
+({ключ: id уведомления}) и действуют, пока строка уведомления видна в БД: после отката её нет,
+поэтому откат не подавляет повторную отправку. Цена — параллельные транзакции могут создать
+одно уведомление дважды.
+
+Счётчик непрочитанных хранится в кэше (notifications:unread:{user_id}) и меняется после
+коммита (incr/decr), новое значение уходит в группу dashboard_{user_id} — бейдж не опрашивает
+БД. При отсутствии ключа счётчик считается по индексу (user, read_at). Расхождения
+(сброс кэша, прямые UPDATE) исправляет задача reconcile_unread_counters.
+"""
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEDUPE_WINDOW_SECONDS = 3600
+DEFAULT_UNREAD_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_RECONCILE_LOOKBACK_HOURS = 24
+
+
+def dedupe_window():
+    return getattr(settings, 'NOTIFICATION_DEDUPE_WINDOW_SECONDS', DEFAULT_DEDUPE_WINDOW_SECONDS)
+
+
+def unread_ttl():
+    return getattr(settings, 'NOTIFICATION_UNREAD_TTL_SECONDS', DEFAULT_UNREAD_TTL_SECONDS)
+
+
+def unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def _dedupe_cache_key(user_id, notif_type, message, related_workitem_id, dedupe_key):
+    raw = f'{notif_type}|{dedupe_key or message}|{related_workitem_id or ""}'
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    return f'notifications:dedupe:{user_id}:{digest}'
+
+
+_pending = threading.local()
+
+
+def _pending_markers():
+    """Реестр потока: {ключ дедупликации: id уведомления} маркеров, ожидающих коммита."""
+    markers = getattr(_pending, 'markers', None)
+    if markers is None:
+        markers = _pending.markers = {}
+    return markers
+
+
+class _DedupeMarkers:
+    """Callback on_commit: поставить маркеры окна дедупликации и убрать их из реестра потока."""
+
+    def __init__(self, keys, window):
+        self.keys = keys
+        self.window = window
+
+    def __call__(self):
+        pending = _pending_markers()
+        for key in self.keys:
+            pending.pop(key, None)
+        try:
+            cache.set_many(dict.fromkeys(self.keys, 1), timeout=self.window)
+        except Exception as e:
+            logger.warning('Notification dedupe markers store failed: %s', e)
+
+
+def _is_first_in_window(key, item, window, pending):
+    """Первое такое уведомление пользователю за окно (при недоступном кэше — проверка по БД)."""
+    notification_id = pending.get(key)
+    if notification_id is not None:
+        # Маркер незакоммиченной транзакции потока: после отката строки уже нет
+        if Notification.objects.filter(pk=notification_id, user_id=item['user_id']).exists():
+            return False
+        del pending[key]
+    try:
+        return cache.get(key) is None
+    except Exception as e:
+        logger.warning('Notification dedupe cache failed, checking DB: %s', e)
+        return not Notification.objects.filter(
+            user_id=item['user_id'],
+            type=item['type'],
+            message=item['message'],
+            related_workitem_id=item.get('related_workitem_id'),
+            created_at__gte=timezone.now() - timedelta(seconds=window),
+        ).exists()
+
+
+def create_notifications(items, dedupe=True, window=None):
+    """
+    Создать уведомления одним bulk_create.
+
+    items: список dict {user_id, type, message, related_workitem_id?, dedupe_key?}.
+    dedupe_key задаёт «одинаковость», когда текст меняется (например, процент бюджета).
+    Возвращает список созданных Notification.
+    """
+    window = dedupe_window() if window is None else window
+    dedupe = bool(dedupe and window)
+    in_transaction = not transaction.get_autocommit()
+    pending = _pending_markers()
+    if not in_transaction:
+        # Вне транзакции ожидающих коммита маркеров нет: остатки откатов не копятся
+        pending.clear()
+    objs = []
+    keys = []
+    seen = set()
+    for item in items:
+        if not item.get('user_id'):
+            continue
+        marker = (
+            item['user_id'], item['type'], item.get('dedupe_key') or item['message'],
+            item.get('related_workitem_id'),
+        )
+        if marker in seen:
+            continue
+        seen.add(marker)
+        key = None
+        if dedupe:
+            key = _dedupe_cache_key(
+                item['user_id'], item['type'], item['message'],
+                item.get('related_workitem_id'), item.get('dedupe_key'),
+            )
+            if not _is_first_in_window(key, item, window, pending):
+                continue
+        keys.append(key)
+        objs.append(Notification(
+            user_id=item['user_id'],
+            type=item['type'],
+            message=item['message'],
+            related_workitem_id=item.get('related_workitem_id'),
+        ))
+    if not objs:
+        return []
+    created = Notification.objects.bulk_create(objs)
+    if dedupe:
+        if in_transaction:
+            pending.update(zip(keys, (notification.pk for notification in created)))
+        transaction.on_commit(_DedupeMarkers(set(keys), window))
+    transaction.on_commit(partial(_publish_created, created))
+    return created
+
+
+def notify_users(user_ids, notif_type, message, related_workitem=None, dedupe_key=None, dedupe=True):
+    """Одно уведомление нескольким получателям (рассылка админам, владельцам и т.п.)."""
+    related_workitem_id = getattr(related_workitem, 'pk', related_workitem)
+    return create_notifications(
+        [
+            {
+                'user_id': user_id,
+                'type': notif_type,
+                'message': message,
+                'related_workitem_id': related_workitem_id,
+                'dedupe_key': dedupe_key,
+            }
+            for user_id in user_ids
+        ],
+        dedupe=dedupe,
+    )
+
+
+def count_unread_in_db(user_id):
+    return Notification.objects.filter(user_id=user_id, read_at__isnull=True).count()
+
+
+def get_unread_count(user_id):
+    """Счётчик непрочитанных: из кэша, при промахе — COUNT по индексу (user, read_at)."""
+    try:
+        value = cache.get(unread_key(user_id))
+    except Exception as e:
+        logger.warning('Unread counter read failed user_id=%s: %s', user_id, e)
+        return count_unread_in_db(user_id)
+    if value is None:
+        value = count_unread_in_db(user_id)
+        try:
+            cache.add(unread_key(user_id), value, timeout=unread_ttl())
+        except Exception as e:
+            logger.warning('Unread counter store failed user_id=%s: %s', user_id, e)
+    return value
+
+
+def _bump_unread(user_id, delta):
+    """Изменить счётчик на delta; нет ключа или ушёл в минус — пересчитать из БД."""
+    key = unread_key(user_id)
+    try:
+        value = cache.incr(key, delta)
+    except ValueError:
+        value = None
+    except Exception as e:
+        logger.warning('Unread counter update failed user_id=%s: %s', user_id, e)
+        return count_unread_in_db(user_id)
+    if value is None or value < 0:
+        value = count_unread_in_db(user_id)
+        try:
+            cache.set(key, value, timeout=unread_ttl())
+        except Exception as e:
+            logger.warning('Unread counter store failed user_id=%s: %s', user_id, e)
+    return value
+
+
+def serialize_notification(notification):
+    return {
+        'id': notification.pk,
+        'type': notification.type,
+        'message': notification.message,
+        'related_workitem_id': notification.related_workitem_id,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+    }
+
+
+def _publish_created(created):
+    """После коммита: увеличить счётчики и отправить уведомления в dashboard_{user_id}."""
+    from .services import NotificationService
+
+    by_user = defaultdict(list)
+    for notification in created:
+        by_user[notification.user_id].append(notification)
+    for user_id, notifications in by_user.items():
+        count = _bump_unread(user_id, len(notifications))
+        try:
+            for notification in notifications:
+                NotificationService.send_notification(
+                    user_id, {**serialize_notification(notification), 'unread_count': count}
+                )
+        except Exception as e:
+            logger.warning('Notification push failed user_id=%s: %s', user_id, e)
+
+
+def _publish_unread_count(user_id, count):
+    from .services import NotificationService
+
+    try:
+        NotificationService.send_unread_count(user_id, count)
+    except Exception as e:
+        logger.warning('Unread counter push failed user_id=%s: %s', user_id, e)
+
+
+def _apply_read(user_id, updated):
+    _publish_unread_count(user_id, _bump_unread(user_id, -updated))
+
+
+def mark_read(user_id, notification_ids=None):
+    """Отметить прочитанными (все или перечисленные). Возвращает число изменённых строк."""
+    qs = Notification.objects.filter(user_id=user_id, read_at__isnull=True)
+    if notification_ids is not None:
+        qs = qs.filter(pk__in=notification_ids)
+    updated = qs.update(read_at=timezone.now())
+    if updated:
+        transaction.on_commit(partial(_apply_read, user_id, updated))
+    return updated
+
+
+def reconcile_unread_counters(user_ids=None, lookback_hours=None):
+    """
+    Сверить кэшированные счётчики с БД одним GROUP BY и исправить расхождения.
+
+    user_ids — кого сверять; по умолчанию пользователи, у которых уведомления создавались
+    или читались за последние lookback_hours. Исправленные значения отправляются в сокет.
+    Возвращает число исправленных счётчиков.
+    """
+    if user_ids is None:
+        hours = DEFAULT_RECONCILE_LOOKBACK_HOURS if lookback_hours is None else lookback_hours
+        since = timezone.now() - timedelta(hours=hours)
+        user_ids = (
+            Notification.objects.filter(Q(created_at__gte=since) | Q(read_at__gte=since))
+            .values_list('user_id', flat=True)
+            .distinct()
+        )
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    actual = dict.fromkeys(user_ids, 0)
+    actual.update(
+        Notification.objects.filter(user_id__in=user_ids, read_at__isnull=True)
+        .values('user_id')
+        .annotate(total=Count('id'))
+        .order_by()
+        .values_list('user_id', 'total')
+    )
+    cached = cache.get_many([unread_key(user_id) for user_id in user_ids])
+    fixed = {
+        user_id: count
+        for user_id, count in actual.items()
+        if cached.get(unread_key(user_id), count) != count
+    }
+    missing = {
+        unread_key(user_id): count
+        for user_id, count in actual.items()
+        if unread_key(user_id) not in cached
+    }
+    cache.set_many(
+        {**missing, **{unread_key(user_id): count for user_id, count in fixed.items()}},
+        timeout=unread_ttl(),
+    )
+    for user_id, count in fixed.items():
+        _publish_unread_count(user_id, count)
+    if fixed:
+        logger.info('reconcile_unread_counters: fixed %s counters', len(fixed))
+    return len(fixed)
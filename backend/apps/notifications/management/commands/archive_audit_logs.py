@@ -0,0 +1,40 @@
+"""
+Management command: выгрузка старых записей AuditLog в gzip NDJSON и удаление их из audit_logs.
+
+Использование:
+    python manage.py archive_audit_logs
+    python manage.py archive_audit_logs --retention-months 6 --dir /var/backups/audit
+
+По умолчанию выполняется Celery Beat задачей apps.notifications.tasks.maintain_audit_partitions.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.notifications.audit_partitions import archive_old_months, ensure_partitions, retention_months
+
+
+class Command(BaseCommand):
+    help = 'Создать партиции audit_logs и архивировать месяцы старше срока хранения в .ndjson.gz'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-months',
+            type=int,
+            default=None,
+            help='Сколько месяцев хранить в БД (по умолчанию AUDIT_LOG_RETENTION_MONTHS)',
+        )
+        parser.add_argument('--dir', default=None, help='Каталог архивов (по умолчанию AUDIT_LOG_ARCHIVE_DIR)')
+
+    def handle(self, *args, **options):
+        retention = options['retention_months']
+        created = ensure_partitions()
+        for name in created:
+            self.stdout.write(f'Создана партиция {name}')
+        archived = archive_old_months(retention=retention, directory=options['dir'])
+        for month, rows, path in archived:
+            self.stdout.write(f'{month}: {rows} записей -> {path or "(пусто)"}')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Готово: хранится {retention if retention is not None else retention_months()} мес., '
+                f'архивировано месяцев: {len(archived)}'
+            )
+        )
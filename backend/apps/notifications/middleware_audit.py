@@ -1,8 +1,9 @@
 """
 Middleware для установки текущего пользователя в thread-local (для AuditLog в сигналах).
 Используется при обработке HTTP-запросов; для DRF пользователь устанавливается после аутентификации в миксине.
+Также открывает буфер AuditLog на время запроса: записи пишутся одним bulk_create в конце.
 """
-from .audit import set_current_user
+from .audit import audit_buffer, set_current_user
 
 
 class AuditRequestMiddleware:
@@ -16,6 +17,7 @@ class AuditRequestMiddleware:
     def __call__(self, request):
         set_current_user(getattr(request, 'user', None))
         try:
-            return self.get_response(request)
+            with audit_buffer():
+                return self.get_response(request)
         finally:
             set_current_user(None)
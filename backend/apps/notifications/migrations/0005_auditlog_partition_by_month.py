@@ -0,0 +1,88 @@
+# audit_logs -> RANGE-партиционированная по месяцам таблица (только PostgreSQL).
+# PK становится (id, timestamp): ключ партиционирования обязан входить в уникальные индексы.
+# id берётся из отдельной последовательности (identity на партиционированной таблице
+# в PostgreSQL 15 не поддерживается). Существующие строки переносятся в партиции.
+
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import migrations
+
+MONTHS_AHEAD = 2
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _add_months(value, months):
+    index = value.year * 12 + (value.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_audit_logs(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    AuditLog = apps.get_model('notifications', 'AuditLog')
+    users_table = AuditLog._meta.get_field('user').related_model._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = 'audit_logs'")
+        row = cursor.fetchone()
+        if row and row[0] == 'p':
+            return
+
+        cursor.execute('ALTER TABLE audit_logs RENAME TO audit_logs_legacy')
+        cursor.execute(
+            'CREATE TABLE audit_logs (LIKE audit_logs_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute('CREATE SEQUENCE audit_logs_part_id_seq OWNED BY audit_logs.id')
+        cursor.execute(
+            "SELECT setval('audit_logs_part_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM audit_logs_legacy"
+        )
+        cursor.execute("ALTER TABLE audit_logs ALTER COLUMN id SET DEFAULT nextval('audit_logs_part_id_seq')")
+        cursor.execute('ALTER TABLE audit_logs ADD CONSTRAINT audit_logs_pkey_part PRIMARY KEY (id, "timestamp")')
+        cursor.execute(
+            f'ALTER TABLE audit_logs ADD CONSTRAINT audit_logs_user_id_part_fk '
+            f'FOREIGN KEY (user_id) REFERENCES "{users_table}" (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+
+        cursor.execute('SELECT MIN("timestamp") FROM audit_logs_legacy')
+        oldest = cursor.fetchone()[0]
+        now = datetime.now(dt_timezone.utc)
+        month = _month_start(oldest or now)
+        last = _add_months(_month_start(now), MONTHS_AHEAD)
+        while month <= last:
+            end = _add_months(month, 1)
+            cursor.execute(
+                f'CREATE TABLE audit_logs_p{month.year:04d}{month.month:02d} PARTITION OF audit_logs '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+            )
+            month = end
+        cursor.execute('CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT')
+
+        cursor.execute(
+            'INSERT INTO audit_logs (id, action, model_name, object_id, user_id, changes, "timestamp") '
+            'SELECT id, action, model_name, object_id, user_id, changes, "timestamp" FROM audit_logs_legacy'
+        )
+        cursor.execute('DROP TABLE audit_logs_legacy CASCADE')
+
+    # Индексы модели (те же имена) — на партиционированной таблице, распространяются на партиции
+    for index in AuditLog._meta.indexes:
+        schema_editor.add_index(AuditLog, index)
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_auditlog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_audit_logs, noop),
+    ]
@@ -2,6 +2,7 @@
 Notifications models for Office Suite 360.
 """
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from apps.core.models import User
 
@@ -79,6 +80,34 @@ class Notification(models.Model):
         return self.read_at is not None
 
 
+class AuditLogQuerySet(models.QuerySet):
+    """
+    Запросы к audit_logs, партиционированному по месяцам (timestamp).
+    Фильтр по диапазону timestamp позволяет PostgreSQL читать только нужные партиции.
+    """
+
+    def in_period(self, since=None, until=None):
+        """Записи в [since, until)."""
+        qs = self
+        if since is not None:
+            qs = qs.filter(timestamp__gte=since)
+        if until is not None:
+            qs = qs.filter(timestamp__lt=until)
+        return qs
+
+    def recent(self, limit, months=None, now=None):
+        """
+        Последние limit записей (список, новые первыми) за срок хранения.
+        Один запрос с нижней границей timestamp и ORDER BY/LIMIT: PostgreSQL читает
+        только партиции срока хранения, а не все, и фильтр передаётся в БД один раз.
+        """
+        from .audit_partitions import add_months, month_start, retention_months
+
+        months = retention_months() + 1 if months is None else months
+        since = add_months(month_start(now or timezone.now()), -(max(1, months) - 1))
+        return list(self.in_period(since).order_by('-timestamp', '-id')[:limit])
+
+
 class AuditLog(models.Model):
     """Аудит лог."""
     
@@ -116,10 +145,14 @@ class AuditLog(models.Model):
         blank=True,
         verbose_name=_('Changes')
     )
+    # Момент вызова log_audit (а не INSERT): записи пишутся буфером после коммита
     timestamp = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
+        editable=False,
         verbose_name=_('Timestamp')
     )
+
+    objects = AuditLogQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Журнал аудита'
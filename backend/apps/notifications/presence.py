@@ -0,0 +1,299 @@
+"""
+Presence на канбан-досках и проектах: кто сейчас смотрит и где его курсор.
+
+Хранение — без строк в БД: на каждую группу WebSocket (kanban_board_{id}, project_{id})
+в Redis лежат
+  presence:{group}:conns     ZSET  "{user_id}:{channel_name}" -> момент истечения (TTL heartbeat)
+  presence:{group}:users     HASH  user_id -> JSON {id, name}
+  presence:{group}:snapshot  SET   user_id, уже разосланные клиентам
+  presence:{group}:cursors   HASH  user_id -> JSON курсора (последний за интервал)
+  presence:{group}:tick      STR   NX-блокировка тика рассылки (одна рассылка на группу за интервал)
+
+Изменения не рассылаются на каждый connect/disconnect: раз в PRESENCE_BROADCAST_INTERVAL
+один процесс сравнивает текущих пользователей со snapshot и отправляет в группу
+один presence_diff {joined, left, cursors, count}.
+InMemoryPresenceStore — замена Redis для тестов и SQLite-окружения.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 75
+DEFAULT_BROADCAST_INTERVAL = 1.0
+# Допустимые поля курсора (не пересылаем клиентам произвольный JSON)
+CURSOR_FIELDS = ('column_id', 'workitem_id', 'x', 'y', 'field')
+
+
+def presence_ttl():
+    return getattr(settings, 'PRESENCE_TTL_SECONDS', DEFAULT_TTL_SECONDS)
+
+
+def presence_interval():
+    return getattr(settings, 'PRESENCE_BROADCAST_INTERVAL', DEFAULT_BROADCAST_INTERVAL)
+
+
+def clean_cursor(data):
+    """Оставить в курсоре только разрешённые скалярные поля."""
+    if not isinstance(data, dict):
+        return None
+    cursor = {
+        key: data[key]
+        for key in CURSOR_FIELDS
+        if isinstance(data.get(key), (int, float, str)) and len(str(data[key])) <= 64
+    }
+    return cursor or None
+
+
+class InMemoryPresenceStore:
+    """Presence в памяти процесса (тесты, SQLite-окружение, один воркер)."""
+
+    def __init__(self):
+        self._conns = defaultdict(dict)
+        self._users = defaultdict(dict)
+        self._snapshots = defaultdict(set)
+        self._cursors = defaultdict(dict)
+        self._ticks = {}
+
+    async def touch(self, group, user_id, channel_name, info, now, ttl):
+        self._conns[group][f'{user_id}:{channel_name}'] = now + ttl
+        self._users[group][str(user_id)] = info
+
+    async def remove(self, group, user_id, channel_name):
+        self._conns[group].pop(f'{user_id}:{channel_name}', None)
+
+    async def set_cursor(self, group, user_id, cursor):
+        self._cursors[group][str(user_id)] = cursor
+
+    async def current_users(self, group, now):
+        conns = self._conns[group]
+        for member in [m for m, expires_at in conns.items() if expires_at <= now]:
+            del conns[member]
+        user_ids = {member.split(':', 1)[0] for member in conns}
+        users = self._users[group]
+        for user_id in [u for u in users if u not in user_ids]:
+            del users[user_id]
+        return {user_id: users[user_id] for user_id in user_ids}
+
+    async def acquire_tick(self, group, now, interval):
+        if self._ticks.get(group, 0) > now:
+            return False
+        self._ticks[group] = now + interval
+        return True
+
+    async def swap_snapshot(self, group, user_ids):
+        previous = self._snapshots[group]
+        self._snapshots[group] = set(user_ids)
+        return previous
+
+    async def pop_cursors(self, group):
+        return self._cursors.pop(group, {})
+
+
+class RedisPresenceStore:
+    """Presence в Redis: общие для всех воркеров Daphne множества на группу."""
+
+    def __init__(self, url):
+        import redis.asyncio as redis_asyncio
+
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(group, suffix):
+        return f'presence:{group}:{suffix}'
+
+    async def touch(self, group, user_id, channel_name, info, now, ttl):
+        conns_key = self._key(group, 'conns')
+        users_key = self._key(group, 'users')
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(conns_key, {f'{user_id}:{channel_name}': now + ttl})
+            pipe.hset(users_key, str(user_id), json.dumps(info))
+            # Брошенные группы исчезают сами
+            for key in (conns_key, users_key, self._key(group, 'snapshot')):
+                pipe.expire(key, int(ttl * 2))
+            await pipe.execute()
+
+    async def remove(self, group, user_id, channel_name):
+        await self._redis.zrem(self._key(group, 'conns'), f'{user_id}:{channel_name}')
+
+    async def set_cursor(self, group, user_id, cursor):
+        cursors_key = self._key(group, 'cursors')
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hset(cursors_key, str(user_id), json.dumps(cursor))
+            pipe.expire(cursors_key, int(presence_ttl()))
+            await pipe.execute()
+
+    async def current_users(self, group, now):
+        conns_key = self._key(group, 'conns')
+        users_key = self._key(group, 'users')
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(conns_key, '-inf', now)
+            pipe.zrange(conns_key, 0, -1)
+            pipe.hgetall(users_key)
+            _, members, users = await pipe.execute()
+        user_ids = {member.split(':', 1)[0] for member in members}
+        stale = [user_id for user_id in users if user_id not in user_ids]
+        if stale:
+            await self._redis.hdel(users_key, *stale)
+        return {
+            user_id: json.loads(users[user_id]) if user_id in users else {'id': int(user_id)}
+            for user_id in user_ids
+        }
+
+    async def acquire_tick(self, group, now, interval):
+        return bool(await self._redis.set(
+            self._key(group, 'tick'), '1', nx=True, px=max(1, int(interval * 1000))
+        ))
+
+    async def swap_snapshot(self, group, user_ids):
+        snapshot_key = self._key(group, 'snapshot')
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.smembers(snapshot_key)
+            pipe.delete(snapshot_key)
+            if user_ids:
+                pipe.sadd(snapshot_key, *user_ids)
+                pipe.expire(snapshot_key, int(presence_ttl() * 2))
+            result = await pipe.execute()
+        return set(result[0])
+
+    async def pop_cursors(self, group):
+        cursors_key = self._key(group, 'cursors')
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(cursors_key)
+            pipe.delete(cursors_key)
+            cursors, _ = await pipe.execute()
+        return {user_id: json.loads(raw) for user_id, raw in cursors.items()}
+
+
+_stores = {}
+
+
+def get_presence_store():
+    """Хранилище presence по settings.PRESENCE_BACKEND ('redis' | 'memory')."""
+    backend = getattr(settings, 'PRESENCE_BACKEND', 'redis')
+    if backend not in _stores:
+        if backend == 'memory':
+            _stores[backend] = InMemoryPresenceStore()
+        else:
+            _stores[backend] = RedisPresenceStore(settings.REDIS_URL)
+    return _stores[backend]
+
+
+def reset_presence_store():
+    """Сбросить хранилища (тесты)."""
+    _stores.clear()
+    _broadcasters.clear()
+
+
+class PresenceService:
+    """Операции presence поверх хранилища (общие для всех консьюмеров)."""
+
+    def __init__(self, store=None):
+        self.store = store or get_presence_store()
+
+    async def heartbeat(self, group, user, channel_name, now=None):
+        """Подключение или heartbeat: продлить TTL соединения."""
+        now = time.time() if now is None else now
+        info = {'id': user.id, 'name': user.get_full_name() or user.username}
+        await self.store.touch(group, user.id, channel_name, info, now, presence_ttl())
+
+    async def leave(self, group, user, channel_name):
+        await self.store.remove(group, user.id, channel_name)
+
+    async def move_cursor(self, group, user, cursor):
+        await self.store.set_cursor(group, user.id, cursor)
+
+    async def state(self, group, now=None):
+        """Полный список присутствующих (отправляется новому подключению)."""
+        now = time.time() if now is None else now
+        users = await self.store.current_users(group, now)
+        return {'users': sorted(users.values(), key=lambda u: u.get('id', 0)), 'count': len(users)}
+
+    async def collect_diff(self, group, now=None, interval=None):
+        """
+        Один тик рассылки: если блокировка тика получена — сравнить текущих
+        пользователей со snapshot. Возвращает diff или None (нет изменений / тик у другого процесса).
+        """
+        now = time.time() if now is None else now
+        interval = presence_interval() if interval is None else interval
+        if not await self.store.acquire_tick(group, now, interval):
+            return None
+        current = await self.store.current_users(group, now)
+        previous = await self.store.swap_snapshot(group, set(current))
+        cursors = await self.store.pop_cursors(group)
+        joined = [current[user_id] for user_id in sorted(current) if user_id not in previous]
+        left = sorted(int(user_id) for user_id in previous if user_id not in current)
+        cursors = {user_id: cursor for user_id, cursor in cursors.items() if user_id in current}
+        if not (joined or left or cursors):
+            return None
+        return {'joined': joined, 'left': left, 'cursors': cursors, 'count': len(current)}
+
+
+class PresenceBroadcaster:
+    """
+    Фоновый цикл рассылки presence_diff для одной группы в этом процессе.
+    Живёт, пока в процессе есть хотя бы одно подключение к группе.
+    """
+
+    def __init__(self, group, channel_layer):
+        self.group = group
+        self.channel_layer = channel_layer
+        self.refs = 0
+        self.task = None
+        self.idle = asyncio.Event()
+
+    async def run(self):
+        service = PresenceService()
+        while self.refs > 0:
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout=presence_interval())
+            except asyncio.TimeoutError:
+                pass
+            if self.refs > 0:
+                await self.flush(service)
+        # Последний локальный зритель ушёл — отдаём финальный diff остальным процессам
+        await self.flush(service)
+
+    async def flush(self, service):
+        try:
+            diff = await service.collect_diff(self.group)
+            if diff:
+                await self.channel_layer.group_send(
+                    self.group,
+                    {
+                        'type': 'presence_diff',
+                        'data': diff
+                    }
+                )
+        except Exception as e:
+            logger.warning('PresenceBroadcaster.flush %s: %s', self.group, e)
+
+
+_broadcasters = {}
+
+
+def subscribe_broadcaster(group, channel_layer):
+    """Учесть подключение к группе; запустить цикл рассылки, если он ещё не идёт."""
+    broadcaster = _broadcasters.get(group)
+    if broadcaster is None or broadcaster.task is None or broadcaster.task.done():
+        broadcaster = PresenceBroadcaster(group, channel_layer)
+        _broadcasters[group] = broadcaster
+    broadcaster.refs += 1
+    if broadcaster.task is None:
+        broadcaster.task = asyncio.ensure_future(broadcaster.run())
+    return broadcaster
+
+
+def unsubscribe_broadcaster(group):
+    broadcaster = _broadcasters.get(group)
+    if broadcaster is None:
+        return
+    broadcaster.refs = max(0, broadcaster.refs - 1)
+    if broadcaster.refs == 0:
+        _broadcasters.pop(group, None)
+        broadcaster.idle.set()
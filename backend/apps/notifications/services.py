@@ -138,3 +138,27 @@ class NotificationService:
                 'data': {'task_id': task_id}
             }
         )
+    
+    @staticmethod
+    def send_notification(user_id, notification_data):
+        """Отправка нового уведомления (вместе с актуальным unread_count)."""
+        group_name = f"dashboard_{user_id}"
+        async_to_sync(channel_layer.group_send)(
+            group_name,
+            {
+                'type': 'notification',
+                'data': notification_data
+            }
+        )
+    
+    @staticmethod
+    def send_unread_count(user_id, count):
+        """Отправка счётчика непрочитанных уведомлений (бейдж)."""
+        group_name = f"dashboard_{user_id}"
+        async_to_sync(channel_layer.group_send)(
+            group_name,
+            {
+                'type': 'unread_count',
+                'data': {'count': count}
+            }
+        )
@@ -51,3 +51,53 @@ def send_email_message(to_email: str, subject: str, body: str) -> bool:
     except Exception as e:
         logger.warning('send_email_message task failed to=%s: %s', to_email, e)
         return False
+
+
+@shared_task(name='apps.notifications.tasks.write_audit_entries')
+def write_audit_entries_task(entries: list) -> int:
+    """
+    Записать пачку записей AuditLog, не поместившуюся в буфер запроса (переполнение).
+
+    :param entries: Список dict (serialize_audit_entry) в порядке вызова log_audit.
+    :return: Количество записанных записей.
+    """
+    from .audit import deserialize_audit_entry, write_audit_entries
+
+    objs = [deserialize_audit_entry(entry) for entry in entries or []]
+    write_audit_entries(objs)
+    return len(objs)
+
+
+@shared_task(name='apps.notifications.tasks.maintain_audit_partitions')
+def maintain_audit_partitions() -> dict:
+    """
+    Обслуживание audit_logs (раз в сутки): партиции на следующие месяцы,
+    выгрузка месяцев старше AUDIT_LOG_RETENTION_MONTHS в gzip NDJSON и их удаление.
+    """
+    from .audit_partitions import archive_old_months, ensure_partitions
+
+    created = ensure_partitions()
+    archived = archive_old_months()
+    result = {
+        'created_partitions': created,
+        'archived': [{'month': month, 'rows': rows, 'path': str(path) if path else None} for month, rows, path in archived],
+    }
+    logger.info('maintain_audit_partitions: %s', result)
+    return result
+
+
+@shared_task(name='apps.notifications.tasks.reconcile_unread_counters')
+def reconcile_unread_counters_task(lookback_hours: int = 24) -> int:
+    """
+    Сверка счётчиков непрочитанных уведомлений в кэше с БД (GROUP BY по user).
+
+    :param lookback_hours: Сверять пользователей с уведомлениями, созданными/прочитанными за это время.
+    :return: Количество исправленных счётчиков.
+    """
+    from .inbox import reconcile_unread_counters
+
+    try:
+        return reconcile_unread_counters(lookback_hours=lookback_hours)
+    except Exception as e:
+        logger.warning('reconcile_unread_counters failed: %s', e)
+        return 0
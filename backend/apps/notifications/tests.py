@@ -0,0 +1,460 @@
+"""
+Tests for notifications app: presence (кто смотрит доску/проект, курсоры),
+буферизованная запись AuditLog, помесячное хранение и архивирование журнала,
+пакетные уведомления и счётчик непрочитанных.
+"""
+import gzip
+import json
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+
+from apps.core.models import User, Workspace, WorkspaceMember
+from apps.finance.services import _check_budget_alert
+from apps.notifications import inbox
+from apps.notifications.audit import audit_buffer, log_audit
+from apps.notifications.audit_partitions import add_months, archive_old_months, month_start
+from apps.notifications.consumers import DashboardConsumer, ProjectConsumer
+from apps.notifications.models import AuditLog, Notification
+from apps.notifications.presence import (
+    InMemoryPresenceStore,
+    PresenceService,
+    clean_cursor,
+    reset_presence_store,
+)
+from apps.todo.models import Project
+
+
+class FakeUser:
+    """Минимальный пользователь для PresenceService (без БД)."""
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f'user{user_id}'
+
+    def get_full_name(self):
+        return ''
+
+
+class PresenceServiceTestCase(SimpleTestCase):
+    """Батч presence_diff: joined/left/cursors, TTL heartbeat, одна рассылка за тик."""
+
+    group = 'kanban_board_1'
+
+    def setUp(self):
+        self.service = PresenceService(store=InMemoryPresenceStore())
+
+    def run_async(self, coro):
+        async def runner():
+            return await coro
+        return async_to_sync(runner)()
+
+    def test_join_and_leave_are_batched(self):
+        alice, bob = FakeUser(1), FakeUser(2)
+        self.run_async(self.service.heartbeat(self.group, alice, 'c1', now=0))
+        self.run_async(self.service.heartbeat(self.group, alice, 'c2', now=0))
+        self.run_async(self.service.heartbeat(self.group, bob, 'c3', now=0))
+        diff = self.run_async(self.service.collect_diff(self.group, now=1, interval=1))
+        self.assertEqual([u['id'] for u in diff['joined']], [1, 2])
+        self.assertEqual(diff['count'], 2)
+
+        # Вторая вкладка Alice закрыта — Alice всё ещё на доске
+        self.run_async(self.service.leave(self.group, alice, 'c1'))
+        self.assertIsNone(self.run_async(self.service.collect_diff(self.group, now=2, interval=1)))
+        self.run_async(self.service.leave(self.group, alice, 'c2'))
+        diff = self.run_async(self.service.collect_diff(self.group, now=3, interval=1))
+        self.assertEqual(diff['left'], [1])
+        self.assertEqual(diff['joined'], [])
+
+    def test_expired_heartbeat_counts_as_left(self):
+        with self.settings(PRESENCE_TTL_SECONDS=30):
+            self.run_async(self.service.heartbeat(self.group, FakeUser(7), 'c1', now=0))
+            self.run_async(self.service.collect_diff(self.group, now=1, interval=1))
+            diff = self.run_async(self.service.collect_diff(self.group, now=31, interval=1))
+        self.assertEqual(diff['left'], [7])
+
+    def test_tick_lock_allows_one_broadcast_per_interval(self):
+        self.run_async(self.service.heartbeat(self.group, FakeUser(1), 'c1', now=0))
+        self.assertIsNotNone(self.run_async(self.service.collect_diff(self.group, now=1, interval=5)))
+        self.run_async(self.service.heartbeat(self.group, FakeUser(2), 'c2', now=2))
+        self.assertIsNone(self.run_async(self.service.collect_diff(self.group, now=3, interval=5)))
+        diff = self.run_async(self.service.collect_diff(self.group, now=6, interval=5))
+        self.assertEqual([u['id'] for u in diff['joined']], [2])
+
+    def test_cursors_keep_latest_position_of_present_users(self):
+        alice = FakeUser(1)
+        self.run_async(self.service.heartbeat(self.group, alice, 'c1', now=0))
+        self.run_async(self.service.move_cursor(self.group, alice, {'column_id': 3}))
+        self.run_async(self.service.move_cursor(self.group, alice, {'column_id': 4}))
+        self.run_async(self.service.move_cursor(self.group, FakeUser(99), {'column_id': 1}))
+        diff = self.run_async(self.service.collect_diff(self.group, now=1, interval=1))
+        self.assertEqual(diff['cursors'], {'1': {'column_id': 4}})
+
+    def test_clean_cursor_drops_unknown_fields(self):
+        self.assertEqual(clean_cursor({'x': 10, 'y': 5, 'html': '<b>'}), {'x': 10, 'y': 5})
+        self.assertIsNone(clean_cursor({'html': '<b>'}))
+        self.assertIsNone(clean_cursor('column'))
+
+
+class PresenceLoadTestCase(SimpleTestCase):
+    """
+    Нагрузочный сценарий: тысячи подключений к одной доске.
+    Рассылка — один presence_diff на тик, независимо от числа подключений.
+    """
+
+    group = 'kanban_board_42'
+    connections = 5000
+    users = 2500
+
+    def test_thousands_of_connections_per_board(self):
+        service = PresenceService(store=InMemoryPresenceStore())
+        users = [FakeUser(i) for i in range(1, self.users + 1)]
+
+        async def scenario():
+            started = time.perf_counter()
+            for i in range(self.connections):
+                await service.heartbeat(self.group, users[i % self.users], f'chan{i}', now=0)
+            join_diff = await service.collect_diff(self.group, now=1, interval=1)
+            # Heartbeat всех подключений + курсоры каждого второго пользователя
+            for i in range(self.connections):
+                await service.heartbeat(self.group, users[i % self.users], f'chan{i}', now=10)
+            for user in users[::2]:
+                await service.move_cursor(self.group, user, {'column_id': user.id % 5})
+            cursor_diff = await service.collect_diff(self.group, now=11, interval=1)
+            # 10% пользователей закрывают все вкладки
+            for i in range(self.connections):
+                user = users[i % self.users]
+                if user.id % 10 == 0:
+                    await service.leave(self.group, user, f'chan{i}')
+            leave_diff = await service.collect_diff(self.group, now=12, interval=1)
+            return join_diff, cursor_diff, leave_diff, time.perf_counter() - started
+
+        join_diff, cursor_diff, leave_diff, elapsed = async_to_sync(scenario)()
+        self.assertEqual(len(join_diff['joined']), self.users)
+        self.assertEqual(join_diff['count'], self.users)
+        self.assertEqual(len(cursor_diff['cursors']), self.users // 2)
+        self.assertEqual(cursor_diff['joined'], [])
+        self.assertEqual(len(leave_diff['left']), self.users // 10)
+        self.assertEqual(leave_diff['count'], self.users - self.users // 10)
+        self.assertLess(elapsed, 5.0)
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    PRESENCE_BACKEND='memory',
+    PRESENCE_BROADCAST_INTERVAL=0.05,
+)
+class ProjectConsumerPresenceTestCase(TestCase):
+    """Подключения к проекту получают presence_state и батчи presence_diff."""
+
+    def setUp(self):
+        reset_presence_store()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='x')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='x')
+        workspace = Workspace.objects.create(name='Presence WS', slug='presence-ws')
+        self.project = Project.objects.create(name='Presence', workspace=workspace)
+        self.application = URLRouter([
+            path('ws/project/<int:project_id>/', ProjectConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        reset_presence_store()
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(self.application, f'/ws/project/{self.project.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    @staticmethod
+    async def _receive_until(communicator, predicate):
+        while True:
+            message = json.loads(await communicator.receive_from(timeout=2))
+            if predicate(message):
+                return message
+
+    def test_join_cursor_and_leave_reach_other_viewers(self):
+        async def scenario():
+            alice = await self._connect(self.alice)
+            state = json.loads(await alice.receive_from())
+            bob = await self._connect(self.bob)
+            joined = await self._receive_until(
+                alice,
+                lambda m: m['type'] == 'presence_diff'
+                and self.bob.id in [u['id'] for u in m['data']['joined']],
+            )
+            await bob.send_to(text_data=json.dumps({'type': 'cursor', 'data': {'workitem_id': 5}}))
+            cursor = await self._receive_until(
+                alice,
+                lambda m: m['type'] == 'presence_diff' and m['data']['cursors'],
+            )
+            await bob.disconnect()
+            left = await self._receive_until(
+                alice,
+                lambda m: m['type'] == 'presence_diff' and m['data']['left'],
+            )
+            await alice.disconnect()
+            return state, joined, cursor, left
+
+        state, joined, cursor, left = async_to_sync(scenario)()
+        self.assertEqual(state['type'], 'presence_state')
+        self.assertEqual([u['id'] for u in state['data']['users']], [self.alice.id])
+        self.assertEqual(joined['data']['count'], 2)
+        self.assertEqual(cursor['data']['cursors'], {str(self.bob.id): {'workitem_id': 5}})
+        self.assertEqual(left['data']['left'], [self.bob.id])
+
+
+@override_settings(AUDIT_LOG_BUFFERED=True, AUDIT_BUFFER_MAX_ENTRIES=500)
+class AuditBufferTestCase(TestCase):
+    """log_audit: запись после коммита, один bulk_create на буфер, порядок по объекту."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', email='auditor@example.com', password='x')
+
+    def test_entries_written_in_one_insert_after_commit(self):
+        with self.assertNumQueries(1):
+            with audit_buffer():
+                with self.captureOnCommitCallbacks(execute=True):
+                    for i in range(5):
+                        log_audit(AuditLog.ACTION_UPDATE, 'workitem', 1, user=self.user, changes={'step': i})
+        steps = [
+            entry.changes['step']
+            for entry in AuditLog.objects.filter(model_name='workitem', object_id=1).order_by('timestamp', 'id')
+        ]
+        self.assertEqual(steps, [0, 1, 2, 3, 4])
+
+    def test_not_written_before_commit(self):
+        with audit_buffer():
+            log_audit(AuditLog.ACTION_UPDATE, 'workitem', 1, user=self.user)
+        # TestCase держит транзакцию открытой: on_commit не выполнен — записи нет
+        self.assertFalse(AuditLog.objects.exists())
+
+    def test_rolled_back_savepoint_discards_entries(self):
+        with audit_buffer():
+            with self.captureOnCommitCallbacks(execute=True):
+                log_audit(AuditLog.ACTION_CREATE, 'project', 7, user=self.user)
+                try:
+                    with transaction.atomic():
+                        log_audit(AuditLog.ACTION_UPDATE, 'project', 7, user=self.user)
+                        raise RuntimeError('rollback')
+                except RuntimeError:
+                    pass
+                log_audit(AuditLog.ACTION_DELETE, 'project', 7, user=self.user)
+        actions = list(AuditLog.objects.order_by('timestamp', 'id').values_list('action', flat=True))
+        self.assertEqual(actions, [AuditLog.ACTION_CREATE, AuditLog.ACTION_DELETE])
+
+    @override_settings(AUDIT_BUFFER_MAX_ENTRIES=3)
+    def test_overflow_is_drained_to_celery_in_order(self):
+        with mock.patch('apps.notifications.tasks.write_audit_entries_task.delay') as delay:
+            with audit_buffer():
+                with self.captureOnCommitCallbacks(execute=True):
+                    for i in range(4):
+                        log_audit(AuditLog.ACTION_UPDATE, 'workitem', 2, user=self.user, changes={'step': i})
+        delay.assert_called_once()
+        drained = delay.call_args[0][0]
+        self.assertEqual([entry['changes']['step'] for entry in drained], [0, 1, 2])
+        self.assertEqual([entry.changes['step'] for entry in AuditLog.objects.all()], [3])
+
+    def test_unbuffered_mode_writes_immediately(self):
+        with self.settings(AUDIT_LOG_BUFFERED=False):
+            log_audit(AuditLog.ACTION_CREATE, 'workitem', 3, user=self.user)
+        self.assertEqual(AuditLog.objects.filter(object_id=3).count(), 1)
+
+
+class AuditLogRetentionTestCase(TestCase):
+    """recent() в пределах срока хранения и архивирование старых месяцев в .ndjson.gz."""
+
+    now = datetime(2026, 6, 15, 12, 0, tzinfo=dt_timezone.utc)
+
+    def _entry(self, object_id, timestamp, action=AuditLog.ACTION_UPDATE):
+        return AuditLog.objects.create(
+            action=action, model_name='workitem', object_id=object_id, changes={}, timestamp=timestamp,
+        )
+
+    def test_month_helpers(self):
+        self.assertEqual(month_start(self.now), datetime(2026, 6, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(self.now, -6), datetime(2025, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(self.now, 7), datetime(2027, 1, 1, tzinfo=dt_timezone.utc))
+
+    def test_recent_is_bounded_by_retention(self):
+        self._entry(1, datetime(2026, 6, 10, tzinfo=dt_timezone.utc))
+        self._entry(2, datetime(2026, 4, 20, tzinfo=dt_timezone.utc))
+        self._entry(3, datetime(2026, 4, 2, tzinfo=dt_timezone.utc))
+        self._entry(4, datetime(2025, 1, 1, tzinfo=dt_timezone.utc))
+        recent = AuditLog.objects.recent(2, now=self.now)
+        self.assertEqual([entry.object_id for entry in recent], [1, 2])
+        # Выборка не выходит за срок хранения
+        recent = AuditLog.objects.recent(10, months=3, now=self.now)
+        self.assertEqual([entry.object_id for entry in recent], [1, 2, 3])
+
+    def test_recent_uses_single_query_for_sparse_results(self):
+        self._entry(1, datetime(2025, 8, 1, tzinfo=dt_timezone.utc))
+        with self.assertNumQueries(1):
+            recent = AuditLog.objects.filter(object_id__in=range(1, 500)).recent(10, months=13, now=self.now)
+        self.assertEqual([entry.object_id for entry in recent], [1])
+
+    def test_archive_exports_old_months_and_deletes_them(self):
+        self._entry(10, datetime(2025, 3, 5, tzinfo=dt_timezone.utc), AuditLog.ACTION_CREATE)
+        self._entry(10, datetime(2025, 3, 6, tzinfo=dt_timezone.utc), AuditLog.ACTION_UPDATE)
+        self._entry(11, datetime(2025, 5, 1, tzinfo=dt_timezone.utc))
+        self._entry(12, datetime(2026, 6, 1, tzinfo=dt_timezone.utc))
+        with tempfile.TemporaryDirectory() as directory:
+            archived = archive_old_months(retention=12, directory=directory, now=self.now)
+            self.assertEqual([(month, rows) for month, rows, _ in archived], [
+                ('2025-03', 2), ('2025-04', 0), ('2025-05', 1),
+            ])
+            march = Path(directory) / 'audit_logs_202503.ndjson.gz'
+            with gzip.open(march, 'rt', encoding='utf-8') as fh:
+                rows = [json.loads(line) for line in fh]
+            self.assertFalse((Path(directory) / 'audit_logs_202504.ndjson.gz').exists())
+        self.assertEqual([row['action'] for row in rows], [AuditLog.ACTION_CREATE, AuditLog.ACTION_UPDATE])
+        self.assertEqual(list(AuditLog.objects.values_list('object_id', flat=True)), [12])
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    NOTIFICATION_DEDUPE_WINDOW_SECONDS=3600,
+)
+class NotificationInboxTestCase(TestCase):
+    """Уведомления одним bulk_create, дедупликация в окне, счётчик непрочитанных в кэше."""
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f'inbox{i}', email=f'inbox{i}@example.com', password='x')
+            for i in range(3)
+        ]
+        self.user_ids = [user.id for user in self.users]
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_fan_out_is_one_insert_and_bumps_counters(self):
+        for user_id in self.user_ids:
+            self.assertEqual(inbox.get_unread_count(user_id), 0)
+        with mock.patch('apps.notifications.services.NotificationService.send_notification') as push:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(1):
+                    created = inbox.notify_users(self.user_ids, Notification.TYPE_BUDGET_ALERT, 'Бюджет 90%')
+        self.assertEqual(len(created), 3)
+        self.assertEqual(push.call_count, 3)
+        self.assertEqual(push.call_args[0][1]['unread_count'], 1)
+        with self.assertNumQueries(0):
+            counts = [inbox.get_unread_count(user_id) for user_id in self.user_ids]
+        self.assertEqual(counts, [1, 1, 1])
+
+    def test_identical_alert_is_deduped_within_window(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            inbox.notify_users(self.user_ids[:1], Notification.TYPE_BUDGET_ALERT, '81%', dedupe_key='budget:1')
+            again = inbox.notify_users(self.user_ids, Notification.TYPE_BUDGET_ALERT, '85%', dedupe_key='budget:1')
+        self.assertEqual([n.user_id for n in again], self.user_ids[1:])
+        self.assertEqual(Notification.objects.count(), 3)
+
+        with self.settings(NOTIFICATION_DEDUPE_WINDOW_SECONDS=0):
+            inbox.notify_users(self.user_ids[:1], Notification.TYPE_BUDGET_ALERT, '81%', dedupe_key='budget:1')
+        self.assertEqual(Notification.objects.count(), 4)
+
+    def test_rolled_back_alert_does_not_suppress_retry(self):
+        user_ids = self.user_ids[:1]
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    inbox.notify_users(user_ids, Notification.TYPE_BUDGET_ALERT, '81%', dedupe_key='budget:1')
+                    raise RuntimeError('rollback')
+            retried = inbox.notify_users(user_ids, Notification.TYPE_BUDGET_ALERT, '82%', dedupe_key='budget:1')
+        self.assertEqual([n.message for n in retried], ['82%'])
+        self.assertEqual(Notification.objects.count(), 1)
+        # После коммита маркер стоит: повтор в окне подавляется
+        self.assertEqual(
+            inbox.notify_users(user_ids, Notification.TYPE_BUDGET_ALERT, '83%', dedupe_key='budget:1'), []
+        )
+
+    def test_mark_read_decrements_and_reconcile_fixes_drift(self):
+        user_id = self.user_ids[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            created = inbox.create_notifications([
+                {'user_id': user_id, 'type': Notification.TYPE_TASK_ASSIGNED, 'message': f'Задача {i}'}
+                for i in range(3)
+            ])
+        self.assertEqual(inbox.get_unread_count(user_id), 3)
+        with mock.patch('apps.notifications.services.NotificationService.send_unread_count') as push:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(inbox.mark_read(user_id, [created[0].id]), 1)
+        push.assert_called_once_with(user_id, 2)
+
+        # Прямой UPDATE мимо сервиса — счётчик расходится, сверка исправляет
+        Notification.objects.filter(user_id=user_id).update(read_at=None)
+        self.assertEqual(inbox.get_unread_count(user_id), 2)
+        with mock.patch('apps.notifications.services.NotificationService.send_unread_count') as push:
+            self.assertEqual(inbox.reconcile_unread_counters(), 1)
+        push.assert_called_once_with(user_id, 3)
+        self.assertEqual(inbox.get_unread_count(user_id), 3)
+
+    def test_budget_alert_notifies_admins_once(self):
+        owner, admin, member = self.users
+        workspace = Workspace.objects.create(name='Inbox WS', slug='inbox-ws')
+        for user, role in (
+            (owner, WorkspaceMember.ROLE_OWNER),
+            (admin, WorkspaceMember.ROLE_ADMIN),
+            (member, WorkspaceMember.ROLE_MEMBER),
+        ):
+            WorkspaceMember.objects.create(workspace=workspace, user=user, role=role)
+        project = Project.objects.create(name='Budget', workspace=workspace)
+        Project.objects.filter(pk=project.pk).update(budget_total=100, budget_spent=90)
+        project.refresh_from_db()
+
+        _check_budget_alert(project)
+        Project.objects.filter(pk=project.pk).update(budget_spent=95)
+        project.refresh_from_db()
+        _check_budget_alert(project)
+
+        recipients = sorted(Notification.objects.values_list('user_id', flat=True))
+        self.assertEqual(recipients, sorted([owner.id, admin.id]))
+
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class DashboardUnreadCountTestCase(TransactionTestCase):
+    """Бейдж непрочитанных: приходит при подключении и после mark_read (on_commit без обёртки TestCase)."""
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_dashboard_socket_gets_counter_and_pushes(self):
+        user = User.objects.create_user(username='badge', email='badge@example.com', password='x')
+        application = URLRouter([path('ws/dashboard/', DashboardConsumer.as_asgi())])
+
+        async def scenario():
+            communicator = WebsocketCommunicator(application, '/ws/dashboard/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            initial = json.loads(await communicator.receive_from())
+            await communicator.send_to(text_data=json.dumps({'type': 'mark_read'}))
+            after_read = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return initial, after_read
+
+        inbox.create_notifications([
+            {'user_id': user.id, 'type': Notification.TYPE_TASK_ASSIGNED, 'message': 'Новая задача'},
+        ])
+        # Сервис шлёт через слой, созданный при импорте; в тесте — тот же слой, что у консьюмера
+        with mock.patch('apps.notifications.services.channel_layer', get_channel_layer()):
+            initial, after_read = async_to_sync(scenario)()
+        self.assertEqual(initial, {'type': 'unread_count', 'data': {'count': 1}})
+        self.assertEqual(after_read, {'type': 'unread_count', 'data': {'count': 0}})
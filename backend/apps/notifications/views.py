@@ -49,11 +49,11 @@ class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
             )
             project_ids = list(Project.objects.filter(workspace_id__in=workspace_ids).values_list('id', flat=True))
             task_ids = list(WorkItem.objects.filter(project_id__in=project_ids).values_list('id', flat=True))
-            qs = qs.filter(
+            # recent(): один запрос в пределах срока хранения — читаются только его партиции audit_logs
+            return qs.filter(
                 Q(model_name='project', object_id__in=project_ids)
                 | Q(model_name='workitem', object_id__in=task_ids)
-            )[:limit]
-            return qs
+            ).recent(limit)
         try:
             project_id = int(project_id)
         except (TypeError, ValueError):
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-19 06:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_timelog_invoice(apps, schema_editor):
+    """invoice лога — первый счёт, в который он включён (M2M Invoice.related_timelogs)."""
+    TimeLog = apps.get_model('timetracking', 'TimeLog')
+    Link = apps.get_model('billing', 'Invoice').related_timelogs.through
+    first_invoice = Link.objects.filter(timelog_id=OuterRef('pk')).order_by('invoice_id').values('invoice_id')[:1]
+    TimeLog.objects.filter(pk__in=Link.objects.values('timelog_id')).update(invoice_id=Subquery(first_invoice))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0014_workspace_storage_usage'),
+        ('timetracking', '0004_alter_timelog_options'),
+        ('todo', '0021_alter_checklistitem_options_alter_project_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelog',
+            name='invoice',
+            field=models.ForeignKey(blank=True, help_text='Счёт, в который включён лог (InvoiceGenerator)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='billed_timelogs', to='billing.invoice', verbose_name='Invoice'),
+        ),
+        migrations.AddIndex(
+            model_name='timelog',
+            index=models.Index(condition=models.Q(('billable', True), ('invoice__isnull', True)), fields=['workitem', 'started_at'], name='time_logs_unbilled_idx'),
+        ),
+        migrations.RunPython(backfill_timelog_invoice, migrations.RunPython.noop),
+    ]
@@ -73,6 +73,15 @@ class TimeLog(models.Model):
         verbose_name=_('Paid at'),
         help_text=_('Дата/время оплаты по ведомости')
     )
+    invoice = models.ForeignKey(
+        'billing.Invoice',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='billed_timelogs',
+        verbose_name=_('Invoice'),
+        help_text=_('Счёт, в который включён лог (InvoiceGenerator)')
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name=_('Created at')
@@ -90,6 +99,12 @@ class TimeLog(models.Model):
         indexes = [
             models.Index(fields=['workitem', 'user']),
             models.Index(fields=['started_at']),
+            # Невыставленные billable-логи: выборка InvoiceGenerator — поиск по индексу
+            models.Index(
+                fields=['workitem', 'started_at'],
+                condition=models.Q(billable=True, invoice__isnull=True),
+                name='time_logs_unbilled_idx',
+            ),
         ]
     
     def __str__(self):
@@ -69,14 +69,14 @@ def task_post_save(sender, instance, created, **kwargs):
             import logging
             logging.getLogger(__name__).warning('trigger_export_on_change: %s', e)
 
-    # Пересчёт бюджета проекта при изменении cost
+    # Пересчёт бюджета проекта при изменении cost (один раз на коммит/окно debounce)
     if instance.project_id:
         try:
-            from apps.finance.services import recalc_project_budget
-            recalc_project_budget(instance.project)
+            from apps.finance.services import mark_project_budget_dirty
+            mark_project_budget_dirty(instance.project_id)
         except Exception as e:
             import logging
-            logging.getLogger(__name__).warning('recalc_project_budget: %s', e)
+            logging.getLogger(__name__).warning('mark_project_budget_dirty: %s', e)
 
     # Пересчёт прогресса и здоровья этапа (Stage)
     stage = instance.stage
@@ -382,14 +382,11 @@ def task_post_delete(sender, instance, **kwargs):
     log_audit(AuditLog.ACTION_DELETE, 'workitem', instance.id, changes={'title': instance.title})
     if instance.project_id:
         try:
-            from apps.finance.services import recalc_project_budget
-            from apps.todo.models import Project
-            project = Project.objects.filter(id=instance.project_id).first()
-            if project:
-                recalc_project_budget(project)
+            from apps.finance.services import mark_project_budget_dirty
+            mark_project_budget_dirty(instance.project_id)
         except Exception as e:
             import logging
-            logging.getLogger(__name__).warning('recalc_project_budget on delete: %s', e)
+            logging.getLogger(__name__).warning('mark_project_budget_dirty on delete: %s', e)
 
 
 @receiver(pre_save, sender=Project)
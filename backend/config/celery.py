@@ -4,7 +4,7 @@ Celery configuration for Office Suite 360.
 import os
 import logging
 from celery import Celery
-from celery.signals import task_failure, task_retry
+from celery.signals import task_failure, task_postrun, task_prerun, task_retry
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +26,19 @@ def debug_task(self):
     print(f'Request: {self.request!r}')
 
 
+@task_prerun.connect
+def on_celery_task_prerun(**extra):
+    """Буфер AuditLog на время задачи: записи пишутся одним bulk_create в конце."""
+    from apps.notifications.audit import open_audit_buffer
+    open_audit_buffer()
+
+
+@task_postrun.connect
+def on_celery_task_postrun(**extra):
+    from apps.notifications.audit import close_audit_buffer
+    close_audit_buffer()
+
+
 @task_failure.connect
 def on_celery_task_failure(sender=None, task_id=None, exception=None, args=None, kwargs=None, traceback=None, einfo=None, **extra):
     task_name = getattr(sender, 'name', '') or ''
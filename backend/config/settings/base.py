@@ -105,6 +105,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'apps.notifications.middleware_audit.AuditRequestMiddleware',
+    'apps.billing.middleware.EntitlementScopeMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -231,6 +232,46 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Presence на досках/проектах (apps.notifications.presence): 'redis' или 'memory' (тесты, SQLite)
+PRESENCE_BACKEND = env('PRESENCE_BACKEND', default='redis')
+PRESENCE_TTL_SECONDS = env.int('PRESENCE_TTL_SECONDS', default=75)
+PRESENCE_BROADCAST_INTERVAL = env.float('PRESENCE_BROADCAST_INTERVAL', default=1.0)
+
+# AuditLog: запись после коммита пачками (apps.notifications.audit); False — синхронный INSERT
+AUDIT_LOG_BUFFERED = env.bool('AUDIT_LOG_BUFFERED', default=True)
+AUDIT_BUFFER_MAX_ENTRIES = env.int('AUDIT_BUFFER_MAX_ENTRIES', default=500)
+# Помесячные партиции audit_logs: сколько месяцев хранить в БД и куда выгружать старые (.ndjson.gz)
+AUDIT_LOG_RETENTION_MONTHS = env.int('AUDIT_LOG_RETENTION_MONTHS', default=12)
+AUDIT_LOG_ARCHIVE_DIR = env('AUDIT_LOG_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'audit_logs'))
+
+# Notification (apps.notifications.inbox): окно дедупликации одинаковых уведомлений и TTL счётчика непрочитанных
+NOTIFICATION_DEDUPE_WINDOW_SECONDS = env.int('NOTIFICATION_DEDUPE_WINDOW_SECONDS', default=3600)
+NOTIFICATION_UNREAD_TTL_SECONDS = env.int('NOTIFICATION_UNREAD_TTL_SECONDS', default=7 * 24 * 3600)
+
+# Пересчёт budget_spent проекта после изменений задач: не чаще раза в окно (apps.finance.services.mark_project_budget_dirty)
+FINANCE_BUDGET_RECALC_DEBOUNCE_SECONDS = env.int('FINANCE_BUDGET_RECALC_DEBOUNCE_SECONDS', default=10)
+# Валюта учёта по умолчанию (курсы ExchangeRate — к ней); workspace может задать свою в settings['base_currency']
+FINANCE_BASE_CURRENCY = env('FINANCE_BASE_CURRENCY', default='RUB')
+# Сколько секунд процесс держит таблицу курсов в памяти (apps.finance.fx)
+FINANCE_FX_CACHE_SECONDS = env.int('FINANCE_FX_CACHE_SECONDS', default=60)
+
+# Кэш рассчитанных entitlements биллинг-аккаунта между запросами (apps.billing.services.EntitlementCache); 0 — выключен
+BILLING_ENTITLEMENTS_CACHE_SECONDS = env.int('BILLING_ENTITLEMENTS_CACHE_SECONDS', default=600)
+# Буфер usage-событий (apps.billing.metering): 'redis' | 'memory'; сколько секунд помнить idempotency_key события
+BILLING_USAGE_BUFFER_BACKEND = env('BILLING_USAGE_BUFFER_BACKEND', default='redis')
+BILLING_USAGE_IDEMPOTENCY_TTL_SECONDS = env.int('BILLING_USAGE_IDEMPOTENCY_TTL_SECONDS', default=86400)
+# refresh_usage_summaries: аккаунтов в задаче группы и максимум аккаунтов за запуск
+BILLING_USAGE_REFRESH_CHUNK_SIZE = env.int('BILLING_USAGE_REFRESH_CHUNK_SIZE', default=200)
+BILLING_USAGE_REFRESH_MAX_ACCOUNTS = env.int('BILLING_USAGE_REFRESH_MAX_ACCOUNTS', default=10000)
+# Нумерация счетов (apps.billing.numbering): 'global' — INV-YYYY-XXXX, 'workspace' — INV-{workspace_id}-YYYY-XXXX
+BILLING_INVOICE_NUMBER_SCOPE = env('BILLING_INVOICE_NUMBER_SCOPE', default='global')
+# Процессов WeasyPrint для пакетного рендера PDF счетов (apps.billing.pdf.render_invoice_pdfs)
+BILLING_PDF_RENDER_PROCESSES = env.int('BILLING_PDF_RENDER_PROCESSES', default=2)
+# Webhook-события платежей: пакетная обработка (apps.billing.webhooks) вместо задачи на событие
+BILLING_WEBHOOK_BATCH_MODE = env.bool('BILLING_WEBHOOK_BATCH_MODE', default=False)
+BILLING_WEBHOOK_BATCH_SIZE = env.int('BILLING_WEBHOOK_BATCH_SIZE', default=500)
+BILLING_WEBHOOK_BATCH_COUNTDOWN_SECONDS = env.int('BILLING_WEBHOOK_BATCH_COUNTDOWN_SECONDS', default=2)
+
 # Celery Configuration
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
@@ -256,6 +297,18 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.billing.tasks.refresh_usage_summaries',
         'schedule': 300.0,
     },
+    'billing-flush-usage-buffer': {
+        'task': 'apps.billing.tasks.flush_usage_buffer',
+        'schedule': 60.0,
+    },
+    'billing-reconcile-storage-usage': {
+        'task': 'apps.billing.tasks.reconcile_storage_usage',
+        'schedule': 86400.0,
+    },
+    'billing-process-pending-webhooks': {
+        'task': 'apps.billing.tasks.process_pending_webhook_events',
+        'schedule': 60.0,
+    },
     'billing-enforce-subscription-access-states': {
         'task': 'apps.billing.tasks.enforce_subscription_access_states',
         'schedule': 900.0,
@@ -264,6 +317,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.billing.tasks.process_dunning_notifications',
         'schedule': 1800.0,
     },
+    'notifications-maintain-audit-partitions': {
+        'task': 'apps.notifications.tasks.maintain_audit_partitions',
+        'schedule': 86400.0,
+    },
+    'notifications-reconcile-unread-counters': {
+        'task': 'apps.notifications.tasks.reconcile_unread_counters',
+        'schedule': 600.0,
+    },
 }
 
 # Password validation
@@ -23,3 +23,6 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
     },
 }
+
+PRESENCE_BACKEND = 'memory'
+BILLING_USAGE_BUFFER_BACKEND = 'memory'
@@ -72,12 +72,20 @@ export interface ProjectBudgetSummary {
   budget_spent: string;
   remaining: string;
   spent_percent: number;
+  /** 0 — норма, 80 — порог проекта достигнут, 100 — бюджет исчерпан */
+  alert_level: 0 | 80 | 100;
   transactions_count: number;
   income_total: string;
   expense_total: string;
   hold_total: string;
 }
 
+export interface CursorPage<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+}
+
 export interface ApiResponse<T> {
   count: number;
   next: string | null;
@@ -265,11 +273,25 @@ export const financeApi = {
     return response.data;
   },
 
-  getAllProjectsSummaries: async (): Promise<ProjectBudgetSummary[]> => {
-    const response = await api.get('/finance/projects/');
+  /** Страница сводок (keyset-пагинация): cursor — из next/previous предыдущего ответа */
+  getProjectsSummariesPage: async (cursor?: string | null, pageSize?: number): Promise<CursorPage<ProjectBudgetSummary>> => {
+    const response = await api.get('/finance/projects/', {
+      params: { cursor: cursor ?? undefined, page_size: pageSize },
+    });
     return response.data;
   },
 
+  getAllProjectsSummaries: async (): Promise<ProjectBudgetSummary[]> => {
+    const summaries: ProjectBudgetSummary[] = [];
+    let cursor: string | null = null;
+    do {
+      const page: CursorPage<ProjectBudgetSummary> = await financeApi.getProjectsSummariesPage(cursor);
+      summaries.push(...page.results);
+      cursor = page.next ? new URL(page.next, window.location.origin).searchParams.get('cursor') : null;
+    } while (cursor);
+    return summaries;
+  },
+
   /** Сводка для дашборда */
   getAnalyticsSummary: async (): Promise<FinanceAnalyticsSummary> => {
     const response = await api.get('/finance/analytics/summary/');